@@ -52,6 +52,9 @@ from modules.models.casino import CasinoGame, CasinoStats
 from modules.models.trial import TrialSettings
 from modules.models.user_config import UserConfig
 from modules.models.option import PurchaseOption
+from modules.models.broadcast import BroadcastJob
+from modules.models.payment_event import PaymentEvent
+from modules.models.analytics import AnalyticsDaily
 
 # ============================================================================
 # ИМПОРТ API МАРШРУТОВ
@@ -330,96 +333,32 @@ def serve_admin_panel(path):
 # ПЛАНИРОВЩИК АВТОМАТИЧЕСКОЙ РАССЫЛКИ
 # ============================================================================
 
-# Глобальная переменная для планировщика
-_scheduler = None
+# Задачи выполняет отдельный процесс scheduler_worker.py (modules/scheduler.py).
+# При запуске через python app.py планировщик по умолчанию работает потоком этого процесса;
+# блокировка лидера не дает ему дублировать scheduler_worker.py.
 
 def get_broadcast_settings():
     """Получить настройки автоматической рассылки из БД или переменных окружения"""
-    try:
-        with app.app_context():
-            from modules.models.auto_broadcast import AutoBroadcastSettings
-            settings = AutoBroadcastSettings.query.first()
-            if settings:
-                return {
-                    'enabled': settings.enabled,
-                    'hours': settings.hours
-                }
-    except Exception as e:
-        print(f"Warning: Could not load settings from DB: {e}")
-    
-    # Fallback на переменные окружения
-    return {
-        'enabled': os.getenv('AUTO_BROADCAST_ENABLED', 'true').lower() == 'true',
-        'hours': os.getenv('AUTO_BROADCAST_HOURS', '9,14,19')
-    }
-
-def run_auto_broadcasts_job():
-    """Задача для автоматической рассылки"""
-    try:
-        with app.app_context():
-            from send_auto_broadcasts import send_auto_broadcasts
-            app.logger.info("📬 Запуск автоматической рассылки...")
-            send_auto_broadcasts()
-            app.logger.info("✅ Автоматическая рассылка завершена")
-    except Exception as e:
-        app.logger.error(f"❌ Ошибка автоматической рассылки: {e}")
+    from modules.scheduler import get_auto_broadcast_settings
+    with app.app_context():
+        return get_auto_broadcast_settings()
 
 def start_scheduler():
-    """Запустить планировщик автоматической рассылки"""
-    global _scheduler
-    
+    """Запустить встроенный планировщик (SCHEDULER_EMBEDDED=false - только scheduler_worker.py)"""
+    if os.getenv('SCHEDULER_EMBEDDED', 'true').lower() != 'true':
+        app.logger.info("📅 Встроенный планировщик отключен, задачи выполняет scheduler_worker.py")
+        return
     try:
-        from apscheduler.schedulers.background import BackgroundScheduler
-        from apscheduler.triggers.cron import CronTrigger
-        import atexit
-        
+        from modules.scheduler import start_embedded_scheduler
+        start_embedded_scheduler(app)
         settings = get_broadcast_settings()
-        
-        if not settings['enabled']:
-            app.logger.info("📅 Автоматическая рассылка отключена")
-            return
-        
-        _scheduler = BackgroundScheduler(daemon=True)
-        
-        # Парсим часы
-        hours = [int(h.strip()) for h in settings['hours'].split(',')]
-        
-        for hour in hours:
-            _scheduler.add_job(
-                func=run_auto_broadcasts_job,
-                trigger=CronTrigger(hour=hour, minute=0),
-                id=f'auto_broadcast_{hour}',
-                name=f'Auto Broadcast at {hour}:00',
-                replace_existing=True
-            )
-        
-        _scheduler.start()
         app.logger.info(f"📅 Планировщик автоматической рассылки запущен: {settings['hours']}:00")
-        
-        # Останавливаем планировщик при выходе
-        atexit.register(lambda: _scheduler.shutdown() if _scheduler else None)
-        
-    except ImportError:
-        app.logger.warning("⚠️  APScheduler не установлен. Автоматическая рассылка недоступна.")
     except Exception as e:
         app.logger.warning(f"⚠️  Ошибка запуска планировщика: {e}")
 
 def restart_scheduler():
-    """Перезапустить планировщик с новыми настройками"""
-    global _scheduler
-    
-    try:
-        # Останавливаем текущий планировщик
-        if _scheduler:
-            _scheduler.shutdown(wait=False)
-            _scheduler = None
-            app.logger.info("📅 Планировщик остановлен для перезапуска")
-        
-        # Запускаем с новыми настройками
-        start_scheduler()
-        
-    except Exception as e:
-        app.logger.error(f"❌ Ошибка перезапуска планировщика: {e}")
+    """Настройки читаются планировщиком на каждом такте, перезапуск не требуется"""
+    app.logger.info("📅 Новые настройки автоматической рассылки применятся на следующем такте планировщика")
 
 
 # ============================================================================
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Пересчет дневных агрегатов аналитики (таблица analytics_daily)
+
+Обычно агрегаты обновляются автоматически при регистрациях и оплатах.
+Скрипт нужен для первичного заполнения и после ручных правок в БД.
+
+Использование:
+    python backfill_analytics.py                                 # вся история
+    python backfill_analytics.py --days 7                        # последние 7 дней
+    python backfill_analytics.py --start 2024-01-01 --end 2024-01-31
+"""
+
+import os
+import sys
+import argparse
+from datetime import date, datetime, timedelta, timezone
+
+# Добавляем путь к проекту
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Загружаем переменные окружения ДО импорта app
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет дневных агрегатов аналитики')
+    parser.add_argument('--days', type=int, help='Пересчитать последние N дней')
+    parser.add_argument('--start', type=date.fromisoformat, help='Первый день (YYYY-MM-DD)')
+    parser.add_argument('--end', type=date.fromisoformat, help='Последний день (YYYY-MM-DD), по умолчанию сегодня')
+    args = parser.parse_args()
+
+    start_day = args.start
+    end_day = args.end
+    if args.days:
+        end_day = end_day or datetime.now(timezone.utc).date()
+        start_day = end_day - timedelta(days=args.days - 1)
+
+    from app import app
+    from modules.models.analytics import AnalyticsDaily
+    from modules.analytics import rebuild_rollups
+    from modules.core import get_db
+
+    with app.app_context():
+        AnalyticsDaily.__table__.create(bind=get_db().engine, checkfirst=True)
+        started = datetime.now()
+        days = rebuild_rollups(start_day, end_day)
+        print(f"✅ Пересчитано дней: {days} за {(datetime.now() - started).total_seconds():.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ Telegram Bot для клиентов StealthNET VPN
 import os
 import logging
 import requests
+import httpx
 import asyncio
 import base64
 import json
@@ -28,7 +29,7 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from telegram.error import Conflict
+from telegram.error import Conflict, BadRequest
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -54,6 +55,7 @@ def normalize_ui_text(text: str) -> str:
 # Конфигурация
 CLIENT_BOT_TOKEN = os.getenv("CLIENT_BOT_TOKEN")  # Токен бота для клиентов
 FLASK_API_URL = os.getenv("FLASK_API_URL", "http://localhost:5000")  # URL Flask API
+BOT_API_KEY = os.getenv("BOT_API_KEY", "")  # Общий секрет с API: отдельный лимит запросов для бота
 YOUR_SERVER_IP = os.getenv("YOUR_SERVER_IP", "https://panel.stealthnet.app")  # URL сервера (панель)
 MINIAPP_URL = os.getenv("MINIAPP_URL", YOUR_SERVER_IP)  # URL для miniapp
 SERVICE_NAME = os.getenv("SERVICE_NAME", "StealthNET")  # Название сервиса (можно менять через env)
@@ -69,63 +71,66 @@ LOGO_PATH = os.path.join(os.path.dirname(__file__), "logo.png")
 _bot_config_cache = {
     'data': None,
     'last_update': 0,
-    'cache_ttl': 5  # 5 секунд — для быстрого обновления при изменении в админке
+    'cache_ttl': 5  # Интервал опроса, если API не поддерживает /api/public/config-version
+}
+
+# Конфигурация перечитывается после смены версии на сервере (long-poll /api/public/config-version)
+CONFIG_VERSION_WAIT = 25  # Сколько сервер держит запрос, если версия не менялась (сек)
+CONFIG_MAX_AGE = 600  # Перечитать конфигурацию не реже чем раз в 10 минут (на случай пропущенной смены версии)
+
+# Конфигурация по умолчанию (пока API недоступен)
+DEFAULT_BOT_CONFIG = {
+    'service_name': SERVICE_NAME,
+    'support_url': '',
+    'support_bot_username': '',
+    'show_webapp_button': True,
+    'show_trial_button': True,
+    'show_referral_button': True,
+    'show_support_button': True,
+    'show_servers_button': True,
+    'show_agreement_button': True,
+    'show_offer_button': True,
+    'show_topup_button': True,
+    'trial_days': 3,
+    'translations': {},
+    'welcome_messages': {},
+    'user_agreements': {},
+    'offer_texts': {},
+    'require_channel_subscription': False,
+    'channel_id': '',
+    'channel_url': '',
+    'channel_subscription_texts': {}
 }
 
 def clear_bot_config_cache():
-    """Очистить кеш конфигурации бота"""
-    _bot_config_cache['data'] = None
+    """Пометить кеш конфигурации бота устаревшим (обновится фоновой задачей)"""
     _bot_config_cache['last_update'] = 0
 
 def get_bot_config() -> dict:
-    """Получить конфигурацию бота из API с кешированием"""
-    import time
-    
-    current_time = time.time()
-    
-    # Возвращаем из кеша если не истёк
-    if _bot_config_cache['data'] and (current_time - _bot_config_cache['last_update']) < _bot_config_cache['cache_ttl']:
-        return _bot_config_cache['data']
-    
-    # Загружаем из API
+    """
+    Получить конфигурацию бота из кеша.
+    Сетевых запросов не делает: кеш наполняется refresh_bot_config()
+    при старте и фоновой задачей config_refresh_loop().
+    """
+    return _bot_config_cache['data'] or DEFAULT_BOT_CONFIG
+
+async def refresh_bot_config(version: Optional[str] = None) -> dict:
+    """
+    Загрузить конфигурацию бота из API в кеш. version - версия из config-version:
+    worker, еще не увидевший ее, сверится с общим кешем и не отдаст старые настройки.
+    """
     try:
-        response = requests.get(f"{FLASK_API_URL}/api/public/bot-config", timeout=5)
+        params = {'version': version} if version else None
+        response = await api.get_conditional(f"{FLASK_API_URL}/api/public/bot-config", params=params, timeout=5)
         if response.status_code == 200:
             config = response.json()
             _bot_config_cache['data'] = config
-            _bot_config_cache['last_update'] = current_time
-            logger.info("Bot config loaded from API")
-            return config
+            _bot_config_cache['last_update'] = time.time()
+            logger.debug("Bot config loaded from API")
     except Exception as e:
         logger.warning(f"Failed to load bot config from API: {e}")
-    
-    # Возвращаем кеш даже если истёк (лучше старые данные чем никаких)
-    if _bot_config_cache['data']:
-        return _bot_config_cache['data']
-    
-    # Дефолтная конфигурация
-    return {
-        'service_name': SERVICE_NAME,
-        'support_url': '',
-        'support_bot_username': '',
-        'show_webapp_button': True,
-        'show_trial_button': True,
-        'show_referral_button': True,
-        'show_support_button': True,
-        'show_servers_button': True,
-        'show_agreement_button': True,
-        'show_offer_button': True,
-        'show_topup_button': True,
-        'trial_days': 3,
-        'translations': {},
-        'welcome_messages': {},
-        'user_agreements': {},
-        'offer_texts': {},
-        'require_channel_subscription': False,
-        'channel_id': '',
-        'channel_url': '',
-        'channel_subscription_texts': {}
-    }
+    # При ошибке остается прежний кеш (лучше старые данные чем никаких)
+    return get_bot_config()
 
 def get_service_name() -> str:
     """Получить название сервиса из конфига или env"""
@@ -181,47 +186,91 @@ _trial_settings_cache = {
     'cache_ttl': 30  # 30 секунд
 }
 
+# Настройки триала по умолчанию (пока API недоступен)
+DEFAULT_TRIAL_SETTINGS = {
+    'days': 3,
+    'devices': 3,
+    'traffic_limit_bytes': 0,
+    'enabled': True,
+    'button_text_ru': '🎁 Попробовать бесплатно ({days} дня)',
+    'button_text_ua': '🎁 Спробувати безкоштовно ({days} дні)',
+    'button_text_en': '🎁 Try Free ({days} Days)',
+    'button_text_cn': '🎁 免费试用 ({days} 天)'
+}
+
 def clear_trial_settings_cache():
-    """Очистить кеш настроек триала"""
-    _trial_settings_cache['data'] = None
+    """Пометить кеш настроек триала устаревшим (обновится фоновой задачей)"""
     _trial_settings_cache['last_update'] = 0
 
 def get_trial_settings() -> dict:
-    """Получить настройки триала из API с кешированием"""
-    import time
-    
-    current_time = time.time()
-    
-    # Возвращаем из кеша если не истёк
-    if _trial_settings_cache['data'] and (current_time - _trial_settings_cache['last_update']) < _trial_settings_cache['cache_ttl']:
-        return _trial_settings_cache['data']
-    
-    # Загружаем из API
+    """Получить настройки триала из кеша (без сетевых запросов, см. refresh_trial_settings)"""
+    return _trial_settings_cache['data'] or DEFAULT_TRIAL_SETTINGS
+
+async def refresh_trial_settings(version: Optional[str] = None) -> dict:
+    """Загрузить настройки триала из API в кеш (version - см. refresh_bot_config)"""
     try:
-        response = requests.get(f"{FLASK_API_URL}/api/public/trial-settings", timeout=5)
+        params = {'version': version} if version else None
+        response = await api.get_conditional(f"{FLASK_API_URL}/api/public/trial-settings", params=params, timeout=5)
         if response.status_code == 200:
-            settings = response.json()
-            _trial_settings_cache['data'] = settings
-            _trial_settings_cache['last_update'] = current_time
-            return settings
+            _trial_settings_cache['data'] = response.json()
+            _trial_settings_cache['last_update'] = time.time()
     except Exception as e:
         logger.warning(f"Failed to load trial settings from API: {e}")
-    
-    # Возвращаем кеш даже если истёк
-    if _trial_settings_cache['data']:
-        return _trial_settings_cache['data']
-    
-    # Дефолтные настройки
-    return {
-        'days': 3,
-        'devices': 3,
-        'traffic_limit_bytes': 0,
-        'enabled': True,
-        'button_text_ru': '🎁 Попробовать бесплатно ({days} дня)',
-        'button_text_ua': '🎁 Спробувати безкоштовно ({days} дні)',
-        'button_text_en': '🎁 Try Free ({days} Days)',
-        'button_text_cn': '🎁 免费试用 ({days} 天)'
-    }
+    return get_trial_settings()
+
+async def fetch_config_version(known: Optional[str] = None) -> Optional[str]:
+    """
+    Версия конфигурации на сервере. С known запрос ждет на сервере (до CONFIG_VERSION_WAIT секунд),
+    пока версия не станет отличной от known. None - эндпоинт недоступен.
+    """
+    params = {'known': known, 'wait': CONFIG_VERSION_WAIT} if known else None
+    response = await api.get(
+        f"{FLASK_API_URL}/api/public/config-version",
+        params=params,
+        timeout=CONFIG_VERSION_WAIT + 10
+    )
+    if response.status_code != 200:
+        return None
+    return (response.json() or {}).get('version')
+
+async def config_refresh_loop():
+    """
+    Фоновая задача: перечитывает конфигурацию бота и настройки триала, когда на сервере
+    меняется версия настроек (long-poll). Если сервер версию не отдает - опрос по TTL кешей.
+    """
+    version = None
+    while True:
+        started = time.time()
+        try:
+            new_version = await fetch_config_version(version)
+        except Exception as e:
+            logger.warning(f"Config version request failed: {e}")
+            new_version = None
+
+        try:
+            now = time.time()
+            if new_version:
+                changed = new_version != version
+                version = new_version
+                if changed or now - _bot_config_cache['last_update'] >= CONFIG_MAX_AGE:
+                    await refresh_bot_config(version)
+                if changed or now - _trial_settings_cache['last_update'] >= CONFIG_MAX_AGE:
+                    await refresh_trial_settings(version)
+                if changed or now - started >= 1:
+                    continue
+                # Сервер ответил сразу без смены версии (long-poll недоступен: нет BOT_API_KEY,
+                # занят лимит ожидающих) - опрашиваем с интервалом cache_ttl, как без long-poll
+                await asyncio.sleep(_bot_config_cache['cache_ttl'])
+                continue
+
+            version = None
+            if now - _bot_config_cache['last_update'] >= _bot_config_cache['cache_ttl']:
+                await refresh_bot_config()
+            if now - _trial_settings_cache['last_update'] >= _trial_settings_cache['cache_ttl']:
+                await refresh_trial_settings()
+        except Exception as e:
+            logger.warning(f"Config refresh loop error: {e}")
+        await asyncio.sleep(_bot_config_cache['cache_ttl'])
 
 def get_trial_button_text(lang: str = 'ru') -> str:
     """Получить текст кнопки триала для указанного языка"""
@@ -809,44 +858,95 @@ if MINIAPP_URL and not MINIAPP_URL.startswith("https://"):
 
 
 class ClientBotAPI:
-    """Класс для взаимодействия с Flask API"""
+    """Класс для взаимодействия с Flask API (асинхронный, с пулом соединений)"""
     
-    def __init__(self, api_url: str):
+    # Статусы, при которых запрос повторяется (аналог прежней urllib3 Retry стратегии)
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, api_url: str, max_retries: int = 3, backoff_factor: float = 1.0):
         self.api_url = api_url.rstrip('/')
-        self.session = requests.Session()
-        
-        # Настройка connection pooling для переиспользования соединений
-        from requests.adapters import HTTPAdapter
-        from urllib3.util.retry import Retry
-        
-        # Настройка retry стратегии
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
-            raise_on_status=False
-        )
-        
-        # Настройка HTTP adapter с connection pooling
-        adapter = HTTPAdapter(
-            pool_connections=10,
-            pool_maxsize=20,
-            max_retries=retry_strategy,
-            pool_block=False
-        )
-        
-        # Применяем adapter для HTTP и HTTPS
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-        
-        # Настройка keep-alive заголовков
-        self.session.headers.update({
-            'Connection': 'keep-alive',
-            'Keep-Alive': 'timeout=60, max=100'
-        })
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._client = None
+        self._etag_cache = {}  # url -> (ETag, тело ответа) для условных запросов
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Общий httpx.AsyncClient. Создается лениво - внутри event loop приложения,
+        чтобы соединения пула принадлежали тому же loop, что и обработчики.
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=20,
+                    max_keepalive_connections=10,
+                    keepalive_expiry=60
+                ),
+                transport=httpx.AsyncHTTPTransport(retries=1),
+                follow_redirects=True,
+                headers={"X-Bot-Key": BOT_API_KEY} if BOT_API_KEY else None
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Закрыть пул соединений (при остановке бота)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Выполнить запрос с повтором при 429/5xx и сетевых ошибках.
+        Задержка между попытками экспоненциальная (backoff_factor * 2^n) и не блокирует event loop.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff_factor * (2 ** attempt)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_factor * (2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(delay)
+    
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+    
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+    
+    async def get_conditional(self, url: str, **kwargs) -> httpx.Response:
+        """
+        GET с If-None-Match для публичных каталогов (тарифы, опции, брендинг, конфиг бота).
+        Если данные не менялись, сервер отвечает пустым 304 - возвращаем сохраненное
+        тело как ответ 200, поэтому вызывающий код не отличает его от обычного.
+        """
+        cached = self._etag_cache.get(url)
+        if cached:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers["If-None-Match"] = cached[0]
+            kwargs["headers"] = headers
+        response = await self.get(url, **kwargs)
+        if response.status_code == 304 and cached:
+            return httpx.Response(
+                200,
+                content=cached[1],
+                headers={"Content-Type": "application/json", "ETag": cached[0]},
+                request=response.request
+            )
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag:
+            self._etag_cache[url] = (etag, response.content)
+        return response
     
-    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
+    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
         """Получить пользователя по Telegram ID через API бота или создать JWT"""
         # Сначала пытаемся получить JWT токен через telegram-login эндпоинт
         # Но для бота нам нужен другой подход - создадим специальный эндпоинт
@@ -854,7 +954,7 @@ class ClientBotAPI:
         
         # Временное решение: используем внутренний эндпоинт для ботов
         try:
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/bot/get-token",
                 json={"telegram_id": telegram_id},
                 timeout=10
@@ -873,7 +973,7 @@ class ClientBotAPI:
         
         return None
     
-    def register_user(self, telegram_id: int, telegram_username: str = "", ref_code: str = None, preferred_lang: str = None, preferred_currency: str = None) -> Optional[dict]:
+    async def register_user(self, telegram_id: int, telegram_username: str = "", ref_code: str = None, preferred_lang: str = None, preferred_currency: str = None) -> Optional[dict]:
         """Зарегистрировать пользователя через бота"""
         try:
             payload = {
@@ -886,7 +986,7 @@ class ClientBotAPI:
             if preferred_currency:
                 payload["preferred_currency"] = preferred_currency
             
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/bot/register",
                 json=payload,
                 timeout=30
@@ -898,10 +998,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка регистрации: {e}")
         return None
     
-    def get_credentials(self, telegram_id: int) -> Optional[dict]:
+    async def get_credentials(self, telegram_id: int) -> Optional[dict]:
         """Получить логин (email) и пароль пользователя для входа на сайте"""
         try:
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/bot/get-credentials",
                 json={"telegram_id": telegram_id},
                 timeout=10
@@ -912,7 +1012,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения credentials: {e}")
         return None
     
-    def get_user_data(self, token: str, force_refresh: bool = False) -> Optional[dict]:
+    async def get_user_data(self, token: str, force_refresh: bool = False) -> Optional[dict]:
         """Получить данные пользователя с retry логикой"""
         headers = {
             "Authorization": f"Bearer {token}",
@@ -929,7 +1029,7 @@ class ClientBotAPI:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = self.session.get(
+                response = await self.get(
                     url,
                     headers=headers,
                     timeout=15  # Увеличено до 15 секунд
@@ -948,46 +1048,17 @@ class ClientBotAPI:
                     return None
                 else:
                     logger.warning(f"HTTP {response.status_code} при получении данных пользователя (попытка {attempt + 1}/{max_retries})")
-            except requests.exceptions.Timeout:
+            except httpx.TimeoutException:
                 logger.warning(f"Timeout при получении данных пользователя (попытка {attempt + 1}/{max_retries})")
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  # Экспоненциальная задержка: 1s, 2s, 4s
+                    await asyncio.sleep(2 ** attempt)  # Экспоненциальная задержка: 1s, 2s, 4s
                 else:
                     logger.error(f"Превышено максимальное количество попыток при получении данных пользователя")
-            except requests.exceptions.ConnectionError as e:
+            except httpx.TransportError as e:
+                # Битое соединение пул отбрасывает сам - пересоздавать клиент не нужно
                 logger.warning(f"Ошибка соединения при получении данных пользователя (попытка {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)
-                    # Пытаемся пересоздать соединение
-                    try:
-                        self.session.close()
-                        self.session = requests.Session()
-                        # Повторно применяем adapter
-                        from requests.adapters import HTTPAdapter
-                        from urllib3.util.retry import Retry
-                        retry_strategy = Retry(
-                            total=3,
-                            backoff_factor=1,
-                            status_forcelist=[429, 500, 502, 503, 504],
-                            allowed_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
-                            raise_on_status=False
-                        )
-                        adapter = HTTPAdapter(
-                            pool_connections=10,
-                            pool_maxsize=20,
-                            max_retries=retry_strategy,
-                            pool_block=False
-                        )
-                        self.session.mount("http://", adapter)
-                        self.session.mount("https://", adapter)
-                        self.session.headers.update({
-                            'Connection': 'keep-alive',
-                            'Keep-Alive': 'timeout=60, max=100'
-                        })
-                    except Exception as reset_error:
-                        logger.error(f"Ошибка при пересоздании сессии: {reset_error}")
+                    await asyncio.sleep(2 ** attempt)
                 else:
                     logger.error(f"Превышено максимальное количество попыток при ошибке соединения")
             except Exception as e:
@@ -997,10 +1068,10 @@ class ClientBotAPI:
         
         return None
     
-    def get_tariffs(self) -> list:
+    async def get_tariffs(self) -> list:
         """Получить список тарифов"""
         try:
-            response = self.session.get(
+            response = await self.get_conditional(
                 f"{self.api_url}/api/public/tariffs",
                 timeout=10
             )
@@ -1010,10 +1081,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения тарифов: {e}")
         return []
     
-    def get_tariff_features(self) -> dict:
+    async def get_tariff_features(self) -> dict:
         """Получить функции тарифов по tier"""
         try:
-            response = self.session.get(
+            response = await self.get_conditional(
                 f"{self.api_url}/api/public/tariff-features",
                 timeout=10
             )
@@ -1056,10 +1127,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения функций тарифов: {e}")
         return {}
 
-    def get_tariff_levels(self) -> list:
+    async def get_tariff_levels(self) -> list:
         """Получить публичные уровни тарифов"""
         try:
-            response = self.session.get(
+            response = await self.get_conditional(
                 f"{self.api_url}/api/public/tariff-levels",
                 timeout=10
             )
@@ -1070,10 +1141,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения уровней тарифов: {e}")
         return []
     
-    def get_branding(self) -> dict:
+    async def get_branding(self) -> dict:
         """Получить настройки брендинга (для названий функций)"""
         try:
-            response = self.session.get(
+            response = await self.get_conditional(
                 f"{self.api_url}/api/public/branding",
                 timeout=10
             )
@@ -1083,7 +1154,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения брендинга: {e}")
         return {}
     
-    def get_system_settings(self) -> dict:
+    async def get_system_settings(self) -> dict:
         """Получить системные настройки (активные языки и валюты) с кэшированием на 1 минуту"""
         # Используем простой кэш в памяти
         if not hasattr(self, '_system_settings_cache') or not hasattr(self, '_system_settings_cache_time'):
@@ -1096,7 +1167,7 @@ class ClientBotAPI:
             return self._system_settings_cache
         
         try:
-            response = self.session.get(
+            response = await self.get(
                 f"{self.api_url}/api/public/system-settings",
                 timeout=10
             )
@@ -1116,10 +1187,10 @@ class ClientBotAPI:
         }
         return default_settings
     
-    def get_available_payment_methods(self) -> list:
+    async def get_available_payment_methods(self) -> list:
         """Получить список доступных способов оплаты"""
         try:
-            response = self.session.get(
+            response = await self.get(
                 f"{self.api_url}/api/public/available-payment-methods",
                 timeout=10
             )
@@ -1130,10 +1201,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения способов оплаты: {e}")
         return []
 
-    def get_purchase_options(self) -> dict:
+    async def get_purchase_options(self) -> dict:
         """Получить опции для покупки (сгруппированные по типу)"""
         try:
-            response = self.session.get(
+            response = await self.get_conditional(
                 f"{self.api_url}/api/public/purchase-options",
                 timeout=10
             )
@@ -1144,7 +1215,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения опций: {e}")
         return {"traffic": [], "devices": [], "squad": []}
 
-    def create_option_payment(
+    async def create_option_payment(
         self,
         token: str,
         option_id: int,
@@ -1161,7 +1232,7 @@ class ClientBotAPI:
             if config_id:
                 payload["config_id"] = int(config_id)
 
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/client/create-option-payment",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
@@ -1177,10 +1248,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания платежа за опцию: {e}")
         return {"success": False, "message": "Ошибка создания платежа"}
     
-    def get_nodes(self, token: str) -> list:
+    async def get_nodes(self, token: str) -> list:
         """Получить список серверов"""
         try:
-            response = self.session.get(
+            response = await self.get(
                 f"{self.api_url}/api/client/nodes",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
@@ -1192,10 +1263,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения серверов: {e}")
         return []
     
-    def activate_trial(self, token: str) -> dict:
+    async def activate_trial(self, token: str) -> dict:
         """Активировать триал"""
         try:
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/client/activate-trial",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
@@ -1206,13 +1277,13 @@ class ClientBotAPI:
             logger.error(f"Ошибка активации триала: {e}")
         return {"success": False, "message": "Ошибка активации триала"}
 
-    def get_configs(self, token: str, force_refresh: bool = False) -> dict:
+    async def get_configs(self, token: str, force_refresh: bool = False) -> dict:
         """Получить список конфигов пользователя (primary + дополнительные)"""
         try:
             url = f"{self.api_url}/api/client/configs"
             if force_refresh:
                 url += "?force_refresh=true"
-            response = self.session.get(
+            response = await self.get(
                 url,
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=15
@@ -1223,7 +1294,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения конфигов: {e}")
         return {"configs": []}
     
-    def create_payment(
+    async def create_payment(
         self,
         token: str,
         tariff_id: int,
@@ -1244,7 +1315,7 @@ class ClientBotAPI:
                 payload["config_id"] = int(config_id)
             if create_new_config:
                 payload["create_new_config"] = True
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/client/create-payment",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
@@ -1256,10 +1327,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания платежа: {e}")
         return {"success": False, "message": "Ошибка создания платежа"}
     
-    def get_support_tickets(self, token: str) -> list:
+    async def get_support_tickets(self, token: str) -> list:
         """Получить список тикетов поддержки"""
         try:
-            response = self.session.get(
+            response = await self.get(
                 f"{self.api_url}/api/client/support-tickets",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
@@ -1270,10 +1341,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения тикетов: {e}")
         return []
     
-    def create_support_ticket(self, token: str, subject: str, message: str) -> dict:
+    async def create_support_ticket(self, token: str, subject: str, message: str) -> dict:
         """Создать тикет поддержки"""
         try:
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/client/support-tickets",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json={"subject": subject, "message": message},
@@ -1286,10 +1357,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка создания тикета: {e}")
         return {"success": False, "message": "Ошибка создания тикета"}
     
-    def get_ticket_messages(self, token: str, ticket_id: int) -> dict:
+    async def get_ticket_messages(self, token: str, ticket_id: int) -> dict:
         """Получить сообщения тикета"""
         try:
-            response = self.session.get(
+            response = await self.get(
                 f"{self.api_url}/api/support-tickets/{ticket_id}",
                 headers={"Authorization": f"Bearer {token}"},
                 timeout=10
@@ -1300,7 +1371,7 @@ class ClientBotAPI:
             logger.error(f"Ошибка получения сообщений тикета: {e}")
         return {}
     
-    def save_settings(self, token: str, lang: Optional[str] = None, currency: Optional[str] = None) -> dict:
+    async def save_settings(self, token: str, lang: Optional[str] = None, currency: Optional[str] = None) -> dict:
         """Сохранить настройки пользователя (язык, валюта)"""
         try:
             payload = {}
@@ -1313,7 +1384,7 @@ class ClientBotAPI:
                 return {"success": False, "message": "Нет данных для сохранения"}
             
             logger.info(f"Saving settings: {payload}")
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/client/settings",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json=payload,
@@ -1328,10 +1399,10 @@ class ClientBotAPI:
             logger.error(f"Ошибка сохранения настроек: {e}")
         return {"success": False, "message": "Ошибка сохранения настроек"}
     
-    def reply_to_ticket(self, token: str, ticket_id: int, message: str) -> dict:
+    async def reply_to_ticket(self, token: str, ticket_id: int, message: str) -> dict:
         """Ответить на тикет"""
         try:
-            response = self.session.post(
+            response = await self.post(
                 f"{self.api_url}/api/support-tickets/{ticket_id}/reply",
                 headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
                 json={"message": message},
@@ -2254,7 +2325,7 @@ def get_text(key: str, lang: str = 'ru') -> str:
         text = text.replace('{SERVICE_NAME}', get_service_name())
     return text
 
-def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = None, token: str = None) -> str:
+async def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = None, token: str = None) -> str:
     """Получить язык пользователя из данных, context или по токену"""
     # Сначала проверяем context.user_data (самый быстрый способ, если язык был недавно изменен)
     if context and hasattr(context, 'user_data') and 'user_lang' in context.user_data:
@@ -2273,7 +2344,7 @@ def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = N
     
     # Если есть token, получаем данные из API
     if token:
-        user_data = api.get_user_data(token)
+        user_data = await api.get_user_data(token)
         if user_data:
             lang = user_data.get('preferred_lang') or user_data.get('preferredLang') or 'ru'
             if lang in ['ru', 'ua', 'en', 'cn']:
@@ -2286,7 +2357,7 @@ def get_user_lang(user_data: dict = None, context: ContextTypes.DEFAULT_TYPE = N
     return 'ru'
 
 
-def get_user_token(telegram_id: int) -> Optional[str]:
+async def get_user_token(telegram_id: int) -> Optional[str]:
     """Получить или создать JWT токен для пользователя"""
     if telegram_id in user_tokens:
         cached = user_tokens.get(telegram_id)
@@ -2308,7 +2379,7 @@ def get_user_token(telegram_id: int) -> Optional[str]:
                 return cached["token"]
     
     # Получаем токен через API
-    token = api.get_user_by_telegram_id(telegram_id)
+    token = await api.get_user_by_telegram_id(telegram_id)
     if token and isinstance(token, str):
         user_tokens[telegram_id] = {"token": token, "exp": _get_jwt_exp(token)}
         return token
@@ -2347,10 +2418,10 @@ def clear_user_token_cache(telegram_id: int):
         pass
 
 
-def get_system_defaults() -> tuple[str, str]:
+async def get_system_defaults() -> tuple[str, str]:
     """Вернуть (default_language, default_currency) из системных настроек."""
     try:
-        settings = api.get_system_settings() or {}
+        settings = await api.get_system_settings() or {}
         lang = str(settings.get("default_language") or "ru").strip().lower() or "ru"
         currency = str(settings.get("default_currency") or "uah").strip().lower() or "uah"
         return lang, currency
@@ -2358,7 +2429,7 @@ def get_system_defaults() -> tuple[str, str]:
         return "ru", "uah"
 
 
-def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bool = False):
+async def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bool = False):
     """
     Получить user_data. Если token протух/стал невалидным — автоматически обновит токен и повторит запрос.
     Возвращает: (token, user_data)
@@ -2366,15 +2437,15 @@ def get_user_data_safe(telegram_id: int, token: Optional[str], force_refresh: bo
     if not token or not isinstance(token, str):
         return token, None
 
-    user_data = api.get_user_data(token, force_refresh=force_refresh)
+    user_data = await api.get_user_data(token, force_refresh=force_refresh)
     if user_data:
         return token, user_data
 
     # Наиболее частая причина: протухший JWT из кеша. Обновляем и пробуем ещё раз.
     clear_user_token_cache(telegram_id)
-    new_token = get_user_token(telegram_id)
+    new_token = await get_user_token(telegram_id)
     if new_token and isinstance(new_token, str):
-        user_data = api.get_user_data(new_token, force_refresh=force_refresh)
+        user_data = await api.get_user_data(new_token, force_refresh=force_refresh)
         if user_data:
             return new_token, user_data
 
@@ -2387,7 +2458,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     
     # Получаем токен для пользователя
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     
     # Проверяем блокировку аккаунта
     if isinstance(token, dict) and token.get('blocked'):
@@ -2420,9 +2491,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await show_channel_subscription_required(update, context)
                 return
 
-        default_lang, default_currency = get_system_defaults()
+        default_lang, default_currency = await get_system_defaults()
         telegram_username = user.username or ""
-        result = api.register_user(
+        result = await api.register_user(
             telegram_id,
             telegram_username,
             ref_code=referral_code,
@@ -2436,7 +2507,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_tokens[telegram_id] = {"token": token, "exp": _get_jwt_exp(token)}
         else:
             clear_user_token_cache(telegram_id)
-            token = get_user_token(telegram_id)
+            token = await get_user_token(telegram_id)
 
         if not token or not isinstance(token, str):
             # Если что-то пошло не так — показываем сообщение об ошибке
@@ -2444,15 +2515,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     # Получаем данные пользователя (с авто-refresh токена)
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await reply_with_logo(update, f"❌ {get_text('failed_to_load_user', lang)}")
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Получаем данные для клавиатуры
     is_active = user_data.get("activeInternalSquads", [])
@@ -2592,15 +2663,15 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
     # Попробуем обработать "зависшие" оплаты (если webhook не дошел), затем обновим профиль
     try:
-        api.session.post(
+        await api.post(
             f"{FLASK_API_URL}/api/client/payments/reconcile",
             headers={"Authorization": f"Bearer {token}"},
             json={},
@@ -2609,14 +2680,14 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         pass
 
-    token, user_data = get_user_data_safe(telegram_id, token, force_refresh=True)
+    token, user_data = await get_user_data_safe(telegram_id, token, force_refresh=True)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Формируем сообщение со статусом
     is_active = user_data.get("activeInternalSquads", [])
@@ -2685,7 +2756,7 @@ async def show_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_text += "━━━━━━━━━━━━━━━\n"
     status_text += f"🔐 **{get_text('login_data_title', user_lang)}**\n"
     
-    credentials = api.get_credentials(telegram_id)
+    credentials = await api.get_credentials(telegram_id)
     if credentials and credentials.get("email"):
         status_text += f"📧 `{credentials['email']}`\n"
         if credentials.get("password"):
@@ -2738,20 +2809,20 @@ async def show_subscription_menu(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
     # Обновим профиль, чтобы статус был актуален
-    token, user_data = get_user_data_safe(telegram_id, token, force_refresh=True)
+    token, user_data = await get_user_data_safe(telegram_id, token, force_refresh=True)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('failed_to_load', lang)}", show_alert=True)
         return
 
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
     is_active = user_data.get("activeInternalSquads", [])
     expire_at = user_data.get("expireAt")
@@ -2830,8 +2901,8 @@ async def show_support_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
 
     text = f"💬 **{get_text('support', user_lang)}**\n"
     text += "━━━━━━━━━━━━━━━\n\n"
@@ -2891,7 +2962,7 @@ async def show_support_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     agreement_url = ''
     offer_url = ''
     try:
-        branding = api.get_branding() or {}
+        branding = await api.get_branding() or {}
         agreement_url = (branding.get('user_agreement_url') or '').strip()
         offer_url = (branding.get('offer_url') or '').strip()
     except Exception:
@@ -2943,19 +3014,19 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
-    tariffs = api.get_tariffs()
+    tariffs = await api.get_tariffs()
     
     if not tariffs:
         await update.callback_query.answer("❌ Тарифы не найдены")
         return
     
     # Получаем валюту пользователя
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     
     currency_map = {
@@ -2968,13 +3039,13 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     symbol = currency_config["symbol"]
     
     # Динамические уровни тарифов (как в V3)
-    levels = api.get_tariff_levels()
+    levels = await api.get_tariff_levels()
     levels_sorted = sorted(
         (lvl for lvl in levels if isinstance(lvl, dict) and lvl.get("code")),
         key=lambda x: (x.get("display_order", 0), x.get("id", 0))
     )
 
-    branding = api.get_branding()
+    branding = await api.get_branding()
     basic_name = branding.get("tariff_tier_basic_name", "Базовый") or "Базовый"
     pro_name = branding.get("tariff_tier_pro_name", "Премиум") or "Премиум"
     elite_name = branding.get("tariff_tier_elite_name", "Элитный") or "Элитный"
@@ -3059,29 +3130,15 @@ async def show_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await safe_edit_or_send_with_logo(update, context, text_clean, reply_markup=reply_markup)
 
 
-async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str):
-    """Показать тарифы конкретного типа (Basic/Pro/Elite) с выбором длительности"""
-    query = update.callback_query
-    if not query:
-        return
-    
-    user = update.effective_user
-    telegram_id = user.id
-    
-    token = get_user_token(telegram_id)
-    if not token:
-        await query.answer("❌ Ошибка авторизации")
-        return
-    
-    tariffs = api.get_tariffs()
-    
+async def build_tier_tariffs_view(tier: str, currency: str, tariffs=None):
+    """
+    Данные экрана тарифов уровня (tier) в валюте пользователя и параметры изображения.
+    Возвращает None, если тарифов этого уровня нет.
+    """
+    if tariffs is None:
+        tariffs = await api.get_tariffs()
     if not tariffs:
-        await query.answer("❌ Тарифы не найдены")
-        return
-    
-    # Получаем валюту пользователя
-    token, user_data = get_user_data_safe(telegram_id, token)
-    currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
+        return None
     
     currency_map = {
         "uah": {"field": "price_uah", "symbol": "₴"},
@@ -3094,12 +3151,12 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
     symbol = currency_config["symbol"]
     
     # Получаем названия уровней тарифов (TariffLevel), fallback на branding
-    branding = api.get_branding()
+    branding = await api.get_branding()
     basic_name = branding.get("tariff_tier_basic_name", "Базовый") or "Базовый"
     pro_name = branding.get("tariff_tier_pro_name", "Премиум") or "Премиум"
     elite_name = branding.get("tariff_tier_elite_name", "Элитный") or "Элитный"
 
-    levels = api.get_tariff_levels()
+    levels = await api.get_tariff_levels()
     tier_names_plain = {lvl.get("code"): (lvl.get("name") or lvl.get("code")) for lvl in levels if isinstance(lvl, dict) and lvl.get("code")}
     tier_names_plain.setdefault("basic", basic_name)
     tier_names_plain.setdefault("pro", pro_name)
@@ -3125,18 +3182,17 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
             tier_tariffs.append(tariff)
     
     if not tier_tariffs:
-        await query.answer("❌ Тарифы этого типа не найдены")
-        return
+        return None
     
     # Сортируем по длительности
     tier_tariffs.sort(key=lambda x: x.get("duration_days", 0))
     
     # Получаем функции тарифа для этого tier
-    tariff_features = api.get_tariff_features()
+    tariff_features = await api.get_tariff_features()
     features_list = tariff_features.get(tier, [])
     
     # Получаем названия функций из брендинга
-    branding = api.get_branding()
+    branding = await api.get_branding()
     features_names = branding.get("tariff_features_names", {})
     
     # Подготавливаем функции для генерации изображения
@@ -3171,31 +3227,88 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
         "icon": tier_icons.get(str(tier), "⭐"),
     }
     
+    # Получаем цвет из брендинга (если есть)
+    primary_color_hex = branding.get("primary_color", "#3f69ff")
+    # Конвертируем hex в RGB tuple
+    try:
+        hex_color = primary_color_hex.lstrip('#')
+        if len(hex_color) == 3:
+            hex_color = ''.join([c*2 for c in hex_color])
+        primary_color = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    except:
+        primary_color = (63, 105, 255)  # Синий по умолчанию
+
+    image_params = dict(
+        tier_name=tier_info["name"],
+        tier_icon=tier_info["icon"],
+        features=processed_features,
+        tariffs=tier_tariffs,
+        currency=currency,
+        currency_symbol=symbol,
+        primary_color=primary_color
+    )
+    
+    return {
+        "tier_tariffs": tier_tariffs,
+        "features_list": features_list,
+        "processed_features": processed_features,
+        "tier_info": tier_info,
+        "price_field": price_field,
+        "symbol": symbol,
+        "image_params": image_params,
+    }
+
+
+async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE, tier: str):
+    """Показать тарифы конкретного типа (Basic/Pro/Elite) с выбором длительности"""
+    query = update.callback_query
+    if not query:
+        return
+    
+    user = update.effective_user
+    telegram_id = user.id
+    
+    token = await get_user_token(telegram_id)
+    if not token:
+        await query.answer("❌ Ошибка авторизации")
+        return
+    
+    tariffs = await api.get_tariffs()
+    
+    if not tariffs:
+        await query.answer("❌ Тарифы не найдены")
+        return
+    
+    # Получаем валюту пользователя
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
+    
+    
+    view = await build_tier_tariffs_view(tier, currency, tariffs)
+    if not view:
+        await query.answer("❌ Тарифы этого типа не найдены")
+        return
+    
+    tier_tariffs = view["tier_tariffs"]
+    features_list = view["features_list"]
+    processed_features = view["processed_features"]
+    tier_info = view["tier_info"]
+    price_field = view["price_field"]
+    symbol = view["symbol"]
+    image_params = view["image_params"]
+    
     # Генерируем изображение
     try:
-        from modules.image_generator import generate_tariff_image
+        from modules.image_generator import tariff_image_key, tariff_image_cache
         from io import BytesIO
         
-        # Получаем цвет из брендинга (если есть)
-        primary_color_hex = branding.get("primary_color", "#3f69ff")
-        # Конвертируем hex в RGB tuple
-        try:
-            hex_color = primary_color_hex.lstrip('#')
-            if len(hex_color) == 3:
-                hex_color = ''.join([c*2 for c in hex_color])
-            primary_color = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        except:
-            primary_color = (63, 105, 255)  # Синий по умолчанию
-        
-        image_bytes = generate_tariff_image(
-            tier_name=tier_info["name"],
-            tier_icon=tier_info["icon"],
-            features=processed_features,
-            tariffs=tier_tariffs,
-            currency=currency,
-            currency_symbol=symbol,
-            primary_color=primary_color
-        )
+        # Изображение кешируется по хэшу данных; после первой отправки используется file_id
+        image_key = tariff_image_key(**image_params)
+        image_file_id = tariff_image_cache.get_file_id(image_key)
+        image_bytes = None
+        if not image_file_id:
+            # Рендер занимает сотни мс CPU - выполняем вне event loop
+            image_bytes = await asyncio.to_thread(tariff_image_cache.get_image, image_key, **image_params)
         
         # Кнопки выбора длительности
         keyboard = []
@@ -3223,23 +3336,37 @@ async def show_tier_tariffs(update: Update, context: ContextTypes.DEFAULT_TYPE,
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Отправляем изображение
-        photo_file = BytesIO(image_bytes)
-        photo_file.name = f"tariff_{tier}.png"
-        
         # Пытаемся удалить старое сообщение
         try:
             await query.message.delete()
         except:
             pass
         
-        # Отправляем новое сообщение с изображением
-        await context.bot.send_photo(
+        # Отправляем новое сообщение с изображением (по file_id, если оно уже загружено)
+        if image_file_id:
+            try:
+                await context.bot.send_photo(
+                    chat_id=query.message.chat_id,
+                    photo=image_file_id,
+                    caption="Выберите длительность:",
+                    reply_markup=reply_markup
+                )
+                return
+            except BadRequest as e:
+                logger.warning(f"Cached tariff image file_id rejected, uploading again: {e}")
+                tariff_image_cache.remember_file_id(image_key, None)
+                image_bytes = await asyncio.to_thread(tariff_image_cache.get_image, image_key, **image_params)
+        
+        photo_file = BytesIO(image_bytes)
+        photo_file.name = f"tariff_{tier}.png"
+        message = await context.bot.send_photo(
             chat_id=query.message.chat_id,
             photo=photo_file,
             caption="Выберите длительность:",
             reply_markup=reply_markup
         )
+        if message and message.photo:
+            tariff_image_cache.remember_file_id(image_key, message.photo[-1].file_id)
         
     except ImportError:
         # Если модуль не найден, используем текстовую версию (fallback)
@@ -3351,17 +3478,17 @@ async def show_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать категории дополнительных опций"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     currency = (user_data.get("preferred_currency") if user_data else "uah") or "uah"
     symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(str(currency).lower(), "₴")
 
-    options = api.get_purchase_options() or {}
+    options = await api.get_purchase_options() or {}
     traffic = options.get("traffic", []) or []
     devices = options.get("devices", []) or []
     squad = options.get("squad", []) or []
@@ -3391,17 +3518,17 @@ async def show_options_category(update: Update, context: ContextTypes.DEFAULT_TY
     """Показать список опций по типу"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     currency = (user_data.get("preferred_currency") if user_data else "uah") or "uah"
     symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(str(currency).lower(), "₴")
 
-    options = api.get_purchase_options() or {}
+    options = await api.get_purchase_options() or {}
     items = options.get(option_type, []) or []
 
     titles = {"traffic": "📊 Трафик", "devices": "📱 Устройства", "squad": "👥 Сквады"}
@@ -3456,15 +3583,15 @@ async def show_option_payment_methods(update: Update, context: ContextTypes.DEFA
     """Показать методы оплаты для опции"""
     query = update.callback_query
     telegram_id = query.from_user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     if not available_methods:
         text = "❌ Нет доступных способов оплаты. Настройте платежки в админке."
         keyboard = [[InlineKeyboardButton(f"🔙 {get_text('back', user_lang)}", callback_data="options")]]
@@ -3505,18 +3632,18 @@ async def show_servers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
     # Проверяем активность подписки
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await update.callback_query.answer("❌ Не удалось загрузить данные")
         return
     
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     is_active = user_data.get("activeInternalSquads", [])
     expire_at = user_data.get("expireAt")
     
@@ -3524,7 +3651,7 @@ async def show_servers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.answer("❌ Подписка не активна. Активируйте триал или выберите тариф")
         return
     
-    nodes = api.get_nodes(token)
+    nodes = await api.get_nodes(token)
     
     back_to = pop_back_callback(context, "main_menu")
 
@@ -3589,22 +3716,22 @@ async def show_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await update.callback_query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await update.callback_query.answer("❌ Не удалось загрузить данные")
         return
     
     # Получаем язык пользователя
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Получаем информацию о реферальной программе из API
     try:
-        ref_resp = api.session.get(
+        ref_resp = await api.get(
             f"{FLASK_API_URL}/api/client/referrals/info",
             headers={"Authorization": f"Bearer {token}"},
             timeout=5
@@ -3644,7 +3771,7 @@ async def show_referrals(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Получаем домен сервера из API
         try:
-            domain_resp = api.session.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
+            domain_resp = await api.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
             if domain_resp.status_code == 200:
                 domain_data = domain_resp.json()
                 server_domain = domain_data.get("full_url") or domain_data.get("domain") or YOUR_SERVER_IP
@@ -3733,21 +3860,21 @@ async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('auth_error', lang)}")
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await update.callback_query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
 
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    tickets = api.get_support_tickets(token)
+    tickets = await api.get_support_tickets(token)
     
     text = f"💬 **{get_text('support_title', user_lang)}**\n"
     text += "━━━━━━━━━━━━━━━\n\n"
@@ -3804,8 +3931,8 @@ async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_user_agreement(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать пользовательское соглашение"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст пользовательского соглашения (может быть ссылкой)
     agreement_text = get_user_agreement_text(user_lang)
@@ -3838,8 +3965,8 @@ async def show_user_agreement(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать публичную оферту"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст публичной оферты (может быть ссылкой)
     offer_text = get_offer_text(user_lang)
@@ -4400,8 +4527,8 @@ def get_refund_policy_text(lang: str = 'ru') -> str:
 async def show_refund_policy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать политику возврата"""
     telegram_id = update.effective_user.id
-    token = get_user_token(telegram_id)
-    user_lang = get_user_lang(None, context, token)
+    token = await get_user_token(telegram_id)
+    user_lang = await get_user_lang(None, context, token)
     
     # Текст политики возврата
     policy_text = get_refund_policy_text(user_lang)
@@ -4453,13 +4580,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if token:
-            token, user_data = get_user_data_safe(telegram_id, token)
+            token, user_data = await get_user_data_safe(telegram_id, token)
             
             if user_data:
                 # Получаем язык пользователя
-                user_lang = get_user_lang(user_data, context, token)
+                user_lang = await get_user_lang(user_data, context, token)
                 
                 welcome_text = f"🛡 **{get_text('stealthnet_bot', user_lang)}**\n"
                 welcome_text += f"👋 {get_text('main_menu_button', user_lang)}\n"
@@ -4574,7 +4701,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         
         # Fallback если не удалось загрузить данные
-        lang = get_user_lang(None, context, token) if token else 'ru'
+        lang = await get_user_lang(None, context, token) if token else 'ru'
         welcome_text = f"👋 {get_text('main_menu_button', lang)}\n\n"
         welcome_text += f"{get_text('select_action', lang)}:"
         
@@ -4679,7 +4806,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         telegram_id = update.callback_query.from_user.id
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
             await update.callback_query.answer("❌ Ошибка авторизации")
             return
@@ -4691,10 +4818,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             cfg_id = None
 
-        await update.callback_query.answer(get_text('creating_payment', get_user_lang(None, context, token)))
-        result = api.create_option_payment(token, option_id, provider, config_id=cfg_id)
-        user_data_api = api.get_user_data(token) or {}
-        user_lang = get_user_lang(user_data_api, context, token)
+        await update.callback_query.answer(get_text('creating_payment', await get_user_lang(None, context, token)))
+        result = await api.create_option_payment(token, option_id, provider, config_id=cfg_id)
+        user_data_api = await api.get_user_data(token) or {}
+        user_lang = await get_user_lang(user_data_api, context, token)
 
         if result.get("payment_url"):
             payment_url = result["payment_url"]
@@ -4747,19 +4874,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
-            lang = get_user_lang(None, context, token)
+            lang = await get_user_lang(None, context, token)
             await query.answer(f"❌ {get_text('auth_error', lang)}")
             return
         
-        token, user_data_api = get_user_data_safe(telegram_id, token)
+        token, user_data_api = await get_user_data_safe(telegram_id, token)
         if not user_data_api:
-            lang = get_user_lang(None, context, token)
+            lang = await get_user_lang(None, context, token)
             await query.answer(f"❌ {get_text('failed_to_load', lang)}")
             return
         
-        user_lang = get_user_lang(user_data_api, context, token)
+        user_lang = await get_user_lang(user_data_api, context, token)
         preferred_currency = user_data_api.get("preferred_currency", "uah")
         currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
         
@@ -4802,13 +4929,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user = update.effective_user
         telegram_id = user.id
-        token = get_user_token(telegram_id)
-        token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-        user_lang = get_user_lang(user_data, context, token)
+        token = await get_user_token(telegram_id)
+        token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+        user_lang = await get_user_lang(user_data, context, token)
         
         # Получаем домен сервера из API
         try:
-            domain_resp = api.session.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
+            domain_resp = await api.get(f"{FLASK_API_URL}/api/public/server-domain", timeout=5)
             if domain_resp.status_code == 200:
                 domain_data = domain_resp.json()
                 server_domain = domain_data.get("full_url") or domain_data.get("domain") or YOUR_SERVER_IP
@@ -4847,9 +4974,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "create_ticket":
         user = update.effective_user
         telegram_id = user.id
-        token = get_user_token(telegram_id)
-        token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-        user_lang = get_user_lang(user_data, context, token)
+        token = await get_user_token(telegram_id)
+        token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+        user_lang = await get_user_lang(user_data, context, token)
         
         temp_update = Update(update_id=0, callback_query=query)
         await safe_edit_or_send_with_logo(
@@ -4873,9 +5000,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ticket_id = int(data.replace("reply_ticket_", ""))
             user = update.effective_user
             telegram_id = user.id
-            token = get_user_token(telegram_id)
-            token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-            user_lang = get_user_lang(user_data, context, token)
+            token = await get_user_token(telegram_id)
+            token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+            user_lang = await get_user_lang(user_data, context, token)
             
             temp_update = Update(update_id=0, callback_query=query)
             await safe_edit_or_send_with_logo(
@@ -4891,9 +5018,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except (ValueError, IndexError):
             user = update.effective_user
             telegram_id = user.id
-            token = get_user_token(telegram_id)
-            token, user_data = get_user_data_safe(telegram_id, token) if token else (token, None)
-            user_lang = get_user_lang(user_data, context, token)
+            token = await get_user_token(telegram_id)
+            token, user_data = await get_user_data_safe(telegram_id, token) if token else (token, None)
+            user_lang = await get_user_lang(user_data, context, token)
             await query.answer(f"❌ {get_text('invalid_ticket_id', user_lang)}")
     
     elif data == "register_user":
@@ -4941,18 +5068,18 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await query.answer("❌ Не удалось загрузить данные")
         return
     
     # Получаем язык и валюту с правильными ключами
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     current_currency = user_data.get("preferred_currency") or user_data.get("preferredCurrency") or "uah"
     
     logger.debug(f"Settings: lang={user_lang}, currency={current_currency}")
@@ -4973,7 +5100,7 @@ async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text += f"📝 {get_text('select_currency', user_lang)}\n"
     
     # Получаем активные валюты из настроек
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     # Генерируем кнопки валют динамически
@@ -5025,13 +5152,13 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
     # Проверяем, что валюта активна
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     if currency not in active_currencies:
@@ -5039,7 +5166,7 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
         return
     
     # Проверяем текущую валюту
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     current_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     
     if current_currency == currency:
@@ -5047,7 +5174,7 @@ async def set_currency(update: Update, context: ContextTypes.DEFAULT_TYPE, curre
         return
     
     # Сохраняем валюту
-    result = api.save_settings(token, currency=currency)
+    result = await api.save_settings(token, currency=currency)
     
     logger.info(f"Currency save result: {result}")
     
@@ -5076,24 +5203,24 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
         await query.answer("❌ Не удалось загрузить данные")
         return
     
-    current_lang = get_user_lang(user_data, context, token)
+    current_lang = await get_user_lang(user_data, context, token)
     
     # Если язык не указан, показываем меню выбора
     if not lang:
         text = f"🌐 **{get_text('select_language', current_lang)}**\n\n"
         
         # Получаем активные языки из настроек
-        system_settings = api.get_system_settings()
+        system_settings = await api.get_system_settings()
         active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
         
         # Генерируем кнопки языков динамически
@@ -5132,7 +5259,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
         return
     
     # Проверяем, что язык активен
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
     
     if lang not in active_languages:
@@ -5145,7 +5272,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE, lang:
         return
     
     # Сохраняем язык
-    result = api.save_settings(token, lang=lang)
+    result = await api.save_settings(token, lang=lang)
     
     logger.info(f"Language save result: {result}")
     
@@ -5179,18 +5306,18 @@ async def view_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     await query.answer(f"⏳ {get_text('loading_ticket', user_lang)}...")
     
-    ticket_data = api.get_ticket_messages(token, ticket_id)
+    ticket_data = await api.get_ticket_messages(token, ticket_id)
     
     if not ticket_data or not ticket_data.get("messages"):
         temp_update = Update(update_id=0, callback_query=query)
@@ -5314,9 +5441,9 @@ async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_username = user.username or ""
     
     # Проверяем, не зарегистрирован ли уже
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if token:
-        lang = get_user_lang(None, context, token) if token else 'ru'
+        lang = await get_user_lang(None, context, token) if token else 'ru'
         await query.answer(f"✅ {get_text('already_registered', lang)}", show_alert=True)
         await start(update, context)
         return
@@ -5334,9 +5461,9 @@ async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Авто-регистрация с системными настройками (язык/валюта)
     ref_code = context.user_data.get("ref_code")
-    default_lang, default_currency = get_system_defaults()
+    default_lang, default_currency = await get_system_defaults()
     await query.answer("⏳", show_alert=False)
-    result = api.register_user(
+    result = await api.register_user(
         telegram_id,
         telegram_username,
         ref_code=ref_code,
@@ -5358,7 +5485,7 @@ async def register_select_language(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Проверяем, что язык активен
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_languages = system_settings.get("active_languages", ["ru", "ua", "en", "cn"])
     
     if lang not in active_languages:
@@ -5382,7 +5509,7 @@ async def register_select_language(update: Update, context: ContextTypes.DEFAULT
     text += "💡 Вы сможете изменить её позже в настройках."
     
     # Получаем активные валюты из настроек
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     # Генерируем кнопки валют динамически на основе активных валют
@@ -5427,7 +5554,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
         return
     
     # Проверяем, что валюта активна
-    system_settings = api.get_system_settings()
+    system_settings = await api.get_system_settings()
     active_currencies = system_settings.get("active_currencies", ["uah", "rub", "usd"])
     
     if currency not in active_currencies:
@@ -5478,7 +5605,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
     ref_code = context.user_data.get("ref_code")
     
     # Регистрируем пользователя с выбранными языком и валютой
-    result = api.register_user(telegram_id, telegram_username, ref_code, preferred_lang=lang, preferred_currency=currency)
+    result = await api.register_user(telegram_id, telegram_username, ref_code, preferred_lang=lang, preferred_currency=currency)
     
     if not result:
         text = "❌ **Ошибка регистрации**\n\n"
@@ -5494,7 +5621,7 @@ async def register_select_currency(update: Update, context: ContextTypes.DEFAULT
     
     if result.get("message") == "User already registered":
         await query.answer("✅ Вы уже зарегистрированы!", show_alert=True)
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if token:
             await show_status(update, context)
         return
@@ -5569,18 +5696,18 @@ async def activate_trial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     await query.answer(f"⏳ {get_text('activating_trial', user_lang)}...")
     
-    result = api.activate_trial(token)
+    result = await api.activate_trial(token)
     
     keyboard = [[InlineKeyboardButton(f"🔙 {get_text('main_menu_button', user_lang)}", callback_data="main_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -5686,22 +5813,22 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
         await query.answer("❌ Ошибка авторизации", show_alert=True)
         return
     
     # Получаем информацию о тарифе
-    tariffs = api.get_tariffs()
+    tariffs = await api.get_tariffs()
     tariff = next((t for t in tariffs if t.get("id") == tariff_id), None)
     
     if not tariff:
         await query.answer("❌ Тариф не найден", show_alert=True)
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     currency_map = {
         "uah": {"field": "price_uah", "symbol": "₴"},
@@ -5729,11 +5856,11 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
             tariff_tier = "basic"
     
     # Получаем функции тарифа
-    tariff_features = api.get_tariff_features()
+    tariff_features = await api.get_tariff_features()
     features_list = tariff_features.get(tariff_tier, [])
     
     # Получаем названия функций из брендинга
-    branding = api.get_branding()
+    branding = await api.get_branding()
     features_names = branding.get("tariff_features_names", {})
     
     text = f"💎 **{get_text('tariff_selected', user_lang)}:** {tariff.get('name', get_text('unknown', user_lang))}\n"
@@ -5788,7 +5915,7 @@ async def select_tariff(update: Update, context: ContextTypes.DEFAULT_TYPE, tari
     text += f"**{get_text('payment_methods', user_lang)}**:"
     
     # Получаем доступные способы оплаты из API
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     
     # Маппинг названий способов оплаты
     payment_names = {
@@ -5882,14 +6009,14 @@ async def handle_payment(
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     
     # Если оплата с баланса, используем специальный endpoint
     if provider == 'balance':
@@ -5902,7 +6029,7 @@ async def handle_payment(
             if create_new_config:
                 payload["create_new_config"] = True
 
-            response = api.session.post(
+            response = await api.post(
                 f"{FLASK_API_URL}/api/client/purchase-with-balance",
                 headers={"Authorization": f"Bearer {token}"},
                 json=payload,
@@ -5955,7 +6082,7 @@ async def handle_payment(
     
     await query.answer(f"⏳ {get_text('creating_payment', user_lang)}...")
     
-    result = api.create_payment(
+    result = await api.create_payment(
         token,
         tariff_id,
         provider,
@@ -6031,16 +6158,16 @@ async def choose_config_for_payment(update: Update, context: ContextTypes.DEFAUL
     user = update.effective_user
     telegram_id = user.id
 
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    cfgs_resp = api.get_configs(token)
+    cfgs_resp = await api.get_configs(token)
     cfgs = (cfgs_resp or {}).get('configs') or []
 
     text = "🧩 **Выберите конфиг для оплаты**\n"
@@ -6082,16 +6209,16 @@ async def show_configs(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user = update.effective_user
     telegram_id = user.id
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}", show_alert=True)
         return
 
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
 
-    cfgs_resp = api.get_configs(token, force_refresh=True)
+    cfgs_resp = await api.get_configs(token, force_refresh=True)
     cfgs = (cfgs_resp or {}).get('configs') or []
 
     text = f"🧩 **{get_text('configs_button', user_lang)}**\n"
@@ -6148,19 +6275,19 @@ async def show_topup_balance(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
     if not user_data:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('failed_to_load', lang)}")
         return
     
-    user_lang = get_user_lang(user_data, context, token)
+    user_lang = await get_user_lang(user_data, context, token)
     balance = user_data.get("balance", 0)
     preferred_currency = user_data.get("preferred_currency", "uah")
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
@@ -6219,9 +6346,9 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         if query:
             await query.answer(f"❌ {get_text('auth_error', lang)}")
         elif message:
@@ -6229,8 +6356,8 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
             await reply_with_logo(temp_update, f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     preferred_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
     
@@ -6240,7 +6367,7 @@ async def select_topup_method(update: Update, context: ContextTypes.DEFAULT_TYPE
     text += f"**{get_text('select_topup_method', user_lang)}**:"
     
     # Получаем доступные способы оплаты
-    available_methods = api.get_available_payment_methods()
+    available_methods = await api.get_available_payment_methods()
     
     payment_names = {
         'crystalpay': '💳 CrystalPay',
@@ -6317,21 +6444,21 @@ async def handle_topup_payment(update: Update, context: ContextTypes.DEFAULT_TYP
     user = update.effective_user
     telegram_id = user.id
     
-    token = get_user_token(telegram_id)
+    token = await get_user_token(telegram_id)
     if not token:
-        lang = get_user_lang(None, context, token)
+        lang = await get_user_lang(None, context, token)
         await query.answer(f"❌ {get_text('auth_error', lang)}")
         return
     
-    token, user_data = get_user_data_safe(telegram_id, token)
-    user_lang = get_user_lang(user_data, context, token)
+    token, user_data = await get_user_data_safe(telegram_id, token)
+    user_lang = await get_user_lang(user_data, context, token)
     preferred_currency = user_data.get("preferred_currency", "uah") if user_data else "uah"
     currency_symbol = {"uah": "₴", "rub": "₽", "usd": "$"}.get(preferred_currency, "₴")
     
     await query.answer(f"⏳ {get_text('creating_payment', user_lang)}...")
     
     try:
-        response = api.session.post(
+        response = await api.post(
             f"{FLASK_API_URL}/api/client/create-payment",
             headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
             json={
@@ -6394,10 +6521,64 @@ async def handle_topup_payment(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+async def prewarm_tariff_images():
+    """Предварительный рендер изображений тарифов для всех уровней и валют"""
+    from modules.image_generator import tariff_image_key, tariff_image_cache
+
+    try:
+        tariffs = await api.get_tariffs()
+        if not tariffs:
+            return
+        levels = await api.get_tariff_levels()
+        tiers = [lvl.get("code") for lvl in levels if isinstance(lvl, dict) and lvl.get("code")]
+        for tier in ("basic", "pro", "elite"):
+            if tier not in tiers:
+                tiers.append(tier)
+
+        rendered = 0
+        for tier in tiers:
+            for currency in ("uah", "rub", "usd"):
+                view = await build_tier_tariffs_view(tier, currency, tariffs)
+                if not view:
+                    continue
+                image_params = view["image_params"]
+                image_key = tariff_image_key(**image_params)
+                await asyncio.to_thread(tariff_image_cache.get_image, image_key, **image_params)
+                rendered += 1
+        logger.info(f"Tariff images pre-warmed: {rendered}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Tariff images pre-warm failed: {e}")
+
+
+async def post_init(application: Application):
+    """Запуск внутри event loop: первичная загрузка конфигурации и фоновое обновление кешей"""
+    await refresh_bot_config()
+    await refresh_trial_settings()
+    application.bot_data['config_refresh_task'] = asyncio.create_task(config_refresh_loop())
+    application.bot_data['tariff_prewarm_task'] = asyncio.create_task(prewarm_tariff_images())
+
+
+async def post_shutdown(application: Application):
+    """Остановка фоновых задач и закрытие пула соединений с Flask API"""
+    for name in ('config_refresh_task', 'tariff_prewarm_task'):
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    await api.aclose()
+
+
 def main():
     """Главная функция запуска бота"""
     # Создаем приложение
-    application = Application.builder().token(CLIENT_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(CLIENT_BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -6492,14 +6673,14 @@ def main():
                 message = update.message.text
                 
                 telegram_id = update.effective_user.id
-                token = get_user_token(telegram_id)
+                token = await get_user_token(telegram_id)
                 
                 if token:
-                    result = api.create_support_ticket(token, subject, message)
+                    result = await api.create_support_ticket(token, subject, message)
                     
                     # Получаем язык пользователя для кнопки
-                    token, user_data_api = get_user_data_safe(telegram_id, token) if token else (token, None)
-                    user_lang = get_user_lang(user_data_api, context, token)
+                    token, user_data_api = await get_user_data_safe(telegram_id, token) if token else (token, None)
+                    user_lang = await get_user_lang(user_data_api, context, token)
                     
                     # API возвращает {"message": "Created", "ticket_id": nt.id} со статусом 201
                     # Проверяем оба варианта
@@ -6546,14 +6727,14 @@ def main():
                 message = update.message.text
                 
                 telegram_id = update.effective_user.id
-                token = get_user_token(telegram_id)
+                token = await get_user_token(telegram_id)
                 
                 if token and ticket_id:
                     # Получаем язык пользователя для кнопок
-                    token, user_data_api = get_user_data_safe(telegram_id, token)
-                    user_lang = get_user_lang(user_data_api, context, token)
+                    token, user_data_api = await get_user_data_safe(telegram_id, token)
+                    user_lang = await get_user_lang(user_data_api, context, token)
                     
-                    result = api.reply_to_ticket(token, ticket_id, message)
+                    result = await api.reply_to_ticket(token, ticket_id, message)
                     
                     if result.get("id") or result.get("success"):
                         # Создаем клавиатуру с кнопками "Просмотреть тикет" и "Назад"
@@ -6593,9 +6774,9 @@ def main():
                 user = update.effective_user
                 telegram_id = user.id
                 
-                token = get_user_token(telegram_id)
-                token, user_data_api = get_user_data_safe(telegram_id, token) if token else (token, None)
-                user_lang = get_user_lang(user_data_api, context, token)
+                token = await get_user_token(telegram_id)
+                token, user_data_api = await get_user_data_safe(telegram_id, token) if token else (token, None)
+                user_lang = await get_user_lang(user_data_api, context, token)
                 
                 try:
                     amount_text = update.message.text.strip()
@@ -6662,13 +6843,13 @@ def main():
         user = update.effective_user
         telegram_id = user.id
         
-        token = get_user_token(telegram_id)
+        token = await get_user_token(telegram_id)
         if not token:
             await message.reply_text("❌ Ошибка авторизации")
             return
         
-        token, user_data = get_user_data_safe(telegram_id, token)
-        user_lang = get_user_lang(user_data, context, token)
+        token, user_data = await get_user_data_safe(telegram_id, token)
+        user_lang = await get_user_lang(user_data, context, token)
         
         # Платеж обрабатывается через вебхук, просто уведомляем пользователя
         text = f"✅ **{get_text('payment_successful', user_lang)}**\n\n"
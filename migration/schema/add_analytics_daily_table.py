@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Миграция: создание таблицы analytics_daily.
+
+Дневные агрегаты для /api/admin/analytics. Если таблица пустая,
+она заполняется по всей истории (см. backfill_analytics.py).
+"""
+
+from flask import Flask
+from modules.core import init_app, get_db
+
+
+def add_analytics_daily_table(app=None):
+    """Создать таблицу analytics_daily (если ещё нет) и заполнить её"""
+    if app is None:
+        app = Flask(__name__)
+    init_app(app)
+
+    with app.app_context():
+        db = get_db()
+        from modules.models.analytics import AnalyticsDaily
+        from modules.analytics import rebuild_rollups
+        try:
+            AnalyticsDaily.__table__.create(bind=db.engine, checkfirst=True)
+            print("✅ Таблица analytics_daily создана")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Ошибка создания таблицы analytics_daily: {e}")
+            return False
+
+        try:
+            if db.session.query(AnalyticsDaily.id).first() is None:
+                days = rebuild_rollups()
+                print(f"✅ Агрегаты аналитики заполнены: {days} дн.")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Ошибка заполнения analytics_daily: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    add_analytics_daily_table()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Миграция: создание таблицы broadcast_job.
+
+Задания ручной рассылки (/api/admin/broadcast) с прогрессом выполнения.
+"""
+
+from flask import Flask
+from modules.core import init_app, get_db
+
+
+def add_broadcast_job_table(app=None):
+    """Создать таблицу broadcast_job (если ещё нет)"""
+    if app is None:
+        app = Flask(__name__)
+    init_app(app)
+
+    with app.app_context():
+        db = get_db()
+        from modules.models.broadcast import BroadcastJob  # noqa: F401
+        try:
+            BroadcastJob.__table__.create(bind=db.engine, checkfirst=True)
+            print("✅ Таблица broadcast_job создана")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Ошибка создания таблицы broadcast_job: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    add_broadcast_job_table()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Миграция: индексы для частых выборок.
+
+Индексы объявлены в моделях (__table_args__), новые БД получают их через
+db.create_all(). Скрипт создает их в существующих БД:
+- SQLite: CREATE INDEX IF NOT EXISTS
+- PostgreSQL: CREATE INDEX CONCURRENTLY IF NOT EXISTS (без блокировки записи в таблицу)
+
+Проверка планов запросов: other/tools/check_query_plans.py
+"""
+
+from flask import Flask
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+from modules.core import init_app, get_db
+
+
+def _indexed_tables():
+    from modules.models.payment import Payment
+    from modules.models.user import User
+    from modules.models.user_config import UserConfig
+    from modules.models.ticket import Ticket, TicketMessage
+    from modules.models.casino import CasinoGame
+    return [m.__table__ for m in (Payment, User, UserConfig, Ticket, TicketMessage, CasinoGame)]
+
+
+def add_hot_lookup_indexes(app=None):
+    """Создать недостающие индексы из моделей"""
+    if app is None:
+        app = Flask(__name__)
+    init_app(app)
+
+    with app.app_context():
+        db = get_db()
+        engine = db.engine
+        is_postgres = engine.dialect.name == 'postgresql'
+        inspector = inspect(engine)
+        ok = True
+
+        for table in _indexed_tables():
+            if not inspector.has_table(table.name):
+                print(f"   ⏭️  Таблица {table.name} не найдена, индексы будут созданы вместе с ней")
+                continue
+            existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                if index.name in existing:
+                    continue
+                try:
+                    if is_postgres:
+                        # CONCURRENTLY нельзя выполнять внутри транзакции
+                        ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                        ddl = ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                            conn.exec_driver_sql(ddl)
+                    else:
+                        index.create(bind=engine, checkfirst=True)
+                    print(f"✅ Индекс {index.name} создан")
+                except Exception as e:
+                    ok = False
+                    print(f"❌ Ошибка создания индекса {index.name}: {e}")
+        return ok
+
+
+if __name__ == "__main__":
+    add_hot_lookup_indexes()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Миграция: создание таблицы payment_event.
+
+Inbox событий платежей: вебхуки сохраняют событие, фоновый пул применяет его один раз.
+"""
+
+from flask import Flask
+from modules.core import init_app, get_db
+
+
+def add_payment_event_table(app=None):
+    """Создать таблицу payment_event (если ещё нет)"""
+    if app is None:
+        app = Flask(__name__)
+    init_app(app)
+
+    with app.app_context():
+        db = get_db()
+        from modules.models.payment_event import PaymentEvent  # noqa: F401
+        try:
+            PaymentEvent.__table__.create(bind=db.engine, checkfirst=True)
+            print("✅ Таблица payment_event создана")
+            return True
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Ошибка создания таблицы payment_event: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    add_payment_event_table()
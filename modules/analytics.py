@@ -0,0 +1,346 @@
+"""
+Дневные агрегаты аналитики (таблица analytics_daily)
+
+/api/admin/analytics читает только агрегаты, а не все платежи и пользователей за период.
+
+Агрегаты обновляются инкрементально: при изменении User / Payment / UserConfig
+(регистрация, оплата в вебхуке, создание конфига) день записи помечается
+"грязным" и после commit пересчитывается только этот день.
+Полный пересчет (первичное заполнение, исправление после ручных правок в БД):
+    python backfill_analytics.py [--days N | --start YYYY-MM-DD --end YYYY-MM-DD]
+
+Массовые Query.update()/delete() обходят события ORM - после них нужен backfill.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import event, func, case, select, delete, insert, distinct
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from modules.core import get_db
+from modules.models.analytics import AnalyticsDaily
+from modules.models.user import User
+from modules.models.payment import Payment
+from modules.models.user_config import UserConfig
+
+db = get_db()
+
+DIRTY_DAYS_KEY = 'analytics_dirty_days'
+
+# Метрики регистраций (порядок совпадает с колонками запроса в _compute_day)
+REGISTRATION_METRICS = (
+    'registrations',
+    'registrations_verified',
+    'registrations_telegram',
+    'registrations_trial',
+    'registrations_referred',
+)
+
+# Поля, изменение которых влияет на агрегаты
+TRACKED_FIELDS = {
+    User: ('role', 'created_at', 'is_verified', 'telegram_id', 'trial_used', 'referrer_id'),
+    Payment: ('status', 'amount', 'currency', 'payment_provider', 'tariff_id', 'promo_code_id', 'user_id', 'created_at'),
+    UserConfig: ('user_id', 'created_at'),
+}
+
+
+def to_day(value):
+    """Дата (UTC) из datetime/date"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def _day_bounds(day):
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+# ============================================================================
+# ПЕРЕСЧЕТ
+# ============================================================================
+
+def _compute_day(conn, day):
+    """Агрегаты одного дня: {(metric, dim, currency): [count, amount]}"""
+    start, end = _day_bounds(day)
+    users = User.__table__
+    payments = Payment.__table__
+    configs = UserConfig.__table__
+    rows = {}
+
+    def add(metric, count, amount=0.0, dim='', currency=''):
+        row = rows.setdefault((metric, str(dim), currency or ''), [0, 0.0])
+        row[0] += int(count or 0)
+        row[1] += float(amount or 0)
+
+    # Регистрации клиентов
+    registrations = conn.execute(select(
+        func.count(users.c.id),
+        func.sum(case((users.c.is_verified == True, 1), else_=0)),
+        func.sum(case((users.c.telegram_id.isnot(None), 1), else_=0)),
+        func.sum(case((users.c.trial_used == True, 1), else_=0)),
+        func.sum(case((users.c.referrer_id.isnot(None), 1), else_=0)),
+    ).where(
+        users.c.role == 'CLIENT',
+        users.c.created_at >= start,
+        users.c.created_at < end
+    )).one()
+    for metric, value in zip(REGISTRATION_METRICS, registrations):
+        if value:
+            add(metric, value)
+
+    # Рефералы по рефереру
+    referrer = users.alias('referrer')
+    for referrer_id, count in conn.execute(select(
+        users.c.referrer_id, func.count(users.c.id)
+    ).join(
+        referrer, referrer.c.id == users.c.referrer_id
+    ).where(
+        users.c.role == 'CLIENT',
+        referrer.c.role == 'CLIENT',
+        users.c.created_at >= start,
+        users.c.created_at < end
+    ).group_by(users.c.referrer_id)):
+        add('referral', count, dim=referrer_id)
+
+    # Все созданные платежи
+    total_payments = conn.execute(select(func.count(payments.c.id)).where(
+        payments.c.created_at >= start,
+        payments.c.created_at < end
+    )).scalar()
+    if total_payments:
+        add('payments', total_payments)
+
+    # Оплаченные платежи: выручка по валюте, провайдеру, тарифу, промокоду и пользователю
+    for currency, provider, tariff_id, promo_code_id, user_id, role, count, amount in conn.execute(select(
+        payments.c.currency,
+        payments.c.payment_provider,
+        payments.c.tariff_id,
+        payments.c.promo_code_id,
+        payments.c.user_id,
+        users.c.role,
+        func.count(payments.c.id),
+        func.sum(payments.c.amount)
+    ).outerjoin(
+        users, users.c.id == payments.c.user_id
+    ).where(
+        payments.c.status == 'PAID',
+        payments.c.created_at >= start,
+        payments.c.created_at < end
+    ).group_by(
+        payments.c.currency,
+        payments.c.payment_provider,
+        payments.c.tariff_id,
+        payments.c.promo_code_id,
+        payments.c.user_id,
+        users.c.role
+    )):
+        currency = currency or 'USD'
+        add('revenue', count, amount, currency=currency)
+        add('provider', count, amount, dim=provider or 'unknown', currency=currency)
+        if tariff_id is not None:
+            add('tariff', count, amount, dim=tariff_id, currency=currency)
+        if promo_code_id is not None:
+            add('promo', count, amount, dim=promo_code_id, currency=currency)
+        if role == 'CLIENT':
+            add('user_revenue', count, amount, dim=user_id, currency=currency)
+
+    # Созданные конфиги
+    for user_id, count in conn.execute(select(
+        configs.c.user_id, func.count(configs.c.id)
+    ).where(
+        configs.c.created_at >= start,
+        configs.c.created_at < end
+    ).group_by(configs.c.user_id)):
+        add('configs', count)
+        add('config_user', count, dim=user_id)
+
+    return rows
+
+
+def recompute_days(days):
+    """Пересчитать агрегаты указанных дней. Возвращает количество пересчитанных дней."""
+    days = sorted({d for d in days if d})
+    table = AnalyticsDaily.__table__
+    for day in days:
+        for attempt in range(2):
+            try:
+                with db.engine.begin() as conn:
+                    rows = _compute_day(conn, day)
+                    conn.execute(delete(table).where(table.c.day == day))
+                    if rows:
+                        conn.execute(insert(table), [
+                            {'day': day, 'metric': metric, 'dim': dim, 'currency': currency, 'count': count, 'amount': amount}
+                            for (metric, dim, currency), (count, amount) in rows.items()
+                        ])
+                break
+            except IntegrityError:
+                # Тот же день параллельно пересчитал другой worker - пересчитываем еще раз
+                if attempt:
+                    raise
+    return len(days)
+
+
+def rebuild_rollups(start_day=None, end_day=None):
+    """
+    Полный пересчет агрегатов за диапазон дней (по умолчанию - вся история).
+    Возвращает количество пересчитанных дней.
+    """
+    if start_day is None:
+        candidates = [
+            db.session.query(func.min(User.created_at)).scalar(),
+            db.session.query(func.min(Payment.created_at)).scalar(),
+            db.session.query(func.min(UserConfig.created_at)).scalar(),
+        ]
+        candidates = [to_day(c) for c in candidates if c]
+        if not candidates:
+            return 0
+        start_day = min(candidates)
+    if end_day is None:
+        end_day = datetime.now(timezone.utc).date()
+
+    table = AnalyticsDaily.__table__
+    with db.engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.day >= start_day, table.c.day <= end_day))
+
+    days = []
+    day = start_day
+    while day <= end_day:
+        days.append(day)
+        day += timedelta(days=1)
+    return recompute_days(days)
+
+
+# ============================================================================
+# ИНКРЕМЕНТАЛЬНОЕ ОБНОВЛЕНИЕ (события ORM)
+# ============================================================================
+
+def _mark_dirty(target, check_changes):
+    session = object_session(target)
+    if session is None:
+        return
+    days = session.info.setdefault(DIRTY_DAYS_KEY, set())
+    if check_changes:
+        state = db.inspect(target)
+        changed = False
+        for field in TRACKED_FIELDS[type(target)]:
+            history = state.attrs[field].history
+            if history.has_changes():
+                changed = True
+                if field == 'created_at':
+                    days.update(to_day(old) for old in history.deleted)
+        if not changed:
+            return
+    days.add(to_day(target.created_at))
+
+
+def _after_insert(mapper, connection, target):
+    _mark_dirty(target, check_changes=False)
+
+
+def _after_update(mapper, connection, target):
+    _mark_dirty(target, check_changes=True)
+
+
+def _after_delete(mapper, connection, target):
+    _mark_dirty(target, check_changes=False)
+
+
+for _model in TRACKED_FIELDS:
+    event.listen(_model, 'after_insert', _after_insert)
+    event.listen(_model, 'after_update', _after_update)
+    event.listen(_model, 'after_delete', _after_delete)
+
+
+@event.listens_for(Session, 'after_commit')
+def _recompute_dirty_days(session):
+    days = session.info.pop(DIRTY_DAYS_KEY, None)
+    if not days:
+        return
+    try:
+        recompute_days(days)
+    except Exception as e:
+        print(f"Warning: analytics rollup update failed for {sorted(d.isoformat() for d in days if d)}: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_dirty_days(session):
+    session.info.pop(DIRTY_DAYS_KEY, None)
+
+
+# ============================================================================
+# ЧТЕНИЕ
+# ============================================================================
+
+def _range_filter(start_day, end_day, metrics):
+    filters = [AnalyticsDaily.day >= start_day, AnalyticsDaily.day <= end_day]
+    if isinstance(metrics, str):
+        filters.append(AnalyticsDaily.metric == metrics)
+    else:
+        filters.append(AnalyticsDaily.metric.in_(list(metrics)))
+    return filters
+
+
+def get_totals(start_day, end_day, metrics, dims=None):
+    """Суммы за диапазон: {metric: {(dim, currency): (count, amount)}}"""
+    query = db.session.query(
+        AnalyticsDaily.metric,
+        AnalyticsDaily.dim,
+        AnalyticsDaily.currency,
+        func.sum(AnalyticsDaily.count),
+        func.sum(AnalyticsDaily.amount)
+    ).filter(*_range_filter(start_day, end_day, metrics))
+    if dims is not None:
+        query = query.filter(AnalyticsDaily.dim.in_([str(d) for d in dims]))
+    result = {}
+    for metric, dim, currency, count, amount in query.group_by(
+        AnalyticsDaily.metric, AnalyticsDaily.dim, AnalyticsDaily.currency
+    ):
+        result.setdefault(metric, {})[(dim, currency)] = (int(count or 0), float(amount or 0))
+    return result
+
+
+def get_daily(start_day, end_day, metrics):
+    """Значения по дням: [(day, metric, currency, count, amount)]"""
+    return db.session.query(
+        AnalyticsDaily.day,
+        AnalyticsDaily.metric,
+        AnalyticsDaily.currency,
+        func.sum(AnalyticsDaily.count),
+        func.sum(AnalyticsDaily.amount)
+    ).filter(*_range_filter(start_day, end_day, metrics)).group_by(
+        AnalyticsDaily.day, AnalyticsDaily.metric, AnalyticsDaily.currency
+    ).order_by(AnalyticsDaily.day).all()
+
+
+def get_top_dims(start_day, end_day, metric, limit, by='amount'):
+    """Топ значений dim метрики по сумме amount или count: [(dim, count, amount)]"""
+    total_count = func.sum(AnalyticsDaily.count)
+    total_amount = func.sum(AnalyticsDaily.amount)
+    order = total_amount if by == 'amount' else total_count
+    return db.session.query(AnalyticsDaily.dim, total_count, total_amount).filter(
+        *_range_filter(start_day, end_day, metric)
+    ).group_by(AnalyticsDaily.dim).order_by(order.desc()).limit(limit).all()
+
+
+def count_dims(start_day, end_day, metric):
+    """Количество различных dim метрики за диапазон (например, пользователей с конфигами)"""
+    return db.session.query(func.count(distinct(AnalyticsDaily.dim))).filter(
+        *_range_filter(start_day, end_day, metric)
+    ).scalar() or 0
+
+
+def dims_subquery(start_day, end_day, metric):
+    """Подзапрос различных dim метрики за диапазон"""
+    return select(AnalyticsDaily.dim).where(*_range_filter(start_day, end_day, metric)).distinct()
+
+
+__all__ = [
+    'recompute_days', 'rebuild_rollups', 'to_day',
+    'get_totals', 'get_daily', 'get_top_dims', 'count_dims', 'dims_subquery',
+]
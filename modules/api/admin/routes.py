@@ -14,7 +14,7 @@ API эндпоинты администратора
 - GET/POST /api/admin/trial-settings - Настройки триала
 - GET/POST /api/admin/tariff-features - Функции тарифов
 - GET/POST /api/admin/currency-rates - Курсы валют
-- POST /api/admin/broadcast - Рассылка
+- POST /api/admin/broadcast - Рассылка (GET /api/admin/broadcast/<id> - прогресс)
 """
 
 from flask import jsonify, request
@@ -23,10 +23,24 @@ import requests
 import json
 import os
 
-from modules.core import get_app, get_db, get_cache, get_bcrypt
-from modules.auth import admin_required
+from modules.core import get_app, get_db, get_cache
+from modules.auth import admin_required, invalidate_identity
+from modules.remnawave import get_remnawave
+from modules.remnawave_snapshot import get_users_snapshot
+from modules import analytics
+from modules import settings_registry
+from modules import swr_cache
+from modules import tagged_cache
+from modules import password_hashing
+from modules.password_hashing import PasswordHashingBusy
+# send_telegram_message / pin_telegram_message импортируются отсюда другими модулями
+from modules.broadcast import (
+    send_telegram_message, pin_telegram_message, get_broadcast_bot_token,
+    enqueue_broadcast, cancel_broadcast, start_broadcast_worker
+)
 from modules.models.user import User
-from modules.models.payment import Payment, PaymentSetting
+from modules.models.payment import Payment
+from modules.payment_settings import get_payment_settings
 from modules.models.tariff import Tariff
 from modules.models.promo import PromoCode
 from modules.models.ticket import Ticket, TicketMessage
@@ -36,136 +50,178 @@ from modules.models.bot_config import BotConfig
 from modules.models.referral import ReferralSetting
 from modules.models.tariff_feature import TariffFeatureSetting
 from modules.models.currency import CurrencyRate
+from modules.currency import invalidate_currency_rates
 from modules.models.auto_broadcast import AutoBroadcastMessage, AutoBroadcastSettings
 from modules.models.trial import TrialSettings
 from modules.models.tariff_level import TariffLevel
 from modules.models.option import PurchaseOption
+from modules.models.broadcast import BroadcastJob
 
 app = get_app()
 db = get_db()
 cache = get_cache()
-bcrypt = get_bcrypt()
-
-
-def get_remnawave_headers():
-    """Получить заголовки для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    return headers, cookies
+remnawave = get_remnawave()
+users_snapshot = get_users_snapshot()
 
 
 # ============================================================================
 # USERS
 # ============================================================================
 
+# Поля сортировки списка пользователей (?sort=-created_at)
+ADMIN_USERS_SORT_FIELDS = {
+    'id': User.id,
+    'email': User.email,
+    'role': User.role,
+    'balance': User.balance,
+    'created_at': User.created_at,
+    'telegram_id': User.telegram_id,
+    'telegram_username': User.telegram_username,
+}
+ADMIN_USERS_MAX_PAGE_SIZE = 500
+# Запрос без page/page_size (устарел): не больше стольких пользователей (0 - без ограничения).
+# Админка из frontend/build запрашивает список без пагинации и ищет/блокирует на клиенте,
+# поэтому по умолчанию ограничения нет - включайте его после перехода админки на page/page_size
+ADMIN_USERS_UNPAGINATED_LIMIT = int(os.getenv('ADMIN_USERS_UNPAGINATED_LIMIT', 0))
+
+
+def _parse_bool_arg(name):
+    """true/false/1/0 из query string, None если параметр не задан"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _has_active_subscription(live_data):
+    """Активна ли подписка по данным RemnaWave (expireAt в будущем)"""
+    if not live_data or not live_data.get('expireAt'):
+        return False
+    try:
+        expire_at = datetime.fromisoformat(str(live_data['expireAt']).replace('Z', '+00:00'))
+        if expire_at.tzinfo is None:
+            expire_at = expire_at.replace(tzinfo=timezone.utc)
+        return expire_at > datetime.now(timezone.utc)
+    except Exception:
+        return False
+
+
 @app.route('/api/admin/users', methods=['GET'])
 @admin_required
 def get_admin_users(current_admin):
-    """Получение списка пользователей"""
+    """
+    Получение списка пользователей
+
+    Query параметры:
+    - page, page_size - пагинация (page_size до 500). Без них (устарело, текущая админка)
+      возвращается массив всех пользователей (или первых ADMIN_USERS_UNPAGINATED_LIMIT,
+      если лимит задан), общее количество - в заголовке X-Total-Count
+    - search - поиск по email, telegram_id/username, UUID, реферальному коду, id
+    - sort - поле сортировки (id, email, role, balance, created_at, telegram_id,
+      telegram_username), "-" в начале - по убыванию
+    - blocked, has_telegram, has_subscription - фильтры (true/false)
+    """
     try:
-        local_users = User.query.all()
-        live_map = cache.get('all_live_users_map')
-        
-        if not live_map:
-            headers, cookies = get_remnawave_headers()
-            try:
-                # RemnaWave /api/users поддерживает пагинацию (size/start). Без параметров может вернуться
-                # только первая страница, из-за чего большинство пользователей будет "не найдено".
-                users_list = []
-                start = 0
-                size = 1000
-                total = None
-                while True:
-                    resp = requests.get(
-                        f"{os.getenv('API_URL')}/api/users",
-                        params={"size": size, "start": start},
-                        headers=headers,
-                        cookies=cookies,
-                        timeout=15
-                    )
-                    payload = resp.json() if resp is not None else {}
-                    data = payload.get('response', payload) if isinstance(payload, dict) else payload
-
-                    if isinstance(data, dict):
-                        chunk = data.get('users', []) or []
-                        if total is None:
-                            try:
-                                total = int(data.get('total')) if data.get('total') is not None else None
-                            except Exception:
-                                total = None
-                    elif isinstance(data, list):
-                        chunk = data
-                    else:
-                        chunk = []
-
-                    if not isinstance(chunk, list) or len(chunk) == 0:
-                        break
-
-                    users_list.extend(chunk)
-                    start += size
-
-                    if total is not None and len(users_list) >= total:
-                        break
-                    # Safety to avoid infinite loop if API behaves unexpectedly
-                    if start > 50000:
-                        break
-                # Создаем два индекса: по UUID и по email/username
-                live_map = {u['uuid']: u for u in users_list if isinstance(u, dict) and 'uuid' in u}
-                # Дополнительный индекс по email для поиска, если UUID не совпадает
-                live_map_by_email = {}
-                for u in users_list:
-                    if isinstance(u, dict):
-                        # Пробуем разные поля для email/username
-                        email_key = u.get('email') or u.get('username') or u.get('name')
-                        if email_key:
-                            live_map_by_email[email_key.lower()] = u
-                cache.set('all_live_users_map', live_map, timeout=60)
-                cache.set('all_live_users_map_by_email', live_map_by_email, timeout=60)
-            except Exception as e:
-                print(f"Warning: Could not fetch live users: {e}")
-                live_map = {}
-                live_map_by_email = {}
+        from sqlalchemy import func, or_
+        from modules.models.user_config import UserConfig
+
+        paginated = 'page' in request.args or 'page_size' in request.args
+        page = max(request.args.get('page', type=int) or 1, 1)
+        page_size = min(max(request.args.get('page_size', type=int) or 50, 1), ADMIN_USERS_MAX_PAGE_SIZE)
+        if not paginated and ADMIN_USERS_UNPAGINATED_LIMIT > 0:
+            # Устаревший запрос без пагинации - первая страница увеличенного размера
+            paginated, page, page_size = True, 1, ADMIN_USERS_UNPAGINATED_LIMIT
+            legacy = True
         else:
-            live_map_by_email = cache.get('all_live_users_map_by_email') or {}
+            legacy = not paginated
+        search = (request.args.get('search') or '').strip()
+        sort = (request.args.get('sort') or 'id').strip()
+        blocked = _parse_bool_arg('blocked')
+        has_telegram = _parse_bool_arg('has_telegram')
+        has_subscription = _parse_bool_arg('has_subscription')
+
+        # UUID основного конфига одним подзапросом вместо запроса на каждого пользователя
+        primary_cfg = db.session.query(
+            UserConfig.user_id.label('user_id'),
+            func.min(UserConfig.remnawave_uuid).label('primary_uuid')
+        ).filter(UserConfig.is_primary == True).group_by(UserConfig.user_id).subquery()
+
+        query = db.session.query(User, primary_cfg.c.primary_uuid).outerjoin(
+            primary_cfg, primary_cfg.c.user_id == User.id
+        )
+
+        if search:
+            pattern = f'%{search}%'
+            conditions = [
+                User.email.ilike(pattern),
+                User.telegram_username.ilike(pattern),
+                User.telegram_id.ilike(pattern),
+                User.remnawave_uuid.ilike(pattern),
+                User.referral_code.ilike(pattern),
+                primary_cfg.c.primary_uuid.ilike(pattern),
+            ]
+            if search.isdigit():
+                conditions.append(User.id == int(search))
+            query = query.filter(or_(*conditions))
+        if blocked is not None:
+            query = query.filter(User.is_blocked == blocked)
+        if has_telegram is not None:
+            query = query.filter(User.telegram_id.isnot(None) if has_telegram else User.telegram_id.is_(None))
+
+        sort_desc = sort.startswith('-')
+        sort_column = ADMIN_USERS_SORT_FIELDS.get(sort.lstrip('-'), User.id)
+        query = query.order_by(sort_column.desc() if sort_desc else sort_column.asc(), User.id.asc())
+
+        if has_subscription is None:
+            total = query.order_by(None).count()
+            rows = query.limit(page_size).offset((page - 1) * page_size).all() if paginated else query.all()
+        else:
+            # Подписка живет в RemnaWave: фильтруем легкий список (id, uuid) по снимку,
+            # а полные строки загружаем только для нужной страницы
+            id_rows = query.with_entities(User.id, func.coalesce(primary_cfg.c.primary_uuid, User.remnawave_uuid)).all()
+            live_by_uuid = users_snapshot.get_many({uuid for _, uuid in id_rows if uuid})
+            matched_ids = [
+                user_id for user_id, uuid in id_rows
+                if _has_active_subscription(live_by_uuid.get(uuid)) == has_subscription
+            ]
+            total = len(matched_ids)
+            page_ids = matched_ids[(page - 1) * page_size:page * page_size] if paginated else matched_ids
+            rows_by_id = {}
+            for i in range(0, len(page_ids), 900):
+                chunk_ids = page_ids[i:i + 900]
+                for user, primary_uuid in query.filter(User.id.in_(chunk_ids)).all():
+                    rows_by_id[user.id] = (user, primary_uuid)
+            rows = [rows_by_id[user_id] for user_id in page_ids if user_id in rows_by_id]
+
+        # Данные RemnaWave из снимка - только для пользователей текущей выборки
+        try:
+            live_map = users_snapshot.get_many({(primary_uuid or u.remnawave_uuid) for u, primary_uuid in rows})
+        except Exception as e:
+            print(f"Warning: Could not fetch live users: {e}")
+            live_map = {}
         
-        from modules.currency import convert_from_usd
+        from modules.currency import convert_many_from_usd
+        
+        balances_converted = convert_many_from_usd(
+            [float(u.balance) if u.balance else 0.0 for u, _ in rows],
+            [u.preferred_currency or 'uah' for u, _ in rows]
+        )
         
         combined = []
-        for u in local_users:
+        for (u, primary_uuid), balance_converted in zip(rows, balances_converted):
             balance_usd = float(u.balance) if u.balance else 0.0
-            balance_converted = convert_from_usd(balance_usd, u.preferred_currency or 'uah')
             
             # Пытаемся найти пользователя в RemnaWave
             live_data = None
             fetch_error = None
-            primary_uuid = None
             
             # Если включены несколько конфигов (UserConfig), то remnawave_uuid у User должен быть равен UUID основного конфига.
             # Ранее здесь был авто-апдейт UUID по email/username из RemnaWave, но при нескольких конфигурациях это опасно:
             # - email может совпадать у разных конфигов
             # - live_map_by_email становится неоднозначным
             # и в итоге u.remnawave_uuid начинает "прыгать", ломая оплаты/уведомления.
-            try:
-                from modules.models.user_config import UserConfig
-                primary_cfg = UserConfig.query.filter_by(user_id=u.id, is_primary=True).first()
-                if primary_cfg and primary_cfg.remnawave_uuid:
-                    primary_uuid = primary_cfg.remnawave_uuid
-                    if u.remnawave_uuid != primary_uuid:
-                        u.remnawave_uuid = primary_uuid
-            except Exception:
-                primary_uuid = None
+            if primary_uuid and u.remnawave_uuid != primary_uuid:
+                u.remnawave_uuid = primary_uuid
             
             # Сначала ищем по UUID
             uuid_for_lookup = primary_uuid or u.remnawave_uuid
@@ -180,10 +236,10 @@ def get_admin_users(current_admin):
                     u.email.replace('@', '_').lower(),  # admin@stealthnet.app -> admin_stealthnet_app
                     u.email.split('@')[0].lower()  # admin@stealthnet.app -> admin
                 ]
-                for email_var in email_variants:
-                    if email_var in live_map_by_email:
-                        live_data = live_map_by_email[email_var]
-                        break
+                try:
+                    live_data = users_snapshot.find_by_email(email_variants)
+                except Exception:
+                    live_data = None
             
             if u.remnawave_uuid and not live_data:
                 fetch_error = "User not found in RemnaWave"
@@ -215,7 +271,22 @@ def get_admin_users(current_admin):
             print(f"Error committing UUID updates: {e}")
             db.session.rollback()
         
-        return jsonify(combined), 200
+        if legacy:
+            response = jsonify(combined)
+            response.headers['X-Total-Count'] = str(total)
+            response.headers['Deprecation'] = 'true'
+            if total > len(combined):
+                response.headers['X-Truncated'] = 'true'
+                print(f"[ADMIN] /api/admin/users without page: returned {len(combined)} of {total} users, use page/page_size")
+            return response, 200
+        
+        return jsonify({
+            "users": combined,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "pages": (total + page_size - 1) // page_size
+        }), 200
         
     except Exception as e:
         print(f"Error in get_admin_users: {e}")
@@ -290,13 +361,7 @@ def delete_user(current_admin, user_id):
         # Удаляем пользователя из RemnaWave перед удалением из локальной БД
         if remnawave_uuid:
             try:
-                headers, cookies = get_remnawave_headers()
-                delete_response = requests.delete(
-                    f"{os.getenv('API_URL')}/api/users/{remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
-                    timeout=10
-                )
+                delete_response = remnawave.delete_user(remnawave_uuid)
                 if delete_response.status_code in [200, 204]:
                     print(f"✓ User {user_id} deleted from RemnaWave (UUID: {remnawave_uuid})")
                 else:
@@ -308,7 +373,6 @@ def delete_user(current_admin, user_id):
         # Очищаем кэш
         if remnawave_uuid:
             cache.delete(f'live_data_{remnawave_uuid}')
-        cache.delete('all_live_users_map')
         
         # Удаляем пользователя из локальной БД
         db.session.delete(user)
@@ -382,7 +446,7 @@ def update_user_balance(current_admin, user_id):
         
         # Очищаем кэш пользователя
         cache.delete(f'live_data_{u.remnawave_uuid}')
-        cache.delete('all_live_users_map')
+        invalidate_identity(u.id)
         
         # Конвертируем баланс обратно в валюту пользователя для отображения
         balance_display = convert_from_usd(new_balance_usd, u.preferred_currency or 'uah')
@@ -417,9 +481,11 @@ def admin_change_user_password(current_admin, user_id):
         new_password = data.get('new_password')
         if not new_password:
             return jsonify({"message": "New password is required"}), 400
-        user.password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
+        user.password_hash = password_hashing.hash_password(new_password)
         db.session.commit()
         return jsonify({"message": "Password changed successfully"}), 200
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
     except Exception as e:
         return jsonify({"message": "Internal Error"}), 500
 
@@ -510,6 +576,7 @@ def block_user(current_admin, user_id):
         user.blocked_at = datetime.now(timezone.utc)
         
         db.session.commit()
+        invalidate_identity(user.id)
         
         return jsonify({
             "message": "User blocked successfully",
@@ -539,11 +606,11 @@ def unblock_user(current_admin, user_id):
         user.blocked_at = None
         
         db.session.commit()
+        invalidate_identity(user.id)
         
         # Очищаем кэш пользователя, чтобы данные обновились
         if user.remnawave_uuid:
             cache.delete(f'live_data_{user.remnawave_uuid}')
-        cache.delete('all_live_users_map')
         
         return jsonify({
             "message": "User unblocked successfully",
@@ -582,13 +649,7 @@ def update_user_telegram_id(current_admin, user_id):
         # Обновляем telegramId в RemnaWave, если есть UUID
         if user.remnawave_uuid:
             try:
-                headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-                requests.patch(
-                    f"{os.getenv('API_URL')}/api/users",
-                    headers=headers,
-                    json={"uuid": user.remnawave_uuid, "telegramId": telegram_id},
-                    timeout=10
-                )
+                remnawave.patch_user({"uuid": user.remnawave_uuid, "telegramId": telegram_id})
                 cache.delete(f'live_data_{user.remnawave_uuid}')
             except Exception as e:
                 print(f"Warning: Failed to update telegramId in RemnaWave: {e}")
@@ -639,8 +700,6 @@ def admin_update_user(current_admin, user_id):
         if not action:
             return jsonify({"message": "Action is required. Valid actions: grant_tariff, grant_trial, set_device_limit"}), 400
         
-        headers, cookies = get_remnawave_headers()
-
         def _parse_dt(value):
             """Parse ISO datetime string (handles trailing Z). Returns aware dt in UTC or None."""
             if not value or not isinstance(value, str):
@@ -701,12 +760,7 @@ def admin_update_user(current_admin, user_id):
             if days_to_add <= 0:
                 days_to_add = 30
 
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{target_uuid}",
-                headers=headers,
-                cookies=cookies,
-                timeout=10
-            )
+            resp = remnawave.get_user(target_uuid)
             if resp.status_code != 200:
                 return jsonify({"message": "Failed to get user data"}), 500
 
@@ -754,18 +808,11 @@ def admin_update_user(current_admin, user_id):
             except Exception:
                 pass
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
-                json=patch_payload,
-                timeout=10
-            )
+            patch_resp = remnawave.patch_user(patch_payload)
             if not patch_resp.ok:
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
             return jsonify({
                 "message": "Tariff granted successfully",
                 "user_email": user.email,
@@ -784,12 +831,7 @@ def admin_update_user(current_admin, user_id):
             if days <= 0:
                 days = 3
 
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{target_uuid}",
-                headers=headers,
-                cookies=cookies,
-                timeout=10
-            )
+            resp = remnawave.get_user(target_uuid)
             if resp.status_code != 200:
                 return jsonify({"message": "Failed to get user data"}), 500
 
@@ -804,7 +846,7 @@ def admin_update_user(current_admin, user_id):
             # Если у пользователя уже есть сквады — сохраняем. Иначе ставим trial squad / default squad.
             trial_squad = None
             try:
-                referral_settings = ReferralSetting.query.first()
+                referral_settings = settings_registry.get_referral_settings()
                 if referral_settings and getattr(referral_settings, 'trial_squad_id', None):
                     trial_squad = referral_settings.trial_squad_id
             except Exception:
@@ -818,18 +860,11 @@ def admin_update_user(current_admin, user_id):
                 "activeInternalSquads": current_squads if current_squads else ([trial_squad] if trial_squad else [])
             }
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
-                json=patch_payload,
-                timeout=10
-            )
+            patch_resp = remnawave.patch_user(patch_payload)
             if not patch_resp.ok:
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
             return jsonify({
                 "message": "Trial granted successfully",
                 "user_email": user.email,
@@ -847,18 +882,11 @@ def admin_update_user(current_admin, user_id):
             if device_limit < 0:
                 device_limit = 0
 
-            patch_resp = requests.patch(
-                f"{os.getenv('API_URL')}/api/users",
-                headers=headers,
-                cookies=cookies,
-                json={"uuid": target_uuid, "hwidDeviceLimit": device_limit},
-                timeout=10
-            )
+            patch_resp = remnawave.patch_user({"uuid": target_uuid, "hwidDeviceLimit": device_limit})
             if not patch_resp.ok:
                 return jsonify({"message": "Failed to update user in RemnaWave"}), 500
 
             cache.delete(f'live_data_{target_uuid}')
-            cache.delete('all_live_users_map')
             return jsonify({
                 "message": "Device limit updated successfully",
                 "user_email": user.email,
@@ -959,13 +987,11 @@ def get_statistics(current_admin):
 @app.route('/api/admin/analytics', methods=['GET'])
 @admin_required
 def get_analytics(current_admin):
-    """Получение расширенной аналитики с группировкой по дням, неделям, месяцам"""
+    """
+    Получение расширенной аналитики с группировкой по дням, неделям, месяцам.
+    Читает только дневные агрегаты analytics_daily (modules/analytics.py).
+    """
     try:
-        from sqlalchemy import func, extract, case, text
-        from modules.models.user_config import UserConfig
-        
-        # Определяем тип БД
-        is_postgresql = app.config.get('USE_POSTGRESQL', False)
         period = request.args.get('period', 'days')  # days, weeks, months
         
         # Фильтры по датам (опционально)
@@ -985,669 +1011,247 @@ def get_analytics(current_admin):
             stats_start_date, stats_end_date = custom_date_range
         else:
             # Используем период по умолчанию
+            stats_end_date = datetime.now(timezone.utc)
             if period == 'days':
-                stats_end_date = datetime.now(timezone.utc)
                 stats_start_date = stats_end_date - timedelta(days=30)
             elif period == 'weeks':
-                stats_end_date = datetime.now(timezone.utc)
                 stats_start_date = stats_end_date - timedelta(weeks=12)
             else:  # months
-                stats_end_date = datetime.now(timezone.utc)
                 stats_start_date = stats_end_date - timedelta(days=365)
-        
-        # Общая статистика с учетом выбранного периода/диапазона
-        total_users = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
-        verified_users = User.query.filter_by(role='CLIENT', is_verified=True).filter(
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
-        
-        # Конфиги созданные в выбранном периоде
-        total_configs = UserConfig.query.filter(
-            UserConfig.created_at >= stats_start_date,
-            UserConfig.created_at <= stats_end_date
-        ).count()
-        
-        total_payments = Payment.query.filter(
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).count()
-        successful_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).count()
-        
-        # Статистика по пользователям в боте (с telegram_id) в выбранном периоде
-        users_with_telegram = User.query.filter_by(role='CLIENT').filter(
-            User.telegram_id.isnot(None),
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
-        
-        # Статистика по сайтам (конфигам) - пользователи с конфигами в выбранном периоде
-        configs_by_user = db.session.query(
-            func.count(UserConfig.id).label('config_count')
-        ).filter(
-            UserConfig.created_at >= stats_start_date,
-            UserConfig.created_at <= stats_end_date
-        ).group_by(UserConfig.user_id).all()
-        users_with_configs = len(configs_by_user)
-        
-        # Подсчет прибыли по валютам в выбранном периоде
-        paid_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).all()
-        total_revenue = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        
-        for payment in paid_payments:
-            currency = payment.currency or 'USD'
-            amount = float(payment.amount) if payment.amount else 0.0
+        start_day = analytics.to_day(stats_start_date)
+        end_day = analytics.to_day(stats_end_date)
+        
+        currencies = ('USD', 'UAH', 'RUB')
+        
+        def empty_revenue():
+            return {c: 0.0 for c in currencies}
+        
+        # Суммы агрегатов за выбранный период (кроме разрезов по пользователям)
+        totals = analytics.get_totals(start_day, end_day, [
+            *analytics.REGISTRATION_METRICS, 'payments', 'revenue', 'provider', 'tariff', 'promo', 'configs'
+        ])
+        
+        def total_count(metric):
+            return sum(count for count, _ in totals.get(metric, {}).values())
+        
+        total_users = total_count('registrations')
+        verified_users = total_count('registrations_verified')
+        users_with_telegram = total_count('registrations_telegram')
+        trial_users = total_count('registrations_trial')
+        users_with_referrer = total_count('registrations_referred')
+        total_configs = total_count('configs')
+        users_with_configs = analytics.count_dims(start_day, end_day, 'config_user')
+        total_payments = total_count('payments')
+        successful_payments = total_count('revenue')
+        
+        # Прибыль по валютам
+        total_revenue = empty_revenue()
+        for (_, currency), (_, amount) in totals.get('revenue', {}).items():
             if currency in total_revenue:
                 total_revenue[currency] += amount
         
         # Группировка по периодам
-        revenue_by_period = []
-        user_registrations_by_period = []
-        payments_by_period = []
-        
         if period == 'days':
-            # Используем кастомный диапазон или последние 30 дней
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
-                start_date = end_date - timedelta(days=30)
-            
-            if is_postgresql:
-                # Доходы по дням (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date(Payment.created_at).label('date'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date(Payment.created_at),
-                    Payment.currency
-                ).order_by('date').all()
-                
-                # Регистрации по дням
-                registrations_query = db.session.query(
-                    func.date(User.created_at).label('date'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date(User.created_at)).order_by('date').all()
-                
-                # Платежи по дням
-                payments_count_query = db.session.query(
-                    func.date(Payment.created_at).label('date'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date(Payment.created_at)).order_by('date').all()
-            else:
-                # SQLite - используем strftime
-                revenue_query = db.session.query(
-                    func.strftime('%Y-%m-%d', Payment.created_at).label('date'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.strftime('%Y-%m-%d', Payment.created_at),
-                    Payment.currency
-                ).order_by('date').all()
-                
-                registrations_query = db.session.query(
-                    func.strftime('%Y-%m-%d', User.created_at).label('date'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.strftime('%Y-%m-%d', User.created_at)).order_by('date').all()
-                
-                payments_count_query = db.session.query(
-                    func.strftime('%Y-%m-%d', Payment.created_at).label('date'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.strftime('%Y-%m-%d', Payment.created_at)).order_by('date').all()
-            
-            # Формируем данные по дням
-            date_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    date, currency, total = item
-                    date_str = date.isoformat() if hasattr(date, 'isoformat') else str(date)
-                    if date_str not in date_dict:
-                        date_dict[date_str] = {'date': date_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in date_dict[date_str]:
-                        date_dict[date_str][currency] += float(total)
-            
-            revenue_by_period = list(date_dict.values())
-            
-            # Регистрации
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in date_dict.keys()
-            ]
-            
-            # Платежи
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in date_dict.keys()
-            ]
-            
+            bucket = lambda day: day.isoformat()
         elif period == 'weeks':
-            # Используем кастомный диапазон или последние 12 недель
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
-                start_date = end_date - timedelta(weeks=12)
-            
-            # Для PostgreSQL используем date_trunc, для SQLite - группируем в Python
-            if is_postgresql:
-                # Доходы по неделям (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date_trunc('week', Payment.created_at).label('week'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date_trunc('week', Payment.created_at),
-                    Payment.currency
-                ).order_by('week').all()
-                
-                # Регистрации по неделям
-                registrations_query = db.session.query(
-                    func.date_trunc('week', User.created_at).label('week'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date_trunc('week', User.created_at)).order_by('week').all()
-                
-                # Платежи по неделям
-                payments_count_query = db.session.query(
-                    func.date_trunc('week', Payment.created_at).label('week'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date_trunc('week', Payment.created_at)).order_by('week').all()
-            else:
-                # SQLite - получаем все данные и группируем в Python
-                all_payments = Payment.query.filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).all()
-                
-                all_users = User.query.filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).all()
-                
-                # Группируем по неделям в Python
-                week_dict_rev = {}
-                week_dict_reg = {}
-                week_dict_pay = {}
-                
-                for payment in all_payments:
-                    if payment.created_at:
-                        # Находим начало недели (понедельник)
-                        week_start = payment.created_at - timedelta(days=payment.created_at.weekday())
-                        week_key = week_start.date().isoformat()
-                        
-                        if week_key not in week_dict_rev:
-                            week_dict_rev[week_key] = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                        currency = payment.currency or 'USD'
-                        if currency in week_dict_rev[week_key]:
-                            week_dict_rev[week_key][currency] += float(payment.amount or 0)
-                        
-                        if week_key not in week_dict_pay:
-                            week_dict_pay[week_key] = 0
-                        week_dict_pay[week_key] += 1
-                
-                for user in all_users:
-                    if user.created_at:
-                        week_start = user.created_at - timedelta(days=user.created_at.weekday())
-                        week_key = week_start.date().isoformat()
-                        if week_key not in week_dict_reg:
-                            week_dict_reg[week_key] = 0
-                        week_dict_reg[week_key] += 1
-                
-                revenue_query = [
-                    (week_key, currency, amount)
-                    for week_key, currencies in week_dict_rev.items()
-                    for currency, amount in currencies.items()
-                    if amount > 0
-                ]
-                registrations_query = [(week_key, count) for week_key, count in week_dict_reg.items()]
-                payments_count_query = [(week_key, count) for week_key, count in week_dict_pay.items()]
-            
-            # Формируем данные
-            week_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    week, currency, total = item
-                    week_str = week.isoformat() if hasattr(week, 'isoformat') else str(week)
-                    if week_str not in week_dict:
-                        week_dict[week_str] = {'date': week_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in week_dict[week_str]:
-                        week_dict[week_str][currency] += float(total)
-            
-            revenue_by_period = list(week_dict.values())
-            
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in week_dict.keys()
-            ]
-            
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in week_dict.keys()
-            ]
-            
+            bucket = lambda day: (day - timedelta(days=day.weekday())).isoformat()  # Понедельник
         elif period == 'months':
-            # Используем кастомный диапазон или последние 12 месяцев
-            if custom_date_range:
-                start_date, end_date = custom_date_range
-            else:
-                end_date = datetime.now(timezone.utc)
-                start_date = end_date - timedelta(days=365)
-            
-            if is_postgresql:
-                # Доходы по месяцам (PostgreSQL)
-                revenue_query = db.session.query(
-                    func.date_trunc('month', Payment.created_at).label('month'),
-                    Payment.currency,
-                    func.sum(Payment.amount).label('total')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(
-                    func.date_trunc('month', Payment.created_at),
-                    Payment.currency
-                ).order_by('month').all()
-                
-                # Регистрации по месяцам
-                registrations_query = db.session.query(
-                    func.date_trunc('month', User.created_at).label('month'),
-                    func.count(User.id).label('count')
-                ).filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).group_by(func.date_trunc('month', User.created_at)).order_by('month').all()
-                
-                # Платежи по месяцам
-                payments_count_query = db.session.query(
-                    func.date_trunc('month', Payment.created_at).label('month'),
-                    func.count(Payment.id).label('count')
-                ).filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).group_by(func.date_trunc('month', Payment.created_at)).order_by('month').all()
-            else:
-                # SQLite - группируем в Python
-                all_payments = Payment.query.filter(
-                    Payment.status == 'PAID',
-                    Payment.created_at >= start_date,
-                    Payment.created_at <= end_date
-                ).all()
-                
-                all_users = User.query.filter(
-                    User.role == 'CLIENT',
-                    User.created_at >= start_date,
-                    User.created_at <= end_date
-                ).all()
-                
-                month_dict_rev = {}
-                month_dict_reg = {}
-                month_dict_pay = {}
-                
-                for payment in all_payments:
-                    if payment.created_at:
-                        month_key = payment.created_at.replace(day=1).date().isoformat()
-                        if month_key not in month_dict_rev:
-                            month_dict_rev[month_key] = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                        currency = payment.currency or 'USD'
-                        if currency in month_dict_rev[month_key]:
-                            month_dict_rev[month_key][currency] += float(payment.amount or 0)
-                        
-                        if month_key not in month_dict_pay:
-                            month_dict_pay[month_key] = 0
-                        month_dict_pay[month_key] += 1
-                
-                for user in all_users:
-                    if user.created_at:
-                        month_key = user.created_at.replace(day=1).date().isoformat()
-                        if month_key not in month_dict_reg:
-                            month_dict_reg[month_key] = 0
-                        month_dict_reg[month_key] += 1
-                
-                revenue_query = [
-                    (month_key, currency, amount)
-                    for month_key, currencies in month_dict_rev.items()
-                    for currency, amount in currencies.items()
-                    if amount > 0
-                ]
-                registrations_query = [(month_key, count) for month_key, count in month_dict_reg.items()]
-                payments_count_query = [(month_key, count) for month_key, count in month_dict_pay.items()]
-            
-            # Формируем данные
-            month_dict = {}
-            for item in revenue_query:
-                if len(item) == 3:
-                    month, currency, total = item
-                    month_str = month.isoformat() if hasattr(month, 'isoformat') else str(month)
-                    if month_str not in month_dict:
-                        month_dict[month_str] = {'date': month_str, 'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                    if currency in month_dict[month_str]:
-                        month_dict[month_str][currency] += float(total)
-            
-            revenue_by_period = list(month_dict.values())
-            
-            reg_dict = {str(item[0]): item[1] for item in registrations_query}
-            user_registrations_by_period = [
-                {'date': date, 'count': reg_dict.get(date, 0)}
-                for date in month_dict.keys()
-            ]
-            
-            payments_dict = {str(item[0]): item[1] for item in payments_count_query}
-            payments_by_period = [
-                {'date': date, 'count': payments_dict.get(date, 0)}
-                for date in month_dict.keys()
-            ]
-        
-        # Статистика по провайдерам платежей в выбранном периоде
-        provider_stats = db.session.query(
-            Payment.payment_provider,
-            func.count(Payment.id).label('count'),
-            func.sum(Payment.amount).label('total')
-        ).filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).group_by(Payment.payment_provider).all()
+            bucket = lambda day: day.replace(day=1).isoformat()
+        else:
+            bucket = None
         
-        payment_providers = [
-            {
-                'provider': provider or 'unknown',
-                'count': count,
-                'total': float(total) if total else 0.0
-            }
-            for provider, count, total in provider_stats
-        ]
+        revenue_by_period = []
+        user_registrations_by_period = []
+        payments_by_period = []
+        if bucket:
+            periods = {}
+            for day, metric, currency, count, amount in analytics.get_daily(start_day, end_day, ['registrations', 'revenue']):
+                key = bucket(day)
+                item = periods.setdefault(key, {'revenue': empty_revenue(), 'registrations': 0, 'payments': 0})
+                if metric == 'registrations':
+                    item['registrations'] += int(count or 0)
+                else:
+                    item['payments'] += int(count or 0)
+                    if currency in item['revenue']:
+                        item['revenue'][currency] += float(amount or 0)
+            for key in sorted(periods):
+                item = periods[key]
+                revenue_by_period.append({'date': key, **item['revenue']})
+                user_registrations_by_period.append({'date': key, 'count': item['registrations']})
+                payments_by_period.append({'date': key, 'count': item['payments']})
+        
+        # Статистика по провайдерам платежей
+        providers_dict = {}
+        for (provider, _), (count, amount) in totals.get('provider', {}).items():
+            item = providers_dict.setdefault(provider, {'provider': provider or 'unknown', 'count': 0, 'total': 0.0})
+            item['count'] += count
+            item['total'] += amount
+        payment_providers = sorted(providers_dict.values(), key=lambda x: x['count'], reverse=True)
         
-        # Дополнительные метрики
         # ARPU и средний чек по валютам
         arpu_by_currency = {
-            'USD': round(total_revenue['USD'] / total_users, 2) if total_users > 0 else 0.0,
-            'UAH': round(total_revenue['UAH'] / total_users, 2) if total_users > 0 else 0.0,
-            'RUB': round(total_revenue['RUB'] / total_users, 2) if total_users > 0 else 0.0
+            c: round(total_revenue[c] / total_users, 2) if total_users > 0 else 0.0
+            for c in currencies
         }
-        
-        # Средний чек на платеж по валютам
         avg_payment_by_currency = {
-            'USD': round(total_revenue['USD'] / successful_payments, 2) if successful_payments > 0 else 0.0,
-            'UAH': round(total_revenue['UAH'] / successful_payments, 2) if successful_payments > 0 else 0.0,
-            'RUB': round(total_revenue['RUB'] / successful_payments, 2) if successful_payments > 0 else 0.0
+            c: round(total_revenue[c] / successful_payments, 2) if successful_payments > 0 else 0.0
+            for c in currencies
         }
         
         # Конверсия: регистрации -> платежи
         conversion_rate = round((successful_payments / total_users * 100), 2) if total_users > 0 else 0.0
         
-        # Статистика по тарифам (по валютам отдельно) в выбранном периоде
-        tariff_stats = db.session.query(
-            Tariff.id,
-            Tariff.name,
-            Payment.currency,
-            func.count(Payment.id).label('count'),
-            func.sum(Payment.amount).label('total')
-        ).join(
-            Payment, Payment.tariff_id == Tariff.id
-        ).filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).group_by(Tariff.id, Tariff.name, Payment.currency).all()
-        
-        # Группируем по тарифам и валютам
+        # Статистика по тарифам (по валютам отдельно)
+        tariff_totals = totals.get('tariff', {})
+        tariff_names = {}
+        tariff_ids = {int(dim) for dim, _ in tariff_totals}
+        if tariff_ids:
+            tariff_names = dict(db.session.query(Tariff.id, Tariff.name).filter(Tariff.id.in_(tariff_ids)).all())
         tariffs_dict = {}
-        for tariff_id, name, currency, count, total in tariff_stats:
-            if tariff_id not in tariffs_dict:
-                tariffs_dict[tariff_id] = {
-                    'id': tariff_id,
-                    'name': name,
-                    'count': 0,
-                    'revenue_by_currency': {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                }
-            tariffs_dict[tariff_id]['count'] += count
-            if currency in tariffs_dict[tariff_id]['revenue_by_currency']:
-                tariffs_dict[tariff_id]['revenue_by_currency'][currency] += float(total) if total else 0.0
-        
-        tariffs_analytics = sorted(
-            list(tariffs_dict.values()),
-            key=lambda x: x['count'],
-            reverse=True
-        )
-        
-        # Статистика по промокодам (по валютам отдельно) в выбранном периоде
-        promo_stats = db.session.query(
-            PromoCode.code,
-            Payment.currency,
-            func.count(Payment.id).label('count'),
-            func.sum(Payment.amount).label('total')
-        ).join(
-            Payment, Payment.promo_code_id == PromoCode.id
-        ).filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).group_by(PromoCode.code, Payment.currency).all()
-        
-        # Группируем по промокодам и валютам
+        for (dim, currency), (count, amount) in tariff_totals.items():
+            tariff_id = int(dim)
+            if tariff_id not in tariff_names:
+                continue  # Тариф удален
+            item = tariffs_dict.setdefault(tariff_id, {
+                'id': tariff_id,
+                'name': tariff_names[tariff_id],
+                'count': 0,
+                'revenue_by_currency': empty_revenue()
+            })
+            item['count'] += count
+            if currency in item['revenue_by_currency']:
+                item['revenue_by_currency'][currency] += amount
+        tariffs_analytics = sorted(tariffs_dict.values(), key=lambda x: x['count'], reverse=True)
+        
+        # Статистика по промокодам (по валютам отдельно)
+        promo_totals = totals.get('promo', {})
+        promo_codes = {}
+        promo_ids = {int(dim) for dim, _ in promo_totals}
+        if promo_ids:
+            promo_codes = dict(db.session.query(PromoCode.id, PromoCode.code).filter(PromoCode.id.in_(promo_ids)).all())
         promos_dict = {}
-        for code, currency, count, total in promo_stats:
-            if code not in promos_dict:
-                promos_dict[code] = {
-                    'code': code,
-                    'count': 0,
-                    'revenue_by_currency': {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-                }
-            promos_dict[code]['count'] += count
-            if currency in promos_dict[code]['revenue_by_currency']:
-                promos_dict[code]['revenue_by_currency'][currency] += float(total) if total else 0.0
-        
-        promocodes_analytics = sorted(
-            list(promos_dict.values()),
-            key=lambda x: x['count'],
-            reverse=True
-        )
+        for (dim, currency), (count, amount) in promo_totals.items():
+            code = promo_codes.get(int(dim))
+            if code is None:
+                continue  # Промокод удален
+            item = promos_dict.setdefault(code, {
+                'code': code,
+                'count': 0,
+                'revenue_by_currency': empty_revenue()
+            })
+            item['count'] += count
+            if currency in item['revenue_by_currency']:
+                item['revenue_by_currency'][currency] += amount
+        promocodes_analytics = sorted(promos_dict.values(), key=lambda x: x['count'], reverse=True)
         
-        # Статистика по триалам в выбранном периоде
-        trial_users = User.query.filter_by(role='CLIENT', trial_used=True).filter(
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
         trial_usage_rate = round((trial_users / total_users * 100), 2) if total_users > 0 else 0.0
-        
-        # Статистика по реферальной программе в выбранном периоде
-        users_with_referrer = User.query.filter_by(role='CLIENT').filter(
-            User.referrer_id.isnot(None),
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date
-        ).count()
         referral_rate = round((users_with_referrer / total_users * 100), 2) if total_users > 0 else 0.0
         
-        # Новые пользователи за последние периоды для сравнения (всегда за последние периоды, независимо от выбранного диапазона)
-        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        # Сравнение с предыдущими периодами (всегда за последние периоды, независимо от выбранного диапазона)
+        today = datetime.now(timezone.utc).date()
         yesterday = today - timedelta(days=1)
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
         
-        new_users_today = User.query.filter_by(role='CLIENT').filter(User.created_at >= today).count()
-        new_users_yesterday = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= yesterday,
-            User.created_at < today
-        ).count()
-        new_users_this_week = User.query.filter_by(role='CLIENT').filter(User.created_at >= week_ago).count()
-        new_users_last_week = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= (week_ago - timedelta(days=7)),
-            User.created_at < week_ago
-        ).count()
-        new_users_this_month = User.query.filter_by(role='CLIENT').filter(User.created_at >= month_ago).count()
-        new_users_last_month = User.query.filter_by(role='CLIENT').filter(
-            User.created_at >= (month_ago - timedelta(days=30)),
-            User.created_at < month_ago
-        ).count()
-        
-        # Платежи за периоды для сравнения
-        payments_today = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= today
-        ).count()
-        payments_yesterday = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= yesterday,
-            Payment.created_at < today
-        ).count()
-        payments_this_week = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= week_ago
-        ).count()
-        payments_last_week = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= (week_ago - timedelta(days=7)),
-            Payment.created_at < week_ago
-        ).count()
+        daily_users = {}
+        daily_payments = {}
+        daily_revenue = {}
+        for day, metric, currency, count, amount in analytics.get_daily(month_ago - timedelta(days=30), today, ['registrations', 'revenue']):
+            if metric == 'registrations':
+                daily_users[day] = daily_users.get(day, 0) + int(count or 0)
+            else:
+                daily_payments[day] = daily_payments.get(day, 0) + int(count or 0)
+                revenue = daily_revenue.setdefault(day, empty_revenue())
+                if currency in revenue:
+                    revenue[currency] += float(amount or 0)
         
-        # Доходы за периоды
-        today_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= today
-        ).all()
-        revenue_today = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        for payment in today_payments:
-            currency = payment.currency or 'USD'
-            if currency in revenue_today:
-                revenue_today[currency] += float(payment.amount or 0)
+        def sum_days(values, start, end=None):
+            return sum(v for d, v in values.items() if d >= start and (end is None or d < end))
         
-        yesterday_payments = Payment.query.filter(
-            Payment.status == 'PAID',
-            Payment.created_at >= yesterday,
-            Payment.created_at < today
-        ).all()
-        revenue_yesterday = {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0}
-        for payment in yesterday_payments:
-            currency = payment.currency or 'USD'
-            if currency in revenue_yesterday:
-                revenue_yesterday[currency] += float(payment.amount or 0)
-        
-        # Расширенная статистика по триалам в выбранном периоде
+        # Расширенная статистика по триалам
         trial_stats = {
             'total_used': trial_users,
             'usage_rate': trial_usage_rate,
             'not_used': total_users - trial_users,
             'conversion_from_trial': 0  # Сколько из триалов конвертировались в платных
         }
-        # Пользователи, которые использовали триал и потом сделали платеж в выбранном периоде
-        trial_users_with_payments = db.session.query(User.id).join(
-            Payment, Payment.user_id == User.id
-        ).filter(
-            User.role == 'CLIENT',
-            User.trial_used == True,
-            Payment.status == 'PAID',
-            User.created_at >= stats_start_date,
-            User.created_at <= stats_end_date,
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).distinct().count()
-        trial_stats['conversion_from_trial'] = round((trial_users_with_payments / trial_users * 100), 2) if trial_users > 0 else 0
-        
-        # Детальная статистика по реферальной программе в выбранном периоде
-        referral_stats = {
-            'total_referrers': User.query.filter_by(role='CLIENT').filter(
-                User.referrer_id.isnot(None),
-                User.created_at >= stats_start_date,
-                User.created_at <= stats_end_date
-            ).count(),
-            'total_referrals': db.session.query(func.count(User.id)).filter(
+        # Пользователи с триалом (зарегистрированные в периоде), оплатившие в периоде
+        trial_users_with_payments = 0
+        if trial_users > 0:
+            paying_users = analytics.dims_subquery(start_day, end_day, 'user_revenue')
+            trial_users_with_payments = User.query.filter(
+                db.cast(User.id, db.String).in_(paying_users),
                 User.role == 'CLIENT',
-                User.referrer_id.isnot(None),
+                User.trial_used == True,
                 User.created_at >= stats_start_date,
                 User.created_at <= stats_end_date
-            ).scalar(),
+            ).count()
+        trial_stats['conversion_from_trial'] = round((trial_users_with_payments / trial_users * 100), 2) if trial_users > 0 else 0
+        
+        # Детальная статистика по реферальной программе
+        referral_stats = {
+            'total_referrers': users_with_referrer,
+            'total_referrals': users_with_referrer,
             'top_referrers': []
         }
         
-        # Топ рефереров (пользователи с наибольшим количеством рефералов) в выбранном периоде
-        # Используем правильный способ для self-referential relationship
-        from sqlalchemy.orm import aliased
-        Referral = aliased(User)
+        top_referrers = analytics.get_top_dims(start_day, end_day, 'referral', limit=10, by='count')
+        top_user_ids = [int(dim) for dim, _, _ in top_referrers]
         
-        top_referrers_query = db.session.query(
-            User.id,
-            User.email,
-            User.telegram_username,
-            func.count(Referral.id).label('referrals_count')
-        ).join(
-            Referral, Referral.referrer_id == User.id
-        ).filter(
-            User.role == 'CLIENT',
-            Referral.role == 'CLIENT',
-            Referral.created_at >= stats_start_date,
-            Referral.created_at <= stats_end_date
-        ).group_by(
-            User.id, User.email, User.telegram_username
-        ).order_by(
-            func.count(Referral.id).desc()
-        ).limit(10).all()
+        # Топ пользователей по тратам (по валютам отдельно)
+        top_spenders = analytics.get_top_dims(start_day, end_day, 'user_revenue', limit=20, by='amount')
+        top_spender_ids = [int(dim) for dim, _, _ in top_spenders]
+        
+        users_info = {}
+        if top_user_ids or top_spender_ids:
+            users_info = {
+                u.id: u for u in db.session.query(User.id, User.email, User.telegram_username).filter(
+                    User.id.in_(set(top_user_ids + top_spender_ids))
+                ).all()
+            }
         
         referral_stats['top_referrers'] = [
             {
                 'id': ref_id,
-                'email': email or 'N/A',
-                'telegram_username': telegram_username,
-                'referrals_count': count
+                'email': users_info[ref_id].email or 'N/A',
+                'telegram_username': users_info[ref_id].telegram_username,
+                'referrals_count': int(count or 0)
             }
-            for ref_id, email, telegram_username, count in top_referrers_query
+            for ref_id, (_, count, _) in zip(top_user_ids, top_referrers)
+            if ref_id in users_info
         ]
         
-        # Воронка конверсии (уже использует отфильтрованные данные)
+        spending = analytics.get_totals(start_day, end_day, 'user_revenue', dims=top_spender_ids).get('user_revenue', {}) if top_spender_ids else {}
+        users_dict = {}
+        for (dim, currency), (count, amount) in spending.items():
+            user_id = int(dim)
+            if user_id not in users_info:
+                continue
+            item = users_dict.setdefault(user_id, {
+                'id': user_id,
+                'email': users_info[user_id].email or 'N/A',
+                'telegram_username': users_info[user_id].telegram_username,
+                'spending_by_currency': empty_revenue(),
+                'payments_count': 0
+            })
+            if currency in item['spending_by_currency']:
+                item['spending_by_currency'][currency] += amount
+            item['payments_count'] += count
+        
+        # Сортируем по общей сумме (сумма всех валют)
+        top_users = sorted(
+            [
+                {
+                    **user_data,
+                    'total_spent': sum(user_data['spending_by_currency'].values())
+                }
+                for user_data in users_dict.values()
+            ],
+            key=lambda x: x['total_spent'],
+            reverse=True
+        )[:20]
+        
+        # Воронка конверсии
         conversion_funnel = {
             'registrations': total_users,
             'verified': verified_users,
@@ -1666,55 +1270,6 @@ def get_analytics(current_admin):
             'subscription_rate': round((users_with_configs / total_users * 100), 2) if total_users > 0 else 0
         }
         
-        # Топ пользователей по тратам (по валютам отдельно) в выбранном периоде
-        top_users_by_spending = db.session.query(
-            User.id,
-            User.email,
-            User.telegram_username,
-            Payment.currency,
-            func.sum(Payment.amount).label('total_spent'),
-            func.count(Payment.id).label('payments_count')
-        ).join(
-            Payment, Payment.user_id == User.id
-        ).filter(
-            User.role == 'CLIENT',
-            Payment.status == 'PAID',
-            Payment.created_at >= stats_start_date,
-            Payment.created_at <= stats_end_date
-        ).group_by(
-            User.id, User.email, User.telegram_username, Payment.currency
-        ).order_by(
-            func.sum(Payment.amount).desc()
-        ).all()
-        
-        # Группируем по пользователям и валютам
-        users_dict = {}
-        for user_id, email, telegram_username, currency, total_spent, payments_count in top_users_by_spending:
-            if user_id not in users_dict:
-                users_dict[user_id] = {
-                    'id': user_id,
-                    'email': email or 'N/A',
-                    'telegram_username': telegram_username,
-                    'spending_by_currency': {'USD': 0.0, 'UAH': 0.0, 'RUB': 0.0},
-                    'payments_count': 0
-                }
-            if currency in users_dict[user_id]['spending_by_currency']:
-                users_dict[user_id]['spending_by_currency'][currency] += float(total_spent) if total_spent else 0.0
-            users_dict[user_id]['payments_count'] += payments_count
-        
-        # Сортируем по общей сумме (сумма всех валют)
-        top_users = sorted(
-            [
-                {
-                    **user_data,
-                    'total_spent': sum(user_data['spending_by_currency'].values())
-                }
-                for user_data in users_dict.values()
-            ],
-            key=lambda x: x['total_spent'],
-            reverse=True
-        )[:20]
-        
         return jsonify({
             'overview': {
                 'total_users': total_users,
@@ -1743,22 +1298,22 @@ def get_analytics(current_admin):
             'promocodes_analytics': promocodes_analytics,
             'comparison': {
                 'users': {
-                    'today': new_users_today,
-                    'yesterday': new_users_yesterday,
-                    'this_week': new_users_this_week,
-                    'last_week': new_users_last_week,
-                    'this_month': new_users_this_month,
-                    'last_month': new_users_last_month
+                    'today': daily_users.get(today, 0),
+                    'yesterday': daily_users.get(yesterday, 0),
+                    'this_week': sum_days(daily_users, week_ago),
+                    'last_week': sum_days(daily_users, week_ago - timedelta(days=7), week_ago),
+                    'this_month': sum_days(daily_users, month_ago),
+                    'last_month': sum_days(daily_users, month_ago - timedelta(days=30), month_ago)
                 },
                 'payments': {
-                    'today': payments_today,
-                    'yesterday': payments_yesterday,
-                    'this_week': payments_this_week,
-                    'last_week': payments_last_week
+                    'today': daily_payments.get(today, 0),
+                    'yesterday': daily_payments.get(yesterday, 0),
+                    'this_week': sum_days(daily_payments, week_ago),
+                    'last_week': sum_days(daily_payments, week_ago - timedelta(days=7), week_ago)
                 },
                 'revenue': {
-                    'today': revenue_today,
-                    'yesterday': revenue_yesterday
+                    'today': daily_revenue.get(today, empty_revenue()),
+                    'yesterday': daily_revenue.get(yesterday, empty_revenue())
                 }
             },
             'trial_stats': trial_stats,
@@ -1868,24 +1423,23 @@ def get_sales(current_admin):
 @admin_required
 def get_squads(current_admin):
     """Получить список сквадов"""
-    try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.get(f"{os.getenv('API_URL')}/api/internal-squads", headers=headers, timeout=10)
+    def load_squads():
+        resp = remnawave.squads()
         resp.raise_for_status()
         
         data = resp.json()
         if isinstance(data, dict) and 'response' in data:
             response_data = data['response']
             if isinstance(response_data, dict) and 'internalSquads' in response_data:
-                squads_list = response_data['internalSquads']
-            else:
-                squads_list = response_data if isinstance(response_data, list) else []
+                return response_data['internalSquads']
+            return response_data if isinstance(response_data, list) else []
         elif isinstance(data, list):
-            squads_list = data
-        else:
-            squads_list = []
-        
-        cache.set('squads_list', squads_list, timeout=300)
+            return data
+        return []
+
+    try:
+        # Кэш с фоновым обновлением (modules/swr_cache.py)
+        squads_list = swr_cache.get_or_load('squads_list', load_squads, soft_ttl=300)
         return jsonify(squads_list), 200
     except requests.exceptions.RequestException:
         cached = cache.get('squads_list')
@@ -1906,17 +1460,17 @@ def get_internal_squads(current_admin):
 @admin_required
 def get_nodes(current_admin):
     """Получить список нод"""
-    try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.get(f"{os.getenv('API_URL')}/api/nodes", headers=headers, timeout=10)
+    def load_nodes():
+        resp = remnawave.nodes()
         resp.raise_for_status()
         
         data = resp.json()
         nodes_list = data.get('response', data) if isinstance(data, dict) else data
-        if not isinstance(nodes_list, list):
-            nodes_list = []
-        
-        cache.set('nodes_list', nodes_list, timeout=300)
+        return nodes_list if isinstance(nodes_list, list) else []
+
+    try:
+        # Кэш с фоновым обновлением (modules/swr_cache.py); после действий с нодами ключ удаляется
+        nodes_list = swr_cache.get_or_load('nodes_list', load_nodes, soft_ttl=300)
         return jsonify(nodes_list), 200
     except requests.exceptions.RequestException:
         cached = cache.get('nodes_list')
@@ -1931,8 +1485,7 @@ def get_nodes(current_admin):
 def restart_node(current_admin, uuid):
     """Перезапустить ноду"""
     try:
-        headers, cookies = get_remnawave_headers()
-        requests.post(f"{os.getenv('API_URL')}/api/nodes/{uuid}/restart", headers=headers, cookies=cookies)
+        remnawave.restart_node(uuid)
         return jsonify({"message": "Node restart initiated"}), 200
     except Exception:
         return jsonify({"message": "Failed to restart node"}), 500
@@ -1943,8 +1496,7 @@ def restart_node(current_admin, uuid):
 def restart_all_nodes(current_admin):
     """Перезапустить все ноды"""
     try:
-        headers, cookies = get_remnawave_headers()
-        requests.post(f"{os.getenv('API_URL')}/api/nodes/restart-all", headers=headers, cookies=cookies)
+        remnawave.restart_all_nodes()
         return jsonify({"message": "All nodes restart initiated"}), 200
     except Exception:
         return jsonify({"message": "Failed to restart all nodes"}), 500
@@ -1955,12 +1507,7 @@ def restart_all_nodes(current_admin):
 def enable_node(current_admin, uuid):
     """Включить конкретную ноду"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.post(
-            f"{os.getenv('API_URL')}/api/nodes/{uuid}/actions/enable",
-            headers=headers,
-            timeout=30
-        )
+        resp = remnawave.node_action(uuid, 'enable', timeout=30)
         resp.raise_for_status()
         
         # Очищаем кэш нод после изменения
@@ -1979,12 +1526,7 @@ def enable_node(current_admin, uuid):
 def disable_node(current_admin, uuid):
     """Отключить конкретную ноду"""
     try:
-        headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-        resp = requests.post(
-            f"{os.getenv('API_URL')}/api/nodes/{uuid}/actions/disable",
-            headers=headers,
-            timeout=30
-        )
+        resp = remnawave.node_action(uuid, 'disable', timeout=30)
         resp.raise_for_status()
         
         # Очищаем кэш нод после изменения
@@ -2020,6 +1562,7 @@ def system_settings(current_admin):
         if not s.active_currencies or s.active_currencies.strip() == '':
             s.active_currencies = '["uah","rub","usd"]'
         db.session.commit()
+        settings_registry.invalidate_settings()
     
     if request.method == 'GET':
         # Парсим JSON массивы
@@ -2044,6 +1587,7 @@ def system_settings(current_admin):
         if needs_save:
             try:
                 db.session.commit()
+                settings_registry.invalidate_settings()
             except:
                 pass
         
@@ -2130,6 +1674,7 @@ def system_settings(current_admin):
             s.theme_text_secondary_dark = data['theme_text_secondary_dark']
         
         db.session.commit()
+        settings_registry.invalidate_settings()
         return jsonify({"message": "System settings updated successfully"}), 200
 
     except Exception as e:
@@ -2152,6 +1697,8 @@ def admin_branding_settings(current_admin):
         b = BrandingSetting(id=1)
         db.session.add(b)
         db.session.commit()
+        settings_registry.invalidate_settings()
+        tagged_cache.invalidate(tagged_cache.BRANDING)
     
     if request.method == 'GET':
         # Парсим JSON для названий функций тарифов
@@ -2278,6 +1825,8 @@ def admin_branding_settings(current_admin):
         # Используем merge для гарантии, что объект в сессии
         db.session.merge(b)
         db.session.commit()
+        settings_registry.invalidate_settings()
+        tagged_cache.invalidate(tagged_cache.BRANDING)
         app.logger.info(f"✅ Branding settings saved successfully (ID: {b.id})")
         return jsonify({"message": "Branding settings updated successfully"}), 200
     except Exception as e:
@@ -2301,6 +1850,7 @@ def admin_bot_config_endpoint(current_admin):
         config = BotConfig(id=1)
         db.session.add(config)
         db.session.commit()
+        settings_registry.invalidate_settings()
     
     if request.method == 'GET':
         default_buttons_order = ["trial", "connect", "status", "tariffs", "options", "referrals", "support", "settings", "webapp"]
@@ -2410,6 +1960,7 @@ def admin_bot_config_endpoint(current_admin):
                 setattr(config, field, json.dumps(data[field], ensure_ascii=False) if data[field] else None)
         
         db.session.commit()
+        settings_registry.invalidate_settings()
         
         # Очищаем кеш конфигурации бота в старом боте
         try:
@@ -2511,24 +2062,8 @@ def create_tariff(current_admin):
         db.session.add(tariff)
         db.session.commit()
         
-        # Очищаем кэш тарифов (Flask-Caching использует ключи вида 'flask_cache_view//api/public/tariffs')
-        cache.delete('flask_cache_view//api/public/tariffs')
-        cache.delete('view//api/public/tariffs')
-        cache.delete('public_tariffs')
-        # Также очищаем все ключи с 'tariff' в названии через Redis напрямую
-        try:
-            import redis
-            redis_host = os.getenv("REDIS_HOST", "localhost")
-            redis_port = int(os.getenv("REDIS_PORT", 6379))
-            redis_db = int(os.getenv("REDIS_DB", 0))
-            redis_password = os.getenv("REDIS_PASSWORD", None)
-            r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password, decode_responses=True)
-            keys = r.keys('*tariff*')
-            if keys:
-                r.delete(*keys)
-                print(f"[CACHE] Deleted {len(keys)} tariff cache keys")
-        except Exception as e:
-            print(f"[CACHE] Error clearing cache: {e}")
+        # Очищаем кэш публичного списка тарифов (все варианты запроса)
+        tagged_cache.invalidate(tagged_cache.TARIFFS)
         
         print(f"[TARIFF] Created tariff: id={tariff.id}, name={tariff.name}, squad_ids={tariff.squad_ids}")
         return jsonify({"message": "Tariff created", "tariff_id": tariff.id}), 201
@@ -2584,24 +2119,8 @@ def update_tariff(current_admin, tariff_id=None, id=None):
 
         db.session.commit()
         
-        # Очищаем кэш тарифов (Flask-Caching использует ключи вида 'flask_cache_view//api/public/tariffs')
-        cache.delete('flask_cache_view//api/public/tariffs')
-        cache.delete('view//api/public/tariffs')
-        cache.delete('public_tariffs')
-        # Также очищаем все ключи с 'tariff' в названии через Redis напрямую
-        try:
-            import redis
-            redis_host = os.getenv("REDIS_HOST", "localhost")
-            redis_port = int(os.getenv("REDIS_PORT", 6379))
-            redis_db = int(os.getenv("REDIS_DB", 0))
-            redis_password = os.getenv("REDIS_PASSWORD", None)
-            r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password, decode_responses=True)
-            keys = r.keys('*tariff*')
-            if keys:
-                r.delete(*keys)
-                print(f"[CACHE] Deleted {len(keys)} tariff cache keys")
-        except Exception as e:
-            print(f"[CACHE] Error clearing cache: {e}")
+        # Очищаем кэш публичного списка тарифов (все варианты запроса)
+        tagged_cache.invalidate(tagged_cache.TARIFFS)
         
         print(f"[TARIFF] Updated tariff: id={tariff.id}, name={tariff.name}, squad_ids={tariff.squad_ids}")
         return jsonify({"message": "Tariff updated successfully"}), 200
@@ -2634,24 +2153,8 @@ def delete_tariff(current_admin, tariff_id=None, id=None):
         db.session.delete(tariff)
         db.session.commit()
         
-        # Очищаем кэш тарифов (Flask-Caching использует ключи вида 'flask_cache_view//api/public/tariffs')
-        cache.delete('flask_cache_view//api/public/tariffs')
-        cache.delete('view//api/public/tariffs')
-        cache.delete('public_tariffs')
-        # Также очищаем все ключи с 'tariff' в названии через Redis напрямую
-        try:
-            import redis
-            redis_host = os.getenv("REDIS_HOST", "localhost")
-            redis_port = int(os.getenv("REDIS_PORT", 6379))
-            redis_db = int(os.getenv("REDIS_DB", 0))
-            redis_password = os.getenv("REDIS_PASSWORD", None)
-            r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password, decode_responses=True)
-            keys = r.keys('*tariff*')
-            if keys:
-                r.delete(*keys)
-                print(f"[CACHE] Deleted {len(keys)} tariff cache keys")
-        except Exception as e:
-            print(f"[CACHE] Error clearing cache: {e}")
+        # Очищаем кэш публичного списка тарифов (все варианты запроса)
+        tagged_cache.invalidate(tagged_cache.TARIFFS)
         
         print(f"[TARIFF] Deleted tariff: id={tariff_id}")
         return jsonify({"message": "Tariff deleted successfully"}), 200
@@ -2707,15 +2210,7 @@ def create_option(current_admin):
         db.session.commit()
 
         # Очищаем кэш публичных опций
-        try:
-            cache.delete('flask_cache_view//api/public/options')
-            cache.delete('view//api/public/options')
-            cache.delete('public_options')
-            cache.delete('flask_cache_view//api/public/purchase-options')
-            cache.delete('view//api/public/purchase-options')
-            cache.delete('public_purchase_options_grouped')
-        except Exception:
-            pass
+        tagged_cache.invalidate(tagged_cache.OPTIONS)
 
         return jsonify(option.to_dict()), 201
     except Exception as e:
@@ -2774,15 +2269,7 @@ def update_option(current_admin, option_id):
 
         db.session.commit()
 
-        try:
-            cache.delete('flask_cache_view//api/public/options')
-            cache.delete('view//api/public/options')
-            cache.delete('public_options')
-            cache.delete('flask_cache_view//api/public/purchase-options')
-            cache.delete('view//api/public/purchase-options')
-            cache.delete('public_purchase_options_grouped')
-        except Exception:
-            pass
+        tagged_cache.invalidate(tagged_cache.OPTIONS)
 
         return jsonify(option.to_dict()), 200
     except Exception as e:
@@ -2802,15 +2289,7 @@ def delete_option(current_admin, option_id):
         db.session.delete(option)
         db.session.commit()
 
-        try:
-            cache.delete('flask_cache_view//api/public/options')
-            cache.delete('view//api/public/options')
-            cache.delete('public_options')
-            cache.delete('flask_cache_view//api/public/purchase-options')
-            cache.delete('view//api/public/purchase-options')
-            cache.delete('public_purchase_options_grouped')
-        except Exception:
-            pass
+        tagged_cache.invalidate(tagged_cache.OPTIONS)
 
         return jsonify({"message": "Option deleted"}), 200
     except Exception as e:
@@ -2830,15 +2309,7 @@ def toggle_option(current_admin, option_id):
         option.is_active = not option.is_active
         db.session.commit()
 
-        try:
-            cache.delete('flask_cache_view//api/public/options')
-            cache.delete('view//api/public/options')
-            cache.delete('public_options')
-            cache.delete('flask_cache_view//api/public/purchase-options')
-            cache.delete('view//api/public/purchase-options')
-            cache.delete('public_purchase_options_grouped')
-        except Exception:
-            pass
+        tagged_cache.invalidate(tagged_cache.OPTIONS)
 
         return jsonify(option.to_dict()), 200
     except Exception as e:
@@ -2855,7 +2326,7 @@ def toggle_option(current_admin, option_id):
 def ref_settings(current_admin):
     """Настройки реферальной программы"""
     if request.method == 'GET':
-        s = ReferralSetting.query.first() or ReferralSetting()
+        s = settings_registry.get_referral_settings() or ReferralSetting()
         return jsonify({
             "invitee_bonus_days": s.invitee_bonus_days,
             "referrer_bonus_days": s.referrer_bonus_days,
@@ -2876,6 +2347,7 @@ def ref_settings(current_admin):
             s.default_referral_percent = float(data.get('default_referral_percent', 10.0))
         db.session.add(s)
         db.session.commit()
+        settings_registry.invalidate_settings()
         return jsonify({"message": "Referral settings updated"}), 200
     except Exception as e:
         print(f"Error updating referral settings: {e}")
@@ -2966,12 +2438,7 @@ def admin_trial_settings(current_admin):
         
         db.session.add(settings)
         db.session.commit()
-        
-        # Очищаем кэш (если используется)
-        try:
-            cache.delete('trial_settings')
-        except:
-            pass
+        settings_registry.invalidate_settings()
         
         return jsonify({"message": "Trial settings updated"}), 200
     except Exception as e:
@@ -2983,11 +2450,11 @@ def admin_trial_settings(current_admin):
 
 
 @app.route('/api/public/trial-settings', methods=['GET'])
+@tagged_cache.conditional
 def public_trial_settings():
-    """Публичный endpoint для получения настроек триала (для фронтенда)"""
-    from modules.models.trial import get_trial_settings
-    
-    settings = get_trial_settings()
+    """Публичный endpoint для получения настроек триала (для фронтенда; ?version= - версия из config-version)"""
+    settings_registry.ensure_version(request.args.get('version'))
+    settings = settings_registry.get_trial_settings()
     
     # Форматируем текст, заменяя {days} на актуальное значение
     def format_text(text, days):
@@ -3058,15 +2525,7 @@ def tariff_levels_settings(current_admin):
             db.session.commit()
 
             # Очищаем кэш публичного списка уровней/фич
-            try:
-                cache.delete('flask_cache_view//api/public/tariff-levels')
-                cache.delete('view//api/public/tariff-levels')
-                cache.delete('get_public_tariff_levels')
-                cache.delete('flask_cache_view//api/public/tariff-features')
-                cache.delete('view//api/public/tariff-features')
-                cache.delete('get_public_tariff_features')
-            except Exception:
-                pass
+            tagged_cache.invalidate(tagged_cache.LEVELS, tagged_cache.FEATURES)
 
             return jsonify({"message": "Tariff level created successfully", "level": level.to_dict()}), 201
 
@@ -3088,15 +2547,7 @@ def tariff_levels_settings(current_admin):
 
             db.session.commit()
 
-            try:
-                cache.delete('flask_cache_view//api/public/tariff-levels')
-                cache.delete('view//api/public/tariff-levels')
-                cache.delete('get_public_tariff_levels')
-                cache.delete('flask_cache_view//api/public/tariff-features')
-                cache.delete('view//api/public/tariff-features')
-                cache.delete('get_public_tariff_features')
-            except Exception:
-                pass
+            tagged_cache.invalidate(tagged_cache.LEVELS, tagged_cache.FEATURES)
 
             return jsonify({"message": "Tariff level updated successfully", "level": level.to_dict()}), 200
 
@@ -3119,15 +2570,7 @@ def tariff_levels_settings(current_admin):
             level.is_active = False
             db.session.commit()
 
-            try:
-                cache.delete('flask_cache_view//api/public/tariff-levels')
-                cache.delete('view//api/public/tariff-levels')
-                cache.delete('get_public_tariff_levels')
-                cache.delete('flask_cache_view//api/public/tariff-features')
-                cache.delete('view//api/public/tariff-features')
-                cache.delete('get_public_tariff_features')
-            except Exception:
-                pass
+            tagged_cache.invalidate(tagged_cache.LEVELS, tagged_cache.FEATURES)
 
             return jsonify({"message": "Tariff level deleted successfully"}), 200
 
@@ -3184,28 +2627,8 @@ def tariff_features_settings(current_admin):
             setting.features = json.dumps(features, ensure_ascii=False) if isinstance(features, list) else features
         db.session.commit()
         
-        # Очищаем кеш функций тарифов
-        cache.delete('flask_cache_view//api/public/tariff-features')
-        cache.delete('view//api/public/tariff-features')
-        cache.delete('get_public_tariff_features')
-        # Также очищаем кэш уровней, т.к. фичи завязаны на уровни
-        cache.delete('flask_cache_view//api/public/tariff-levels')
-        cache.delete('view//api/public/tariff-levels')
-        cache.delete('get_public_tariff_levels')
-        # Также очищаем все ключи с 'tariff-feature' в названии через Redis напрямую
-        try:
-            import redis
-            redis_host = os.getenv("REDIS_HOST", "localhost")
-            redis_port = int(os.getenv("REDIS_PORT", 6379))
-            redis_db = int(os.getenv("REDIS_DB", 0))
-            redis_password = os.getenv("REDIS_PASSWORD", None)
-            r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, password=redis_password, decode_responses=True)
-            keys = r.keys('*tariff-feature*') + r.keys('*tariff-level*')
-            if keys:
-                r.delete(*keys)
-                print(f"[CACHE] Deleted {len(keys)} tariff-feature cache keys")
-        except Exception as e:
-            print(f"[CACHE] Error clearing tariff-feature cache: {e}")
+        # Очищаем кеш функций тарифов (фичи завязаны на уровни - сбрасываем оба тега)
+        tagged_cache.invalidate(tagged_cache.FEATURES, tagged_cache.LEVELS)
         
         return jsonify({"message": "Tariff features updated successfully"}), 200
     except Exception as e:
@@ -3277,6 +2700,7 @@ def currency_rates(current_admin):
                 db.session.add(rate_obj)
         
         db.session.commit()
+        invalidate_currency_rates()
         return jsonify({"message": "Currency rates updated"}), 200
     except Exception as e:
         db.session.rollback()
@@ -3289,85 +2713,15 @@ def currency_rates(current_admin):
 # BROADCAST
 # ============================================================================
 
-def send_telegram_message(bot_token, chat_id, text, photo_url=None, photo_file=None):
-    """
-    Отправить сообщение в Telegram через Bot API
-    Если указано фото, отправляет фото с caption (одно сообщение)
-    """
-    import requests
-    try:
-        if photo_url or photo_file:
-            # Отправляем фото с caption
-            url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
-            
-            # Обрезаем caption до 1024 символов (лимит Telegram)
-            caption = text[:1024] if len(text) > 1024 else text
-            
-            if photo_file:
-                # Загружаем файл
-                files = {'photo': photo_file}
-                data = {
-                    "chat_id": chat_id,
-                    "caption": caption,
-                    "parse_mode": "HTML"
-                }
-                response = requests.post(url, files=files, data=data, timeout=30)
-            elif photo_url:
-                # Используем URL
-                payload = {
-                    "chat_id": chat_id,
-                    "photo": photo_url,
-                    "caption": caption,
-                    "parse_mode": "HTML"
-                }
-                response = requests.post(url, json=payload, timeout=30)
-            else:
-                return False, "Photo URL or file required"
-        else:
-            # Отправляем текстовое сообщение
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-            payload = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, json=payload, timeout=10)
-        
-        if response.status_code == 200:
-            result = response.json()
-            message_id = result.get('result', {}).get('message_id')
-            return True, message_id
-        else:
-            error_data = response.json() if response.content else {}
-            error_msg = error_data.get('description', f'HTTP {response.status_code}')
-            return False, error_msg
-    except Exception as e:
-        return False, str(e)
-
-def pin_telegram_message(bot_token, chat_id, message_id):
-    """Закрепить сообщение в Telegram"""
-    import requests
-    try:
-        url = f"https://api.telegram.org/bot{bot_token}/pinChatMessage"
-        payload = {
-            "chat_id": chat_id,
-            "message_id": message_id,
-            "disable_notification": False
-        }
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code == 200:
-            return True, None
-        else:
-            error_data = response.json() if response.content else {}
-            error_msg = error_data.get('description', f'HTTP {response.status_code}')
-            return False, error_msg
-    except Exception as e:
-        return False, str(e)
-
 @app.route('/api/admin/broadcast', methods=['POST'])
 @admin_required
 def send_broadcast(current_admin):
-    """Рассылка email и/или Telegram"""
+    """
+    Рассылка email и/или Telegram
+
+    Рассылка ставится в очередь как задание и выполняется фоновым пулом отправки
+    (modules/broadcast.py). Прогресс: GET /api/admin/broadcast/<job_id>
+    """
     try:
         # Проверяем, есть ли файл изображения
         photo_file = None
@@ -3386,7 +2740,6 @@ def send_broadcast(current_admin):
             # Парсим JSON поля если они есть
             if 'custom_emails' in data and isinstance(data['custom_emails'], str):
                 try:
-                    import json
                     data['custom_emails'] = json.loads(data['custom_emails'])
                 except:
                     data['custom_emails'] = []
@@ -3398,7 +2751,6 @@ def send_broadcast(current_admin):
         recipient_type = data.get('recipient_type', 'all')
         custom_emails = data.get('custom_emails', [])
         if isinstance(custom_emails, str):
-            import json
             try:
                 custom_emails = json.loads(custom_emails)
             except:
@@ -3412,153 +2764,98 @@ def send_broadcast(current_admin):
         if broadcast_type == 'email' and not subject:
             return jsonify({"message": "Subject is required for email broadcast"}), 400
         
-        # Получаем токены ботов
-        old_bot_token = os.getenv("CLIENT_BOT_TOKEN")
-        new_bot_token = os.getenv("CLIENT_BOT_V2_TOKEN") or os.getenv("CLIENT_BOT_TOKEN")
-        
         # Выбираем токен в зависимости от выбранного бота
-        bot_token = new_bot_token if bot_type == 'new' else old_bot_token
+        bot_token = get_broadcast_bot_token(bot_type)
         
         if broadcast_type in ['telegram', 'both'] and not bot_token:
             return jsonify({"message": f"Bot token for {bot_type} bot is not configured"}), 400
         
-        # Определяем получателей
-        recipients = []
+        # Определяем получателей (только id - сами данные читает исполнитель пачками)
+        recipients_query = None
         if recipient_type == 'all':
-            recipients = User.query.filter_by(role='CLIENT').all()
+            recipients_query = db.session.query(User.id).filter(User.role == 'CLIENT')
         elif recipient_type == 'active':
-            from sqlalchemy import and_
-            recipients = User.query.filter(and_(User.role == 'CLIENT', User.remnawave_uuid != None)).all()
+            recipients_query = db.session.query(User.id).filter(User.role == 'CLIENT', User.remnawave_uuid != None)
         elif recipient_type == 'inactive':
-            recipients = User.query.filter_by(role='CLIENT').filter(User.remnawave_uuid == None).all()
+            recipients_query = db.session.query(User.id).filter(User.role == 'CLIENT', User.remnawave_uuid == None)
         elif recipient_type == 'custom':
             if not custom_emails or not isinstance(custom_emails, list):
                 return jsonify({"message": "Custom emails list is required"}), 400
             emails = [email.strip() for email in custom_emails if email.strip()]
-            recipients = User.query.filter(User.email.in_(emails)).all()
+            recipients_query = db.session.query(User.id).filter(User.email.in_(emails))
         
-        if not recipients:
+        recipient_ids = [user_id for (user_id,) in recipients_query.order_by(User.id).all()] if recipients_query is not None else []
+        if not recipient_ids:
             return jsonify({"message": "No recipients found"}), 400
         
-        # Статистика
-        email_sent = 0
-        email_failed = 0
-        telegram_sent = 0
-        telegram_failed = 0
-        failed_emails = []
-        failed_telegram = []
-        
-        import threading
-        from flask_mail import Message
-        from modules.core import get_mail
-        
-        def send_email_background(email, subj, msg):
-            """Отправить email в фоновом режиме"""
-            with app.app_context():
-                try:
-                    mail_obj = get_mail()
-                    m = Message(subj, recipients=[email])
-                    m.html = msg
-                    mail_obj.send(m)
-                    return True
-                except Exception as e:
-                    print(f"Failed to send email to {email}: {e}")
-                    return False
-        
-        # Формируем текст для Telegram
-        telegram_text = f"<b>{subject}</b>\n\n{message}" if subject else message
-        
-        # Отправляем сообщения
-        for user in recipients:
-            # Email рассылка
-            if broadcast_type in ['email', 'both']:
-                if user.email and not user.email.endswith('@telegram.local'):
-                    def send_email_wrapper(u, subj, msg):
-                        nonlocal email_sent, email_failed, failed_emails
-                        if send_email_background(u.email, subj, msg):
-                            email_sent += 1
-                        else:
-                            email_failed += 1
-                            failed_emails.append(u.email)
-                    
-                    threading.Thread(
-                        target=send_email_wrapper,
-                        args=(user, subject, message)
-                    ).start()
-            
-            # Telegram рассылка
-            if broadcast_type in ['telegram', 'both']:
-                if user.telegram_id:
-                    def send_telegram_wrapper(u, token, text, photo, pin):
-                        nonlocal telegram_sent, telegram_failed, failed_telegram
-                        # Отправляем сообщение
-                        success, result = send_telegram_message(token, u.telegram_id, text, photo_file=photo)
-                        if success:
-                            telegram_sent += 1
-                            message_id = result
-                            
-                            # Закрепляем сообщение если нужно
-                            if pin and message_id:
-                                pin_success, pin_error = pin_telegram_message(token, u.telegram_id, message_id)
-                                if not pin_success:
-                                    # Логируем ошибку закрепления, но не считаем это критичной ошибкой
-                                    print(f"Failed to pin message for user {u.telegram_id}: {pin_error}")
-                        else:
-                            telegram_failed += 1
-                            failed_telegram.append({
-                                'telegram_id': u.telegram_id,
-                                'email': u.email,
-                                'error': result
-                            })
-                    
-                    # Если есть фото, нужно переоткрыть файл для каждого потока
-                    photo_for_thread = None
-                    if photo_file:
-                        # Сохраняем файл во временное место или используем BytesIO
-                        from io import BytesIO
-                        photo_file.seek(0)  # Возвращаемся в начало файла
-                        photo_data = photo_file.read()
-                        photo_for_thread = BytesIO(photo_data)
-                        photo_file.seek(0)  # Возвращаемся для следующего использования
-                    
-                    threading.Thread(
-                        target=send_telegram_wrapper,
-                        args=(user, bot_token, telegram_text, photo_for_thread, pin_message)
-                    ).start()
-        
-        # Ждем немного, чтобы потоки начали работу
-        import time
-        time.sleep(0.5)
-        
-        result = {
-            "message": "Broadcast initiated",
-            "total_recipients": len(recipients),
-            "broadcast_type": broadcast_type,
-            "bot_type": bot_type
-        }
-        
-        if broadcast_type in ['email', 'both']:
-            result["email"] = {
-                "sent": email_sent,
-                "failed": email_failed,
-                "failed_emails": failed_emails[:10]
-            }
-        
-        if broadcast_type in ['telegram', 'both']:
-            result["telegram"] = {
-                "sent": telegram_sent,
-                "failed": telegram_failed,
-                "failed_users": failed_telegram[:10]
-            }
+        photo = None
+        photo_filename = None
+        if photo_file and broadcast_type in ['telegram', 'both']:
+            photo = photo_file.read()
+            photo_filename = photo_file.filename
+        
+        job = enqueue_broadcast(
+            recipient_ids, message,
+            subject=subject,
+            broadcast_type=broadcast_type,
+            bot_type=bot_type,
+            recipient_type=recipient_type,
+            pin_message=pin_message,
+            photo=photo,
+            photo_filename=photo_filename,
+            created_by=current_admin.id
+        )
         
+        result = job.to_dict()
+        result["message"] = "Broadcast initiated"
         return jsonify(result), 200
         
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({"message": f"Failed to send broadcast: {str(e)}"}), 500
 
 
+@app.route('/api/admin/broadcast/jobs', methods=['GET'])
+@admin_required
+def get_broadcast_jobs(current_admin):
+    """Последние задания рассылки"""
+    try:
+        limit = min(request.args.get('limit', type=int) or 20, 100)
+        jobs = BroadcastJob.query.order_by(BroadcastJob.id.desc()).limit(limit).all()
+        if any(j.status in ('queued', 'running') for j in jobs):
+            # Подхватываем задания, оставшиеся после перезапуска worker'а
+            start_broadcast_worker()
+        return jsonify([j.to_dict() for j in jobs]), 200
+    except Exception as e:
+        print(f"Error in get_broadcast_jobs: {e}")
+        return jsonify({"message": "Internal Server Error"}), 500
+
+
+@app.route('/api/admin/broadcast/<int:job_id>', methods=['GET'])
+@admin_required
+def get_broadcast_status(current_admin, job_id):
+    """Прогресс задания рассылки"""
+    job = db.session.get(BroadcastJob, job_id)
+    if not job:
+        return jsonify({"message": "Broadcast not found"}), 404
+    if job.status in ('queued', 'running'):
+        start_broadcast_worker()
+    return jsonify(job.to_dict()), 200
+
+
+@app.route('/api/admin/broadcast/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_broadcast_job(current_admin, job_id):
+    """Отменить задание рассылки"""
+    if not db.session.get(BroadcastJob, job_id):
+        return jsonify({"message": "Broadcast not found"}), 404
+    if not cancel_broadcast(job_id):
+        return jsonify({"message": "Broadcast already finished"}), 400
+    return jsonify({"message": "Broadcast cancelled"}), 200
+
+
 # ============================================================================
 # SYNC BOT USERS
 # ============================================================================
@@ -3568,7 +2865,7 @@ def send_broadcast(current_admin):
 def sync_bot_users(current_admin):
     """Синхронизация пользователей бота"""
     try:
-        bot_config = BotConfig.query.first()
+        bot_config = settings_registry.get_bot_config()
         if not bot_config or not bot_config.bot_api_url or not bot_config.bot_api_token:
             return jsonify({"message": "Bot API not configured"}), 400
 
@@ -3877,10 +3174,12 @@ def auto_broadcast_settings_endpoint(current_admin):
             db.session.commit()
         
         if request.method == 'GET':
+            from modules.scheduler import get_auto_broadcast_progress
             return jsonify({
                 'enabled': settings.enabled,
                 'hours': settings.hours,
-                'updated_at': settings.updated_at.isoformat() if settings.updated_at else None
+                'updated_at': settings.updated_at.isoformat() if settings.updated_at else None,
+                'progress': get_auto_broadcast_progress()
             }), 200
         
         elif request.method == 'POST':
@@ -4072,16 +3371,11 @@ def get_default_translations(current_admin):
 # TELEGRAM WEBHOOK MANAGEMENT
 # ============================================================================
 
-def decrypt_key(key):
-    """Расшифровка ключа"""
-    from modules.core import get_fernet
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
+@app.route('/api/admin/password-hashing/stats', methods=['GET'])
+@admin_required
+def password_hashing_stats(current_admin):
+    """Метрики пула хеширования паролей (очередь, отказы, время ожидания) worker'а, принявшего запрос"""
+    return jsonify(password_hashing.get_stats()), 200
 
 
 @app.route('/api/admin/telegram-webhook-status', methods=['GET'])
@@ -4089,8 +3383,8 @@ def decrypt_key(key):
 def telegram_webhook_status(current_admin):
     """Проверка статуса webhook для Telegram бота"""
     try:
-        s = PaymentSetting.query.first()
-        bot_token = decrypt_key(s.telegram_bot_token) if s else None
+        s = get_payment_settings()
+        bot_token = s.telegram_bot_token if s else None
         
         if not bot_token or bot_token == "DECRYPTION_ERROR":
             return jsonify({"error": "Bot token not configured"}), 400
@@ -4124,8 +3418,8 @@ def telegram_webhook_status(current_admin):
 def telegram_set_webhook(current_admin):
     """Настройка webhook для Telegram бота"""
     try:
-        s = PaymentSetting.query.first()
-        bot_token = decrypt_key(s.telegram_bot_token) if s else None
+        s = get_payment_settings()
+        bot_token = s.telegram_bot_token if s else None
         
         if not bot_token or bot_token == "DECRYPTION_ERROR":
             return jsonify({"error": "Bot token not configured"}), 400
@@ -15,24 +15,24 @@ import random
 import string
 import threading
 import requests
-import json
 import os
 
-from modules.core import get_app, get_db, get_bcrypt, get_fernet, get_mail, get_cache, get_limiter
+from modules.core import get_app, get_db, get_fernet, get_mail, get_cache, get_limiter
 from modules.auth import create_local_jwt
 from modules.models.user import User
 from modules.models.system import SystemSetting
-from modules.models.referral import ReferralSetting
-from modules.models.branding import BrandingSetting
-from modules.models.bot_config import BotConfig
+from modules.remnawave import get_remnawave
+from modules import settings_registry
+from modules import password_hashing
+from modules.password_hashing import PasswordHashingBusy
 
 app = get_app()
 db = get_db()
-bcrypt = get_bcrypt()
 fernet = get_fernet()
 mail = get_mail()
 cache = get_cache()
 limiter = get_limiter()
+remnawave = get_remnawave()
 
 
 def generate_referral_code(user_id):
@@ -41,29 +41,6 @@ def generate_referral_code(user_id):
     return f"REF-{user_id}-{random_part}"
 
 
-def get_remnawave_headers(additional_headers=None):
-    """Получение заголовков для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    if additional_headers:
-        headers.update(additional_headers)
-    
-    return headers, cookies
-
-
 def send_email_in_background(app_context, recipient, subject, html_body):
     """Отправка email в фоновом режиме"""
     with app_context:
@@ -89,8 +66,8 @@ def send_email_in_background(app_context, recipient, subject, html_body):
 
 
 def get_system_settings():
-    """Получить системные настройки"""
-    return SystemSetting.query.first()
+    """Получить системные настройки (снимок из modules/settings_registry.py)"""
+    return settings_registry.get_system_settings()
 
 
 def create_system_settings():
@@ -98,12 +75,13 @@ def create_system_settings():
     settings = SystemSetting(default_language='ru', default_currency='uah')
     db.session.add(settings)
     db.session.commit()
+    settings_registry.invalidate_settings()
     return settings
 
 
 def get_referral_settings():
     """Получить настройки рефералов"""
-    return ReferralSetting.query.first()
+    return settings_registry.get_referral_settings()
 
 
 # ============================================================================
@@ -137,7 +115,10 @@ def public_register():
         if existing_telegram_user:
             return jsonify({"message": "Telegram account already registered"}), 400
 
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        hashed_password = password_hashing.hash_password(password)
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
     clean_username = email.replace("@", "_").replace(".", "_")
 
     referrer, bonus_days_new = None, 0
@@ -150,21 +131,11 @@ def public_register():
     expire_date = (datetime.now(timezone.utc) + timedelta(days=bonus_days_new)).isoformat()
 
     try:
-        headers, cookies = get_remnawave_headers()
-        API_URL = os.getenv('API_URL')
         
         # Сначала проверяем, существует ли пользователь в RemnaWave по email
         existing_remnawave_user = None
         try:
-            # URL-encode email для безопасной передачи
-            import urllib.parse
-            encoded_email = urllib.parse.quote(email, safe='')
-            check_resp = requests.get(
-                f"{API_URL}/api/users/by-email/{encoded_email}",
-                headers=headers,
-                cookies=cookies,
-                timeout=15
-            )
+            check_resp = remnawave.get_users_by_email(email, timeout=15)
             if check_resp.status_code == 200:
                 check_data = check_resp.json()
                 # API может вернуть response с пользователем или массив пользователей
@@ -188,7 +159,7 @@ def public_register():
                 "activeInternalSquads": [os.getenv("DEFAULT_SQUAD_ID")] if referrer else []
             }
 
-            resp = requests.post(f"{API_URL}/api/users", headers=headers, cookies=cookies, json=payload_create)
+            resp = remnawave.create_user(payload_create, timeout=30)
             resp.raise_for_status()
             remnawave_uuid = resp.json().get('response', {}).get('uuid')
 
@@ -234,8 +205,8 @@ def public_register():
 
             url = f"{your_server_ip}/verify?token={verif_token}"
             # Получаем branding и service_name для шаблона
-            branding = BrandingSetting.query.first()
-            bot_config = BotConfig.query.first()
+            branding = settings_registry.get_branding_settings()
+            bot_config = settings_registry.get_bot_config()
             service_name = bot_config.service_name if bot_config else (branding.site_name if branding else "StealthNET")
             html = render_template('email_verification.html', 
                                  verification_url=url,
@@ -250,15 +221,12 @@ def public_register():
         if referrer:
             s = get_referral_settings()
             days = s.referrer_bonus_days if s else 7
-            headers, cookies = get_remnawave_headers()
-            resp = requests.get(f"{os.getenv('API_URL')}/api/users/{referrer.remnawave_uuid}", headers=headers, cookies=cookies)
+            resp = remnawave.get_user(referrer.remnawave_uuid)
             if resp.ok:
                 live_data = resp.json().get('response', {})
                 curr = datetime.fromisoformat(live_data.get('expireAt'))
                 new_exp = max(datetime.now(timezone.utc), curr) + timedelta(days=days)
-                requests.patch(f"{os.getenv('API_URL')}/api/users",
-                            headers={"Content-Type": "application/json", **headers},
-                            json={"uuid": referrer.remnawave_uuid, "expireAt": new_exp.isoformat()})
+                remnawave.patch_user({"uuid": referrer.remnawave_uuid, "expireAt": new_exp.isoformat()})
                 cache.delete(f'live_data_{referrer.remnawave_uuid}')
 
         return jsonify({"message": "Регистрация прошла успешно. Проверьте email."}), 201
@@ -305,7 +273,7 @@ def client_login():
             else:
                 return jsonify({"message": "This account uses Telegram login"}), 401
         
-        if not bcrypt.check_password_hash(user.password_hash, password):
+        if not password_hashing.verify_and_rehash(user, password):
             return jsonify({"message": "Invalid credentials"}), 401
         if not user.is_verified:
             return jsonify({"message": "Email не подтверждён", "code": "NOT_VERIFIED"}), 403
@@ -320,6 +288,8 @@ def client_login():
             }), 403
 
         return jsonify({"token": create_local_jwt(user.id), "role": user.role}), 200
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
     except Exception as e:
         print(f"Login Error: {e}")
         return jsonify({"message": "Internal Server Error"}), 500
@@ -361,8 +331,7 @@ def forgot_password():
         import secrets
         new_password = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(12))
         
-        hashed_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
-        user.password_hash = hashed_password
+        user.password_hash = password_hashing.hash_password(new_password)
 
         if fernet:
             try:
@@ -448,8 +417,8 @@ def resend_verification():
 
             url = f"{your_server_ip}/verify?token={user.verification_token}"
             # Получаем branding и service_name для шаблона
-            branding = BrandingSetting.query.first()
-            bot_config = BotConfig.query.first()
+            branding = settings_registry.get_branding_settings()
+            bot_config = settings_registry.get_bot_config()
             service_name = bot_config.service_name if bot_config else (branding.site_name if branding else "StealthNET")
             html = render_template('email_verification.html', 
                                  verification_url=url,
@@ -12,11 +12,12 @@ import string
 import os
 
 from modules.core import get_app, get_db
+from modules import settings_registry
+from modules import password_hashing
+from modules.password_hashing import PasswordHashingBusy
 from modules.auth import create_local_jwt
 from modules.models.user import User
 from modules.models.system import SystemSetting
-from modules.models.bot_config import BotConfig
-from modules.models.referral import ReferralSetting
 
 app = get_app()
 db = get_db()
@@ -53,8 +54,7 @@ def bot_get_token():
             user = User.query.filter_by(email=email).first()
             if user:
                 # Проверяем пароль
-                from modules.core import bcrypt
-                if not user.password_hash or not bcrypt.check_password_hash(user.password_hash, password):
+                if not password_hashing.verify_and_rehash(user, password):
                     return jsonify({"message": "Invalid credentials"}), 401
                 # Если пользователь найден по email/password, но у него нет telegram_id, связываем его
                 if telegram_id and not user.telegram_id:
@@ -81,6 +81,8 @@ def bot_get_token():
             "role": user.role
         }), 200
 
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
     except Exception as e:
         print(f"Error in bot_get_token: {e}")
         return jsonify({"message": "Internal Server Error"}), 500
@@ -111,8 +113,10 @@ def bot_register():
             }), 200
 
         # Получаем системные настройки
-        sys_settings = SystemSetting.query.first()
+        sys_settings = settings_registry.get_system_settings()
+        settings_created = False
         if not sys_settings:
+            settings_created = True
             sys_settings = SystemSetting(default_language='ru', default_currency='uah')
             db.session.add(sys_settings)
             db.session.flush()
@@ -132,15 +136,15 @@ def bot_register():
 
         # Создаем пользователя в RemnaWave API (как в старом app.py)
         remnawave_uuid = None
-        from modules.api.webhooks.routes import get_remnawave_headers
+        from modules.remnawave import get_remnawave
         from datetime import datetime, timedelta, timezone
         import requests
         
-        API_URL = os.getenv('API_URL')
-        ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+        remnawave = get_remnawave()
+        API_URL = remnawave.base_url
         DEFAULT_SQUAD_ID = os.getenv('DEFAULT_SQUAD_ID')
         
-        if not API_URL or not ADMIN_TOKEN:
+        if not remnawave.configured:
             return jsonify({"message": "RemnaWave API not configured (API_URL or ADMIN_TOKEN missing)"}), 500
         
         try:
@@ -149,11 +153,7 @@ def bot_register():
             if telegram_id:
                 try:
                     telegram_id_int = int(telegram_id) if isinstance(telegram_id, (str, int)) else telegram_id
-                    check_resp = requests.get(
-                        f"{API_URL}/api/users/by-telegram-id/{telegram_id_int}",
-                        headers={"Authorization": f"Bearer {ADMIN_TOKEN}"},
-                        timeout=15
-                    )
+                    check_resp = remnawave.get_users_by_telegram_id(telegram_id_int, timeout=15)
                     if check_resp.status_code == 200:
                         check_data = check_resp.json()
                         # API может вернуть response с пользователем или массив пользователей
@@ -174,7 +174,7 @@ def bot_register():
                 # Бонусные дни для реферала
                 bonus_days = 0
                 if referrer:
-                    ref_settings = ReferralSetting.query.first()
+                    ref_settings = settings_registry.get_referral_settings()
                     bonus_days = ref_settings.invitee_bonus_days if ref_settings else 7
                 
                 expire_date = (datetime.now(timezone.utc) + timedelta(days=bonus_days)).isoformat()
@@ -203,12 +203,7 @@ def bot_register():
                 
                 print(f"Creating user in RemnaWave with payload: {payload_create}")
                 
-                resp = requests.post(
-                    f"{API_URL}/api/users",
-                    headers={"Authorization": f"Bearer {ADMIN_TOKEN}"},
-                    json=payload_create,
-                    timeout=30
-                )
+                resp = remnawave.create_user(payload_create, timeout=30)
                 
                 if resp.status_code != 200 and resp.status_code != 201:
                     error_text = resp.text[:500] if hasattr(resp, 'text') else 'No error details'
@@ -269,8 +264,8 @@ def bot_register():
             return jsonify({"message": "Failed to get UUID from RemnaWave"}), 500
             
         # Хешируем пароль для возможности входа на сайте
-        from modules.core import bcrypt, get_fernet
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        from modules.core import get_fernet
+        hashed_password = password_hashing.hash_password(password)
         
         # Сохраняем зашифрованный пароль для старого бота (get-credentials)
         encrypted_password_str = None
@@ -304,6 +299,8 @@ def bot_register():
             new_user.referrer_id = referrer.id
 
         db.session.commit()
+        if settings_created:
+            settings_registry.invalidate_settings()
 
         token = create_local_jwt(new_user.id)
 
@@ -329,6 +326,9 @@ def bot_register():
 
         return jsonify(response_data), 201
 
+    except PasswordHashingBusy:
+        # Пользователь RemnaWave уже создан - повторная регистрация найдет его по email/telegramId
+        return password_hashing.busy_response()
     except Exception as e:
         db.session.rollback()
         print(f"Error in bot_register: {e}")
@@ -389,7 +389,7 @@ def bot_get_credentials():
         
         # Добавляем данные для подключения (для совместимости)
         if user.remnawave_uuid:
-            bot_config = BotConfig.query.first()
+            bot_config = settings_registry.get_bot_config()
             response["remnawave_uuid"] = user.remnawave_uuid
             response["server_domain"] = os.getenv("YOUR_SERVER_IP") or os.getenv("YOUR_SERVER_IP_OR_DOMAIN", "testpanel.stealthnet.app")
             response["bot_config"] = {
@@ -13,21 +13,25 @@ API эндпоинты клиента
 from flask import request, jsonify
 from datetime import datetime, timezone, timedelta
 import requests
-import json
 import os
 import time
 
-from modules.core import get_app, get_db, get_cache, get_limiter, get_bcrypt
-from modules.auth import get_user_from_token
+from modules.core import get_app, get_db, get_cache, get_limiter, rate_limit
+from modules import settings_registry
+from modules import password_hashing
+from modules.password_hashing import PasswordHashingBusy
+from modules.auth import get_user_from_token, get_identity_from_token
 from modules.models.user import User
 from modules.models.promo import PromoCode
-from modules.models.referral import ReferralSetting
 from modules.currency import convert_from_usd, convert_to_usd, parse_iso_datetime, convert_to_usd, parse_iso_datetime
 from modules.models.tariff import Tariff
-from modules.models.payment import Payment, PaymentSetting
+from modules.models.payment import Payment
 from modules.models.option import PurchaseOption
 from modules.core import get_fernet
-from modules.api.payments.base import decrypt_key, get_return_url
+from modules.api.payments.base import get_return_url
+from modules.payment_settings import get_payment_settings
+from modules.remnawave import get_remnawave
+from modules.user_configs import resolve_live_data, get_live_data, get_accessible_nodes
 
 app = get_app()
 
@@ -77,28 +81,7 @@ def _reset_platega_cookies():
 db = get_db()
 cache = get_cache()
 limiter = get_limiter()
-
-
-def get_remnawave_headers(additional_headers=None):
-    """Получение заголовков для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    if additional_headers:
-        headers.update(additional_headers)
-    
-    return headers, cookies
+remnawave = get_remnawave()
 
 
 def _get_public_base_url_from_request() -> str:
@@ -131,12 +114,12 @@ def _try_reconcile_payment_if_needed(payment: Payment, user: User) -> bool:
         if not payment.payment_system_id:
             return False
 
-        s = PaymentSetting.query.first()
+        s = get_payment_settings()
 
         # CrystalPay: invoice/info (state == payed)
         if payment.payment_provider == 'crystalpay':
-            crystalpay_key = decrypt_key(getattr(s, 'crystalpay_api_key', None)) if s else None
-            crystalpay_secret = decrypt_key(getattr(s, 'crystalpay_api_secret', None)) if s else None
+            crystalpay_key = s.crystalpay_api_key if s else None
+            crystalpay_secret = s.crystalpay_api_secret if s else None
             if not crystalpay_key or not crystalpay_secret:
                 return False
             resp = requests.post(
@@ -155,8 +138,8 @@ def _try_reconcile_payment_if_needed(payment: Payment, user: User) -> bool:
 
         # Platega / MIR: transaction/{id} (status == CONFIRMED)
         elif payment.payment_provider in ('platega', 'platega_mir'):
-            platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-            platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
+            platega_key = s.platega_api_key if s else None
+            platega_merchant_raw = s.platega_merchant_id if s else None
             if not platega_key or not platega_merchant_raw:
                 return False
 
@@ -183,30 +166,17 @@ def _try_reconcile_payment_if_needed(payment: Payment, user: User) -> bool:
         else:
             return False
 
-        # Подтверждено: применяем эффект платежа
-        if payment.tariff_id is None:
-            amount_usd = convert_to_usd(payment.amount, payment.currency)
-            user.balance = (float(user.balance) if user.balance else 0.0) + float(amount_usd)
-            payment.status = 'PAID'
-            db.session.commit()
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-            except Exception:
-                pass
-            return True
-
-        t = db.session.get(Tariff, payment.tariff_id)
-        if not t:
-            return False
-        from modules.api.webhooks.routes import process_successful_payment
-        return bool(process_successful_payment(payment, user, t))
+        # Подтверждено: применяем эффект платежа через inbox событий (один раз, даже если webhook пришел одновременно)
+        from modules.payment_events import enqueue_payment_event
+        enqueue_payment_event(payment, 'reconcile', provider_event_id=payment.payment_system_id, inline=True)
+        db.session.refresh(payment)
+        return payment.status == 'PAID'
     except Exception:
         return False
 
 
 def get_referral_settings():
-    return ReferralSetting.query.first()
+    return settings_registry.get_referral_settings()
 
 
 # ============================================================================
@@ -340,7 +310,8 @@ def _normalize_traffic_data(data_dict):
 @app.route('/api/client/me', methods=['GET'])
 def get_client_me():
     """Получение данных текущего пользователя"""
-    user = get_user_from_token()
+    # Данные пользователя из кеша идентичности (modules/auth.py); для изменений - user.load()
+    user = get_identity_from_token()
     if not user:
         return jsonify({"message": "Ошибка аутентификации"}), 401
     
@@ -377,6 +348,7 @@ def get_client_me():
             # Фиксируем user.remnawave_uuid в сторону primary, чтобы старый бот/сайт не "смотрели" на доп. конфиг.
             if user.remnawave_uuid != primary_config.remnawave_uuid:
                 old_uuid = user.remnawave_uuid
+                user = user.load()
                 user.remnawave_uuid = primary_config.remnawave_uuid
                 db.session.commit()
                 if old_uuid:
@@ -391,13 +363,9 @@ def get_client_me():
 
     if is_short_uuid and current_uuid:
         # Попытка найти полный UUID
-        if os.getenv("API_URL") and os.getenv("ADMIN_TOKEN"):
+        if remnawave.configured:
             try:
-                resp = requests.get(
-                    f"{os.getenv('API_URL')}/api/users/by-short-uuid/{current_uuid}",
-                    headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
-                    timeout=10
-                )
+                resp = remnawave.get_user_by_short_uuid(current_uuid)
                 if resp.status_code == 200:
                     data = resp.json()
                     user_data = data.get('response', {}) if isinstance(data, dict) and 'response' in data else data
@@ -405,6 +373,7 @@ def get_client_me():
                     
                     if found_uuid and '-' in found_uuid and len(found_uuid) >= 36:
                         old_uuid = user.remnawave_uuid
+                        user = user.load()
                         user.remnawave_uuid = found_uuid
                         db.session.commit()
                         current_uuid = found_uuid
@@ -426,6 +395,8 @@ def get_client_me():
             if pending_dt.tzinfo is None:
                 pending_dt = pending_dt.replace(tzinfo=timezone.utc)
             if pending_dt > (now_utc - timedelta(hours=6)):
+                # Обработка платежа меняет баланс - дальше работаем с объектом модели
+                user = user.load()
                 if _try_reconcile_payment_if_needed(recent_pending, user):
                     # После успешной обработки — обновим live_data из RemnaWave
                     force_refresh = True
@@ -435,135 +406,80 @@ def get_client_me():
     except Exception:
         pass
 
-    if not force_refresh:
+    def with_user_fields(data):
+        """Данные RemnaWave + поля пользователя из нашей БД (в кеше лежат только данные RemnaWave)"""
+        if not isinstance(data, dict):
+            return data
+        data = data.copy()
+        balance_usd = float(user.balance) if user.balance else 0.0
+        data.update({
+            'referral_code': user.referral_code,
+            'preferred_lang': user.preferred_lang,
+            'preferred_currency': user.preferred_currency,
+            'telegram_id': user.telegram_id,
+            'telegram_username': user.telegram_username,
+            'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
+            'balance_usd': balance_usd,
+            'balance': convert_from_usd(balance_usd, user.preferred_currency),
+            'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
+            **_normalize_traffic_data(data)  # Добавляем нормализованные данные трафика
+        })
+        return data
+
+    def not_found_response():
+        # Если пользователь не найден в RemnaWave, проверяем кэш
         cached = cache.get(cache_key)
         if cached:
-            if isinstance(cached, dict):
-                cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
-                balance_converted = convert_from_usd(balance_usd, user.preferred_currency)
-                # Нормализуем трафик
-                traffic_data = _normalize_traffic_data(cached)
-                cached.update({
-                    'referral_code': user.referral_code,
-                    'preferred_lang': user.preferred_lang,
-                    'preferred_currency': user.preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'balance_usd': balance_usd,
-                    'balance': balance_converted,
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                    **traffic_data  # Добавляем нормализованные данные трафика
-                })
-            return jsonify({"response": cached}), 200
+            return jsonify({"response": with_user_fields(cached)}), 200
+
+        # Если кэша нет, возвращаем базовую информацию из нашей БД
+        balance_usd = float(user.balance) if user.balance else 0.0
+        balance_converted = convert_from_usd(balance_usd, user.preferred_currency)
+
+        # Возвращаем минимальную информацию о пользователе
+        basic_data = {
+            'uuid': current_uuid,
+            'email': user.email,
+            'referral_code': user.referral_code,
+            'preferred_lang': user.preferred_lang,
+            'preferred_currency': user.preferred_currency,
+            'telegram_id': user.telegram_id,
+            'telegram_username': user.telegram_username,
+            'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
+            'balance_usd': balance_usd,
+            'balance': balance_converted,
+            'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
+            'subscription': None,  # Нет подписки, т.к. пользователь не найден в RemnaWave
+            'warning': 'Пользователь не найден в RemnaWave API. Обратитесь к администратору.'
+        }
+
+        return jsonify({"response": basic_data}), 200
 
     try:
         if is_short_uuid and current_uuid:
+            cached = None if force_refresh else cache.get(cache_key)
+            if cached:
+                return jsonify({"response": with_user_fields(cached)}), 200
             return jsonify({
                 "message": f"Некорректный UUID: {current_uuid}. Обратитесь к администратору.",
                 "error": "INVALID_UUID_FORMAT"
             }), 400
 
-        resp = requests.get(
-            f"{os.getenv('API_URL')}/api/users/{current_uuid}",
-            headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
-            timeout=10
-        )
-
-        if resp.status_code != 200:
-            if resp.status_code == 404:
-                # Если пользователь не найден в RemnaWave, проверяем кэш
-                cached = cache.get(cache_key)
-                if cached:
-                    if isinstance(cached, dict):
-                        cached = cached.copy()
-                        balance_usd = float(user.balance) if user.balance else 0.0
-                        # Нормализуем трафик
-                        traffic_data = _normalize_traffic_data(cached)
-                        cached.update({
-                            'referral_code': user.referral_code,
-                            'preferred_lang': user.preferred_lang,
-                            'preferred_currency': user.preferred_currency,
-                            'telegram_id': user.telegram_id,
-                            'telegram_username': user.telegram_username,
-                            'balance_usd': balance_usd,
-                            'balance': convert_from_usd(balance_usd, user.preferred_currency),
-                            'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                            **traffic_data  # Добавляем нормализованные данные трафика
-                        })
-                    return jsonify({"response": cached}), 200
-                
-                # Если кэша нет, возвращаем базовую информацию из нашей БД
-                balance_usd = float(user.balance) if user.balance else 0.0
-                balance_converted = convert_from_usd(balance_usd, user.preferred_currency)
-                
-                # Возвращаем минимальную информацию о пользователе
-                basic_data = {
-                    'uuid': current_uuid,
-                    'email': user.email,
-                    'referral_code': user.referral_code,
-                    'preferred_lang': user.preferred_lang,
-                    'preferred_currency': user.preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
-                    'balance_usd': balance_usd,
-                    'balance': balance_converted,
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                    'subscription': None,  # Нет подписки, т.к. пользователь не найден в RemnaWave
-                    'warning': 'Пользователь не найден в RemnaWave API. Обратитесь к администратору.'
-                }
-                
-                return jsonify({"response": basic_data}), 200
-            return jsonify({"message": f"Ошибка RemnaWave: {resp.status_code}"}), 500
-
-        response_data = resp.json()
-        data = response_data.get('response', {}) if isinstance(response_data, dict) else response_data
-
-        if isinstance(data, dict):
-            balance_usd = float(user.balance) if user.balance else 0.0
-            balance_converted = convert_from_usd(balance_usd, user.preferred_currency)
-            
-            # Нормализуем трафик
-            traffic_data = _normalize_traffic_data(data)
-            
-            data.update({
-                'referral_code': user.referral_code,
-                'preferred_lang': user.preferred_lang,
-                'preferred_currency': user.preferred_currency,
-                'telegram_id': user.telegram_id,
-                'telegram_username': user.telegram_username,
-                'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
-                'balance_usd': balance_usd,
-                'balance': balance_converted,
-                'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                **traffic_data  # Добавляем нормализованные данные трафика
-            })
-
-        cache.set(cache_key, data, timeout=300)
-        return jsonify({"response": data}), 200
-        
+        # Кеш live_data (устаревшее значение отдается сразу и обновляется в фоне) или запрос в RemnaWave
+        data = get_live_data(current_uuid, force_refresh=force_refresh, raise_errors=True) if current_uuid else None
+        if data is None:
+            return not_found_response()
+        return jsonify({"response": with_user_fields(data)}), 200
+
+    except requests.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else 500
+        if status_code == 404:
+            return not_found_response()
+        return jsonify({"message": f"Ошибка RemnaWave: {status_code}"}), 500
     except requests.RequestException as e:
         cached = cache.get(cache_key)
         if cached:
-            if isinstance(cached, dict):
-                cached = cached.copy()
-                balance_usd = float(user.balance) if user.balance else 0.0
-                # Нормализуем трафик
-                traffic_data = _normalize_traffic_data(cached)
-                cached.update({
-                    'referral_code': user.referral_code,
-                    'preferred_lang': user.preferred_lang,
-                    'preferred_currency': user.preferred_currency,
-                    'telegram_id': user.telegram_id,
-                    'telegram_username': user.telegram_username,
-                    'password_hash': user.password_hash if user.password_hash else '',  # Добавляем password_hash
-                    'balance_usd': balance_usd,
-                    'balance': convert_from_usd(balance_usd, user.preferred_currency),
-                    'trial_used': getattr(user, 'trial_used', False),  # Добавляем информацию об использовании триала
-                    **traffic_data  # Добавляем нормализованные данные трафика
-                })
-            return jsonify({"response": cached}), 200
+            return jsonify({"response": with_user_fields(cached)}), 200
         return jsonify({"message": f"Ошибка подключения: {str(e)}"}), 500
     except Exception as e:
         print(f"Error in get_client_me: {e}")
@@ -602,31 +518,12 @@ def get_client_configs():
             UserConfig.created_at.asc()
         ).all()
 
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
+        # Промахи кеша запрашиваются в RemnaWave параллельно
+        live_data = resolve_live_data([cfg.remnawave_uuid for cfg in configs], force_refresh=force_refresh)
 
         out = []
         for cfg in configs:
-            cache_key = f'live_data_{cfg.remnawave_uuid}'
-            data = None if force_refresh else cache.get(cache_key)
-            if not isinstance(data, dict):
-                data = None
-
-            if not data and API_URL:
-                try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{cfg.remnawave_uuid}",
-                        headers=headers,
-                        cookies=cookies,
-                        timeout=10
-                    )
-                    if resp.status_code == 200:
-                        payload = resp.json() or {}
-                        data = payload.get('response', payload) if isinstance(payload, dict) else None
-                        if isinstance(data, dict):
-                            cache.set(cache_key, data, timeout=300)
-                except Exception:
-                    data = None
+            data = live_data.get(cfg.remnawave_uuid)
 
             subscription_url = data.get('subscriptionUrl') if isinstance(data, dict) else None
             expire_at = data.get('expireAt') if isinstance(data, dict) else None
@@ -753,7 +650,6 @@ def create_option_payment():
 @app.route('/api/client/activate-trial', methods=['POST'])
 def activate_trial():
     """Активация триала"""
-    from modules.models.trial import get_trial_settings
     
     user = get_user_from_token()
     if not user:
@@ -767,7 +663,7 @@ def activate_trial():
             return jsonify({"message": "Trial already used"}), 400
         
         # Получаем настройки триала из БД
-        trial_settings = get_trial_settings()
+        trial_settings = settings_registry.get_trial_settings()
         
         if not trial_settings.enabled:
             return jsonify({"message": "Trial is currently disabled"}), 400
@@ -816,9 +712,7 @@ def activate_trial():
         if trial_settings.traffic_limit_bytes > 0:
             patch_payload["trafficLimitBytes"] = trial_settings.traffic_limit_bytes
 
-        headers, cookies = get_remnawave_headers()
-        resp = requests.patch(f"{os.getenv('API_URL')}/api/users", headers=headers, cookies=cookies,
-                    json=patch_payload)
+        resp = remnawave.patch_user(patch_payload)
         
         if resp.status_code != 200:
             return jsonify({"message": "Failed to activate trial"}), 500
@@ -829,7 +723,6 @@ def activate_trial():
         
         # Очищаем кэш для основного конфига
         cache.delete(f'live_data_{remnawave_uuid}')
-        cache.delete('all_live_users_map')
         cache.delete(f'nodes_{remnawave_uuid}')
         
         # Очищаем кэш для основного конфига пользователя (если отличается)
@@ -880,7 +773,6 @@ def set_settings():
         db.session.commit()
         # Очищаем кэш пользователя при изменении настроек
         cache.delete(f'live_data_{user.remnawave_uuid}')
-        cache.delete('all_live_users_map')
         return jsonify({"message": "Settings updated", "preferred_currency": user.preferred_currency}), 200
     except Exception as e:
         import traceback
@@ -933,7 +825,6 @@ def change_password():
         return jsonify({"message": "Ошибка аутентификации"}), 401
 
     try:
-        bcrypt = get_bcrypt()
         data = request.json
         current_password = data.get('current_password')
         new_password = data.get('new_password')
@@ -947,7 +838,7 @@ def change_password():
         # Если у пользователя нет пароля (зарегистрирован через бота), можно установить без текущего
         if not user.password_hash or user.password_hash == '':
             # Установка пароля для пользователя из бота (без проверки текущего)
-            user.password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
+            user.password_hash = password_hashing.hash_password(new_password)
             # Сохраняем зашифрованный пароль для бота
             fernet = get_fernet()
             if fernet:
@@ -962,10 +853,10 @@ def change_password():
         if not current_password:
             return jsonify({"message": "Current password is required"}), 400
 
-        if not bcrypt.check_password_hash(user.password_hash, current_password):
+        if not password_hashing.check_password(user.password_hash, current_password):
             return jsonify({"message": "Current password is incorrect"}), 401
 
-        user.password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
+        user.password_hash = password_hashing.hash_password(new_password)
         # Сохраняем зашифрованный пароль для бота
         fernet = get_fernet()
         if fernet:
@@ -975,6 +866,8 @@ def change_password():
                 pass
         db.session.commit()
         return jsonify({"message": "Password changed successfully"}), 200
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
     except Exception as e:
         print(f"Error in change_password: {e}")
         return jsonify({"message": "Failed to change password"}), 500
@@ -990,22 +883,8 @@ def get_client_nodes():
     # Проверяем параметр force_refresh для принудительного обновления
     force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
     
-    if not force_refresh:
-        cached = cache.get(f'nodes_{user.remnawave_uuid}')
-        if cached:
-            return jsonify(cached), 200
-    
     try:
-        headers, cookies = get_remnawave_headers()
-        resp = requests.get(
-            f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}/accessible-nodes",
-            headers=headers,
-            cookies=cookies,
-            timeout=10
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        cache.set(f'nodes_{user.remnawave_uuid}', data, timeout=600)
+        data = get_accessible_nodes(user.remnawave_uuid, force_refresh=force_refresh)
         return jsonify(data), 200
     except Exception as e:
         print(f"Error fetching nodes: {e}")
@@ -1112,8 +991,7 @@ def activate_promocode():
             return jsonify({"message": "Promo code is no longer valid"}), 400
 
         if promo.promo_type == 'DAYS':
-            headers = {"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"}
-            resp = requests.get(f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}", headers=headers)
+            resp = remnawave.get_user(user.remnawave_uuid)
 
             if resp.status_code == 200:
                 user_data = resp.json().get('response', {})
@@ -1124,11 +1002,7 @@ def activate_promocode():
                 else:
                     new_expire_dt = datetime.now(timezone.utc) + timedelta(days=promo.value)
 
-                update_resp = requests.patch(
-                    f"{os.getenv('API_URL')}/api/users",
-                    headers=headers,
-                    json={"uuid": user.remnawave_uuid, "expireAt": new_expire_dt.isoformat()}
-                )
+                update_resp = remnawave.patch_user({"uuid": user.remnawave_uuid, "expireAt": new_expire_dt.isoformat()})
 
                 if update_resp.status_code == 200:
                     promo.uses_left -= 1
@@ -1153,24 +1027,12 @@ def activate_promocode():
         return jsonify({"message": "Internal Error"}), 500
 
 
-def decrypt_key(key):
-    """Расшифровка ключа"""
-    from modules.core import get_fernet
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
-
-
 # ============================================================================
 # PURCHASE WITH BALANCE
 # ============================================================================
 
 @app.route('/api/client/purchase-with-balance', methods=['POST'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def purchase_with_balance():
     """Покупка тарифа с баланса пользователя"""
     user = get_user_from_token()
@@ -1281,9 +1143,6 @@ def purchase_with_balance():
         db.session.commit()
         
         # Получаем актуальную дату истечения после активации
-        API_URL = os.getenv('API_URL')
-        h, c = get_remnawave_headers()
-        
         # Определяем remnawave_uuid для получения новой даты
         remnawave_uuid_to_check = user.remnawave_uuid
         if user_config:
@@ -1298,7 +1157,7 @@ def purchase_with_balance():
         # Получаем актуальную дату истечения
         new_expire_date = None
         try:
-            resp = requests.get(f"{API_URL}/api/users/{remnawave_uuid_to_check}", headers=h, cookies=c, timeout=10)
+            resp = remnawave.get_user(remnawave_uuid_to_check)
             if resp.status_code == 200:
                 live_data = resp.json().get('response', {})
                 new_expire_date = live_data.get('expireAt')
@@ -1308,7 +1167,6 @@ def purchase_with_balance():
         # Очищаем кэш
         cache.delete(f'live_data_{user.remnawave_uuid}')
         cache.delete(f'nodes_{user.remnawave_uuid}')
-        cache.delete('all_live_users_map')
         
         # Если создали новый конфиг, очищаем кэш для него тоже
         if create_new_config:
@@ -1361,8 +1219,7 @@ def create_payment():
             if not amount or amount <= 0:
                 return jsonify({"message": "Неверная сумма"}), 400
             
-            from modules.models.payment import PaymentSetting, Payment
-            s = PaymentSetting.query.first()
+            s = get_payment_settings()
             order_id = f"u{user.id}-balance-{int(datetime.now().timestamp())}"
             payment_url = None
             payment_system_id = None
@@ -1381,8 +1238,8 @@ def create_payment():
             cp_currency = currency_code_map.get(currency.lower(), "UAH")
             
             if payment_provider == 'crystalpay':
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
+                crystalpay_key = s.crystalpay_api_key if s else None
+                crystalpay_secret = s.crystalpay_api_secret if s else None
                 if not crystalpay_key or crystalpay_key == "DECRYPTION_ERROR" or not crystalpay_secret or crystalpay_secret == "DECRYPTION_ERROR":
                     return jsonify({"message": "CrystalPay не настроен"}), 500
                 
@@ -1410,7 +1267,7 @@ def create_payment():
                     print(f"CrystalPay API Error: {resp.status_code} - {resp.text}")
             
             elif payment_provider == 'heleket':
-                heleket_key = decrypt_key(s.heleket_api_key) if s else None
+                heleket_key = s.heleket_api_key if s else None
                 if not heleket_key or heleket_key == "DECRYPTION_ERROR":
                     return jsonify({"message": "Heleket API key not configured"}), 500
                 
@@ -1493,7 +1350,7 @@ def create_payment():
                     return jsonify({"message": error_msg}), 500
             
             elif payment_provider == 'telegram_stars':
-                bot_token = decrypt_key(s.telegram_bot_token) if s else None
+                bot_token = s.telegram_bot_token if s else None
                 if not bot_token or bot_token == "DECRYPTION_ERROR":
                     return jsonify({"message": "Telegram Bot Token not configured"}), 500
                 
@@ -1539,8 +1396,8 @@ def create_payment():
                     print(f"Telegram Stars API Error: {resp.status_code} - {resp.text}")
             
             elif payment_provider == 'freekassa':
-                freekassa_shop_id = decrypt_key(s.freekassa_shop_id) if s else None
-                freekassa_secret = decrypt_key(s.freekassa_secret) if s else None
+                freekassa_shop_id = s.freekassa_shop_id if s else None
+                freekassa_secret = s.freekassa_secret if s else None
                 if not freekassa_shop_id or not freekassa_secret or freekassa_shop_id == "DECRYPTION_ERROR" or freekassa_secret == "DECRYPTION_ERROR":
                     return jsonify({"message": "Freekassa credentials not configured"}), 500
                 
@@ -1557,8 +1414,8 @@ def create_payment():
                 payment_system_id = order_id
             
             elif payment_provider == 'robokassa':
-                robokassa_login = decrypt_key(getattr(s, 'robokassa_merchant_login', None)) if s else None
-                robokassa_password1 = decrypt_key(getattr(s, 'robokassa_password1', None)) if s else None
+                robokassa_login = s.robokassa_merchant_login if s else None
+                robokassa_password1 = s.robokassa_password1 if s else None
                 if not robokassa_login or not robokassa_password1 or robokassa_login == "DECRYPTION_ERROR" or robokassa_password1 == "DECRYPTION_ERROR":
                     return jsonify({"message": "Robokassa credentials not configured"}), 500
                 
@@ -1572,8 +1429,8 @@ def create_payment():
             elif payment_provider in ('platega', 'platega_mir'):
                 import uuid
                 import re
-                platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-                platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
+                platega_key = s.platega_api_key if s else None
+                platega_merchant_raw = s.platega_merchant_id if s else None
                 if not platega_key or not platega_merchant_raw or platega_key == "DECRYPTION_ERROR" or platega_merchant_raw == "DECRYPTION_ERROR":
                     print(f"Platega credentials error: key={bool(platega_key)}, merchant={bool(platega_merchant_raw)}")
                     return jsonify({"message": "Platega credentials not configured"}), 500
@@ -1833,8 +1690,7 @@ def create_payment():
                 elif promo.promo_type == 'DAYS':
                     return jsonify({"message": "Промокод на бесплатные дни активируется отдельно"}), 400
             
-            from modules.models.payment import PaymentSetting, Payment
-            s = PaymentSetting.query.first()
+            s = get_payment_settings()
             order_id = f"u{user.id}-t{t.id}-{int(datetime.now().timestamp())}"
             payment_url = None
             payment_system_id = None
@@ -1850,8 +1706,8 @@ def create_payment():
             
             # CrystalPay
             if payment_provider == 'crystalpay':
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
+                crystalpay_key = s.crystalpay_api_key if s else None
+                crystalpay_secret = s.crystalpay_api_secret if s else None
                 if not crystalpay_key or crystalpay_key == "DECRYPTION_ERROR" or not crystalpay_secret or crystalpay_secret == "DECRYPTION_ERROR":
                     return jsonify({"message": "CrystalPay не настроен"}), 500
                 
@@ -1880,7 +1736,7 @@ def create_payment():
             
             # Heleket
             elif payment_provider == 'heleket':
-                heleket_key = decrypt_key(s.heleket_api_key) if s else None
+                heleket_key = s.heleket_api_key if s else None
                 if not heleket_key or heleket_key == "DECRYPTION_ERROR":
                     return jsonify({"message": "Heleket API key not configured"}), 500
                 
@@ -1963,7 +1819,7 @@ def create_payment():
             
             # Telegram Stars
             elif payment_provider == 'telegram_stars':
-                bot_token = decrypt_key(s.telegram_bot_token) if s else None
+                bot_token = s.telegram_bot_token if s else None
                 if not bot_token or bot_token == "DECRYPTION_ERROR":
                     return jsonify({"message": "Telegram Bot Token not configured"}), 500
                 
@@ -2008,8 +1864,8 @@ def create_payment():
             
             # FreeKassa
             elif payment_provider == 'freekassa':
-                freekassa_shop_id = decrypt_key(s.freekassa_shop_id) if s else None
-                freekassa_secret = decrypt_key(s.freekassa_secret) if s else None
+                freekassa_shop_id = s.freekassa_shop_id if s else None
+                freekassa_secret = s.freekassa_secret if s else None
                 if not freekassa_shop_id or not freekassa_secret or freekassa_shop_id == "DECRYPTION_ERROR" or freekassa_secret == "DECRYPTION_ERROR":
                     return jsonify({"message": "FreeKassa credentials not configured"}), 500
                 
@@ -2029,8 +1885,8 @@ def create_payment():
             
             # Robokassa
             elif payment_provider == 'robokassa':
-                robokassa_login = decrypt_key(getattr(s, 'robokassa_merchant_login', None)) if s else None
-                robokassa_password1 = decrypt_key(getattr(s, 'robokassa_password1', None)) if s else None
+                robokassa_login = s.robokassa_merchant_login if s else None
+                robokassa_password1 = s.robokassa_password1 if s else None
                 if not robokassa_login or not robokassa_password1 or robokassa_login == "DECRYPTION_ERROR" or robokassa_password1 == "DECRYPTION_ERROR":
                     return jsonify({"message": "Robokassa credentials not configured"}), 500
                 
@@ -2050,7 +1906,7 @@ def create_payment():
             
             # CryptoBot
             elif payment_provider == 'cryptobot':
-                cryptobot_key = decrypt_key(s.cryptobot_api_key) if s else None
+                cryptobot_key = s.cryptobot_api_key if s else None
                 if not cryptobot_key or cryptobot_key == "DECRYPTION_ERROR":
                     return jsonify({"message": "CryptoBot API key not configured"}), 500
                 
@@ -2081,7 +1937,7 @@ def create_payment():
             
             # Monobank
             elif payment_provider == 'monobank':
-                monobank_token = decrypt_key(getattr(s, 'monobank_token', None)) if s else None
+                monobank_token = s.monobank_token if s else None
                 if not monobank_token or monobank_token == "DECRYPTION_ERROR":
                     return jsonify({"message": "Monobank token not configured"}), 500
                 
@@ -2123,8 +1979,8 @@ def create_payment():
             elif payment_provider in ('platega', 'platega_mir'):
                 import uuid
                 import re
-                platega_key = decrypt_key(getattr(s, 'platega_api_key', None)) if s else None
-                platega_merchant_raw = decrypt_key(getattr(s, 'platega_merchant_id', None)) if s else None
+                platega_key = s.platega_api_key if s else None
+                platega_merchant_raw = s.platega_merchant_id if s else None
                 if not platega_key or not platega_merchant_raw or platega_key == "DECRYPTION_ERROR" or platega_merchant_raw == "DECRYPTION_ERROR":
                     print(f"Platega credentials error: key={bool(platega_key)}, merchant={bool(platega_merchant_raw)}")
                     return jsonify({"message": "Platega credentials not configured"}), 500
@@ -2326,9 +2182,9 @@ def create_payment():
             
             # Mulenpay
             elif payment_provider == 'mulenpay':
-                mulenpay_key = decrypt_key(getattr(s, 'mulenpay_api_key', None)) if s else None
-                mulenpay_secret = decrypt_key(getattr(s, 'mulenpay_secret_key', None)) if s else None
-                mulenpay_shop = decrypt_key(getattr(s, 'mulenpay_shop_id', None)) if s else None
+                mulenpay_key = s.mulenpay_api_key if s else None
+                mulenpay_secret = s.mulenpay_secret_key if s else None
+                mulenpay_shop = s.mulenpay_shop_id if s else None
                 if not mulenpay_key or not mulenpay_secret or not mulenpay_shop or mulenpay_key == "DECRYPTION_ERROR" or mulenpay_secret == "DECRYPTION_ERROR" or mulenpay_shop == "DECRYPTION_ERROR":
                     return jsonify({"message": "Mulenpay credentials not configured"}), 500
                 
@@ -2383,9 +2239,9 @@ def create_payment():
             
             # UrlPay
             elif payment_provider == 'urlpay':
-                urlpay_key = decrypt_key(getattr(s, 'urlpay_api_key', None)) if s else None
-                urlpay_secret = decrypt_key(getattr(s, 'urlpay_secret_key', None)) if s else None
-                urlpay_shop = decrypt_key(getattr(s, 'urlpay_shop_id', None)) if s else None
+                urlpay_key = s.urlpay_api_key if s else None
+                urlpay_secret = s.urlpay_secret_key if s else None
+                urlpay_shop = s.urlpay_shop_id if s else None
                 if not urlpay_key or not urlpay_secret or not urlpay_shop or urlpay_key == "DECRYPTION_ERROR" or urlpay_secret == "DECRYPTION_ERROR" or urlpay_shop == "DECRYPTION_ERROR":
                     return jsonify({"message": "UrlPay credentials not configured"}), 500
                 
@@ -2440,9 +2296,9 @@ def create_payment():
             
             # BTCPayServer
             elif payment_provider == 'btcpayserver':
-                btcpayserver_url = decrypt_key(getattr(s, 'btcpayserver_url', None)) if s else None
-                btcpayserver_api_key = decrypt_key(getattr(s, 'btcpayserver_api_key', None)) if s else None
-                btcpayserver_store_id = decrypt_key(getattr(s, 'btcpayserver_store_id', None)) if s else None
+                btcpayserver_url = s.btcpayserver_url if s else None
+                btcpayserver_api_key = s.btcpayserver_api_key if s else None
+                btcpayserver_store_id = s.btcpayserver_store_id if s else None
                 if not btcpayserver_url or not btcpayserver_api_key or not btcpayserver_store_id or btcpayserver_url == "DECRYPTION_ERROR" or btcpayserver_api_key == "DECRYPTION_ERROR" or btcpayserver_store_id == "DECRYPTION_ERROR":
                     return jsonify({"message": "BTCPayServer credentials not configured"}), 500
                 
@@ -2494,7 +2350,7 @@ def create_payment():
             
             # Tribute
             elif payment_provider == 'tribute':
-                tribute_api_key = decrypt_key(getattr(s, 'tribute_api_key', None)) if s else None
+                tribute_api_key = s.tribute_api_key if s else None
                 if not tribute_api_key or tribute_api_key == "DECRYPTION_ERROR":
                     return jsonify({"message": "Tribute API key not configured"}), 500
                 
@@ -2542,8 +2398,8 @@ def create_payment():
             
             # CrystalPay по умолчанию
             else:
-                crystalpay_key = decrypt_key(s.crystalpay_api_key) if s else None
-                crystalpay_secret = decrypt_key(s.crystalpay_api_secret) if s else None
+                crystalpay_key = s.crystalpay_api_key if s else None
+                crystalpay_secret = s.crystalpay_api_secret if s else None
                 if not crystalpay_key or not crystalpay_secret or crystalpay_key == "DECRYPTION_ERROR" or crystalpay_secret == "DECRYPTION_ERROR":
                     return jsonify({"message": "CrystalPay credentials not configured"}), 500
                 
@@ -2640,29 +2496,10 @@ def get_subscription_config():
         # Получаем subscription URL из данных пользователя
         subscription_url = None
         
-        # Пробуем получить из кэша
-        cache_key = f'live_data_{user.remnawave_uuid}'
-        cached = cache.get(cache_key)
-        
-        if cached:
-            subscription_url = cached.get('subscriptionUrl')
-        else:
-            # Получаем из RemnaWave API
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
-            try:
-                resp = requests.get(
-                    f"{API_URL}/api/users/{user.remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
-                    timeout=10
-                )
-                if resp.status_code == 200:
-                    data = resp.json().get('response', {})
-                    subscription_url = data.get('subscriptionUrl')
-                    cache.set(cache_key, data, timeout=300)
-            except Exception as e:
-                print(f"Error fetching subscription URL: {e}")
+        # Из кэша или RemnaWave API
+        data = get_live_data(user.remnawave_uuid)
+        if data:
+            subscription_url = data.get('subscriptionUrl')
         
         if not subscription_url:
             return jsonify({"message": "Подписка не найдена"}), 404
@@ -14,116 +14,45 @@ from datetime import datetime, timezone, timedelta
 import requests
 import json
 import os
-import urllib.parse
 import re
 import uuid
 
-from modules.core import get_app, get_db, get_cache, get_limiter, get_fernet
+from modules.core import get_app, get_db, get_cache, get_limiter, rate_limit
+from modules import settings_registry
+from modules import password_hashing
+from modules.password_hashing import PasswordHashingBusy
 from modules.models.user import User
 from modules.models.tariff import Tariff
 from modules.models.promo import PromoCode
-from modules.models.payment import Payment, PaymentSetting
-from modules.models.referral import ReferralSetting
-from modules.models.branding import BrandingSetting
+from modules.models.payment import Payment
 from modules.models.user_config import UserConfig
 from modules.models.option import PurchaseOption
+from modules.remnawave import get_remnawave
+from modules.user_configs import resolve_live_data, get_live_data, get_accessible_nodes, get_last_paid_tariffs
+from modules.payment_settings import get_payment_settings
+from modules.telegram_webapp import validate_init_data, unsafe_init_data_allowed, get_user_by_telegram_id
 
 app = get_app()
 db = get_db()
 cache = get_cache()
 limiter = get_limiter()
-
-
-def decrypt_key(key):
-    """
-    Расшифровка ключа из PaymentSetting.
-    Поддерживает TEXT (str) и варианты PostgreSQL (memoryview/bytes).
-    """
-    if not key:
-        return ""
-
-    fernet = get_fernet()
-
-    try:
-        # PostgreSQL может вернуть memoryview
-        if isinstance(key, memoryview):
-            key = bytes(key)
-
-        # Если ключ хранится как строка (PostgreSQL TEXT)
-        if isinstance(key, str):
-            # Если строка уже не зашифрована — возвращаем как есть
-            if not key.startswith('gAAAAAB'):
-                return key
-            # Зашифрована, но нет fernet — не можем расшифровать
-            if not fernet:
-                return ""
-            return fernet.decrypt(key.encode('utf-8')).decode('utf-8')
-
-        # Если bytes — пробуем расшифровать
-        if isinstance(key, (bytes, bytearray)):
-            if not fernet:
-                return ""
-            return fernet.decrypt(bytes(key)).decode('utf-8')
-
-        # Прочие типы — пытаемся привести к bytes
-        if not fernet:
-            return str(key)
-        return fernet.decrypt(bytes(key)).decode('utf-8')
-    except Exception:
-        return ""
+remnawave = get_remnawave()
 
 
 def parse_telegram_init_data(init_data):
-    """Парсит initData из Telegram"""
-    if not init_data:
-        return None, None
-    
-    try:
-        if isinstance(init_data, dict):
-            parsed_data = init_data
-        else:
-            parsed_data = urllib.parse.parse_qs(init_data)
-        
-        user_str = parsed_data.get('user', [''])[0] if isinstance(parsed_data.get('user'), list) else parsed_data.get('user')
-        
-        if not user_str:
-            return None, None
-        
-        if isinstance(user_str, str):
-            user_data = json.loads(urllib.parse.unquote(user_str))
-        else:
-            user_data = user_str
-        
-        return user_data.get('id'), user_data
-    except:
+    """Парсит initData из Telegram с проверкой подписи (modules/telegram_webapp.py)"""
+    entry = validate_init_data(init_data)
+    if not entry:
         return None, None
+    return entry['telegram_id'], entry['user']
 
 
 def get_referral_settings():
-    return ReferralSetting.query.first()
+    return settings_registry.get_referral_settings()
 
 
 def get_branding_settings():
-    return BrandingSetting.query.first()
-
-
-def get_remnawave_headers():
-    """Получить заголовки для RemnaWave API"""
-    headers = {}
-    cookies = {}
-    
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except json.JSONDecodeError:
-            pass
-    
-    return headers, cookies
+    return settings_registry.get_branding_settings()
 
 
 # ============================================================================
@@ -131,7 +60,7 @@ def get_remnawave_headers():
 # ============================================================================
 
 @app.route('/miniapp/subscription', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_subscription():
     """Данные подписки пользователя"""
     if request.method == 'OPTIONS':
@@ -164,7 +93,7 @@ def miniapp_subscription():
 
         # Ищем пользователя по telegram_id (как строка)
         telegram_id_str = str(telegram_id)
-        user = User.query.filter_by(telegram_id=telegram_id_str).first()
+        user = get_user_by_telegram_id(telegram_id_str)
         if not user:
             print(f"[MINIAPP] User not found for telegram_id: {telegram_id_str}")
             # Возвращаем 404, чтобы старый мини-апп показал сообщение о регистрации
@@ -174,10 +103,6 @@ def miniapp_subscription():
         
         print(f"[MINIAPP] User found: id={user.id}, telegram_id={user.telegram_id}, email={user.email}")
 
-        # Получаем данные из кэша
-        cache_key = f'live_data_{user.remnawave_uuid}'
-        cached = cache.get(cache_key)
-
         def adapt_data(data_dict, user_obj):
             expire_at = data_dict.get('expireAt')
             has_active = False
@@ -248,28 +173,16 @@ def miniapp_subscription():
                 'activeInternalSquads': active_squads  # Для совместимости
             }
 
-        if cached:
-            response = jsonify(adapt_data(cached.copy(), user))
-            response.headers.add('Access-Control-Allow-Origin', '*')
-            return response, 200
-
-        # Запрос к RemnaWave
+        # Данные из кэша (устаревшие обновляются в фоне) или из RemnaWave
         try:
-            resp = requests.get(
-                f"{os.getenv('API_URL')}/api/users/{user.remnawave_uuid}",
-                headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
-                timeout=10
-            )
-
-            if resp.status_code != 200:
+            try:
+                data = get_live_data(user.remnawave_uuid, raise_errors=True) or {}
+            except requests.HTTPError as e:
                 return jsonify({
-                    "detail": {"title": "Error", "message": f"Failed to fetch data: {resp.status_code}"}
+                    "detail": {"title": "Error", "message": f"Failed to fetch data: {e.response.status_code}"}
                 }), 500
 
-            data = resp.json().get('response', {})
-            cache.set(cache_key, data, timeout=300)
-
-            response = jsonify(adapt_data(data, user))
+            response = jsonify(adapt_data(data.copy(), user))
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 200
 
@@ -285,7 +198,7 @@ def miniapp_subscription():
 
 
 @app.route('/miniapp/maintenance/status', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_maintenance_status():
     """Статус техобслуживания"""
     if request.method == 'OPTIONS':
@@ -297,10 +210,9 @@ def miniapp_maintenance_status():
 
 
 @app.route('/miniapp/subscription/trial', methods=['POST'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def miniapp_activate_trial():
     """Активация триала"""
-    from modules.models.trial import get_trial_settings
     
     try:
         data = request.json or {}
@@ -310,7 +222,7 @@ def miniapp_activate_trial():
         if not telegram_id:
             return jsonify({"success": False, "message": "Missing initData"}), 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             return jsonify({"success": False, "message": "User not registered"}), 404
 
@@ -320,7 +232,7 @@ def miniapp_activate_trial():
             return jsonify({"success": False, "message": "Trial already used"}), 400
 
         # Получаем настройки триала из БД
-        trial_settings = get_trial_settings()
+        trial_settings = settings_registry.get_trial_settings()
         
         if not trial_settings.enabled:
             return jsonify({"success": False, "message": "Trial is currently disabled"}), 400
@@ -369,12 +281,7 @@ def miniapp_activate_trial():
         if trial_settings.traffic_limit_bytes > 0:
             patch_payload["trafficLimitBytes"] = trial_settings.traffic_limit_bytes
 
-        resp = requests.patch(
-            f"{os.getenv('API_URL')}/api/users",
-            headers={"Authorization": f"Bearer {os.getenv('ADMIN_TOKEN')}"},
-            json=patch_payload,
-            timeout=10
-        )
+        resp = remnawave.patch_user(patch_payload)
 
         if resp.status_code != 200:
             return jsonify({"success": False, "message": "Failed to activate trial"}), 500
@@ -413,7 +320,7 @@ def miniapp_activate_trial():
 # ============================================================================
 
 @app.route('/miniapp/payments/methods', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_payment_methods():
     """Методы оплаты"""
     if request.method == 'OPTIONS':
@@ -422,41 +329,41 @@ def miniapp_payment_methods():
         return response
 
     try:
-        s = PaymentSetting.query.first()
+        s = get_payment_settings()
         if not s:
             return jsonify({"methods": []}), 200
 
         available = []
 
-        if s.crystalpay_api_key and decrypt_key(s.crystalpay_api_key):
+        if s.crystalpay_api_key:
             available.append({"id": "crystalpay", "name": "CrystalPay", "type": "redirect"})
-        if s.heleket_api_key and decrypt_key(s.heleket_api_key):
+        if s.heleket_api_key:
             available.append({"id": "heleket", "name": "Heleket (Крипто)", "type": "crypto"})
         # YooKassa - нужны shop_id и secret_key
-        if s.yookassa_shop_id and s.yookassa_secret_key and decrypt_key(s.yookassa_shop_id) and decrypt_key(s.yookassa_secret_key):
+        if s.yookassa_shop_id and s.yookassa_secret_key:
             available.append({"id": "yookassa", "name": "YooKassa", "type": "redirect"})
         # YooMoney - нужны receiver и notification_secret
-        if getattr(s, 'yoomoney_receiver', None) and getattr(s, 'yoomoney_notification_secret', None) and decrypt_key(s.yoomoney_receiver) and decrypt_key(s.yoomoney_notification_secret):
+        if s.yoomoney_receiver and s.yoomoney_notification_secret:
             available.append({"id": "yoomoney", "name": "YooMoney", "type": "redirect"})
-        if s.telegram_bot_token and decrypt_key(s.telegram_bot_token):
+        if s.telegram_bot_token:
             available.append({"id": "telegram_stars", "name": "Telegram Stars", "type": "telegram"})
-        if getattr(s, 'platega_api_key', None) and decrypt_key(s.platega_api_key):
+        if s.platega_api_key:
             available.append({"id": "platega", "name": "Platega", "type": "redirect"})
-            if getattr(s, 'platega_mir_enabled', False):
+            if s.platega_mir_enabled:
                 available.append({"id": "platega_mir", "name": "Карты МИР", "type": "redirect"})
-        if getattr(s, 'monobank_token', None) and decrypt_key(s.monobank_token):
+        if s.monobank_token:
             available.append({"id": "monobank", "name": "Monobank", "type": "card"})
-        if getattr(s, 'freekassa_shop_id', None) and decrypt_key(s.freekassa_shop_id):
+        if s.freekassa_shop_id:
             available.append({"id": "freekassa", "name": "Freekassa", "type": "redirect"})
-        if getattr(s, 'robokassa_merchant_login', None) and decrypt_key(s.robokassa_merchant_login):
+        if s.robokassa_merchant_login:
             available.append({"id": "robokassa", "name": "Robokassa", "type": "redirect"})
-        if getattr(s, 'mulenpay_api_key', None) and decrypt_key(s.mulenpay_api_key):
+        if s.mulenpay_api_key:
             available.append({"id": "mulenpay", "name": "MulenPay", "type": "redirect"})
-        if getattr(s, 'urlpay_api_key', None) and decrypt_key(s.urlpay_api_key):
+        if s.urlpay_api_key:
             available.append({"id": "urlpay", "name": "UrlPay", "type": "redirect"})
-        if getattr(s, 'tribute_api_key', None) and decrypt_key(s.tribute_api_key):
+        if s.tribute_api_key:
             available.append({"id": "tribute", "name": "Tribute", "type": "redirect"})
-        if getattr(s, 'btcpayserver_api_key', None) and decrypt_key(s.btcpayserver_api_key):
+        if s.btcpayserver_api_key:
             available.append({"id": "btcpayserver", "name": "BTCPay (Bitcoin)", "type": "crypto"})
 
         response = jsonify({"methods": available})
@@ -467,7 +374,7 @@ def miniapp_payment_methods():
 
 
 @app.route('/miniapp/payments/create', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def miniapp_create_payment():
     """Создание платежа"""
     if request.method == 'OPTIONS':
@@ -480,8 +387,8 @@ def miniapp_create_payment():
         init_data = data.get('initData') or ''
         telegram_id, _ = parse_telegram_init_data(init_data)
 
-        if not telegram_id:
-            # Попробуем initDataUnsafe
+        if not telegram_id and unsafe_init_data_allowed():
+            # Попробуем initDataUnsafe (только без проверки подписи)
             unsafe = data.get('initDataUnsafe', {})
             if isinstance(unsafe, dict) and unsafe.get('user'):
                 telegram_id = unsafe['user'].get('id')
@@ -491,7 +398,7 @@ def miniapp_create_payment():
                 "detail": {"title": "Authorization Error", "message": "Missing initData"}
             }), 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             return jsonify({
                 "detail": {"title": "User Not Found", "message": "Please register first"}
@@ -710,12 +617,11 @@ def miniapp_create_payment():
 def miniapp_app_config():
     """Конфигурация приложения"""
     import json
-    from modules.models.system import SystemSetting
     
     # Получаем активные языки из настроек
     active_languages = ["ru", "ua", "en", "cn"]
     try:
-        settings = SystemSetting.query.first()
+        settings = settings_registry.get_system_settings()
         if settings and hasattr(settings, 'active_languages') and settings.active_languages:
             try:
                 active_languages = json.loads(settings.active_languages) if isinstance(settings.active_languages, str) else settings.active_languages
@@ -768,7 +674,7 @@ def miniapp_app_config():
 # ============================================================================
 
 @app.route('/miniapp/payments/status', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_payment_status():
     """Получить статус платежа для miniapp"""
     if request.method == 'OPTIONS':
@@ -818,14 +724,13 @@ def miniapp_payment_status():
         # Если платеж Platega со статусом PENDING, проверяем статус через API
         if p.payment_provider in ('platega', 'platega_mir') and p.status == 'PENDING' and p.payment_system_id:
             try:
-                from modules.models.payment import PaymentSetting, decrypt_key
                 import requests
                 import re
                 
-                settings = PaymentSetting.query.first()
+                settings = get_payment_settings()
                 if settings:
-                    platega_key = decrypt_key(settings.platega_api_key) if settings.platega_api_key else None
-                    platega_merchant_raw = decrypt_key(settings.platega_merchant_id) if settings.platega_merchant_id else None
+                    platega_key = settings.platega_api_key or None
+                    platega_merchant_raw = settings.platega_merchant_id or None
                     
                     if platega_key and platega_merchant_raw:
                         # Обработка Merchant ID
@@ -850,27 +755,13 @@ def miniapp_payment_status():
                             api_data = resp.json()
                             api_status = api_data.get('status', '').upper()
                             
-                            # Если статус CONFIRMED, обрабатываем платеж
+                            # Если статус CONFIRMED, применяем платеж через inbox событий
+                            # (один раз, даже если webhook Platega пришел одновременно)
                             if api_status == 'CONFIRMED' and p.status != 'PAID':
-                                from modules.models.user import User
-                                from modules.models.tariff import Tariff
-                                
-                                user = db.session.get(User, p.user_id)
-                                tariff = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
-                                
-                                if user:
-                                    p.status = 'PAID'
-                                    # Если это пополнение баланса
-                                    if not tariff:
-                                        user.balance = (user.balance or 0) + float(p.amount)
-                                        print(f"[PLATEGA] Auto-processed balance topup {p.order_id}, new balance: {user.balance}")
-                                    else:
-                                        # Обрабатываем покупку тарифа
-                                        from modules.api.webhooks.routes import process_successful_payment
-                                        process_successful_payment(p, user, tariff)
-                                        print(f"[PLATEGA] Auto-processed tariff purchase {p.order_id}")
-                                    
-                                    db.session.commit()
+                                from modules.payment_events import enqueue_payment_event
+                                enqueue_payment_event(p, 'platega', provider_event_id=p.payment_system_id, inline=True)
+                                db.session.refresh(p)
+                                print(f"[PLATEGA] Auto-processed payment {p.order_id}: status={p.status}")
             except Exception as e:
                 print(f"[PLATEGA] Error checking status via API: {e}")
         
@@ -902,7 +793,7 @@ def miniapp_payment_status():
 # ============================================================================
 
 @app.route('/miniapp/promo-codes/activate', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def miniapp_activate_promocode():
     """Активировать промокод через miniapp"""
     if request.method == 'OPTIONS':
@@ -928,7 +819,7 @@ def miniapp_activate_promocode():
         init_data = data.get('initData') or request.headers.get('X-Telegram-Init-Data') or request.headers.get('X-Init-Data') or request.args.get('initData')
         
         if not init_data:
-            init_data_unsafe = data.get('initDataUnsafe', {})
+            init_data_unsafe = data.get('initDataUnsafe', {}) if unsafe_init_data_allowed() else {}
             if isinstance(init_data_unsafe, dict) and init_data_unsafe.get('user'):
                 user_data = init_data_unsafe['user']
                 telegram_id = user_data.get('id')
@@ -955,7 +846,7 @@ def miniapp_activate_promocode():
             return response, 401
         
         # Находим пользователя
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -1002,11 +893,8 @@ def miniapp_activate_promocode():
         
         # Применяем промокод (упрощенная версия - только для DAYS)
         if promo.promo_type == 'DAYS':
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
-            
             try:
-                live = requests.get(f"{API_URL}/api/users/{user.remnawave_uuid}", headers=headers, cookies=cookies, timeout=10).json().get('response', {})
+                live = remnawave.get_user(user.remnawave_uuid).json().get('response', {})
                 curr_exp_str = live.get('expireAt')
                 if curr_exp_str:
                     try:
@@ -1033,12 +921,7 @@ def miniapp_activate_promocode():
                     patch_payload["activeInternalSquads"] = [promo.squad_id]
                 # Если у пользователя уже есть сквад - просто добавляем дни (не меняем сквад)
                 
-                patch_resp = requests.patch(
-                    f"{API_URL}/api/users",
-                    headers={"Content-Type": "application/json", **headers},
-                    json=patch_payload,
-                    timeout=10
-                )
+                patch_resp = remnawave.patch_user(patch_payload)
                 
                 if not patch_resp.ok:
                     response = jsonify({
@@ -1055,7 +938,6 @@ def miniapp_activate_promocode():
                 db.session.commit()
                 
                 cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
                 
                 response = jsonify({
                     "message": "Промокод активирован",
@@ -1102,7 +984,7 @@ def miniapp_activate_promocode():
 # ============================================================================
 
 @app.route('/miniapp/nodes', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_nodes():
     """Получить список серверов для miniapp"""
     if request.method == 'OPTIONS':
@@ -1139,7 +1021,7 @@ def miniapp_nodes():
             return response, 401
         
         # Находим пользователя
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -1150,13 +1032,13 @@ def miniapp_nodes():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 404
         
-        # Получаем серверы
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-        resp = requests.get(f"{API_URL}/api/users/{user.remnawave_uuid}/accessible-nodes", headers=headers, cookies=cookies, timeout=10)
-        
-        if resp.status_code == 200:
-            nodes_data = resp.json()
+        # Получаем серверы (кеш nodes_<uuid>, общий с /api/client/nodes)
+        try:
+            nodes_data = get_accessible_nodes(user.remnawave_uuid)
+        except requests.HTTPError:
+            nodes_data = None
+
+        if nodes_data is not None:
             response = jsonify(nodes_data)
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 200
@@ -1188,7 +1070,7 @@ def miniapp_nodes():
 # ============================================================================
 
 @app.route('/miniapp/tariffs', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_tariffs():
     """Получить список тарифов для miniapp"""
     if request.method == 'OPTIONS':
@@ -1235,7 +1117,7 @@ def miniapp_tariffs():
 # ============================================================================
 
 @app.route('/miniapp/subscription/renewal/options', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_subscription_renewal_options():
     """Получить опции продления подписки для miniapp"""
     if request.method == 'OPTIONS':
@@ -1261,7 +1143,7 @@ def miniapp_subscription_renewal_options():
         init_data = data.get('initData') or request.headers.get('X-Telegram-Init-Data') or request.headers.get('X-Init-Data') or request.args.get('initData')
         
         if not init_data:
-            init_data_unsafe = data.get('initDataUnsafe', {})
+            init_data_unsafe = data.get('initDataUnsafe', {}) if unsafe_init_data_allowed() else {}
             if isinstance(init_data_unsafe, dict) and init_data_unsafe.get('user'):
                 user_data = init_data_unsafe['user']
                 telegram_id = user_data.get('id')
@@ -1287,7 +1169,7 @@ def miniapp_subscription_renewal_options():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -1328,7 +1210,7 @@ def miniapp_subscription_renewal_options():
 # ============================================================================
 
 @app.route('/miniapp/subscription/settings', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_subscription_settings():
     """Получить настройки подписки для miniapp"""
     if request.method == 'OPTIONS':
@@ -1354,7 +1236,7 @@ def miniapp_subscription_settings():
         init_data = data.get('initData') or request.headers.get('X-Telegram-Init-Data') or request.headers.get('X-Init-Data') or request.args.get('initData')
         
         if not init_data:
-            init_data_unsafe = data.get('initDataUnsafe', {})
+            init_data_unsafe = data.get('initDataUnsafe', {}) if unsafe_init_data_allowed() else {}
             if isinstance(init_data_unsafe, dict) and init_data_unsafe.get('user'):
                 user_data = init_data_unsafe['user']
                 telegram_id = user_data.get('id')
@@ -1380,7 +1262,7 @@ def miniapp_subscription_settings():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -1419,7 +1301,7 @@ def miniapp_subscription_settings():
 # ============================================================================
 
 @app.route('/miniapp/promo-offers/<offer_id>/claim', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def miniapp_claim_promo_offer(offer_id):
     """Активировать промо-оффер через miniapp (алиас для промокода)"""
     if request.method == 'OPTIONS':
@@ -1466,7 +1348,7 @@ def miniapp_claim_promo_offer(offer_id):
 # ============================================================================
 
 @app.route('/miniapp/configs', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_configs():
     """
     Получить список всех конфигов пользователя.
@@ -1492,7 +1374,7 @@ def miniapp_configs():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -1503,14 +1385,10 @@ def miniapp_configs():
         # Получаем все конфиги пользователя
         user_configs = UserConfig.query.filter_by(user_id=user.id).order_by(UserConfig.is_primary.desc(), UserConfig.created_at.asc()).all()
         
-        API_URL = os.getenv('API_URL')
-        headers, cookies = get_remnawave_headers()
-        
         # Получаем названия уровней тарифов (TariffLevel), fallback на branding для базовых
-        from modules.models.branding import BrandingSetting
         from modules.models.tariff_level import TariffLevel
 
-        branding = BrandingSetting.query.first()
+        branding = settings_registry.get_branding_settings()
         basic_name = getattr(branding, 'tariff_tier_basic_name', None) or 'Базовый'
         pro_name = getattr(branding, 'tariff_tier_pro_name', None) or 'Премиум'
         elite_name = getattr(branding, 'tariff_tier_elite_name', None) or 'Элитный'
@@ -1521,25 +1399,13 @@ def miniapp_configs():
         tier_names.setdefault('elite', elite_name)
         
         configs = []
+
+        # Данные Remna по всем конфигам (промахи кеша - параллельно) и тарифы последних оплат (один запрос)
+        live_data = resolve_live_data([c.remnawave_uuid for c in user_configs])
+        last_tariffs = get_last_paid_tariffs(user.id)
         
         for user_config in user_configs:
-            # Получаем данные из Remna для каждого конфига
-            cache_key = f'live_data_{user_config.remnawave_uuid}'
-            cached = cache.get(cache_key)
-            
-            if not cached:
-                try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{user_config.remnawave_uuid}",
-                        headers=headers,
-                        cookies=cookies,
-                        timeout=10
-                    )
-                    if resp.status_code == 200:
-                        cached = resp.json().get('response', {})
-                        cache.set(cache_key, cached, timeout=300)
-                except:
-                    cached = {}
+            cached = live_data.get(user_config.remnawave_uuid)
             
             subscription_url = cached.get('subscriptionUrl') if cached else None
             expire_at = cached.get('expireAt') if cached else None
@@ -1552,33 +1418,25 @@ def miniapp_configs():
                 except:
                     pass
             
-            # Получаем информацию о тарифе из последнего оплаченного платежа для этого конфига
-            # Ищем платежи, связанные с этим remnawave_uuid через user_config_id (если будет добавлено)
-            # Пока используем последний платеж пользователя
-            last_payment = Payment.query.filter_by(
-                user_id=user.id,
-                status='PAID'
-            ).order_by(Payment.created_at.desc()).first()
-            
             tariff_name = user_config.config_name or (f'Конфиг {user_config.id}' if not user_config.is_primary else 'Основной конфиг')
             tariff_tier = None
             tariff_duration = None
             device_limit = None
             traffic_limit_bytes = None
             
-            if last_payment and last_payment.tariff_id:
-                tariff = db.session.get(Tariff, last_payment.tariff_id)
-                if tariff:
-                    tariff_tier = tariff.tier
-                    device_limit = tariff.hwid_device_limit if hasattr(tariff, 'hwid_device_limit') else None
-                    traffic_limit_bytes = tariff.traffic_limit_bytes if hasattr(tariff, 'traffic_limit_bytes') else None
-                    
-                    if tariff.tier:
-                        tariff_name = tier_names.get(tariff.tier.lower(), tariff.tier)
-                    else:
-                        tariff_name = tariff.name
-                    tariff_duration = tariff.duration_days
-            
+            # Тариф последнего оплаченного платежа этого конфига, иначе - последнего платежа пользователя
+            tariff = last_tariffs.get(user_config.id) or last_tariffs.get(None)
+            if tariff:
+                tariff_tier = tariff.tier
+                device_limit = tariff.hwid_device_limit if hasattr(tariff, 'hwid_device_limit') else None
+                traffic_limit_bytes = tariff.traffic_limit_bytes if hasattr(tariff, 'traffic_limit_bytes') else None
+
+                if tariff.tier:
+                    tariff_name = tier_names.get(tariff.tier.lower(), tariff.tier)
+                else:
+                    tariff_name = tariff.name
+                tariff_duration = tariff.duration_days
+
             configs.append({
                 "id": user_config.id,
                 "config_id": user_config.id,  # Для обратной совместимости
@@ -1635,7 +1493,7 @@ def miniapp_configs():
 # ============================================================================
 
 @app.route('/miniapp/configs/rename', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_configs_rename():
     """Переименовать дополнительный конфиг пользователя."""
     if request.method == 'OPTIONS':
@@ -1655,7 +1513,7 @@ def miniapp_configs_rename():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({"detail": {"title": "User Not Found", "message": "User not registered"}})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1715,7 +1573,7 @@ def miniapp_configs_rename():
 
 
 @app.route('/miniapp/configs/delete', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_configs_delete():
     """Удалить дополнительный конфиг пользователя."""
     if request.method == 'OPTIONS':
@@ -1735,7 +1593,7 @@ def miniapp_configs_delete():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({"detail": {"title": "User Not Found", "message": "User not registered"}})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1779,16 +1637,9 @@ def miniapp_configs_delete():
         # Пытаемся удалить пользователя в RemnaWave (не блокируем удаление в БД при ошибке)
         remote_deleted = False
         remote_status = None
-        API_URL = os.getenv('API_URL')
-        if API_URL and remnawave_uuid:
+        if remnawave.base_url and remnawave_uuid:
             try:
-                headers, cookies = get_remnawave_headers()
-                resp = requests.delete(
-                    f"{API_URL}/api/users/{remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
-                    timeout=10
-                )
+                resp = remnawave.delete_user(remnawave_uuid)
                 remote_status = resp.status_code
                 remote_deleted = resp.status_code in [200, 204]
             except Exception:
@@ -1818,7 +1669,7 @@ def miniapp_configs_delete():
 # ============================================================================
 
 @app.route('/miniapp/referrals/info', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_referrals_info():
     """Получить информацию о реферальной программе"""
     if request.method == 'OPTIONS':
@@ -1838,7 +1689,7 @@ def miniapp_referrals_info():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -1922,7 +1773,7 @@ def miniapp_referrals_info():
 
 
 @app.route('/miniapp/referrals/stats', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_referrals_stats():
     """Получить статистику рефералов пользователя"""
     if request.method == 'OPTIONS':
@@ -1942,7 +1793,7 @@ def miniapp_referrals_stats():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -1982,7 +1833,7 @@ def miniapp_referrals_stats():
 # ============================================================================
 
 @app.route('/miniapp/profile', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_profile():
     """Получить данные профиля пользователя для отображения"""
     if request.method == 'OPTIONS':
@@ -2002,7 +1853,7 @@ def miniapp_profile():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -2011,24 +1862,7 @@ def miniapp_profile():
             return response, 404
         
         # Получаем данные подписки
-        cache_key = f'live_data_{user.remnawave_uuid}'
-        cached = cache.get(cache_key)
-        
-        if not cached:
-            API_URL = os.getenv('API_URL')
-            headers, cookies = get_remnawave_headers()
-            try:
-                resp = requests.get(
-                    f"{API_URL}/api/users/{user.remnawave_uuid}",
-                    headers=headers,
-                    cookies=cookies,
-                    timeout=10
-                )
-                if resp.status_code == 200:
-                    cached = resp.json().get('response', {})
-                    cache.set(cache_key, cached, timeout=300)
-            except:
-                cached = {}
+        cached = get_live_data(user.remnawave_uuid) or {}
         
         expire_at = cached.get('expireAt') if cached else None
         has_active = False
@@ -2074,7 +1908,7 @@ def miniapp_profile():
 
 
 @app.route('/miniapp/settings', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_settings():
     """Обновить настройки пользователя (валюта, язык)"""
     if request.method == 'OPTIONS':
@@ -2094,7 +1928,7 @@ def miniapp_settings():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -2112,8 +1946,8 @@ def miniapp_settings():
                 response.headers.add('Access-Control-Allow-Origin', '*')
                 return response, 400
             
-            from modules.core import bcrypt, get_fernet
-            user.password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
+            from modules.core import get_fernet
+            user.password_hash = password_hashing.hash_password(new_password)
             # Сохраняем зашифрованный пароль для бота
             fernet = get_fernet()
             if fernet:
@@ -2134,9 +1968,8 @@ def miniapp_settings():
         if 'preferred_currency' in data:
             currency = data['preferred_currency']
             # Проверяем, что валюта активна
-            from modules.models.system import SystemSetting
             import json
-            settings = SystemSetting.query.first()
+            settings = settings_registry.get_system_settings()
             active_currencies = ['uah', 'rub', 'usd']
             if settings and hasattr(settings, 'active_currencies') and settings.active_currencies:
                 try:
@@ -2152,15 +1985,13 @@ def miniapp_settings():
                 # Очищаем кэш при изменении валюты, чтобы баланс пересчитался
                 if currency_changed:
                     cache.delete(f'live_data_{user.remnawave_uuid}')
-                    cache.delete('all_live_users_map')
         
         # Обновляем язык
         if 'preferred_lang' in data:
             lang = data['preferred_lang']
             # Проверяем, что язык активен
-            from modules.models.system import SystemSetting
             import json
-            settings = SystemSetting.query.first()
+            settings = settings_registry.get_system_settings()
             active_languages = ['ru', 'ua', 'en', 'cn']
             if settings and hasattr(settings, 'active_languages') and settings.active_languages:
                 try:
@@ -2176,6 +2007,13 @@ def miniapp_settings():
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 200
         
+    except PasswordHashingBusy:
+        response = jsonify({
+            "detail": {"title": "Busy", "message": "Server is busy, please try again later"}
+        })
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -2191,7 +2029,7 @@ def miniapp_settings():
 # ============================================================================
 
 @app.route('/miniapp/options', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_options():
     """Получить список платных опций"""
     if request.method == 'OPTIONS':
@@ -2219,7 +2057,7 @@ def miniapp_options():
         
         # Если есть telegram_id, проверяем статус опций пользователя
         if telegram_id:
-            user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+            user = get_user_by_telegram_id(telegram_id)
             if user:
                 # TODO: Реализовать проверку активных опций через RemnaWave API
                 pass
@@ -2241,7 +2079,7 @@ def miniapp_options():
 # ============================================================================
 
 @app.route('/miniapp/purchase-options', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_get_purchase_options():
     """Получить список доступных опций для покупки (трафик, устройства, сквады)"""
     if request.method == 'OPTIONS':
@@ -2259,7 +2097,7 @@ def miniapp_get_purchase_options():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({"detail": {"title": "User Not Found", "message": "User not registered"}})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -2300,7 +2138,7 @@ def miniapp_get_purchase_options():
 
 
 @app.route('/miniapp/options/purchase', methods=['POST', 'OPTIONS'])
-@limiter.limit("10 per minute")
+@limiter.limit(rate_limit('write'))
 def miniapp_purchase_option():
     """Покупка дополнительной опции"""
     if request.method == 'OPTIONS':
@@ -2313,8 +2151,8 @@ def miniapp_purchase_option():
         init_data = data.get('initData') or data.get('init_data') or ''
         telegram_id, _ = parse_telegram_init_data(init_data)
 
-        # Fallback для initDataUnsafe (для тестирования вне Telegram)
-        if not telegram_id:
+        # Fallback для initDataUnsafe (для тестирования вне Telegram, только без проверки подписи)
+        if not telegram_id and unsafe_init_data_allowed():
             unsafe = data.get('initDataUnsafe', {})
             if isinstance(unsafe, dict) and unsafe.get('user'):
                 telegram_id = unsafe['user'].get('id')
@@ -2324,7 +2162,7 @@ def miniapp_purchase_option():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
 
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({"detail": {"title": "User Not Found", "message": "User not registered"}})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -2424,7 +2262,7 @@ def miniapp_purchase_option():
 # ============================================================================
 
 @app.route('/miniapp/support/tickets', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_support_tickets():
     """Получить список тикетов или создать новый тикет"""
     if request.method == 'OPTIONS':
@@ -2448,7 +2286,7 @@ def miniapp_support_tickets():
             return response, 401
         
         # Получаем пользователя (преобразуем telegram_id в строку, т.к. в БД это VARCHAR)
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -2539,7 +2377,7 @@ def miniapp_support_tickets():
 
 
 @app.route('/miniapp/support/tickets/<int:ticket_id>', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_support_ticket_detail(ticket_id):
     """Получить детали тикета"""
     if request.method == 'OPTIONS':
@@ -2563,7 +2401,7 @@ def miniapp_support_ticket_detail(ticket_id):
             return response, 401
         
         # Получаем пользователя (преобразуем telegram_id в строку, т.к. в БД это VARCHAR)
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -2623,7 +2461,7 @@ def miniapp_support_ticket_detail(ticket_id):
 
 
 @app.route('/miniapp/support/tickets/<int:ticket_id>/reply', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_support_ticket_reply(ticket_id):
     """Ответить на тикет"""
     if request.method == 'OPTIONS':
@@ -2647,7 +2485,7 @@ def miniapp_support_ticket_reply(ticket_id):
             return response, 401
         
         # Получаем пользователя (преобразуем telegram_id в строку, т.к. в БД это VARCHAR)
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {
@@ -2773,7 +2611,7 @@ def miniapp_support_ticket_reply(ticket_id):
 # ============================================================================
 
 @app.route('/miniapp/payments/history', methods=['POST', 'OPTIONS'])
-@limiter.limit("30 per minute")
+@limiter.limit(rate_limit('miniapp'))
 def miniapp_payments_history():
     """Получить историю платежей пользователя"""
     if request.method == 'OPTIONS':
@@ -2793,7 +2631,7 @@ def miniapp_payments_history():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 401
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({
                 "detail": {"title": "User Not Found", "message": "User not registered"}
@@ -2802,10 +2640,9 @@ def miniapp_payments_history():
             return response, 404
         
         # Получаем названия уровней тарифов (TariffLevel), fallback на branding для базовых
-        from modules.models.branding import BrandingSetting
         from modules.models.tariff_level import TariffLevel
 
-        branding = BrandingSetting.query.first()
+        branding = settings_registry.get_branding_settings()
         basic_name = getattr(branding, 'tariff_tier_basic_name', None) or 'Базовый'
         pro_name = getattr(branding, 'tariff_tier_pro_name', None) or 'Премиум'
         elite_name = getattr(branding, 'tariff_tier_elite_name', None) or 'Элитный'
@@ -2914,14 +2751,7 @@ def get_user_days_remaining(user):
         return 0
     
     try:
-        api_url = os.environ.get('API_URL', '')
-        admin_token = os.environ.get('ADMIN_TOKEN', '')
-        
-        response = requests.get(
-            f"{api_url}/api/users/{user.remnawave_uuid}",
-            headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10
-        )
+        response = remnawave.get_user(user.remnawave_uuid)
         
         if response.status_code == 200:
             data = response.json().get('response', {})
@@ -2943,15 +2773,8 @@ def update_user_subscription(user, days_delta):
         return False
     
     try:
-        api_url = os.environ.get('API_URL', '')
-        admin_token = os.environ.get('ADMIN_TOKEN', '')
-        
         # Получаем текущую дату окончания
-        response = requests.get(
-            f"{api_url}/api/users/{user.remnawave_uuid}",
-            headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10
-        )
+        response = remnawave.get_user(user.remnawave_uuid)
         
         if response.status_code != 200:
             return False
@@ -2968,15 +2791,7 @@ def update_user_subscription(user, days_delta):
         new_expire = expire_date + timedelta(days=days_delta)
         
         # Обновляем через API (правильный формат - uuid в теле запроса)
-        update_response = requests.patch(
-            f"{api_url}/api/users",
-            headers={
-                "Authorization": f"Bearer {admin_token}",
-                "Content-Type": "application/json"
-            },
-            json={"uuid": user.remnawave_uuid, "expireAt": new_expire.isoformat()},
-            timeout=10
-        )
+        update_response = remnawave.patch_user({"uuid": user.remnawave_uuid, "expireAt": new_expire.isoformat()})
         
         if update_response.status_code != 200:
             print(f"Error updating subscription: Status {update_response.status_code}, Response: {update_response.text[:200]}")
@@ -3052,7 +2867,7 @@ def casino_play():
             return response, 401
         
         # Находим пользователя
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({'error': 'Пользователь не найден'})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -3226,7 +3041,7 @@ def casino_history():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 200
         
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
+        user = get_user_by_telegram_id(telegram_id)
         if not user:
             response = jsonify({'games': []})
             response.headers.add('Access-Control-Allow-Origin', '*')
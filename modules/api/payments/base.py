@@ -2,52 +2,9 @@
 Базовые функции для платёжных систем
 """
 import os
-from modules.core import get_fernet
-from modules.models.payment import PaymentSetting
-from modules.models.bot_config import BotConfig
-
-fernet = get_fernet()
-
-
-def get_payment_settings():
-    """Получить настройки платёжных систем"""
-    return PaymentSetting.query.first()
-
-
-def decrypt_key(encrypted_key):
-    """Расшифровать ключ API"""
-    if not encrypted_key:
-        return ""
-    if not fernet:
-        # Если fernet не инициализирован, возвращаем как есть (если это уже строка)
-        return str(encrypted_key) if encrypted_key else ""
-    
-    try:
-        # PostgreSQL может возвращать bytes или memoryview
-        if isinstance(encrypted_key, memoryview):
-            encrypted_key = bytes(encrypted_key)
-        elif isinstance(encrypted_key, str):
-            # Если строка, проверяем, зашифрована ли (начинается с gAAAAAB)
-            if encrypted_key.startswith('gAAAAAB'):
-                # Зашифрована - расшифровываем
-                return fernet.decrypt(encrypted_key.encode('utf-8')).decode('utf-8')
-            else:
-                # Не зашифрована - возвращаем как есть
-                return encrypted_key
-        elif isinstance(encrypted_key, bytes):
-            # Если bytes, расшифровываем
-            return fernet.decrypt(encrypted_key).decode('utf-8')
-        else:
-            # Другие типы - пробуем преобразовать в bytes
-            try:
-                key_bytes = bytes(encrypted_key)
-                return fernet.decrypt(key_bytes).decode('utf-8')
-            except:
-                return str(encrypted_key) if encrypted_key else ""
-    except Exception as e:
-        # Если расшифровка не удалась, возвращаем пустую строку
-        print(f"[DECRYPT] Failed to decrypt key: {type(encrypted_key)}, error: {str(e)[:100]}")
-        return ""
+# Настройки с уже расшифрованными ключами (кешируются в памяти worker'а)
+from modules.payment_settings import get_payment_settings, decrypt_key
+from modules import settings_registry
 
 
 def get_callback_url(provider: str) -> str:
@@ -70,7 +27,7 @@ def get_bot_username() -> str:
     
     # Если нет в переменных окружения, пробуем получить из BotConfig
     try:
-        bot_config = BotConfig.query.first()
+        bot_config = settings_registry.get_bot_config()
         if bot_config and bot_config.bot_username:
             username = bot_config.bot_username
             # Убираем @ если есть
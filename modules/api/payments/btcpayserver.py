@@ -3,7 +3,7 @@ BTCPay Server - self-hosted платёжная система для крипт
 https://btcpayserver.org/
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 
 def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -24,7 +24,7 @@ def create_btcpayserver_payment(amount: float, currency: str, order_id: str, **k
         return None, "Payment settings not configured"
     
     server_url = settings.btcpayserver_url
-    api_key = decrypt_key(settings.btcpayserver_api_key)
+    api_key = settings.btcpayserver_api_key
     store_id = settings.btcpayserver_store_id
     
     if not server_url or not api_key or not store_id:
@@ -3,7 +3,7 @@ CryptoBot - платёжная система Telegram
 https://t.me/CryptoBot
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url
+from modules.api.payments.base import get_payment_settings, get_callback_url
 
 
 def create_cryptobot_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -22,7 +22,7 @@ def create_cryptobot_payment(amount: float, currency: str, order_id: str, **kwar
     if not settings:
         return None, "Payment settings not configured"
     
-    api_key = decrypt_key(settings.cryptobot_api_key)
+    api_key = settings.cryptobot_api_key
     if not api_key:
         return None, "CryptoBot API key not configured"
     
@@ -77,7 +77,7 @@ def verify_cryptobot_signature(data: dict, signature: str) -> bool:
     if not settings:
         return False
     
-    api_key = decrypt_key(settings.cryptobot_api_key)
+    api_key = settings.cryptobot_api_key
     if not api_key:
         return False
     
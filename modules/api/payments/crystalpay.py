@@ -3,7 +3,7 @@ CrystalPay - платёжная система
 https://crystalpay.io/
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 
 def create_crystalpay_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -22,8 +22,8 @@ def create_crystalpay_payment(amount: float, currency: str, order_id: str, **kwa
     if not settings:
         return None, "Payment settings not configured"
     
-    api_key = decrypt_key(settings.crystalpay_api_key)
-    api_secret = decrypt_key(settings.crystalpay_api_secret)
+    api_key = settings.crystalpay_api_key
+    api_secret = settings.crystalpay_api_secret
     
     if not api_key or not api_secret:
         return None, "CrystalPay API credentials not configured"
@@ -70,7 +70,7 @@ def verify_crystalpay_signature(data: dict, signature: str) -> bool:
     if not settings:
         return False
     
-    api_secret = decrypt_key(settings.crystalpay_api_secret)
+    api_secret = settings.crystalpay_api_secret
     if not api_secret:
         return False
     
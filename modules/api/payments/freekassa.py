@@ -3,7 +3,7 @@ FreeKassa - платёжная система
 https://freekassa.ru/
 """
 import hashlib
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url
+from modules.api.payments.base import get_payment_settings, get_callback_url
 
 
 def create_freekassa_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -23,7 +23,7 @@ def create_freekassa_payment(amount: float, currency: str, order_id: str, **kwar
         return None, "Payment settings not configured"
     
     shop_id = settings.freekassa_shop_id
-    secret = decrypt_key(settings.freekassa_secret)
+    secret = settings.freekassa_secret
     
     if not shop_id or not secret:
         return None, "FreeKassa credentials not configured"
@@ -58,7 +58,7 @@ def verify_freekassa_signature(data: dict) -> bool:
     if not settings:
         return False
     
-    secret2 = decrypt_key(settings.freekassa_secret2)
+    secret2 = settings.freekassa_secret2
     if not secret2:
         return False
     
@@ -3,7 +3,7 @@ Heleket - платёжная система для криптовалют
 https://heleket.com/
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 
 def create_heleket_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -22,7 +22,7 @@ def create_heleket_payment(amount: float, currency: str, order_id: str, **kwargs
     if not settings:
         return None, "Payment settings not configured"
     
-    api_key = decrypt_key(settings.heleket_api_key)
+    api_key = settings.heleket_api_key
     if not api_key:
         return None, "Heleket API key not configured"
     
@@ -3,7 +3,7 @@ Monobank - платёжная система (Украина)
 https://api.monobank.ua/
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 
 def create_monobank_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -22,7 +22,7 @@ def create_monobank_payment(amount: float, currency: str, order_id: str, **kwarg
     if not settings:
         return None, "Payment settings not configured"
     
-    token = decrypt_key(settings.monobank_token)
+    token = settings.monobank_token
     if not token:
         return None, "Monobank token not configured"
     
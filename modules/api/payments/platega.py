@@ -5,7 +5,7 @@ https://docs.platega.io/
 import requests
 import uuid
 import time
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 # Глобальная сессия для сохранения cookies между запросами (для обхода DDoS-Guard)
 _platega_session = None
@@ -71,8 +71,8 @@ def create_platega_payment(amount: float, currency: str, order_id: str, **kwargs
     if not settings:
         return None, "Payment settings not configured"
     
-    api_key = decrypt_key(getattr(settings, 'platega_api_key', None))
-    merchant_id = decrypt_key(getattr(settings, 'platega_merchant_id', None))
+    api_key = settings.platega_api_key
+    merchant_id = settings.platega_merchant_id
     
     if not api_key or api_key == "DECRYPTION_ERROR":
         return None, "Platega API key not configured"
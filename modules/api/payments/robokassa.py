@@ -3,7 +3,7 @@ Robokassa - платёжная система
 https://robokassa.com/
 """
 import hashlib
-from modules.api.payments.base import get_payment_settings, decrypt_key
+from modules.api.payments.base import get_payment_settings
 
 
 def create_robokassa_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -24,7 +24,7 @@ def create_robokassa_payment(amount: float, currency: str, order_id: str, **kwar
         return None, "Payment settings not configured"
     
     merchant_login = settings.robokassa_merchant_login
-    password1 = decrypt_key(settings.robokassa_password1)
+    password1 = settings.robokassa_password1
     
     if not merchant_login or not password1:
         return None, "Robokassa credentials not configured"
@@ -62,7 +62,7 @@ def verify_robokassa_signature(data: dict) -> bool:
     if not settings:
         return False
     
-    password2 = decrypt_key(settings.robokassa_password2)
+    password2 = settings.robokassa_password2
     if not password2:
         return False
     
@@ -3,7 +3,7 @@ Telegram Stars - оплата через Telegram
 https://core.telegram.org/bots/payments
 """
 import requests
-from modules.api.payments.base import get_payment_settings, decrypt_key
+from modules.api.payments.base import get_payment_settings
 
 
 def create_telegram_stars_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -22,7 +22,7 @@ def create_telegram_stars_payment(amount: float, currency: str, order_id: str, *
     if not settings:
         return None, "Payment settings not configured"
     
-    bot_token = decrypt_key(settings.telegram_bot_token)
+    bot_token = settings.telegram_bot_token
     if not bot_token:
         return None, "Telegram Bot Token not configured"
     
@@ -5,7 +5,7 @@ https://yookassa.ru/
 import requests
 import uuid
 import json
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_callback_url, get_return_url
+from modules.api.payments.base import get_payment_settings, get_callback_url, get_return_url
 
 
 def create_yookassa_payment(amount: float, currency: str, order_id: str, **kwargs):
@@ -26,8 +26,8 @@ def create_yookassa_payment(amount: float, currency: str, order_id: str, **kwarg
         return None, "Payment settings not configured"
     
     # Оба ключа должны быть расшифрованы
-    shop_id = decrypt_key(settings.yookassa_shop_id) if settings.yookassa_shop_id else None
-    secret_key = decrypt_key(settings.yookassa_secret_key) if settings.yookassa_secret_key else None
+    shop_id = settings.yookassa_shop_id or None
+    secret_key = settings.yookassa_secret_key or None
     
     # Если расшифровка не удалась, decrypt_key вернет пустую строку
     if not shop_id or not secret_key:
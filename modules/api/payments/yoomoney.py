@@ -10,7 +10,7 @@ modules/api/webhooks/routes.py -> /api/webhook/yoomoney
 
 from urllib.parse import urlencode
 
-from modules.api.payments.base import get_payment_settings, decrypt_key, get_return_url
+from modules.api.payments.base import get_payment_settings, get_return_url
 
 
 YOOMONEY_QUICKPAY_URL = "https://yoomoney.ru/quickpay/confirm.xml"
@@ -32,7 +32,7 @@ def create_yoomoney_payment(amount: float, currency: str, order_id: str, **kwarg
     if not settings:
         return None, "Payment settings not configured"
 
-    receiver = decrypt_key(getattr(settings, "yoomoney_receiver", None)) if getattr(settings, "yoomoney_receiver", None) else ""
+    receiver = settings.yoomoney_receiver or ""
     receiver = (receiver or "").strip()
     if not receiver:
         return None, "YooMoney receiver is not configured"
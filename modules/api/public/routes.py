@@ -10,6 +10,7 @@ API публичные эндпоинты
 - GET /api/public/system-info - Информация о системе
 - GET /api/public/telegram-auth-enabled - Проверка Telegram авторизации
 - GET /api/public/server-domain - Домен сервера
+- GET /api/public/config-version - Версия конфигурации (long-poll для бота)
 - GET /api/health - Health check
 - GET /api/public/health - Public health check
 """
@@ -19,13 +20,12 @@ from datetime import datetime, timezone
 import json
 import os
 
-from modules.core import get_app, get_db, get_cache
+from modules.core import get_app, get_db, get_cache, is_bot_request
+from modules import settings_registry
+from modules import tagged_cache
 from modules.models.tariff import Tariff
 from modules.models.tariff_feature import TariffFeatureSetting
 from modules.models.tariff_level import TariffLevel
-from modules.models.system import SystemSetting
-from modules.models.branding import BrandingSetting
-from modules.models.bot_config import BotConfig
 from modules.models.currency import CurrencyRate
 from modules.models.option import PurchaseOption
 
@@ -39,7 +39,7 @@ cache = get_cache()
 # ============================================================================
 
 @app.route('/api/public/tariffs', methods=['GET'])
-@cache.cached(timeout=3600)
+@tagged_cache.cached(tagged_cache.TARIFFS)
 def public_tariffs():
     """Публичный список тарифов"""
     try:
@@ -83,7 +83,7 @@ def public_tariffs():
 
 
 @app.route('/api/public/tariff-levels', methods=['GET'])
-@cache.cached(timeout=3600)
+@tagged_cache.cached(tagged_cache.LEVELS)
 def get_public_tariff_levels():
     """Публичные уровни тарифов"""
     try:
@@ -100,7 +100,7 @@ def get_public_tariff_levels():
 
 
 @app.route('/api/public/tariff-features', methods=['GET'])
-@cache.cached(timeout=3600)
+@tagged_cache.cached(tagged_cache.FEATURES, tagged_cache.LEVELS)
 def get_public_tariff_features():
     """Публичные функции тарифов"""
     default_features = {
@@ -144,6 +144,7 @@ def get_public_tariff_features():
 # ============================================================================
 
 @app.route('/api/public/options', methods=['GET'])
+@tagged_cache.cached(tagged_cache.OPTIONS)
 def public_options():
     """Публичный список активных опций"""
     try:
@@ -169,6 +170,7 @@ def public_options():
 
 
 @app.route('/api/public/options/<option_type>', methods=['GET'])
+@tagged_cache.cached(tagged_cache.OPTIONS)
 def public_options_by_type(option_type):
     """Публичный список активных опций по типу"""
     try:
@@ -197,6 +199,7 @@ def public_options_by_type(option_type):
 
 
 @app.route('/api/public/purchase-options', methods=['GET'])
+@tagged_cache.cached(tagged_cache.OPTIONS)
 def public_purchase_options_grouped():
     """Публичный список опций для покупки (сгруппированный по типу)"""
     try:
@@ -241,7 +244,7 @@ def public_system_settings():
     """Публичные системные настройки"""
     try:
         import json
-        settings = SystemSetting.query.first()
+        settings = settings_registry.get_system_settings()
         if not settings:
             return jsonify({
                 "default_language": "ru",
@@ -282,11 +285,12 @@ def public_system_settings():
 
 
 @app.route('/api/public/branding', methods=['GET'])
+@tagged_cache.cached(tagged_cache.BRANDING)
 def public_branding():
     """Публичный брендинг"""
     try:
         import json
-        branding = BrandingSetting.query.first()
+        branding = settings_registry.get_branding_settings()
         if not branding:
             return jsonify({
                 "site_name": "",
@@ -415,13 +419,8 @@ def public_currency_rates():
 def get_public_nodes():
     """Публичные ноды для лендинга"""
     try:
-        import requests
-        headers, cookies = {}, {}
-        ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-        if ADMIN_TOKEN:
-            headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-        
-        resp = requests.get(f"{os.getenv('API_URL')}/api/nodes/public", headers=headers, timeout=10)
+        from modules.remnawave import get_remnawave
+        resp = get_remnawave().public_nodes(timeout=10)
         resp.raise_for_status()
         return jsonify(resp.json()), 200
     except Exception as e:
@@ -432,9 +431,9 @@ def get_public_nodes():
 def get_system_info():
     """Публичная информация о системе"""
     try:
-        system_settings = SystemSetting.query.first()
-        branding = BrandingSetting.query.first()
-        bot_config = BotConfig.query.first()
+        system_settings = settings_registry.get_system_settings()
+        branding = settings_registry.get_branding_settings()
+        bot_config = settings_registry.get_bot_config()
 
         return jsonify({
             "system": {
@@ -478,7 +477,7 @@ def telegram_auth_enabled():
             }), 200
         
         # Fallback: проверяем BotConfig из БД
-        bot_config = BotConfig.query.first()
+        bot_config = settings_registry.get_bot_config()
         if bot_config and bot_config.bot_username:
             return jsonify({
                 "enabled": True,
@@ -510,15 +509,36 @@ def server_domain():
     return jsonify({"domain": domain, "full_url": full_url}), 200
 
 
+@app.route('/api/public/config-version', methods=['GET'])
+def public_config_version():
+    """
+    Версия конфигурации (BotConfig, настройки триала, брендинг и др.).
+    ?known=<версия>&wait=<сек> - long-poll для бота (заголовок X-Bot-Key): ответ приходит
+    после смены версии или через wait секунд (не больше CONFIG_VERSION_WAIT_MAX).
+    Остальным запросам версия отдается сразу - ожидание занимает поток worker'а.
+    """
+    known = request.args.get('known')
+    try:
+        wait = max(float(request.args.get('wait', 0)), 0)
+    except ValueError:
+        wait = 0
+    if known and wait and is_bot_request():
+        version = settings_registry.wait_for_version(known, wait)
+    else:
+        version = settings_registry.current_version()
+    return jsonify({"version": version}), 200
+
+
 @app.route('/api/public/bot-config', methods=['GET'])
+@tagged_cache.conditional
 def public_bot_config():
-    """Публичный эндпоинт для получения конфигурации бота"""
-    from modules.models.bot_config import BotConfig
+    """Публичный эндпоинт для получения конфигурации бота (?version= - версия из config-version)"""
     
     import json
     import os
     
-    config = BotConfig.query.first()
+    settings_registry.ensure_version(request.args.get('version'))
+    config = settings_registry.get_bot_config()
     
     # Получаем bot_username: сначала из BotConfig, потом из .env
     bot_username = ""
@@ -8,6 +8,10 @@ API вебхуков платежных систем
 - POST /api/webhook/telegram-stars - Telegram Stars webhook (alt)
 - POST /api/webhook/freekassa - FreeKassa webhook
 - POST /api/webhook/robokassa - Robokassa webhook
+
+Вебхук проверяет уведомление, сохраняет событие в inbox (payment_event) и сразу
+отвечает провайдеру. Эффект платежа применяет фоновый пул modules/payment_events.py
+через apply_payment_effect - ровно один раз на платеж.
 """
 
 from flask import request, jsonify
@@ -18,18 +22,22 @@ import os
 import threading
 import hashlib
 
-from modules.core import get_app, get_db, get_cache, get_fernet
-from modules.models.payment import Payment, PaymentSetting
+from modules.core import get_app, get_db, get_cache
+from modules import settings_registry
+from modules.models.payment import Payment
+from modules.payment_settings import get_payment_settings
 from modules.models.user import User
 from modules.models.tariff import Tariff
 from modules.models.promo import PromoCode
-from modules.models.referral import ReferralSetting
 from modules.currency import convert_to_usd
 from modules.models.option import PurchaseOption
+from modules.remnawave import get_remnawave
+from modules.payment_events import enqueue_payment_event
 
 app = get_app()
 db = get_db()
 cache = get_cache()
+remnawave = get_remnawave()
 
 BOT_API_URL = os.getenv("BOT_API_URL", "")
 BOT_API_TOKEN = os.getenv("BOT_API_TOKEN", "")
@@ -46,7 +54,7 @@ def add_referral_commission(user, amount_usd, is_tariff_purchase=True):
     """
     try:
         # Проверяем тип реферальной системы
-        referral_settings = ReferralSetting.query.first()
+        referral_settings = settings_registry.get_referral_settings()
         if not referral_settings:
             return
         
@@ -81,33 +89,6 @@ def add_referral_commission(user, amount_usd, is_tariff_purchase=True):
         traceback.print_exc()
 
 
-def get_remnawave_headers(additional_headers=None):
-    headers = {}
-    cookies = {}
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
-    if ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
-    REMNAWAVE_COOKIES_STR = os.getenv("REMNAWAVE_COOKIES", "")
-    if REMNAWAVE_COOKIES_STR:
-        try:
-            cookies = json.loads(REMNAWAVE_COOKIES_STR)
-        except:
-            pass
-    if additional_headers:
-        headers.update(additional_headers)
-    return headers, cookies
-
-
-def decrypt_key(key):
-    fernet = get_fernet()
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except:
-        return ""
-
-
 def sync_subscription_to_bot(app_context, remnawave_uuid):
     """Синхронизация подписки в бота"""
     with app_context:
@@ -168,8 +149,6 @@ def _resolve_target_remnawave_uuid(payment: Payment, user: User) -> str:
 
 def process_option_purchase(payment, user):
     """Обработка успешной покупки опции (трафик, устройства, сквад)"""
-    API_URL = os.getenv("API_URL")
-
     try:
         if not getattr(payment, 'description', None) or not str(payment.description).startswith('OPTION:'):
             print(f"[OPTION] Invalid payment description: {getattr(payment, 'description', None)}")
@@ -192,8 +171,7 @@ def process_option_purchase(payment, user):
             return False
 
         # Получаем текущие данные пользователя из RemnaWave
-        h, c = get_remnawave_headers({"Content-Type": "application/json"})
-        resp = requests.get(f"{API_URL}/api/users/{target_uuid}", headers=h, cookies=c, timeout=15)
+        resp = remnawave.get_user(target_uuid, timeout=15)
         if resp.status_code != 200:
             print(f"[OPTION] Failed to get user data: {resp.status_code} - {resp.text[:200]}")
             return False
@@ -240,7 +218,7 @@ def process_option_purchase(payment, user):
             print(f"[OPTION] Unknown option type: {option_type}")
             return False
 
-        patch_resp = requests.patch(f"{API_URL}/api/users", headers=h, cookies=c, json=patch_payload, timeout=20)
+        patch_resp = remnawave.patch_user(patch_payload, timeout=20)
         if not patch_resp.ok:
             print(f"[OPTION] Failed to update user: {patch_resp.status_code} - {patch_resp.text[:200]}")
             return False
@@ -276,15 +254,12 @@ def process_option_purchase(payment, user):
 
 def process_successful_payment(payment, user, tariff):
     """Обработка успешного платежа"""
-    API_URL = os.getenv("API_URL")
-    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
     DEFAULT_SQUAD_ID = os.getenv("DEFAULT_SQUAD_ID")
     
-    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
-    
     try:
         # Если нужно создать новый конфиг, создаем его перед обработкой платежа
-        if hasattr(payment, 'create_new_config') and payment.create_new_config:
+        # user_config_id уже задан, если конфиг создан при предыдущей попытке обработки
+        if getattr(payment, 'create_new_config', False) and not payment.user_config_id:
             from modules.models.user_config import UserConfig
             
             # Генерируем уникальный username для нового аккаунта
@@ -302,11 +277,7 @@ def process_successful_payment(payment, user, tariff):
             # Пытаемся получить username из Remna для существующих конфигов
             for config in existing_configs:
                 try:
-                    resp = requests.get(
-                        f"{API_URL}/api/users/{config.remnawave_uuid}",
-                        headers=headers,
-                        timeout=5
-                    )
+                    resp = remnawave.get_user(config.remnawave_uuid, timeout=5)
                     if resp.status_code == 200:
                         user_data = resp.json().get('response', {})
                         username = user_data.get('username')
@@ -380,12 +351,7 @@ def process_successful_payment(payment, user, tariff):
                 except (ValueError, TypeError):
                     payload_create["telegramId"] = str(user.telegram_id)
             
-            create_resp = requests.post(
-                f"{API_URL}/api/users",
-                headers=headers,
-                json=payload_create,
-                timeout=30
-            )
+            create_resp = remnawave.create_user(payload_create, timeout=30)
             
             if create_resp.status_code not in [200, 201]:
                 print(f"Failed to create new Remna account: {create_resp.status_code}")
@@ -435,7 +401,7 @@ def process_successful_payment(payment, user, tariff):
                 else:
                     print(f"Warning: user_config_id {payment.user_config_id} not found or doesn't belong to user {user.id}, using primary config")
         
-        resp = requests.get(f"{API_URL}/api/users/{remnawave_uuid}", headers=headers)
+        resp = remnawave.get_user(remnawave_uuid)
         if resp.status_code != 200:
             print(
                 f"Failed to get user data: {resp.status_code} (uuid={remnawave_uuid}, payment={getattr(payment,'order_id',None)}, user_id={getattr(user,'id',None)})"
@@ -493,8 +459,7 @@ def process_successful_payment(payment, user, tariff):
         if hasattr(tariff, 'hwid_device_limit') and tariff.hwid_device_limit is not None and tariff.hwid_device_limit > 0:
             patch_payload["hwidDeviceLimit"] = tariff.hwid_device_limit
         
-        h, c = get_remnawave_headers({"Content-Type": "application/json"})
-        patch_resp = requests.patch(f"{API_URL}/api/users", headers=h, cookies=c, json=patch_payload)
+        patch_resp = remnawave.patch_user(patch_payload)
         
         if not patch_resp.ok:
             print(f"Failed to update user: {patch_resp.status_code}")
@@ -561,7 +526,6 @@ def process_successful_payment(payment, user, tariff):
         try:
             cache.delete(f'live_data_{remnawave_uuid}')
             cache.delete(f'nodes_{remnawave_uuid}')
-            cache.delete('all_live_users_map')
         except Exception as e:
             print(f"Warning: cache clear failed for uuid {remnawave_uuid}: {e}")
         
@@ -588,6 +552,156 @@ def process_successful_payment(payment, user, tariff):
         return False
 
 
+def process_balance_topup(payment, user, notify_user=True):
+    """Зачисление пополнения баланса"""
+    current_balance_usd = float(user.balance) if user.balance else 0.0
+    amount_usd = convert_to_usd(payment.amount, payment.currency)
+    user.balance = current_balance_usd + amount_usd
+    payment.status = 'PAID'
+    db.session.commit()
+
+    # Начисляем реферальную комиссию
+    try:
+        add_referral_commission(user, amount_usd, is_tariff_purchase=False)
+        db.session.commit()
+    except Exception as e:
+        print(f"Warning: referral commission failed for payment {payment.order_id}: {e}")
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+
+    # Отправляем уведомление админам
+    try:
+        from modules.notifications import notify_payment
+        notify_payment(payment, user, is_balance_topup=True)
+    except Exception as e:
+        print(f"Error sending payment notification: {e}")
+
+    # Отправляем уведомление пользователю в бот (синхронно: мы уже вне запроса провайдера)
+    if notify_user:
+        try:
+            from modules.notifications import send_user_payment_notification
+            ok, err = send_user_payment_notification(user, is_successful=True, is_balance_topup=True, payment=payment)
+            if not ok and err:
+                print(f"User payment notification failed: {err}")
+        except Exception as e:
+            print(f"Error sending user payment notification: {e}")
+
+    try:
+        cache.delete(f'live_data_{user.remnawave_uuid}')
+    except Exception:
+        pass
+
+    print(f"[PAYMENT] Balance top-up: user_id={user.id}, amount={amount_usd} USD, new_balance={user.balance} USD")
+    return True
+
+
+def process_refund(payment, user, refund_amount, refund_currency):
+    """Возврат платежа: для пополнения баланса списываем сумму, покупка только помечается REFUNDED"""
+    is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
+    if payment.tariff_id is None and not is_option_purchase:
+        # Это было пополнение баланса - вычитаем сумму
+        current_balance_usd = float(user.balance) if user.balance else 0.0
+        refund_amount_usd = convert_to_usd(refund_amount, refund_currency)
+        new_balance = max(0.0, current_balance_usd - refund_amount_usd)  # Не даем балансу уйти в минус
+        user.balance = new_balance
+        payment.status = 'REFUNDED'
+        db.session.commit()
+
+        cache.delete(f'live_data_{user.remnawave_uuid}')
+
+        print(f"[REFUND] ✅ Balance refund processed: user_id={user.id}, refund={refund_amount_usd} USD, new_balance={new_balance} USD")
+    else:
+        # Это была покупка тарифа или опции - отмечаем как refunded (без изменения баланса)
+        payment.status = 'REFUNDED'
+        db.session.commit()
+
+        # TODO: Можно добавить логику отмены тарифа через RemnaWave API, если нужно
+        if is_option_purchase:
+            print(f"[REFUND] ✅ Option purchase refunded: user_id={user.id}, payment_id={payment.id}")
+        else:
+            print(f"[REFUND] ✅ Tariff purchase refunded: user_id={user.id}, tariff_id={payment.tariff_id}")
+    return True
+
+
+# Провайдеры, вебхук которых применяет только покупку тарифа (пополнение баланса и опции не обрабатываются)
+TARIFF_ONLY_PROVIDERS = ('freekassa', 'mulenpay', 'urlpay', 'btcpayserver', 'tribute', 'monobank')
+
+
+def _apply_provider_specific(payment, user, provider):
+    """
+    Особенности отдельных провайдеров, сохраненные при переносе вебхуков в очередь событий.
+    Возвращает результат для apply_payment_effect или NotImplemented - общая обработка.
+    """
+    is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
+    if provider == 'platega' and payment.tariff_id is None:
+        # Пополнение баланса Platega: сумма зачисляется без конвертации
+        payment.status = 'PAID'
+        user.balance = (user.balance or 0) + float(payment.amount)
+        db.session.commit()
+        print(f"[PLATEGA] Balance topup payment {payment.order_id} marked as PAID, balance updated: {user.balance}")
+        return True
+    if provider == 'reconcile' and payment.tariff_id is None:
+        # Ручная проверка статуса (/api/client/me): пополнение с конвертацией, только уведомление пользователю
+        user.balance = (float(user.balance) if user.balance else 0.0) + float(convert_to_usd(payment.amount, payment.currency))
+        payment.status = 'PAID'
+        db.session.commit()
+        try:
+            # Проверка идет inline в запросе клиента - уведомление отправляем в фоне
+            from modules.notifications import send_user_payment_notification_async
+            send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
+        except Exception:
+            pass
+        return True
+    if provider in ('robokassa', 'heleket') and payment.tariff_id is None and not is_option_purchase:
+        # Пополнение баланса отмечается оплаченным без зачисления
+        payment.status = 'PAID'
+        db.session.commit()
+        return None
+    if provider in TARIFF_ONLY_PROVIDERS and payment.tariff_id is None:
+        if provider == 'freekassa':
+            payment.status = 'PAID'
+            db.session.commit()
+        return None
+    return NotImplemented
+
+
+def apply_payment_effect(payment, user, kind='paid', payload=None, provider=None):
+    """
+    Применить подтвержденное событие платежа (вызывается исполнителем modules/payment_events.py).
+    True - применено, None - применять нечего, False - временная ошибка, повторить позже.
+    """
+    payload = payload or {}
+
+    if kind == 'refund':
+        # REFUNDED - уже был частичный возврат, следующий возврат по тому же платежу тоже применяем
+        if payment.status not in ('PAID', 'REFUNDED'):
+            print(f"[REFUND] ⚠️ Payment {payment.order_id} is not PAID (status={payment.status}), skipping refund")
+            return None
+        return process_refund(payment, user, float(payload.get('amount') or 0), payload.get('currency') or 'RUB')
+
+    if payment.status == 'PAID':
+        return None
+
+    result = _apply_provider_specific(payment, user, provider)
+    if result is not NotImplemented:
+        return result
+
+    is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
+    if is_option_purchase:
+        return process_option_purchase(payment, user)
+
+    if payment.tariff_id is None:
+        return process_balance_topup(payment, user, notify_user=payload.get('notify_user', True))
+
+    tariff = db.session.get(Tariff, payment.tariff_id)
+    if not tariff:
+        print(f"Warning: Tariff not found for payment {payment.order_id}, tariff_id={payment.tariff_id}")
+        return None
+    return process_successful_payment(payment, user, tariff)
+
+
 # ============================================================================
 # WEBHOOKS
 # ============================================================================
@@ -609,20 +723,15 @@ def heleket_webhook():
         if not payment:
             return jsonify({"status": "error", "message": "Payment not found"}), 404
         
-        payment.status = status.upper()
         payment.payment_system_id = data.get('payment_id')
-        db.session.commit()
-        
         if status.upper() == 'PAID':
-            user = User.query.get(payment.user_id)
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if user and is_option_purchase:
-                process_option_purchase(payment, user)
-            else:
-                tariff = Tariff.query.get(payment.tariff_id)
-                if user and tariff:
-                    process_successful_payment(payment, user, tariff)
-        
+            # Статус PAID выставит исполнитель после применения платежа
+            enqueue_payment_event(payment, 'heleket', provider_event_id=data.get('uuid') or data.get('payment_id'), payload=data)
+        else:
+            if payment.status != 'PAID':
+                payment.status = status.upper()
+            db.session.commit()
+
         return jsonify({"status": "success"}), 200
         
     except Exception as e:
@@ -664,8 +773,8 @@ def yookassa_webhook():
                 # Возвращаем успех, чтобы YooKassa не повторял запрос
                 return jsonify({"status": "success", "message": "Refund processed (payment not found)"}), 200
             
-            # Обрабатываем возврат только если платеж был успешным
-            if payment.status != 'PAID':
+            # Обрабатываем возврат только если платеж был успешным (или уже частично возвращен)
+            if payment.status not in ('PAID', 'REFUNDED'):
                 print(f"[YOOKASSA] ⚠️ Payment {payment_id} is not PAID (status={payment.status}), skipping refund")
                 return jsonify({"status": "success", "message": "Refund ignored (payment not paid)"}), 200
             
@@ -677,33 +786,11 @@ def yookassa_webhook():
             refund_amount = float(object_data.get('amount', {}).get('value', 0))
             refund_currency = object_data.get('amount', {}).get('currency', 'RUB')
             
-            print(f"[YOOKASSA] 🔄 Processing refund: payment_id={payment_id}, amount={refund_amount} {refund_currency}, user_id={user.id}")
-            
-            # Откатываем изменения
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if payment.tariff_id is None and not is_option_purchase:
-                # Это было пополнение баланса - вычитаем сумму
-                current_balance_usd = float(user.balance) if user.balance else 0.0
-                refund_amount_usd = convert_to_usd(refund_amount, refund_currency)
-                new_balance = max(0.0, current_balance_usd - refund_amount_usd)  # Не даем балансу уйти в минус
-                user.balance = new_balance
-                payment.status = 'REFUNDED'
-                db.session.commit()
-                
-                cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
-                
-                print(f"[YOOKASSA] ✅ Balance refund processed: user_id={user.id}, refund={refund_amount_usd} USD, new_balance={new_balance} USD")
-            else:
-                # Это была покупка тарифа или опции - отмечаем как refunded (без изменения баланса)
-                payment.status = 'REFUNDED'
-                db.session.commit()
-                
-                # TODO: Можно добавить логику отмены тарифа через RemnaWave API, если нужно
-                if is_option_purchase:
-                    print(f"[YOOKASSA] ✅ Option purchase refunded: user_id={user.id}, payment_id={payment.id}")
-                else:
-                    print(f"[YOOKASSA] ✅ Tariff purchase refunded: user_id={user.id}, tariff_id={payment.tariff_id}")
+            print(f"[YOOKASSA] 🔄 Refund queued: payment_id={payment_id}, amount={refund_amount} {refund_currency}, user_id={user.id}")
+            enqueue_payment_event(
+                payment, 'yookassa', kind='refund', provider_event_id=object_data.get('id'),
+                payload={"amount": refund_amount, "currency": refund_currency}
+            )
             
             return jsonify({"status": "success"}), 200
         
@@ -770,60 +857,9 @@ def yookassa_webhook():
                 print(f"[YOOKASSA] User not found for payment {order_id}")
                 return jsonify({"status": "error", "message": "User not found"}), 404
             
-            print(f"[YOOKASSA] Processing payment: order_id={order_id}, user_id={user.id}, tariff_id={payment.tariff_id}, amount={payment.amount} {payment.currency}")
-            
-            # Если это пополнение баланса (tariff_id == None)
-            if payment.tariff_id is None:
-                is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-                if is_option_purchase:
-                    ok = process_option_purchase(payment, user)
-                    if ok:
-                        print(f"[YOOKASSA] ✅ Option purchase successful: user_id={user.id}, payment_id={payment.id}")
-                    else:
-                        print(f"[YOOKASSA] ❌ Failed to process option purchase: user_id={user.id}, payment_id={payment.id}")
-                    return jsonify({"status": "success"}), 200
-
-                current_balance_usd = float(user.balance) if user.balance else 0.0
-                amount_usd = convert_to_usd(payment.amount, payment.currency)
-                new_balance = current_balance_usd + amount_usd
-                user.balance = new_balance
-                payment.status = 'PAID'
-                db.session.commit()
-                
-                # Начисляем реферальную комиссию
-                add_referral_commission(user, amount_usd, is_tariff_purchase=False)
-                db.session.commit()
-                
-                cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
-                
-                # Отправляем уведомление админам
-                try:
-                    from modules.notifications import notify_payment
-                    notify_payment(payment, user, is_balance_topup=True)
-                except Exception as e:
-                    print(f"Error sending payment notification: {e}")
-                
-                # Отправляем уведомление пользователю в бот
-                try:
-                    from modules.notifications import send_user_payment_notification_async
-                    send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-                except Exception as e:
-                    print(f"Error sending user payment notification: {e}")
-                
-                print(f"[YOOKASSA] ✅ Balance top-up successful: user_id={user.id}, amount={amount_usd} USD, new_balance={new_balance} USD")
-            else:
-                # Покупка тарифа
-                tariff = Tariff.query.get(payment.tariff_id)
-                if tariff:
-                    # process_successful_payment уже отправляет уведомления админам и пользователю
-                    success = process_successful_payment(payment, user, tariff)
-                    if success:
-                        print(f"[YOOKASSA] ✅ Tariff purchase successful: user_id={user.id}, tariff_id={tariff.id}, tariff_name={tariff.name}")
-                    else:
-                        print(f"[YOOKASSA] ❌ Failed to process tariff purchase: user_id={user.id}, tariff_id={tariff.id}")
-                else:
-                    print(f"[YOOKASSA] ❌ Warning: Tariff not found for payment {payment.order_id}, tariff_id={payment.tariff_id}")
+            # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+            enqueue_payment_event(payment, 'yookassa', provider_event_id=payment_system_id, payload=object_data)
+            print(f"[YOOKASSA] Payment queued: order_id={order_id}, user_id={user.id}, tariff_id={payment.tariff_id}, amount={payment.amount} {payment.currency}")
         else:
             # Логируем другие статусы для отладки
             print(f"[YOOKASSA] Payment status: {status} (not processing, waiting for 'succeeded')")
@@ -883,14 +919,8 @@ def yoomoney_webhook():
             return jsonify({"status": "error", "message": "Missing label"}), 400
 
         # Проверка подписи
-        s = PaymentSetting.query.first()
-        secret = ""
-        if s and getattr(s, 'yoomoney_notification_secret', None):
-            try:
-                from modules.models.payment import decrypt_key as decrypt_key_model
-                secret = (decrypt_key_model(getattr(s, 'yoomoney_notification_secret', None)) or "").strip()
-            except Exception:
-                secret = ""
+        s = get_payment_settings()
+        secret = ((s.yoomoney_notification_secret if s else "") or "").strip()
 
         if secret:
             base = f"{notification_type}&{operation_id}&{amount}&{currency}&{dt}&{sender}&{codepro}&{secret}&{label}"
@@ -923,65 +953,15 @@ def yoomoney_webhook():
         # Сохраняем operation_id
         if operation_id:
             payment.payment_system_id = operation_id
-            db.session.commit()
 
         user = User.query.get(payment.user_id)
         if not user:
-            return jsonify({"status": "success", "message": "User not found"}), 200
-
-        # Пополнение баланса
-        if payment.tariff_id is None:
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if is_option_purchase:
-                ok = process_option_purchase(payment, user)
-                return jsonify({"status": "success", "processed": bool(ok)}), 200
-
-            current_balance_usd = float(user.balance) if user.balance else 0.0
-            amount_usd = convert_to_usd(payment.amount, payment.currency)
-            user.balance = current_balance_usd + amount_usd
-            payment.status = 'PAID'
             db.session.commit()
+            return jsonify({"status": "success", "message": "User not found"}), 200
 
-            # Рефералка
-            try:
-                add_referral_commission(user, amount_usd, is_tariff_purchase=False)
-                db.session.commit()
-            except Exception as e:
-                print(f"[YOOMONEY] Warning: referral commission failed: {e}")
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
-
-            # Уведомления
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(payment, user, is_balance_topup=True)
-            except Exception as e:
-                print(f"[YOOMONEY] Error sending payment notification: {e}")
-
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(user, is_successful=True, is_balance_topup=True, payment=payment)
-            except Exception as e:
-                print(f"[YOOMONEY] Error sending user payment notification: {e}")
-
-            try:
-                cache.delete(f'live_data_{user.remnawave_uuid}')
-                cache.delete('all_live_users_map')
-            except Exception:
-                pass
-
-            return jsonify({"status": "success"}), 200
-
-        # Покупка тарифа
-        tariff = Tariff.query.get(payment.tariff_id)
-        if not tariff:
-            return jsonify({"status": "success", "message": "Tariff not found"}), 200
-
-        # process_successful_payment сам выставит статус и уведомления
-        ok = process_successful_payment(payment, user, tariff)
-        return jsonify({"status": "success", "processed": bool(ok)}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(payment, 'yoomoney', provider_event_id=operation_id, payload=data)
+        return jsonify({"status": "success"}), 200
 
     except Exception as e:
         print(f"[YOOMONEY] Error: {e}")
@@ -1005,8 +985,8 @@ def telegram_webhook():
             order_id = pre_checkout.get('invoice_payload')
             query_id = pre_checkout.get('id')
             
-            s = PaymentSetting.query.first()
-            bot_token = decrypt_key(s.telegram_bot_token) if s else None
+            s = get_payment_settings()
+            bot_token = s.telegram_bot_token if s else None
             
             if not bot_token:
                 return jsonify({"ok": True}), 200
@@ -1039,51 +1019,12 @@ def telegram_webhook():
             if not p or p.status == 'PAID':
                 return jsonify({"ok": True}), 200
             
-            u = db.session.get(User, p.user_id)
-            if not u:
-                return jsonify({"ok": True}), 200
-            
-        # Пополнение баланса
-        if p.tariff_id is None:
-            is_option_purchase = bool(getattr(p, 'description', None)) and str(p.description).startswith('OPTION:')
-            if is_option_purchase:
-                process_option_purchase(p, u)
-                return jsonify({"ok": True}), 200
-
-            current_balance = float(u.balance) if u.balance else 0.0
-            amount_usd = convert_to_usd(p.amount, p.currency)
-            u.balance = current_balance + amount_usd
-            p.status = 'PAID'
-            db.session.commit()
-            
-            # Начисляем реферальную комиссию
-            add_referral_commission(u, amount_usd, is_tariff_purchase=False)
-            db.session.commit()
-            
-            # Отправляем уведомление админам
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(p, u, is_balance_topup=True)
-            except Exception as e:
-                print(f"Error sending payment notification: {e}")
-            
-            # Отправляем уведомление пользователю в бот
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(u, is_successful=True, is_balance_topup=True, payment=p)
-            except Exception as e:
-                print(f"Error sending user payment notification: {e}")
-            
-            cache.delete(f'live_data_{u.remnawave_uuid}')
-            return jsonify({"ok": True}), 200
-        
-        # Покупка тарифа
-        t = db.session.get(Tariff, p.tariff_id)
-        if not t:
-            return jsonify({"ok": True}), 200
-        
-        # process_successful_payment уже отправляет уведомление пользователю
-        process_successful_payment(p, u, t)
+            # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+            enqueue_payment_event(
+                p, 'telegram_stars',
+                provider_event_id=successful_payment.get('telegram_payment_charge_id'),
+                payload=successful_payment
+            )
         
         return jsonify({"ok": True}), 200
         
@@ -1126,56 +1067,32 @@ def process_telegram_payment_internal():
         if not u:
             return jsonify({"success": False, "message": "User not found"}), 404
         
-        # Пополнение баланса
+        # Применяем сразу: бот показывает пользователю результат из ответа.
+        # Уведомление о пополнении бот отправляет сам.
+        event = enqueue_payment_event(p, 'telegram_stars', payload={"telegram_id": telegram_id, "notify_user": False}, inline=True)
+        db.session.refresh(p)
+        if p.status != 'PAID':
+            if event.status in ('queued', 'processing'):
+                return jsonify({"success": True, "message": "Платеж обрабатывается"}), 200
+            return jsonify({"success": False, "message": event.last_error or "Payment processing failed"}), 500
+        
         if p.tariff_id is None:
             is_option_purchase = bool(getattr(p, 'description', None)) and str(p.description).startswith('OPTION:')
             if is_option_purchase:
-                ok = process_option_purchase(p, u)
-                return jsonify({"success": True, "processed": bool(ok)}), 200
-
-            current_balance = float(u.balance) if u.balance else 0.0
-            amount_usd = convert_to_usd(p.amount, p.currency)
-            u.balance = current_balance + amount_usd
-            p.status = 'PAID'
-            db.session.commit()
-            
-            # Начисляем реферальную комиссию
-            try:
-                add_referral_commission(u, amount_usd, is_tariff_purchase=False)
-                db.session.commit()
-            except Exception as e:
-                print(f"[TELEGRAM-INTERNAL] Referral commission error: {e}")
-            
-            # Отправляем уведомление админам
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(p, u, is_balance_topup=True)
-            except Exception as e:
-                print(f"[TELEGRAM-INTERNAL] Notification error: {e}")
-            
-            cache.delete(f'live_data_{u.remnawave_uuid}')
-            print(f"[TELEGRAM-INTERNAL] Balance topped up: user={u.id}, amount={amount_usd} USD")
+                return jsonify({"success": True, "processed": True}), 200
+            print(f"[TELEGRAM-INTERNAL] Balance topped up: user={u.id}, amount={p.amount} {p.currency}")
             return jsonify({
                 "success": True, 
                 "message": f"Баланс пополнен на {p.amount} {p.currency}"
             }), 200
         
-        # Покупка тарифа
         t = db.session.get(Tariff, p.tariff_id)
-        if not t:
-            return jsonify({"success": False, "message": "Tariff not found"}), 404
-        
-        # process_successful_payment обработает платеж
-        try:
-            process_successful_payment(p, u, t)
-            print(f"[TELEGRAM-INTERNAL] Tariff activated: user={u.id}, tariff={t.name}")
-            return jsonify({
-                "success": True, 
-                "message": f"Подписка '{t.name}' активирована!"
-            }), 200
-        except Exception as e:
-            print(f"[TELEGRAM-INTERNAL] Tariff activation error: {e}")
-            return jsonify({"success": False, "message": str(e)}), 500
+        tariff_name = t.name if t else ""
+        print(f"[TELEGRAM-INTERNAL] Tariff activated: user={u.id}, tariff={tariff_name}")
+        return jsonify({
+            "success": True, 
+            "message": f"Подписка '{tariff_name}' активирована!"
+        }), 200
         
     except Exception as e:
         print(f"[TELEGRAM-INTERNAL] Error: {e}")
@@ -1200,15 +1117,9 @@ def freekassa_webhook():
             return "NO", 404
         
         if payment.status != 'PAID':
-            payment.status = 'PAID'
             payment.payment_system_id = data.get('intid')
-            db.session.commit()
-            
-            user = User.query.get(payment.user_id)
-            tariff = Tariff.query.get(payment.tariff_id)
-            
-            if user and tariff:
-                process_successful_payment(payment, user, tariff)
+            # Статус PAID выставит исполнитель событий после применения платежа
+            enqueue_payment_event(payment, 'freekassa', provider_event_id=data.get('intid'), payload=data)
         
         return "YES", 200
         
@@ -1233,17 +1144,8 @@ def robokassa_webhook():
             return "NO", 404
         
         if payment.status != 'PAID':
-            payment.status = 'PAID'
-            db.session.commit()
-            
-            user = User.query.get(payment.user_id)
-            is_option_purchase = bool(getattr(payment, 'description', None)) and str(payment.description).startswith('OPTION:')
-            if user and is_option_purchase:
-                process_option_purchase(payment, user)
-            else:
-                tariff = Tariff.query.get(payment.tariff_id)
-                if user and tariff:
-                    process_successful_payment(payment, user, tariff)
+            # Статус PAID выставит исполнитель событий после применения платежа
+            enqueue_payment_event(payment, 'robokassa', provider_event_id=order_id, payload=data)
         
         return f"OK{order_id}", 200
         
@@ -1280,53 +1182,8 @@ def crystalpay_webhook():
         if not p or p.status == 'PAID':
             return jsonify({"error": False}), 200
         
-        u = db.session.get(User, p.user_id)
-        if not u:
-            return jsonify({"error": False}), 200
-        
-        # Если это пополнение баланса (tariff_id == None)
-        if p.tariff_id is None:
-            is_option_purchase = bool(getattr(p, 'description', None)) and str(p.description).startswith('OPTION:')
-            if is_option_purchase:
-                process_option_purchase(p, u)
-                return jsonify({"error": False}), 200
-
-            current_balance_usd = float(u.balance) if u.balance else 0.0
-            amount_usd = convert_to_usd(p.amount, p.currency)
-            u.balance = current_balance_usd + amount_usd
-            p.status = 'PAID'
-            db.session.commit()
-            
-            # Начисляем реферальную комиссию
-            add_referral_commission(u, amount_usd, is_tariff_purchase=False)
-            db.session.commit()
-            
-            # Отправляем уведомление админам
-            try:
-                from modules.notifications import notify_payment
-                notify_payment(p, u, is_balance_topup=True)
-            except Exception as e:
-                print(f"Error sending payment notification: {e}")
-            
-            # Отправляем уведомление пользователю в бот
-            try:
-                from modules.notifications import send_user_payment_notification_async
-                send_user_payment_notification_async(u, is_successful=True, is_balance_topup=True, payment=p)
-            except Exception as e:
-                print(f"Error sending user payment notification: {e}")
-            
-            cache.delete(f'live_data_{u.remnawave_uuid}')
-            cache.delete('all_live_users_map')
-            
-            return jsonify({"error": False}), 200
-        
-        # Обычная покупка тарифа
-        t = db.session.get(Tariff, p.tariff_id)
-        if not t:
-            return jsonify({"error": False}), 200
-        
-        # process_successful_payment уже отправляет уведомление пользователю
-        process_successful_payment(p, u, t)
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'crystalpay', provider_event_id=d.get('id'), payload=d)
         
         return jsonify({"error": False}), 200
         
@@ -1414,13 +1271,12 @@ def platega_webhook():
         verified_status = None
         if transaction_id:
             try:
-                from modules.models.payment import PaymentSetting, decrypt_key
                 import requests
                 
-                settings = PaymentSetting.query.first()
+                settings = get_payment_settings()
                 if settings:
-                    platega_key = decrypt_key(getattr(settings, 'platega_api_key', None)) if settings else None
-                    platega_merchant_raw = decrypt_key(getattr(settings, 'platega_merchant_id', None)) if settings else None
+                    platega_key = settings.platega_api_key if settings else None
+                    platega_merchant_raw = settings.platega_merchant_id if settings else None
                     
                     if platega_key and platega_merchant_raw:
                         # Обработка Merchant ID (убираем префикс 'live_' если есть)
@@ -1483,31 +1339,10 @@ def platega_webhook():
             print(f"[PLATEGA] Payment {p.order_id} already processed")
             return jsonify({"status": "ok"}), 200
         
-        # Получаем пользователя и тариф
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id) if p.tariff_id else None
-        
-        if not u:
-            print(f"[PLATEGA] User not found for payment {p.order_id}")
-            return jsonify({"status": "ok"}), 200
-        
-        # Если это пополнение баланса (нет тарифа), обрабатываем отдельно
-        if not t:
-            # Для пополнения баланса обновляем статус и пополняем баланс
-            p.status = 'PAID'
-            # Пополняем баланс пользователя
-            u.balance = (u.balance or 0) + float(p.amount)
-            db.session.commit()
-            print(f"[PLATEGA] Balance topup payment {p.order_id} marked as PAID, balance updated: {u.balance}")
-            return jsonify({"status": "ok"}), 200
-        
-        # Обрабатываем успешный платеж за тариф
-        if process_successful_payment(p, u, t):
-            print(f"[PLATEGA] Successfully processed payment {p.order_id}")
-            return jsonify({"status": "ok"}), 200
-        else:
-            print(f"[PLATEGA] Failed to process payment {p.order_id}")
-            return jsonify({"status": "ok"}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'platega', provider_event_id=transaction_id, payload=webhook_data)
+        print(f"[PLATEGA] Payment {p.order_id} queued")
+        return jsonify({"status": "ok"}), 200
         
     except Exception as e:
         print(f"[PLATEGA] Error: {e}")
@@ -1541,16 +1376,9 @@ def mulenpay_webhook():
         if not p or p.status == 'PAID':
             return jsonify({}), 200
         
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id)
-        
-        if not u or not t:
-            return jsonify({}), 200
-        
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'mulenpay', provider_event_id=webhook_data.get('id'), payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[MULENPAY] Error: {e}")
@@ -1582,16 +1410,9 @@ def urlpay_webhook():
         if not p or p.status == 'PAID':
             return jsonify({}), 200
         
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id)
-        
-        if not u or not t:
-            return jsonify({}), 200
-        
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'urlpay', provider_event_id=webhook_data.get('id'), payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[URLPAY] Error: {e}")
@@ -1627,16 +1448,9 @@ def btcpayserver_webhook():
         if not p or p.status == 'PAID':
             return jsonify({}), 200
         
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id)
-        
-        if not u or not t:
-            return jsonify({}), 200
-        
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'btcpayserver', provider_event_id=webhook_data.get('deliveryId') or invoice_id, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[BTCPAYSERVER] Error: {e}")
@@ -1668,16 +1482,9 @@ def tribute_webhook():
         if not p or p.status == 'PAID':
             return jsonify({}), 200
         
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id)
-        
-        if not u or not t:
-            return jsonify({}), 200
-        
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'tribute', provider_event_id=webhook_data.get('id'), payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[TRIBUTE] Error: {e}")
@@ -1706,16 +1513,9 @@ def monobank_webhook():
         if not p or p.status == 'PAID':
             return jsonify({}), 200
         
-        u = db.session.get(User, p.user_id)
-        t = db.session.get(Tariff, p.tariff_id)
-        
-        if not u or not t:
-            return jsonify({}), 200
-        
-        if process_successful_payment(p, u, t):
-            return jsonify({}), 200
-        else:
-            return jsonify({}), 200
+        # Пополнение баланса, покупку опции или тарифа применит исполнитель событий
+        enqueue_payment_event(p, 'monobank', provider_event_id=invoice_id, payload=webhook_data)
+        return jsonify({}), 200
         
     except Exception as e:
         print(f"[MONOBANK] Error: {e}")
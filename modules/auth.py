@@ -11,7 +11,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Импорт центрального модуля
-from modules.core import get_app, get_db, get_bcrypt
+from modules.core import get_app, get_db, get_bcrypt, get_cache
 
 # Получаем основной экземпляр Flask и расширения из центрального модуля
 app = get_app()
@@ -20,6 +20,113 @@ bcrypt = get_bcrypt()
 
 # Импорт модели User из modules.user
 from modules.user import User
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+
+# ============================================================================
+# КЕШ ИДЕНТИЧНОСТИ ПОЛЬЗОВАТЕЛЯ
+# ============================================================================
+# Проверка токена не читает User из БД на каждый запрос: основные поля
+# пользователя хранятся в общем кеше (Redis) AUTH_IDENTITY_TTL секунд.
+# Любое изменение этих полей через ORM (блокировка, роль, баланс, оплата в вебхуке)
+# сбрасывает запись после commit.
+
+IDENTITY_TTL = int(os.getenv('AUTH_IDENTITY_TTL', 60))
+IDENTITY_FIELDS = (
+    'id', 'email', 'role', 'is_blocked', 'block_reason', 'blocked_at',
+    'remnawave_uuid', 'preferred_lang', 'preferred_currency', 'balance',
+    'referral_code', 'telegram_id', 'telegram_username', 'trial_used',
+    'password_hash',  # /api/client/me отдает его фронтенду (признак "пароль задан")
+)
+IDENTITY_DIRTY_KEY = 'auth_identity_dirty'
+
+
+class CachedUser:
+    """
+    Снимок полей User из кеша (только для чтения).
+    Поля не из IDENTITY_FIELDS читаются из БД при первом обращении.
+    Для изменения пользователя используйте load() - он вернет объект модели.
+    """
+
+    def __init__(self, data, user=None):
+        self.__dict__.update(data)
+        self._user = user
+
+    def load(self):
+        """Объект User из текущей сессии БД"""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        user = self.load()
+        if user is None:
+            raise AttributeError(name)
+        return getattr(user, name)
+
+
+def _identity_key(user_id):
+    return f'auth_identity_{user_id}'
+
+
+def get_identity(user_id):
+    """CachedUser по id (из кеша, при промахе - из БД) или None"""
+    cache = get_cache()
+    try:
+        data = cache.get(_identity_key(user_id))
+    except Exception:
+        data = None
+    if data is not None:
+        return CachedUser(data)
+
+    user = db.session.get(User, user_id)
+    if not user:
+        return None
+    data = {field: getattr(user, field, None) for field in IDENTITY_FIELDS}
+    try:
+        cache.set(_identity_key(user_id), data, timeout=IDENTITY_TTL)
+    except Exception:
+        pass
+    return CachedUser(data, user)
+
+
+def invalidate_identity(user_id):
+    """Сбросить кеш идентичности пользователя"""
+    try:
+        get_cache().delete(_identity_key(user_id))
+    except Exception as e:
+        print(f"Warning: failed to invalidate auth identity {user_id}: {e}")
+
+
+@event.listens_for(User, 'after_update')
+def _mark_identity_dirty(mapper, connection, target):
+    state = db.inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in IDENTITY_FIELDS):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(IDENTITY_DIRTY_KEY, set()).add(target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _mark_identity_deleted(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(IDENTITY_DIRTY_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_dirty_identities(session):
+    for user_id in session.info.pop(IDENTITY_DIRTY_KEY, ()):
+        invalidate_identity(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_dirty_identities(session):
+    session.info.pop(IDENTITY_DIRTY_KEY, None)
+
 
 # Функции аутентификации
 def create_local_jwt(user_id):
@@ -27,6 +134,18 @@ def create_local_jwt(user_id):
     token = jwt.encode(payload, app.config['JWT_SECRET_KEY'], algorithm="HS256")
     return token
 
+def _user_id_from_token():
+    """id пользователя из заголовка Authorization (без обращения к БД) или None"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+    try:
+        local_token = auth_header.split(" ")[1]
+        payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+        return int(payload['sub'])
+    except Exception:
+        return None
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -36,7 +155,7 @@ def admin_required(f):
         try:
             local_token = auth_header.split(" ")[1]
             payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-            user = db.session.get(User, int(payload['sub']))
+            user = get_identity(int(payload['sub']))
             if not user or user.role != 'ADMIN':
                 return jsonify({"message": "Forbidden"}), 403
             kwargs['current_admin'] = user
@@ -46,13 +165,21 @@ def admin_required(f):
     return decorated_function
 
 def get_user_from_token():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
+    """Объект User из токена (для эндпоинтов, которые изменяют пользователя)"""
+    user_id = _user_id_from_token()
+    if user_id is None:
         return None
     try:
-        local_token = auth_header.split(" ")[1]
-        payload = jwt.decode(local_token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-        user = db.session.get(User, int(payload['sub']))
-        return user
+        return db.session.get(User, user_id)
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+def get_identity_from_token():
+    """CachedUser из токена - для чтения без запроса к БД"""
+    user_id = _user_id_from_token()
+    if user_id is None:
+        return None
+    try:
+        return get_identity(user_id)
+    except Exception:
+        return None
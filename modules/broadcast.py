@@ -0,0 +1,566 @@
+"""
+Ручная рассылка email / Telegram (/api/admin/broadcast)
+
+Рассылка сохраняется как задание (modules/models/broadcast.py) и выполняется
+фоновым потоком с ограниченным пулом отправки вместо потока на каждого получателя:
+- BROADCAST_WORKERS         - размер пула отправки (по умолчанию 8)
+- BROADCAST_TELEGRAM_RATE   - глобальный лимит сообщений Telegram в секунду (по умолчанию 25,
+                              у Telegram ~30/с на бота; при CACHE_TYPE=redis лимит общий для всех процессов)
+- BROADCAST_BATCH_SIZE      - сколько получателей обрабатывается между сохранениями прогресса (по умолчанию 100)
+
+При ответе 429 Telegram отправка в этот чат повторяется через retry_after.
+Задание, исполнитель которого умер (нет heartbeat дольше BROADCAST_STALE_SECONDS),
+подхватывается заново с сохраненной позиции.
+"""
+
+import os
+import io
+import json
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+import requests
+
+from modules.core import get_app, get_db, get_cache, get_mail, get_redis
+
+
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 8))
+BROADCAST_TELEGRAM_RATE = float(os.getenv("BROADCAST_TELEGRAM_RATE", 25))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", 100))
+BROADCAST_STALE_SECONDS = int(os.getenv("BROADCAST_STALE_SECONDS", 300))
+MAX_STORED_ERRORS = 100
+
+# Общая сессия для Bot API (keep-alive соединения к api.telegram.org)
+_telegram_session = requests.Session()
+_telegram_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(BROADCAST_WORKERS, 10)))
+
+
+# ============================================================================
+# ОГРАНИЧЕНИЕ СКОРОСТИ
+# ============================================================================
+
+class RateLimiter:
+    """
+    Token bucket на процесс + (если доступен Redis) общий счетчик в секундном окне,
+    чтобы несколько worker'ов вместе не превышали лимит Telegram.
+    """
+
+    def __init__(self, rate, redis_key="broadcast:telegram_rate"):
+        self.rate = max(float(rate), 1.0)
+        self.redis_key = redis_key
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _acquire_local(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _acquire_global(self, r):
+        while True:
+            now = time.time()
+            key = f"{self.redis_key}:{int(now)}"
+            pipe = r.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, 2)
+            count = pipe.execute()[0]
+            if count <= self.rate:
+                return
+            time.sleep(max(1 - (now % 1), 0.01))
+
+    def acquire(self):
+        self._acquire_local()
+        r = get_redis()
+        if r is not None:
+            try:
+                self._acquire_global(r)
+            except Exception as e:
+                print(f"Warning: global Telegram rate limit unavailable: {e}")
+
+
+telegram_rate_limiter = RateLimiter(BROADCAST_TELEGRAM_RATE)
+
+
+# ============================================================================
+# TELEGRAM BOT API
+# ============================================================================
+
+def _telegram_post(bot_token, method, max_retries=0, rate_limiter=None, timeout=10, **kwargs):
+    """
+    POST в Bot API. При 429 ждем retry_after и повторяем (до max_retries раз).
+    """
+    url = f"https://api.telegram.org/bot{bot_token}/{method}"
+    attempt = 0
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire()
+        response = _telegram_session.post(url, timeout=timeout, **kwargs)
+        if response.status_code != 429 or attempt >= max_retries:
+            return response
+        try:
+            retry_after = int(((response.json() or {}).get('parameters') or {}).get('retry_after') or 1)
+        except Exception:
+            retry_after = 1
+        attempt += 1
+        time.sleep(min(retry_after, 60))
+        # Файлы надо отмотать в начало перед повторной отправкой
+        for f in (kwargs.get('files') or {}).values():
+            if hasattr(f, 'seek'):
+                f.seek(0)
+
+
+# ============================================================================
+# ПОВТОРНОЕ ИСПОЛЬЗОВАНИЕ ЗАГРУЖЕННЫХ ФОТО (file_id)
+# ============================================================================
+
+# file_id привязан к боту, поэтому ключ включает токен (в виде хэша)
+PHOTO_FILE_ID_TTL = 30 * 86400
+_photo_file_ids = {}
+_photo_file_ids_lock = threading.Lock()
+# id(bytes) -> (bytes, sha256): хэш большого изображения считаем один раз на рассылку,
+# ссылка на сам объект не дает переиспользовать его id
+_photo_digests = {}
+
+
+def _photo_digest(photo_bytes):
+    entry = _photo_digests.get(id(photo_bytes))
+    if entry and entry[0] is photo_bytes:
+        return entry[1]
+    digest = hashlib.sha256(photo_bytes).hexdigest()
+    with _photo_file_ids_lock:
+        if len(_photo_digests) >= 8:
+            _photo_digests.pop(next(iter(_photo_digests)))
+        _photo_digests[id(photo_bytes)] = (photo_bytes, digest)
+    return digest
+
+
+def _photo_file_id_key(bot_token, photo_bytes):
+    token_hash = hashlib.sha256((bot_token or '').encode()).hexdigest()[:16]
+    return f"tg_photo_file_id:{token_hash}:{_photo_digest(photo_bytes)}"
+
+
+def read_photo_bytes(photo_file):
+    """Байты изображения из bytes / файлового объекта (FileStorage, BytesIO...)"""
+    if photo_file is None or isinstance(photo_file, bytes):
+        return photo_file
+    if hasattr(photo_file, 'seek'):
+        photo_file.seek(0)
+    data = photo_file.read()
+    if hasattr(photo_file, 'seek'):
+        photo_file.seek(0)
+    return data
+
+
+def get_photo_file_id(bot_token, photo_bytes):
+    """file_id ранее загруженного этим ботом изображения или None"""
+    if not photo_bytes:
+        return None
+    key = _photo_file_id_key(bot_token, photo_bytes)
+    file_id = _photo_file_ids.get(key)
+    if file_id:
+        return file_id
+    try:
+        file_id = get_cache().get(key)
+    except Exception:
+        file_id = None
+    if file_id:
+        with _photo_file_ids_lock:
+            _photo_file_ids[key] = file_id
+    return file_id
+
+
+def remember_photo_file_id(bot_token, photo_bytes, file_id):
+    """Запомнить file_id загруженного изображения (в процессе и в общем кэше)"""
+    if not photo_bytes:
+        return
+    key = _photo_file_id_key(bot_token, photo_bytes)
+    with _photo_file_ids_lock:
+        if file_id:
+            if len(_photo_file_ids) >= 256:
+                _photo_file_ids.pop(next(iter(_photo_file_ids)))
+            _photo_file_ids[key] = file_id
+        else:
+            _photo_file_ids.pop(key, None)
+    try:
+        if file_id:
+            get_cache().set(key, file_id, timeout=PHOTO_FILE_ID_TTL)
+        else:
+            get_cache().delete(key)
+    except Exception:
+        pass
+
+
+def extract_photo_file_id(result):
+    """file_id самого большого размера фото из ответа sendPhoto"""
+    try:
+        sizes = (result.get('result') or {}).get('photo') or []
+        return sizes[-1].get('file_id') if sizes else None
+    except Exception:
+        return None
+
+
+# Фрагменты описания ошибки 400, означающие недействительный file_id (а не ошибку конкретного чата)
+_BAD_FILE_ID_ERRORS = ('file identifier', 'file_id', 'file reference', 'file_reference')
+
+
+def is_bad_file_id_error(response):
+    """Ответ 400 sendPhoto вызван недействительным file_id"""
+    if response.status_code != 400:
+        return False
+    try:
+        description = (response.json().get('description') or '').lower()
+    except Exception:
+        return False
+    return any(fragment in description for fragment in _BAD_FILE_ID_ERRORS)
+
+
+def send_telegram_photo(bot_token, chat_id, photo, data=None, max_retries=0, rate_limiter=None, filename='photo.jpg'):
+    """
+    sendPhoto с повторным использованием file_id: изображение загружается
+    один раз, дальше отправляется по file_id (килобайты вместо мегабайт).
+    data - остальные поля запроса (caption, parse_mode, reply_markup в виде строки JSON).
+    """
+    photo_bytes = read_photo_bytes(photo)
+    fields = dict(data or {})
+    fields["chat_id"] = chat_id
+
+    file_id = get_photo_file_id(bot_token, photo_bytes)
+    if file_id:
+        response = _telegram_post(bot_token, "sendPhoto", max_retries, rate_limiter, data={**fields, "photo": file_id})
+        # Остальные 400 (чат не найден, пользователь удален и т.п.) относятся к чату - file_id не трогаем
+        if not is_bad_file_id_error(response):
+            return response
+        # file_id больше не действителен - загружаем файл заново
+        remember_photo_file_id(bot_token, photo_bytes, None)
+
+    files = {'photo': (filename, io.BytesIO(photo_bytes))}
+    response = _telegram_post(bot_token, "sendPhoto", max_retries, rate_limiter, timeout=30, files=files, data=fields)
+    if response.status_code == 200:
+        remember_photo_file_id(bot_token, photo_bytes, extract_photo_file_id(response.json()))
+    return response
+
+
+def send_telegram_message(bot_token, chat_id, text, photo_url=None, photo_file=None, max_retries=0, rate_limiter=None):
+    """
+    Отправить сообщение в Telegram через Bot API
+    Если указано фото, отправляет фото с caption (одно сообщение)
+    """
+    try:
+        if photo_url or photo_file:
+            # Обрезаем caption до 1024 символов (лимит Telegram)
+            caption = text[:1024] if len(text) > 1024 else text
+
+            if photo_file:
+                # Загружаем файл (или отправляем по file_id, если он уже загружался)
+                data = {
+                    "caption": caption,
+                    "parse_mode": "HTML"
+                }
+                filename = getattr(photo_file, 'filename', None) or 'photo.jpg'
+                response = send_telegram_photo(bot_token, chat_id, photo_file, data, max_retries, rate_limiter, filename=filename)
+            else:
+                # Используем URL
+                payload = {
+                    "chat_id": chat_id,
+                    "photo": photo_url,
+                    "caption": caption,
+                    "parse_mode": "HTML"
+                }
+                response = _telegram_post(bot_token, "sendPhoto", max_retries, rate_limiter, timeout=30, json=payload)
+        else:
+            # Отправляем текстовое сообщение
+            payload = {
+                "chat_id": chat_id,
+                "text": text,
+                "parse_mode": "HTML"
+            }
+            response = _telegram_post(bot_token, "sendMessage", max_retries, rate_limiter, json=payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            message_id = result.get('result', {}).get('message_id')
+            return True, message_id
+        else:
+            error_data = response.json() if response.content else {}
+            error_msg = error_data.get('description', f'HTTP {response.status_code}')
+            return False, error_msg
+    except Exception as e:
+        return False, str(e)
+
+
+def pin_telegram_message(bot_token, chat_id, message_id, max_retries=0, rate_limiter=None):
+    """Закрепить сообщение в Telegram"""
+    try:
+        payload = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "disable_notification": False
+        }
+        response = _telegram_post(bot_token, "pinChatMessage", max_retries, rate_limiter, json=payload)
+        if response.status_code == 200:
+            return True, None
+        else:
+            error_data = response.json() if response.content else {}
+            error_msg = error_data.get('description', f'HTTP {response.status_code}')
+            return False, error_msg
+    except Exception as e:
+        return False, str(e)
+
+
+def get_broadcast_bot_token(bot_type):
+    """Токен бота для рассылки: 'new' - CLIENT_BOT_V2_TOKEN, иначе CLIENT_BOT_TOKEN"""
+    old_bot_token = os.getenv("CLIENT_BOT_TOKEN")
+    new_bot_token = os.getenv("CLIENT_BOT_V2_TOKEN") or os.getenv("CLIENT_BOT_TOKEN")
+    return new_bot_token if bot_type == 'new' else old_bot_token
+
+
+# ============================================================================
+# ЗАДАНИЯ РАССЫЛКИ
+# ============================================================================
+
+def enqueue_broadcast(recipient_ids, message, subject='', broadcast_type='email', bot_type='old',
+                      recipient_type=None, pin_message=False, photo=None, photo_filename=None, created_by=None):
+    """Сохранить задание рассылки и запустить исполнителя. Возвращает BroadcastJob"""
+    from modules.models.broadcast import BroadcastJob
+
+    db = get_db()
+    job = BroadcastJob(
+        status='queued',
+        broadcast_type=broadcast_type,
+        bot_type=bot_type,
+        recipient_type=recipient_type,
+        subject=subject,
+        message=message,
+        pin_message=bool(pin_message),
+        photo=photo,
+        photo_filename=photo_filename,
+        recipient_ids=json.dumps(list(recipient_ids)),
+        total=len(recipient_ids),
+        created_by=created_by
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    start_broadcast_worker()
+    return job
+
+
+def cancel_broadcast(job_id):
+    """Отменить задание (исполнитель остановится после текущей пачки)"""
+    from modules.models.broadcast import BroadcastJob
+
+    db = get_db()
+    updated = db.session.query(BroadcastJob).filter(
+        BroadcastJob.id == job_id,
+        BroadcastJob.status.in_(('queued', 'running'))
+    ).update({"status": 'cancelled', "finished_at": datetime.now(timezone.utc)}, synchronize_session=False)
+    db.session.commit()
+    return updated == 1
+
+
+def _claim_next_job():
+    """Атомарно забрать следующее задание (queued или зависшее running)"""
+    from modules.models.broadcast import BroadcastJob
+
+    db = get_db()
+    now = datetime.now(timezone.utc)
+    stale_before = now - timedelta(seconds=BROADCAST_STALE_SECONDS)
+    claimable = db.or_(
+        BroadcastJob.status == 'queued',
+        db.and_(BroadcastJob.status == 'running', BroadcastJob.heartbeat_at < stale_before)
+    )
+    candidates = db.session.query(BroadcastJob.id).filter(claimable).order_by(BroadcastJob.id).limit(5).all()
+    for (job_id,) in candidates:
+        updated = db.session.query(BroadcastJob).filter(BroadcastJob.id == job_id, claimable).update(
+            {"status": 'running', "heartbeat_at": now}, synchronize_session=False
+        )
+        db.session.commit()
+        if updated == 1:
+            return job_id
+    return None
+
+
+def _send_email_task(app, email, subject, html):
+    from flask_mail import Message
+    with app.app_context():
+        try:
+            m = Message(subject, recipients=[email])
+            m.html = html
+            get_mail().send(m)
+            return 'email', True, email
+        except Exception as e:
+            print(f"Failed to send email to {email}: {e}")
+            return 'email', False, email
+
+
+def _send_telegram_task(bot_token, user_id, email, telegram_id, text, photo, pin):
+    success, result = send_telegram_message(
+        bot_token, telegram_id, text, photo_file=photo,
+        max_retries=3, rate_limiter=telegram_rate_limiter
+    )
+    if not success:
+        return 'telegram', False, {'telegram_id': telegram_id, 'email': email, 'error': result}
+
+    if pin and result:
+        pin_success, pin_error = pin_telegram_message(
+            bot_token, telegram_id, result, max_retries=3, rate_limiter=telegram_rate_limiter
+        )
+        if not pin_success:
+            # Логируем ошибку закрепления, но не считаем это критичной ошибкой
+            print(f"Failed to pin message for user {telegram_id}: {pin_error}")
+    return 'telegram', True, telegram_id
+
+
+def _run_job(app, job_id):
+    """Выполнить задание с сохраненной позиции"""
+    from modules.models.broadcast import BroadcastJob
+    from modules.models.user import User
+
+    db = get_db()
+    job = db.session.get(BroadcastJob, job_id)
+    if not job:
+        return
+    if not job.started_at:
+        job.started_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+    recipient_ids = job.get_recipient_ids()
+    errors = job.get_errors()
+    send_email = job.broadcast_type in ('email', 'both')
+    send_telegram = job.broadcast_type in ('telegram', 'both')
+    bot_token = get_broadcast_bot_token(job.bot_type) if send_telegram else None
+    subject = job.subject or ''
+    telegram_text = f"<b>{subject}</b>\n\n{job.message}" if subject else job.message
+    photo = job.photo
+    print(f"[BROADCAST] Job {job.id}: {job.total} recipients, starting at {job.cursor}")
+
+    with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix=f"broadcast-{job.id}") as pool:
+        while job.cursor < len(recipient_ids):
+            status = db.session.query(BroadcastJob.status).filter(BroadcastJob.id == job.id).scalar()
+            if status != 'running':
+                print(f"[BROADCAST] Job {job.id} stopped with status {status}")
+                return
+
+            batch_ids = recipient_ids[job.cursor:job.cursor + BROADCAST_BATCH_SIZE]
+            users = db.session.query(User.id, User.email, User.telegram_id).filter(User.id.in_(batch_ids)).all()
+
+            futures = []
+            outcomes = []
+            for user_id, email, telegram_id in users:
+                if send_email and email and not email.endswith('@telegram.local'):
+                    futures.append(pool.submit(_send_email_task, app, email, subject, job.message))
+                if send_telegram and bot_token and telegram_id:
+                    task_args = (bot_token, user_id, email, telegram_id, telegram_text, photo, job.pin_message)
+                    if photo and not get_photo_file_id(bot_token, photo):
+                        # Фото еще не загружено этим ботом: отправляем синхронно, чтобы загрузить
+                        # его один раз и дальше рассылать по file_id
+                        outcomes.append(_send_telegram_task(*task_args))
+                    else:
+                        futures.append(pool.submit(_send_telegram_task, *task_args))
+
+            for kind, ok, info in outcomes + [f.result() for f in futures]:
+                if kind == 'email':
+                    if ok:
+                        job.email_sent += 1
+                    else:
+                        job.email_failed += 1
+                        if len(errors.setdefault('email', [])) < MAX_STORED_ERRORS:
+                            errors['email'].append(info)
+                else:
+                    if ok:
+                        job.telegram_sent += 1
+                    else:
+                        job.telegram_failed += 1
+                        if len(errors.setdefault('telegram', [])) < MAX_STORED_ERRORS:
+                            errors['telegram'].append(info)
+
+            job.cursor += len(batch_ids)
+            job.errors = json.dumps(errors, ensure_ascii=False)
+            job.heartbeat_at = datetime.now(timezone.utc)
+            db.session.commit()
+
+    db.session.refresh(job)
+    if job.status == 'running':
+        job.status = 'done'
+        job.finished_at = datetime.now(timezone.utc)
+        db.session.commit()
+    print(f"[BROADCAST] Job {job.id} {job.status}: email {job.email_sent}/{job.email_failed}, "
+          f"telegram {job.telegram_sent}/{job.telegram_failed}")
+
+
+def run_pending_broadcasts(app=None):
+    """Выполнить все ожидающие задания (блокирующе). Используется фоновым потоком и отдельным worker'ом"""
+    from modules.models.broadcast import BroadcastJob
+
+    app = app or get_app()
+    with app.app_context():
+        db = get_db()
+        try:
+            while True:
+                job_id = _claim_next_job()
+                if not job_id:
+                    return
+                try:
+                    _run_job(app, job_id)
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    db.session.rollback()
+                    db.session.query(BroadcastJob).filter(BroadcastJob.id == job_id).update(
+                        {"status": 'failed', "finished_at": datetime.now(timezone.utc)}, synchronize_session=False
+                    )
+                    db.session.commit()
+                    print(f"[BROADCAST] Job {job_id} failed: {e}")
+        finally:
+            db.session.remove()
+
+
+_worker_thread = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+_worker_wakeup = threading.Event()
+
+
+def _worker_loop(app):
+    global _worker_thread
+    while True:
+        _worker_wakeup.clear()
+        run_pending_broadcasts(app)
+        # Выходим только если за время работы не появилось новых заданий
+        with _worker_lock:
+            if not _worker_wakeup.is_set():
+                _worker_thread = None
+                return
+
+
+def start_broadcast_worker(app=None):
+    """Запустить фоновый поток исполнителя заданий (не более одного на процесс)"""
+    global _worker_thread, _worker_pid
+    app = app or get_app()
+    with _worker_lock:
+        _worker_wakeup.set()
+        if _worker_thread is not None and _worker_pid == os.getpid() and _worker_thread.is_alive():
+            return False
+        _worker_thread = threading.Thread(target=_worker_loop, args=(app,), name="broadcast-worker", daemon=True)
+        _worker_pid = os.getpid()
+        _worker_thread.start()
+        return True
+
+
+__all__ = [
+    'RateLimiter', 'telegram_rate_limiter',
+    'send_telegram_message', 'send_telegram_photo', 'pin_telegram_message', 'get_broadcast_bot_token',
+    'read_photo_bytes', 'get_photo_file_id', 'remember_photo_file_id', 'extract_photo_file_id', 'is_bad_file_id_error',
+    'enqueue_broadcast', 'cancel_broadcast', 'run_pending_broadcasts', 'start_broadcast_worker',
+]
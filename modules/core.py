@@ -3,7 +3,7 @@
 и другим общим ресурсам.
 """
 
-from flask import Flask, current_app, has_app_context
+from flask import Flask, current_app, g, has_app_context, has_request_context, request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_caching import Cache
@@ -13,6 +13,7 @@ from flask_cors import CORS
 from flask_mail import Mail
 from cryptography.fernet import Fernet
 import os
+import hmac
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
@@ -27,7 +28,89 @@ bcrypt = Bcrypt()
 fernet = None
 mail = Mail()
 cache = Cache()
-limiter = Limiter(get_remote_address, default_limits=["2000 per day", "500 per hour"], storage_uri="memory://")
+
+# ============================================================================
+# ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ
+# ============================================================================
+# Счетчики хранятся в Redis (при CACHE_TYPE=redis) - лимит общий для всех worker'ов,
+# а не умноженный на их число. Если Redis недоступен, лимиты временно считаются в памяти процесса.
+# Уровни лимитов (строки Flask-Limiter, несколько через ";"):
+RATE_LIMIT_TIERS = {
+    'bot': os.getenv("RATE_LIMIT_BOT", "50 per second"),  # Запросы Telegram бота (заголовок X-Bot-Key)
+    'admin': os.getenv("RATE_LIMIT_ADMIN", "3000 per hour"),  # /api/admin/*
+    'miniapp': os.getenv("RATE_LIMIT_MINIAPP", "30 per minute"),  # /miniapp/* (чтение)
+    'write': os.getenv("RATE_LIMIT_WRITE", "10 per minute"),  # Платежи, триал, промокоды, покупки
+    'webhook': os.getenv("RATE_LIMIT_WEBHOOK", "50 per second"),  # /api/webhook/*, /api/internal/* (уведомления платежных систем)
+    'public': os.getenv("RATE_LIMIT_PUBLIC", "2000 per day;500 per hour"),  # Остальные маршруты
+}
+# Общий секрет API и бота: запросы бота идут с одного IP и не должны упираться в лимиты клиентов
+BOT_API_KEY = os.getenv("BOT_API_KEY", "")
+# Сколько доверенных прокси (nginx) перед приложением: IP клиента берется из X-Forwarded-For
+RATE_LIMIT_PROXY_COUNT = int(os.getenv("RATE_LIMIT_PROXY_COUNT", 0))
+
+
+def is_bot_request():
+    """Запрос от Telegram бота (заголовок X-Bot-Key совпадает с BOT_API_KEY)"""
+    key = request.headers.get('X-Bot-Key')
+    return bool(BOT_API_KEY and key) and hmac.compare_digest(key, BOT_API_KEY)
+
+
+def request_tier():
+    """Уровень лимита текущего запроса (для маршрутов без явного @limiter.limit)"""
+    if is_bot_request():
+        return 'bot'
+    # Платежные системы шлют уведомления с нескольких общих IP - не считаем их клиентами
+    if request.path.startswith(('/api/webhook/', '/api/internal/')):
+        return 'webhook'
+    if request.path.startswith('/api/admin/'):
+        return 'admin'
+    if request.path.startswith('/miniapp/'):
+        return 'miniapp'
+    return 'public'
+
+
+def rate_limit_key():
+    """Ключ счетчика: бот - один общий ключ, остальные - IP клиента"""
+    if is_bot_request():
+        return 'bot'
+    if RATE_LIMIT_PROXY_COUNT > 0:
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(forwarded) >= RATE_LIMIT_PROXY_COUNT:
+            return forwarded[-RATE_LIMIT_PROXY_COUNT]
+    return get_remote_address()
+
+
+def rate_limit(tier):
+    """Лимит уровня tier для @limiter.limit (запросы бота получают лимит уровня 'bot')"""
+    def _limit():
+        return RATE_LIMIT_TIERS['bot'] if is_bot_request() else RATE_LIMIT_TIERS[tier]
+    return _limit
+
+
+def _default_rate_limit():
+    return RATE_LIMIT_TIERS[request_tier()]
+
+
+limiter = Limiter(
+    rate_limit_key,
+    default_limits=[_default_rate_limit],
+    strategy="moving-window",
+    headers_enabled=True,  # Retry-After в ответе 429 (ClientBotAPI ждет его перед повтором)
+    in_memory_fallback_enabled=True,
+    swallow_errors=True,
+    key_prefix="ratelimit",
+)
+
+
+def get_rate_limit_storage_uri():
+    """Хранилище счетчиков лимитов: RATELIMIT_STORAGE_URI, Redis при CACHE_TYPE=redis, иначе память процесса"""
+    uri = os.getenv("RATELIMIT_STORAGE_URI")
+    if uri:
+        return uri
+    if os.getenv("CACHE_TYPE", "null").lower() == "redis":
+        return get_redis_url()
+    return "memory://"
+
 
 def init_app(flask_app):
     """
@@ -97,6 +180,9 @@ def init_app(flask_app):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['FERNET_KEY'] = os.getenv("FERNET_KEY").encode() if os.getenv("FERNET_KEY") else None
 
+    # Стоимость bcrypt (хеши с другой стоимостью пересчитываются при входе, см. modules/password_hashing.py)
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+
     # Инициализация расширений (идемпотентно: некоторые миграции вызывают init_app повторно)
     if 'sqlalchemy' not in app.extensions:
         db.init_app(app)
@@ -130,12 +216,7 @@ def init_app(flask_app):
             redis_port = int(os.getenv("REDIS_PORT", 6379))
             redis_db = int(os.getenv("REDIS_DB", 0))
             redis_password = os.getenv("REDIS_PASSWORD", None)
-            
-            # Формируем URL для Redis
-            if redis_password:
-                redis_url = f"redis://:{redis_password}@{redis_host}:{redis_port}/{redis_db}"
-            else:
-                redis_url = f"redis://{redis_host}:{redis_port}/{redis_db}"
+            redis_url = get_redis_url()
             
             app.config['CACHE_TYPE'] = 'RedisCache'
             app.config['CACHE_REDIS_URL'] = redis_url
@@ -186,7 +267,12 @@ def init_app(flask_app):
     if 'cache' not in app.extensions:
         cache.init_app(app)
     if 'limiter' not in app.extensions:
+        app.config.setdefault('RATELIMIT_STORAGE_URI', get_rate_limit_storage_uri())
         limiter.init_app(app)
+        print(f"✅ Ограничение запросов: {app.config['RATELIMIT_STORAGE_URI'].split('://')[0]} (moving window)")
+        if not BOT_API_KEY:
+            print("⚠️  BOT_API_KEY не задан: запросы Telegram бота считаются по лимиту RATE_LIMIT_PUBLIC "
+                  "общего IP бота и будут получать 429. Задайте одинаковый BOT_API_KEY в .env API и бота")
 
     # CORS
     # Временно отключаем CORS для отладки
@@ -242,4 +328,60 @@ def get_limiter():
     """Возвращает экземпляр Limiter"""
     if not has_app_context() and app is None:
         raise RuntimeError("Limiter not initialized. Call init_app() first.")
-    return limiter
\ No newline at end of file
+    return limiter
+
+def get_redis_url():
+    """URL Redis из переменных окружения REDIS_*"""
+    redis_host = os.getenv("REDIS_HOST", "localhost")
+    redis_port = int(os.getenv("REDIS_PORT", 6379))
+    redis_db = int(os.getenv("REDIS_DB", 0))
+    redis_password = os.getenv("REDIS_PASSWORD", None)
+    if redis_password:
+        return f"redis://:{redis_password}@{redis_host}:{redis_port}/{redis_db}"
+    return f"redis://{redis_host}:{redis_port}/{redis_db}"
+
+_redis_client = None
+
+def get_redis():
+    """
+    Возвращает клиент Redis (общий пул соединений на процесс) или None,
+    если CACHE_TYPE != redis.
+    """
+    global _redis_client
+    if os.getenv("CACHE_TYPE", "null").lower() != "redis":
+        return None
+    if _redis_client is None:
+        try:
+            import redis
+            _redis_client = redis.Redis.from_url(get_redis_url(), socket_connect_timeout=2, socket_timeout=5)
+        except Exception as e:
+            print(f"⚠️  Redis client init failed: {e}")
+            return None
+    return _redis_client
+
+
+def get_shared_version(key):
+    """
+    Версия key в общем кеше (создается, если ее еще нет) - по ней worker'ы узнают
+    об изменении данных, закешированных в памяти процесса. None - общего кеша нет
+    (CACHE_TYPE=null) или он недоступен: кешировать дольше запроса нельзя.
+    """
+    import time
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, f"{time.time():.6f}", timeout=0)
+            version = cache.get(key)
+        return version
+    except Exception:
+        return None
+
+
+def request_cached(name, loader):
+    """Значение loader(), вычисленное один раз за HTTP-запрос (flask.g). Вне запроса - каждый вызов"""
+    if not has_request_context():
+        return loader()
+    values = g.setdefault('_request_cached', {})
+    if name not in values:
+        values[name] = loader()
+    return values[name]
@@ -1,11 +1,17 @@
 """
-Модуль валют - реэкспорт из modules.models.currency
+Модуль валют: курсы к USD и конвертация
 
-DEPRECATED: Используйте modules.models.currency напрямую
+Курсы кешируются в памяти процесса (см. get_currency_rates) - конвертация
+не делает запрос к БД на каждый вызов.
 """
-from modules.models.currency import CurrencyRate
+import os
+import time
+import threading
 from datetime import datetime
 
+from modules.core import get_cache, get_shared_version, request_cached
+from modules.models.currency import CurrencyRate
+
 
 # Курсы валют по умолчанию (к USD) - сколько единиц валюты за 1 USD
 DEFAULT_RATES = {
@@ -17,12 +23,72 @@ DEFAULT_RATES = {
 }
 
 
+# ============================================================================
+# КЕШ КУРСОВ В ПРОЦЕССЕ
+# ============================================================================
+# Таблица курсов загружается одним запросом и хранится в памяти worker'а.
+# После сохранения курсов (/api/admin/currency-rates) вызывается
+# invalidate_currency_rates(): она меняет версию в общем кеше (Redis),
+# и остальные worker'ы перечитывают таблицу при следующей проверке версии.
+# Без общего кеша (CACHE_TYPE=null) таблица читается один раз за запрос.
+
+RATES_VERSION_KEY = 'currency_rates_version'
+RATES_CHECK_INTERVAL = float(os.getenv('CURRENCY_RATES_CHECK_INTERVAL', 5))  # Как часто сверять версию с общим кешем (сек)
+RATES_MAX_AGE = 300  # Перечитать таблицу не реже чем раз в 5 минут (если смена версии потерялась)
+
+_rates_state = {'rates': None, 'version': None, 'loaded_at': 0.0, 'checked_at': 0.0}
+_rates_lock = threading.Lock()
+
+
+def _load_rates(version):
+    try:
+        rows = CurrencyRate.query.with_entities(CurrencyRate.currency, CurrencyRate.rate_to_usd).all()
+    except Exception as e:
+        print(f"Warning: failed to load currency rates: {e}")
+        rows = []
+    rates = dict(DEFAULT_RATES)
+    rates.update({currency.upper(): float(rate) for currency, rate in rows if currency and rate})
+    if version is not None:
+        now = time.time()
+        _rates_state.update({'rates': rates, 'version': version, 'loaded_at': now, 'checked_at': now})
+    return rates
+
+
+def get_currency_rates():
+    """Таблица курсов {валюта: единиц за 1 USD} (из памяти процесса, без общего кеша - на время запроса)"""
+    state = _rates_state
+    now = time.time()
+    if state['rates'] is not None and now - state['checked_at'] < RATES_CHECK_INTERVAL:
+        return state['rates']
+
+    with _rates_lock:
+        if state['rates'] is not None and now - state['checked_at'] < RATES_CHECK_INTERVAL:
+            return state['rates']
+        version = get_shared_version(RATES_VERSION_KEY)
+        if version is not None:
+            if state['rates'] is not None and version == state['version'] and now - state['loaded_at'] < RATES_MAX_AGE:
+                state['checked_at'] = now
+                return state['rates']
+            return _load_rates(version)
+        state['rates'] = None
+
+    # Общего кеша нет - другие worker'ы не узнают о новых курсах, храним таблицу только на время запроса
+    return request_cached('currency_rates', lambda: _load_rates(None))
+
+
+def invalidate_currency_rates():
+    """Сбросить кеш курсов во всех worker'ах (вызывать после изменения CurrencyRate)"""
+    try:
+        get_cache().set(RATES_VERSION_KEY, f"{time.time():.6f}", timeout=0)
+    except Exception as e:
+        print(f"Warning: failed to publish currency rates version: {e}")
+    with _rates_lock:
+        _rates_state.update({'rates': None, 'checked_at': 0.0})
+
+
 def get_currency_rate(currency):
     """Получить курс валюты к USD (сколько единиц валюты за 1 USD)"""
-    rate = CurrencyRate.query.filter_by(currency=currency.upper()).first()
-    if rate:
-        return rate.rate_to_usd
-    return DEFAULT_RATES.get(currency.upper(), 1.0)
+    return get_currency_rates().get((currency or 'USD').upper(), 1.0)
 
 
 def convert_to_usd(amount, from_currency):
@@ -41,6 +107,34 @@ def convert_from_usd(amount_usd, to_currency):
     return amount_usd
 
 
+def convert_many_from_usd(amounts_usd, currencies):
+    """
+    Конвертировать список сумм из USD (для списков пользователей и т.п.).
+    currencies - список валют той же длины или одна валюта для всех.
+    Таблица курсов читается один раз на весь список.
+    """
+    rates = get_currency_rates()
+    if isinstance(currencies, str):
+        rate = rates.get(currencies.upper(), 1.0) or 1.0
+        return [amount * rate for amount in amounts_usd]
+    return [
+        amount * (rates.get((currency or 'USD').upper(), 1.0) or 1.0)
+        for amount, currency in zip(amounts_usd, currencies)
+    ]
+
+
+def convert_many_to_usd(amounts, currencies):
+    """Конвертировать список сумм в USD (аналог convert_many_from_usd)"""
+    rates = get_currency_rates()
+    if isinstance(currencies, str):
+        rate = rates.get(currencies.upper(), 1.0) or 1.0
+        return [amount / rate for amount in amounts]
+    return [
+        amount / (rates.get((currency or 'USD').upper(), 1.0) or 1.0)
+        for amount, currency in zip(amounts, currencies)
+    ]
+
+
 def parse_iso_datetime(date_str):
     """Парсит ISO datetime строку"""
     if not date_str:
@@ -54,7 +148,11 @@ def parse_iso_datetime(date_str):
 __all__ = [
     'CurrencyRate',
     'get_currency_rate',
+    'get_currency_rates',
+    'invalidate_currency_rates',
     'convert_to_usd',
     'convert_from_usd',
+    'convert_many_to_usd',
+    'convert_many_from_usd',
     'parse_iso_datetime'
 ]
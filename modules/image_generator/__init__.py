@@ -2,5 +2,6 @@
 Модуль для генерации изображений для бота
 """
 from .tariff_image import generate_tariff_image
+from .cache import tariff_image_key, TariffImageCache, tariff_image_cache
 
-__all__ = ['generate_tariff_image']
+__all__ = ['generate_tariff_image', 'tariff_image_key', 'TariffImageCache', 'tariff_image_cache']
@@ -0,0 +1,95 @@
+"""
+Кеш сгенерированных изображений тарифов
+
+Ключ - хэш всех данных, которые попадают на картинку (название и иконка
+уровня, функции, длительности и цены в выбранной валюте, цвет брендинга).
+Изменение тарифов или брендинга дает другой ключ, поэтому явная инвалидация
+не нужна: старые записи вытесняются по LRU.
+
+Для каждого ключа хранятся PNG и file_id, полученный от Telegram после
+первой отправки, - повторно изображение не рендерится и не загружается.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from .tariff_image import generate_tariff_image
+
+
+PRICE_FIELDS = {"uah": "price_uah", "rub": "price_rub", "usd": "price_usd"}
+
+
+def tariff_image_key(tier_name, tier_icon, features, tariffs, currency, currency_symbol, primary_color):
+    """Хэш данных изображения (те же аргументы, что у generate_tariff_image)"""
+    price_field = PRICE_FIELDS.get(currency, "price_uah")
+    payload = {
+        "tier": [tier_name, tier_icon],
+        "features": [[f.get("name"), f.get("icon")] if isinstance(f, dict) else f for f in features or []],
+        "tariffs": [
+            [t.get("name"), t.get("duration_days", 0), t.get(price_field, 0)]
+            for t in tariffs or []
+        ],
+        "currency": [currency, currency_symbol],
+        "color": list(primary_color or ()),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TariffImageCache:
+    """LRU изображений тарифов: ключ -> {'image': bytes, 'file_id': str | None}"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._render_locks = {}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_file_id(self, key):
+        entry = self._get(key)
+        return entry.get("file_id") if entry else None
+
+    def remember_file_id(self, key, file_id):
+        """Запомнить file_id после отправки (None - забыть, например если Telegram его отклонил)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["file_id"] = file_id
+
+    def get_image(self, key, **params):
+        """
+        PNG для ключа: из кеша или рендер (generate_tariff_image).
+        Один ключ рендерится одновременно только одним потоком.
+        """
+        entry = self._get(key)
+        if entry is not None:
+            return entry["image"]
+
+        with self._lock:
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+        with render_lock:
+            entry = self._get(key)
+            if entry is not None:
+                return entry["image"]
+            image = generate_tariff_image(**params)
+            with self._lock:
+                self._entries[key] = {"image": image, "file_id": None}
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self._render_locks.pop(key, None)
+            return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tariff_image_cache = TariffImageCache()
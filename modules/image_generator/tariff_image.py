@@ -1,8 +1,16 @@
 """
 Модуль для генерации изображений тарифов
+
+Неизменяемые части картинки кешируются в памяти процесса: шрифты, столбец
+градиента фона и полоса заголовка (для данного размера, цвета и названия
+уровня), маски теней (для данного размера карточки). На каждый вызов рисуются
+только карточки функций и таблица тарифов.
+
+Замер времени и памяти: python other/tools/benchmark_tariff_image.py
 """
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from io import BytesIO
+from functools import lru_cache
 import re
 
 
@@ -44,6 +52,7 @@ def clean_text_for_image(text):
 
 # Загружаем шрифты с поддержкой кириллицы (DejaVu Sans)
 # Пробуем разные пути, где могут быть установлены шрифты
+@lru_cache(maxsize=None)
 def load_font(path, size):
     """Загружает шрифт, пробуя разные пути"""
     paths = [
@@ -102,44 +111,114 @@ def draw_rounded_rectangle(draw, xy, radius, fill=None, outline=None, width=1):
         draw.line([(x2, y1 + radius), (x2, y2 - radius)], fill=outline, width=width)
 
 
-def draw_shadow(img, draw, xy, radius, shadow_color=(0, 0, 0), shadow_opacity=20, blur_size=8):
-    """Рисует тень для скругленного прямоугольника"""
+@lru_cache(maxsize=32)
+def _shadow_mask(width, height, radius, opacity, blur_size):
+    """Размытая маска тени карточки (только размер карточки + поля под размытие)"""
+    margin = blur_size * 2
+    mask = Image.new('L', (width + margin * 2, height + margin * 2), 0)
+    draw_rounded_rectangle(
+        ImageDraw.Draw(mask),
+        (margin, margin, margin + width, margin + height),
+        radius, fill=opacity, outline=None
+    )
+    return mask.filter(ImageFilter.GaussianBlur(blur_size / 2))
+
+
+def draw_shadow(img, draw, xy, radius, shadow_color=(0, 0, 0), shadow_opacity=20, blur_size=8, offset=None):
+    """
+    Рисует мягкую тень для скругленного прямоугольника.
+    Размывается только область карточки, а не весь холст.
+    """
     x1, y1, x2, y2 = xy
+    if offset is None:
+        offset = blur_size // 2
+    mask = _shadow_mask(x2 - x1, y2 - y1, radius, shadow_opacity, blur_size)
+    margin = blur_size * 2
+    img.paste(shadow_color, (x1 + offset - margin, y1 + offset - margin, x1 + offset - margin + mask.width, y1 + offset - margin + mask.height), mask)
+    return draw
+
+
+@lru_cache(maxsize=64)
+def _gradient_column(height, bg_color, primary_color):
+    """Столбец 1 x height с цветами вертикального градиента фона"""
+    column = bytearray()
+    for i in range(height):
+        # Двойной градиент для более красивого эффекта
+        progress = i / height
+        # Первый градиент (сверху)
+        alpha1 = min(0.12, progress * 0.12)
+        # Второй градиент (снизу, обратный)
+        alpha2 = min(0.08, (1 - progress) * 0.08)
+        alpha = alpha1 + alpha2
+        column.extend(
+            int(bg_color[j] * (1 - alpha) + primary_color[j] * alpha)
+            for j in range(3)
+        )
+    return Image.frombytes('RGB', (1, height), bytes(column))
+
+
+def _gradient_background(width, height, bg_color, primary_color):
+    """
+    Фон с вертикальным градиентом: закешированный столбец растягивается
+    по ширине средствами PIL - без отрисовки каждой строки.
+    """
+    return _gradient_column(height, bg_color, primary_color).resize((width, height), Image.NEAREST)
+
+
+HEADER_CARD_HEIGHT = 120
+PNG_COMPRESS_LEVEL = 3
+
+
+HEADER_SHADOW_BLUR = 12
+HEADER_SHADOW_OFFSET = 6
+
+
+@lru_cache(maxsize=16)
+def _header_band(width, height, padding, corner_radius, bg_color, primary_color, tier_name):
+    """
+    Верхняя полоса изображения: фон и карточка заголовка с тенью.
+    Не зависит от функций и цен; кешируется только полоса, а не весь холст.
+    """
+    card_bg = (255, 255, 255)  # Белый фон карточек
+    border_color = (226, 232, 240)  # #e2e8f0 - граница
     
-    # Создаем временное изображение для тени
-    shadow_img = Image.new('RGBA', (img.width, img.height), (0, 0, 0, 0))
-    shadow_draw = ImageDraw.Draw(shadow_img)
-    
-    # Рисуем тень большего размера
-    offset = blur_size // 2
-    shadow_x1 = x1 + offset
-    shadow_y1 = y1 + offset
-    shadow_x2 = x2 + offset
-    shadow_y2 = y2 + offset
-    
-    # Рисуем скругленный прямоугольник для тени
-    shadow_fill = (*shadow_color, shadow_opacity)
-    draw_rounded_rectangle(shadow_draw, (shadow_x1, shadow_y1, shadow_x2, shadow_y2), 
-                          radius, fill=shadow_fill, outline=None)
-    
-    # Применяем размытие (простая имитация через несколько слоев)
-    for i in range(blur_size):
-        alpha = shadow_opacity // (blur_size + 1) * (blur_size - i)
-        if alpha > 0:
-            temp_img = Image.new('RGBA', (img.width, img.height), (0, 0, 0, 0))
-            temp_draw = ImageDraw.Draw(temp_img)
-            offset2 = i
-            draw_rounded_rectangle(temp_draw, 
-                                  (shadow_x1 + offset2, shadow_y1 + offset2, 
-                                   shadow_x2 + offset2, shadow_y2 + offset2),
-                                  radius, fill=(*shadow_color, alpha), outline=None)
-            shadow_img = Image.alpha_composite(shadow_img, temp_img)
-    
-    # Накладываем тень на основное изображение
-    img.paste(shadow_img, (0, 0), shadow_img)
-    # Восстанавливаем draw после изменения изображения
+    band_height = min(height, padding + HEADER_CARD_HEIGHT + HEADER_SHADOW_OFFSET + HEADER_SHADOW_BLUR * 2)
+    img = _gradient_column(height, bg_color, primary_color).crop((0, 0, 1, band_height)).resize((width, band_height), Image.NEAREST)
     draw = ImageDraw.Draw(img)
-    return draw
+    
+    # ========== ЗАГОЛОВОК ==========
+    header_y = padding
+    
+    # Мягкая тень заголовка
+    draw_shadow(
+        img, draw,
+        (padding, header_y, width - padding, header_y + HEADER_CARD_HEIGHT),
+        corner_radius, shadow_opacity=40, blur_size=HEADER_SHADOW_BLUR, offset=HEADER_SHADOW_OFFSET
+    )
+    
+    # Рисуем карточку заголовка
+    draw_rounded_rectangle(
+        draw,
+        (padding, header_y, width - padding, header_y + HEADER_CARD_HEIGHT),
+        radius=corner_radius,
+        fill=card_bg,
+        outline=border_color,
+        width=1
+    )
+    
+    # Текст заголовка (убираем emoji) с улучшенной типографикой
+    header_text = clean_text_for_image(tier_name)
+    bbox = draw.textbbox((0, 0), header_text, font=FONT_BOLD)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    x = (width - text_width) // 2
+    y_text = header_y + (HEADER_CARD_HEIGHT - text_height) // 2
+    
+    # Добавляем легкую тень для текста (для глубины)
+    draw.text((x + 2, y_text + 2), header_text, fill=(primary_color[0] // 3, primary_color[1] // 3, primary_color[2] // 3), font=FONT_BOLD)
+    # Основной текст
+    draw.text((x, y_text), header_text, fill=primary_color, font=FONT_BOLD)
+    return img
 
 
 def generate_tariff_image(
@@ -166,6 +245,8 @@ def generate_tariff_image(
     Returns:
         bytes: PNG изображение в виде bytes
     """
+    primary_color = tuple(primary_color)
+    
     # Размеры изображения
     width = 1400
     padding = 60
@@ -191,77 +272,12 @@ def generate_tariff_image(
     tariffs_table_height = 60 + len(tariffs) * 75 + 80  # Заголовок + строки + отступы
     total_height = header_height + features_section_height + tariffs_table_height + padding * 2 + card_spacing * 3
     
-    # Создаем изображение с градиентным фоном
-    img = Image.new('RGB', (width, total_height), color=bg_color)
+    # Фон с градиентом и карточка заголовка - из кеша
+    img = _gradient_background(width, total_height, bg_color, primary_color)
+    img.paste(_header_band(width, total_height, padding, corner_radius, bg_color, primary_color, tier_name), (0, 0))
     draw = ImageDraw.Draw(img)
     
-    # Рисуем улучшенный градиентный фон (более плавный и выразительный)
-    for i in range(total_height):
-        # Двойной градиент для более красивого эффекта
-        progress = i / total_height
-        # Первый градиент (сверху)
-        alpha1 = min(0.12, progress * 0.12)
-        # Второй градиент (снизу, обратный)
-        alpha2 = min(0.08, (1 - progress) * 0.08)
-        alpha = alpha1 + alpha2
-        
-        color = tuple(
-            int(bg_color[j] * (1 - alpha) + primary_color[j] * alpha)
-            for j in range(3)
-        )
-        draw.line([(0, i), (width, i)], fill=color)
-    
-    y = padding
-    
-    # ========== ЗАГОЛОВОК ==========
-    header_card_height = 120
-    header_y = y
-    
-    # Рисуем тень для заголовка (улучшенная)
-    shadow_offset = 6
-    shadow_blur = 12
-    for i in range(shadow_blur):
-        alpha = 8 * (1 - i / shadow_blur)
-        shadow_r = int(shadow_color[0] * alpha / 255)
-        shadow_g = int(shadow_color[1] * alpha / 255)
-        shadow_b = int(shadow_color[2] * alpha / 255)
-        shadow_fill = (shadow_r, shadow_g, shadow_b)
-        draw_rounded_rectangle(
-            draw,
-            (padding + shadow_offset + i, header_y + shadow_offset + i,
-             width - padding + shadow_offset + i, header_y + header_card_height + shadow_offset + i),
-            radius=corner_radius,
-            fill=shadow_fill,
-            outline=None
-        )
-    
-    # Рисуем карточку заголовка с градиентом
-    draw_rounded_rectangle(
-        draw,
-        (padding, header_y, width - padding, header_y + header_card_height),
-        radius=corner_radius,
-        fill=card_bg,
-        outline=border_color,
-        width=1
-    )
-    
-    # Добавляем легкий градиент в заголовке (опционально, через небольшой оверлей)
-    # Для простоты оставляем белый фон, но можно добавить легкий градиент
-    
-    # Текст заголовка (убираем emoji) с улучшенной типографикой
-    header_text = clean_text_for_image(tier_name)
-    bbox = draw.textbbox((0, 0), header_text, font=FONT_BOLD)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    x = (width - text_width) // 2
-    y_text = header_y + (header_card_height - text_height) // 2
-    
-    # Добавляем легкую тень для текста (для глубины)
-    draw.text((x + 2, y_text + 2), header_text, fill=(primary_color[0] // 3, primary_color[1] // 3, primary_color[2] // 3), font=FONT_BOLD)
-    # Основной текст
-    draw.text((x, y_text), header_text, fill=primary_color, font=FONT_BOLD)
-    
-    y += header_card_height + card_spacing
+    y = padding + HEADER_CARD_HEIGHT + card_spacing
     
     # ========== ФУНКЦИИ ТАРИФА ==========
     if features:
@@ -269,22 +285,11 @@ def generate_tariff_image(
         features_y = y
         
         # Тень для карточки функций
-        shadow_offset = 4
-        shadow_blur = 10
-        for i in range(shadow_blur):
-            alpha = 6 * (1 - i / shadow_blur)
-            shadow_r = int(shadow_color[0] * alpha / 255)
-            shadow_g = int(shadow_color[1] * alpha / 255)
-            shadow_b = int(shadow_color[2] * alpha / 255)
-            shadow_fill = (shadow_r, shadow_g, shadow_b)
-            draw_rounded_rectangle(
-                draw,
-                (padding + shadow_offset + i, features_y + shadow_offset + i,
-                 width - padding + shadow_offset + i, features_y + features_card_height + shadow_offset + i),
-                radius=corner_radius,
-                fill=shadow_fill,
-                outline=None
-            )
+        draw_shadow(
+            img, draw,
+            (padding, features_y, width - padding, features_y + features_card_height),
+            corner_radius, shadow_color=shadow_color, shadow_opacity=30, blur_size=10, offset=4
+        )
         
         draw_rounded_rectangle(
             draw,
@@ -556,6 +561,8 @@ def generate_tariff_image(
     
     # Сохраняем в bytes
     output = BytesIO()
-    img.save(output, format='PNG', optimize=True, quality=95)
+    # optimize=True (zlib 9 + перебор фильтров) занимал ~3/4 времени генерации
+    # при выигрыше в размере ~2%; Telegram все равно перекодирует фото
+    img.save(output, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
     output.seek(0)
     return output.getvalue()
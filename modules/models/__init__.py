@@ -20,6 +20,9 @@ from modules.models.tariff_level import TariffLevel
 from modules.models.option import PurchaseOption
 from modules.models.trial import TrialSettings
 from modules.models.user_config import UserConfig
+from modules.models.broadcast import BroadcastJob
+from modules.models.payment_event import PaymentEvent
+from modules.models.analytics import AnalyticsDaily
 
 __all__ = [
     'User',
@@ -36,5 +39,8 @@ __all__ = [
     'TariffLevel',
     'PurchaseOption',
     'TrialSettings',
-    'UserConfig'
+    'UserConfig',
+    'BroadcastJob',
+    'PaymentEvent',
+    'AnalyticsDaily'
 ]
@@ -0,0 +1,33 @@
+"""
+Дневные агрегаты аналитики (/api/admin/analytics)
+
+Одна строка - значение метрики за день в разрезе (dim, currency):
+- registrations*          - регистрации клиентов (dim='', currency='')
+- payments                - все созданные платежи
+- revenue                 - оплаченные платежи и выручка по валюте
+- provider / tariff / promo / user_revenue - то же в разрезе провайдера, тарифа, промокода, пользователя
+- configs / config_user   - созданные конфиги (всего и по пользователю)
+- referral                - привлеченные рефералы по рефереру
+
+Таблица пересчитывается по дням (modules/analytics.py), поэтому
+эндпоинт аналитики не сканирует user/payment за весь период.
+"""
+from modules.core import get_db
+
+db = get_db()
+
+
+class AnalyticsDaily(db.Model):
+    """Значение метрики аналитики за день"""
+    __tablename__ = 'analytics_daily'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'metric', 'dim', 'currency', name='uq_analytics_daily_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    metric = db.Column(db.String(40), nullable=False)
+    dim = db.Column(db.String(100), nullable=False, default='')  # provider / tariff_id / promo_code_id / user_id
+    currency = db.Column(db.String(10), nullable=False, default='')
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
@@ -0,0 +1,91 @@
+"""
+Модель задания ручной рассылки (/api/admin/broadcast)
+
+Задание сохраняется в БД и выполняется фоновым пулом отправки
+(modules/broadcast.py), поэтому переживает перезапуск worker'а
+и позволяет смотреть прогресс.
+"""
+import json
+from datetime import datetime, timezone
+from modules.core import get_db
+
+db = get_db()
+
+
+class BroadcastJob(db.Model):
+    """Задание рассылки email / Telegram"""
+    __tablename__ = 'broadcast_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+
+    # Параметры рассылки
+    broadcast_type = db.Column(db.String(20), nullable=False, default='email')  # email, telegram, both
+    bot_type = db.Column(db.String(10), nullable=False, default='old')  # old, new
+    recipient_type = db.Column(db.String(20), nullable=True)
+    subject = db.Column(db.Text, nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    pin_message = db.Column(db.Boolean, default=False, nullable=False)
+    photo = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Изображение для Telegram (грузится только исполнителем)
+    photo_filename = db.Column(db.String(255), nullable=True)
+
+    # Получатели (JSON-список user.id) и позиция, до которой рассылка уже выполнена
+    recipient_ids = db.Column(db.Text, nullable=False, default='[]')
+    cursor = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer, default=0, nullable=False)
+
+    # Прогресс
+    email_sent = db.Column(db.Integer, default=0, nullable=False)
+    email_failed = db.Column(db.Integer, default=0, nullable=False)
+    telegram_sent = db.Column(db.Integer, default=0, nullable=False)
+    telegram_failed = db.Column(db.Integer, default=0, nullable=False)
+    errors = db.Column(db.Text, nullable=True)  # JSON: первые ошибки доставки
+
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Обновляется исполнителем после каждой пачки
+
+    def get_recipient_ids(self):
+        try:
+            return json.loads(self.recipient_ids or '[]')
+        except (TypeError, ValueError):
+            return []
+
+    def get_errors(self):
+        try:
+            return json.loads(self.errors) if self.errors else {"email": [], "telegram": []}
+        except (TypeError, ValueError):
+            return {"email": [], "telegram": []}
+
+    def to_dict(self):
+        """Статус задания для API"""
+        errors = self.get_errors()
+        result = {
+            "job_id": self.id,
+            "status": self.status,
+            "broadcast_type": self.broadcast_type,
+            "bot_type": self.bot_type,
+            "recipient_type": self.recipient_type,
+            "subject": self.subject,
+            "total_recipients": self.total,
+            "processed": self.cursor,
+            "progress": round(self.cursor * 100.0 / self.total, 1) if self.total else 100.0,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if self.broadcast_type in ('email', 'both'):
+            result["email"] = {
+                "sent": self.email_sent,
+                "failed": self.email_failed,
+                "failed_emails": errors.get("email", [])[:10]
+            }
+        if self.broadcast_type in ('telegram', 'both'):
+            result["telegram"] = {
+                "sent": self.telegram_sent,
+                "failed": self.telegram_failed,
+                "failed_users": errors.get("telegram", [])[:10]
+            }
+        return result
@@ -10,6 +10,9 @@ db = get_db()
 class CasinoGame(db.Model):
     """История игр в казино"""
     __tablename__ = 'casino_game'
+    __table_args__ = (
+        db.Index('ix_casino_game_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
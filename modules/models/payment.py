@@ -2,10 +2,9 @@
 Модели платежей и настроек платёжных систем
 """
 from datetime import datetime, timezone
-from modules.core import get_db, get_fernet
+from modules.core import get_db
 
 db = get_db()
-fernet = get_fernet()
 
 class PaymentSetting(db.Model):
     """Настройки платёжных систем"""
@@ -74,6 +73,12 @@ class PaymentSetting(db.Model):
 
 class Payment(db.Model):
     """Платёж"""
+    __table_args__ = (
+        db.Index('ix_payment_user_id_created_at', 'user_id', 'created_at'),  # История платежей пользователя
+        db.Index('ix_payment_status_created_at', 'status', 'created_at'),  # Оплаченные за период
+        db.Index('ix_payment_payment_system_id', 'payment_system_id'),  # Поиск платежа из вебхуков
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(100), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -89,15 +94,3 @@ class Payment(db.Model):
     user_config_id = db.Column(db.Integer, db.ForeignKey('user_config.id'), nullable=True)  # Конфиг, для которого создан платеж
     create_new_config = db.Column(db.Boolean, default=False, nullable=False)  # Флаг создания нового конфига после оплаты
     description = db.Column(db.Text, nullable=True)  # Служебное описание (например OPTION:{option_id})
-
-
-def decrypt_key(key):
-    """Расшифровка ключа"""
-    if not key or not fernet:
-        return ""
-    try:
-        return fernet.decrypt(key).decode('utf-8')
-    except Exception:
-        return ""
-
-
@@ -0,0 +1,44 @@
+"""
+Модель входящего события платежа (inbox вебхуков платежных систем)
+
+Вебхук только проверяет уведомление и сохраняет событие, а эффект платежа
+(продление подписки в RemnaWave, пополнение баланса, уведомления) применяет
+фоновый пул (modules/payment_events.py). Уникальный dedupe_key - один эффект
+на платеж (и на каждый возврат): повторы уведомлений провайдера не создают новых событий.
+"""
+import json
+from datetime import datetime, timezone
+from modules.core import get_db
+
+db = get_db()
+
+
+class PaymentEvent(db.Model):
+    """Событие платежа, ожидающее применения"""
+    __tablename__ = 'payment_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dedupe_key = db.Column(db.String(100), unique=True, nullable=False)  # "<kind>:<payment.id>", для возвратов + ":<refund id>"
+    kind = db.Column(db.String(20), nullable=False, default='paid')  # paid, refund
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, processing, done, skipped, failed
+
+    payment_id = db.Column(db.Integer, db.ForeignKey('payment.id'), nullable=False, index=True)
+    provider = db.Column(db.String(30), nullable=True)  # Откуда пришло событие (heleket, yookassa, ..., reconcile)
+    provider_event_id = db.Column(db.String(255), nullable=True)  # ID события/транзакции у провайдера (для аудита)
+    payload = db.Column(db.Text, nullable=True)  # JSON: данные уведомления
+
+    # Выполнение
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Повтор после временной ошибки не раньше этого времени
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Последний признак жизни исполнителя (продлевается во время обработки)
+    last_error = db.Column(db.Text, nullable=True)
+    duplicates = db.Column(db.Integer, default=0, nullable=False)  # Сколько повторных уведомлений отброшено
+
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    def get_payload(self):
+        try:
+            return json.loads(self.payload) if self.payload else {}
+        except (TypeError, ValueError):
+            return {}
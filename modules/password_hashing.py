@@ -0,0 +1,190 @@
+"""
+Хеширование и проверка паролей (bcrypt) в ограниченном пуле потоков
+
+Раньше generate_password_hash/check_password_hash выполнялись прямо в потоке
+запроса: ~250мс CPU на вызов при стандартной стоимости. Волна запросов на
+/api/public/login (подбор паролей) занимала все потоки worker'ов и процессор,
+и Mini App с вебхуками отвечали с задержкой.
+
+Теперь вызовы bcrypt выполняются в пуле процесса из PASSWORD_HASH_WORKERS потоков
+(bcrypt отпускает GIL на время вычисления - параллелизм настоящий, но не больше
+заданного). Очередь ограничена PASSWORD_HASH_QUEUE_MAX: если она заполнена или
+ожидание дольше PASSWORD_HASH_TIMEOUT, вызов сразу завершается PasswordHashingBusy
+(ответ 503 с Retry-After), а не ждет, занимая поток запроса.
+
+Стоимость хеша задается BCRYPT_LOG_ROUNDS. Если она изменилась, при успешном
+входе хеш пароля пересчитывается с новой стоимостью (verify_and_rehash).
+
+Использование:
+    from modules import password_hashing
+    from modules.password_hashing import PasswordHashingBusy
+
+    try:
+        user.password_hash = password_hashing.hash_password(password)
+        ok = password_hashing.verify_and_rehash(user, password)  # вход
+    except PasswordHashingBusy:
+        return password_hashing.busy_response()
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import jsonify
+
+from modules.core import get_bcrypt, get_db
+
+
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # Одновременных вычислений bcrypt в процессе
+PASSWORD_HASH_QUEUE_MAX = int(os.getenv('PASSWORD_HASH_QUEUE_MAX', 16))  # Сколько вызовов может ждать в очереди
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))  # Максимальное ожидание результата (сек)
+
+
+class PasswordHashingBusy(Exception):
+    """Пул хеширования паролей перегружен (очередь заполнена или ожидание слишком долгое)"""
+
+
+_lock = threading.Lock()
+_executor = {'pool': None, 'pid': None}
+_stats = {
+    'queued': 0,
+    'active': 0,
+    'completed': 0,
+    'rejected': 0,
+    'timed_out': 0,
+    'rehashed': 0,
+    'max_queued': 0,
+    'wait_seconds_total': 0.0,
+    'run_seconds_total': 0.0,
+}
+
+
+def _get_executor():
+    pid = os.getpid()
+    if _executor['pool'] is None or _executor['pid'] != pid:
+        with _lock:
+            if _executor['pool'] is None or _executor['pid'] != pid:
+                _executor['pool'] = ThreadPoolExecutor(max_workers=max(PASSWORD_HASH_WORKERS, 1), thread_name_prefix="password-hash")
+                _executor['pid'] = pid
+                # Счетчики родительского процесса после fork не относятся к этому worker'у
+                _stats.update({key: 0 if isinstance(value, int) else 0.0 for key, value in _stats.items()})
+    return _executor['pool']
+
+
+def _run(func, *args):
+    """Выполнить func(*args) в пуле (с учетом очереди). PasswordHashingBusy при перегрузке"""
+    executor = _get_executor()
+    submitted = time.monotonic()
+    with _lock:
+        if _stats['queued'] >= PASSWORD_HASH_QUEUE_MAX:
+            _stats['rejected'] += 1
+            raise PasswordHashingBusy("password hashing queue is full")
+        _stats['queued'] += 1
+        _stats['max_queued'] = max(_stats['max_queued'], _stats['queued'])
+
+    def task():
+        started = time.monotonic()
+        with _lock:
+            _stats['queued'] -= 1
+            _stats['active'] += 1
+            _stats['wait_seconds_total'] += started - submitted
+        try:
+            return func(*args)
+        finally:
+            with _lock:
+                _stats['active'] -= 1
+                _stats['completed'] += 1
+                _stats['run_seconds_total'] += time.monotonic() - started
+
+    try:
+        future = executor.submit(task)
+    except Exception:
+        with _lock:
+            _stats['queued'] -= 1
+        raise
+
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        with _lock:
+            _stats['timed_out'] += 1
+            # Еще не начатую задачу убираем из очереди (начатая досчитается и учтет себя сама)
+            if future.cancel():
+                _stats['queued'] -= 1
+        print(f"[AUTH] Password hashing timed out after {PASSWORD_HASH_TIMEOUT}s (queue: {_stats['queued']})")
+        raise PasswordHashingBusy("password hashing timed out")
+
+
+def hash_password(password):
+    """bcrypt-хеш пароля (str) с текущей стоимостью BCRYPT_LOG_ROUNDS"""
+    return _run(get_bcrypt().generate_password_hash, password).decode('utf-8')
+
+
+def check_password(password_hash, password):
+    """Совпадает ли пароль с хешем"""
+    if not password_hash:
+        return False
+    return _run(get_bcrypt().check_password_hash, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """Хеш создан с другой стоимостью, чем текущая BCRYPT_LOG_ROUNDS"""
+    try:
+        rounds = int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return False
+    return rounds != get_bcrypt()._log_rounds
+
+
+def verify_and_rehash(user, password):
+    """
+    Проверить пароль пользователя. При успехе и устаревшей стоимости хеша
+    пересчитывает и сохраняет user.password_hash (commit).
+    """
+    if not check_password(user.password_hash, password):
+        return False
+    if needs_rehash(user.password_hash):
+        db = get_db()
+        try:
+            user.password_hash = hash_password(password)
+            db.session.commit()
+            with _lock:
+                _stats['rehashed'] += 1
+        except PasswordHashingBusy:
+            # Пароль верный - пересчитаем хеш при следующем входе
+            pass
+        except Exception as e:
+            db.session.rollback()
+            print(f"[AUTH] Failed to rehash password for user {user.id}: {e}")
+    return True
+
+
+def busy_response():
+    """Ответ 503 при перегрузке пула хеширования"""
+    response = jsonify({"message": "Server is busy, please try again later", "code": "AUTH_BUSY"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def get_stats():
+    """Метрики пула хеширования текущего процесса (worker'а)"""
+    with _lock:
+        stats = dict(_stats)
+    completed = stats['completed'] or 1
+    stats.update({
+        'workers': max(PASSWORD_HASH_WORKERS, 1),
+        'queue_max': PASSWORD_HASH_QUEUE_MAX,
+        'log_rounds': get_bcrypt()._log_rounds,
+        'avg_wait_ms': round(stats.pop('wait_seconds_total') * 1000 / completed, 1),
+        'avg_run_ms': round(stats.pop('run_seconds_total') * 1000 / completed, 1),
+        'pid': os.getpid(),
+    })
+    return stats
+
+
+__all__ = [
+    'PasswordHashingBusy', 'hash_password', 'check_password', 'needs_rehash', 'verify_and_rehash',
+    'busy_response', 'get_stats',
+    'PASSWORD_HASH_WORKERS', 'PASSWORD_HASH_QUEUE_MAX', 'PASSWORD_HASH_TIMEOUT',
+]
@@ -3,7 +3,8 @@
 
 DEPRECATED: Используйте modules.models.payment напрямую
 """
-from modules.models.payment import Payment, PaymentSetting, decrypt_key
+from modules.models.payment import Payment, PaymentSetting
+from modules.payment_settings import get_payment_settings, decrypt_key
 from modules.core import get_db, get_fernet
 import uuid
 import os
@@ -36,11 +37,11 @@ def create_payment(user_id, tariff_id, payment_provider, amount, currency, promo
 def create_heleket_payment(amount, currency, order_id, email):
     """Создать платёж Heleket"""
     try:
-        s = PaymentSetting.query.first()
+        s = get_payment_settings()
         if not s or not s.heleket_api_key:
             return None, "Heleket not configured"
         
-        api_key = decrypt_key(s.heleket_api_key)
+        api_key = s.heleket_api_key
         if not api_key:
             return None, "Invalid Heleket API key"
         
@@ -54,11 +55,11 @@ def create_heleket_payment(amount, currency, order_id, email):
 def create_telegram_stars_payment(amount, currency, order_id, email):
     """Создать платёж Telegram Stars"""
     try:
-        s = PaymentSetting.query.first()
+        s = get_payment_settings()
         if not s or not s.telegram_bot_token:
             return None, "Telegram Stars not configured"
         
-        bot_token = decrypt_key(s.telegram_bot_token)
+        bot_token = s.telegram_bot_token
         if not bot_token:
             return None, "Invalid Telegram bot token"
         
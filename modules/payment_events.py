@@ -0,0 +1,383 @@
+"""
+Inbox событий платежей (вебхуки платежных систем)
+
+Вебхук проверяет уведомление, сохраняет событие в payment_event и сразу
+отвечает провайдеру. Эффект платежа (RemnaWave, баланс, рефералка,
+уведомления) применяет фоновый пул:
+- PAYMENT_EVENT_WORKERS        - сколько событий применяется одновременно (по умолчанию 4)
+- PAYMENT_EVENT_MAX_ATTEMPTS   - попыток до статуса failed (по умолчанию 8)
+- PAYMENT_EVENT_RETRY_SECONDS  - первая пауза перед повтором, дальше удваивается до часа (по умолчанию 30)
+- PAYMENT_EVENT_STALE_SECONDS  - через сколько событие, захваченное умершим исполнителем,
+                                 забирается снова (по умолчанию 300). Пока эффект применяется,
+                                 исполнитель продлевает heartbeat_at каждые STALE/5 секунд,
+                                 поэтому медленный RemnaWave не приводит к повторному применению
+
+Один эффект на платеж: dedupe_key = "<kind>:<payment.id>" уникален в таблице,
+поэтому повторные уведомления (провайдер не дождался ответа и повторил запрос,
+webhook и ручная проверка статуса одновременно) только увеличивают счетчик
+duplicates. Возвратов по платежу может быть несколько (частичные), поэтому их
+ключ включает ID возврата у провайдера: "refund:<payment.id>:<refund id>".
+Событие забирается исполнителем атомарным UPDATE, а перед применением
+повторно проверяется статус платежа.
+"""
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from modules.core import get_app, get_db
+
+
+PAYMENT_EVENT_WORKERS = int(os.getenv("PAYMENT_EVENT_WORKERS", 4))
+PAYMENT_EVENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_EVENT_MAX_ATTEMPTS", 8))
+PAYMENT_EVENT_RETRY_SECONDS = int(os.getenv("PAYMENT_EVENT_RETRY_SECONDS", 30))
+PAYMENT_EVENT_STALE_SECONDS = int(os.getenv("PAYMENT_EVENT_STALE_SECONDS", 300))
+PAYMENT_EVENT_HEARTBEAT_SECONDS = max(PAYMENT_EVENT_STALE_SECONDS / 5, 1)
+MAX_RETRY_DELAY = 3600
+MAX_IDLE_WAIT = 60  # Как долго поток ждет ближайшего повтора, прежде чем проверить очередь снова
+
+
+# ============================================================================
+# ЗАПИСЬ СОБЫТИЙ
+# ============================================================================
+
+def _dedupe_key(kind, payment_id, provider_event_id=None):
+    if kind == 'refund' and provider_event_id:
+        return f"{kind}:{payment_id}:{provider_event_id}"[:100]
+    return f"{kind}:{payment_id}"
+
+
+def record_payment_event(payment, provider, kind='paid', provider_event_id=None, payload=None):
+    """
+    Сохранить событие платежа (вместе с несохраненными изменениями платежа).
+    Возвращает (PaymentEvent, ready): ready=True, если событие новое
+    или повторно поставлено в очередь после failed.
+    """
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    key = _dedupe_key(kind, payment.id, provider_event_id)
+    event = PaymentEvent.query.filter_by(dedupe_key=key).first()
+    if event is None and key != _dedupe_key(kind, payment.id):
+        # Возврат, записанный до появления ID возврата в ключе
+        event = PaymentEvent.query.filter_by(
+            dedupe_key=_dedupe_key(kind, payment.id), provider_event_id=str(provider_event_id)[:255]
+        ).first()
+    if event is None:
+        event = PaymentEvent(
+            dedupe_key=key,
+            kind=kind,
+            status='queued',
+            payment_id=payment.id,
+            provider=provider,
+            provider_event_id=str(provider_event_id)[:255] if provider_event_id else None,
+            payload=json.dumps(payload, ensure_ascii=False, default=str) if payload else None,
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(event)
+            db.session.commit()
+            print(f"[PAYMENT-EVENT] Queued {key} from {provider} (event {provider_event_id})")
+            return event, True
+        except IntegrityError:
+            # То же событие одновременно записал другой запрос
+            event = PaymentEvent.query.filter_by(dedupe_key=key).first()
+            if event is None:
+                raise
+
+    same_event = db.session.query(PaymentEvent).filter(PaymentEvent.id == event.id)
+    same_event.update({"duplicates": PaymentEvent.duplicates + 1}, synchronize_session=False)
+    # Провайдер повторил уведомление после failed - даем событию еще одну серию попыток
+    ready = same_event.filter(PaymentEvent.status == 'failed').update(
+        {"status": 'queued', "attempts": 0, "next_attempt_at": None}, synchronize_session=False
+    ) == 1
+    db.session.commit()
+    db.session.refresh(event)
+    print(f"[PAYMENT-EVENT] Duplicate {key} from {provider} (status {event.status})")
+    return event, ready
+
+
+def enqueue_payment_event(payment, provider, kind='paid', provider_event_id=None, payload=None, inline=False):
+    """
+    Сохранить событие и передать его исполнителю.
+    inline=True - применить сразу в текущем запросе (если событие не занято другим исполнителем),
+    для мест, где ответ зависит от результата (проверка статуса платежа, внутренний API бота).
+    Возвращает PaymentEvent с актуальным статусом.
+    """
+    db = get_db()
+    event, ready = record_payment_event(payment, provider, kind, provider_event_id, payload)
+    if ready:
+        if inline and process_payment_event(event.id) != 'queued':
+            db.session.refresh(event)
+            return event
+        start_payment_event_worker()
+    db.session.refresh(event)
+    return event
+
+
+# ============================================================================
+# ПРИМЕНЕНИЕ
+# ============================================================================
+
+def _claimable(now):
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    stale_before = now - timedelta(seconds=PAYMENT_EVENT_STALE_SECONDS)
+    return db.or_(
+        db.and_(
+            PaymentEvent.status == 'queued',
+            db.or_(PaymentEvent.next_attempt_at.is_(None), PaymentEvent.next_attempt_at <= now)
+        ),
+        db.and_(PaymentEvent.status == 'processing', PaymentEvent.heartbeat_at < stale_before)
+    )
+
+
+def _claim(event_id, now):
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    updated = db.session.query(PaymentEvent).filter(PaymentEvent.id == event_id, _claimable(now)).update(
+        {"status": 'processing', "heartbeat_at": now, "attempts": PaymentEvent.attempts + 1},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return updated == 1
+
+
+def _claim_ready_events(limit):
+    """Атомарно забрать до limit готовых событий (queued или зависшие processing)"""
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    now = datetime.now(timezone.utc)
+    candidates = db.session.query(PaymentEvent.id).filter(_claimable(now)).order_by(PaymentEvent.id).limit(limit * 2).all()
+    claimed = []
+    for (event_id,) in candidates:
+        if _claim(event_id, now):
+            claimed.append(event_id)
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def _retry_delay(attempts):
+    return min(PAYMENT_EVENT_RETRY_SECONDS * (2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+def _apply_event(event):
+    """
+    Применить эффект. True - применен, None - применять нечего
+    (платеж уже обработан, нет платежа/пользователя), False - повторить позже.
+    """
+    from modules.models.payment import Payment
+    from modules.models.user import User
+    from modules.api.webhooks.routes import apply_payment_effect
+
+    db = get_db()
+    payment = db.session.get(Payment, event.payment_id)
+    if payment is None:
+        return None
+    # Статус мог измениться в другом процессе после загрузки объекта в эту сессию
+    db.session.refresh(payment)
+    user = db.session.get(User, payment.user_id)
+    if user is None:
+        return None
+    return apply_payment_effect(payment, user, event.kind, event.get_payload(), provider=event.provider)
+
+
+def _finish(event_id, result, error=None):
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    event = db.session.get(PaymentEvent, event_id)
+    now = datetime.now(timezone.utc)
+    if result is True:
+        event.status = 'done'
+        event.processed_at = now
+    elif result is None and error is None:
+        event.status = 'skipped'
+        event.processed_at = now
+    elif event.attempts >= PAYMENT_EVENT_MAX_ATTEMPTS:
+        event.status = 'failed'
+        event.processed_at = now
+    else:
+        event.status = 'queued'
+        event.next_attempt_at = now + timedelta(seconds=_retry_delay(event.attempts))
+    if error is not None:
+        event.last_error = str(error)[:1000]
+    elif result is False:
+        event.last_error = "Payment effect was not applied"
+    db.session.commit()
+    print(f"[PAYMENT-EVENT] {event.dedupe_key}: {event.status} (attempt {event.attempts})")
+    return event.status
+
+
+class _Heartbeat:
+    """
+    Продлевает heartbeat_at события, пока исполнитель применяет эффект (запросы к RemnaWave,
+    Telegram могут идти дольше PAYMENT_EVENT_STALE_SECONDS) - иначе событие заберут повторно.
+    Обновление идет отдельным соединением, не затрагивая сессию исполнителя.
+    """
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.engine = get_db().engine
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _beat(self):
+        from modules.models.payment_event import PaymentEvent
+
+        table = PaymentEvent.__table__
+        while not self._stop.wait(PAYMENT_EVENT_HEARTBEAT_SECONDS):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(
+                        table.update()
+                        .where(table.c.id == self.event_id, table.c.status == 'processing')
+                        .values(heartbeat_at=datetime.now(timezone.utc))
+                    )
+            except Exception as e:
+                print(f"[PAYMENT-EVENT] Heartbeat for event {self.event_id} failed: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat, name=f"payment-event-heartbeat-{self.event_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        return False
+
+
+def _process_claimed(event_id):
+    from modules.models.payment_event import PaymentEvent
+
+    db = get_db()
+    event = db.session.get(PaymentEvent, event_id)
+    if event is None:
+        return None
+    db.session.refresh(event)
+    try:
+        with _Heartbeat(event_id):
+            result = _apply_event(event)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        db.session.rollback()
+        return _finish(event_id, False, e)
+    return _finish(event_id, result)
+
+
+def process_payment_event(event_id):
+    """
+    Применить событие в текущем потоке. Возвращает итоговый статус события
+    или None, если событие не готово (уже обработано, ждет повтора или занято).
+    """
+    if not _claim(event_id, datetime.now(timezone.utc)):
+        return None
+    return _process_claimed(event_id)
+
+
+def _process_task(app, event_id):
+    with app.app_context():
+        return _process_claimed(event_id)
+
+
+def run_pending_payment_events(app=None):
+    """Применить все готовые события (блокирующе). Используется фоновым потоком и отдельным worker'ом"""
+    app = app or get_app()
+    processed = 0
+    with app.app_context():
+        db = get_db()
+        try:
+            with ThreadPoolExecutor(max_workers=PAYMENT_EVENT_WORKERS, thread_name_prefix="payment-event") as pool:
+                running = set()
+                while True:
+                    free = PAYMENT_EVENT_WORKERS - len(running)
+                    if free > 0:
+                        for event_id in _claim_ready_events(free):
+                            running.add(pool.submit(_process_task, app, event_id))
+                    if not running:
+                        break
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    processed += len(done)
+        finally:
+            db.session.remove()
+    return processed
+
+
+def _seconds_until_next_retry(app):
+    """Через сколько секунд станет готово ближайшее отложенное событие (None - таких нет)"""
+    from modules.models.payment_event import PaymentEvent
+
+    with app.app_context():
+        db = get_db()
+        try:
+            next_at = db.session.query(db.func.min(PaymentEvent.next_attempt_at)).filter(
+                PaymentEvent.status == 'queued'
+            ).scalar()
+        finally:
+            db.session.remove()
+    if next_at is None:
+        return None
+    if next_at.tzinfo is None:
+        next_at = next_at.replace(tzinfo=timezone.utc)
+    return max((next_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+# ============================================================================
+# ФОНОВЫЙ ИСПОЛНИТЕЛЬ
+# ============================================================================
+
+_worker_thread = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+_worker_wakeup = threading.Event()
+
+
+def _worker_loop(app):
+    global _worker_thread
+    while True:
+        _worker_wakeup.clear()
+        try:
+            run_pending_payment_events(app)
+            delay = _seconds_until_next_retry(app)
+        except Exception as e:
+            print(f"[PAYMENT-EVENT] Worker error: {e}")
+            delay = MAX_IDLE_WAIT
+        if delay is not None:
+            # Ждем ближайшего повтора (или нового события)
+            _worker_wakeup.wait(min(delay + 0.1, MAX_IDLE_WAIT))
+            continue
+        # Выходим только если за время работы не появилось новых событий
+        with _worker_lock:
+            if not _worker_wakeup.is_set():
+                _worker_thread = None
+                return
+
+
+def start_payment_event_worker(app=None):
+    """Запустить фоновый поток исполнителя событий (не более одного на процесс)"""
+    global _worker_thread, _worker_pid
+    app = app or get_app()
+    with _worker_lock:
+        _worker_wakeup.set()
+        if _worker_thread is not None and _worker_pid == os.getpid() and _worker_thread.is_alive():
+            return False
+        _worker_thread = threading.Thread(target=_worker_loop, args=(app,), name="payment-event-worker", daemon=True)
+        _worker_pid = os.getpid()
+        _worker_thread.start()
+        return True
+
+
+__all__ = [
+    'record_payment_event', 'enqueue_payment_event', 'process_payment_event',
+    'run_pending_payment_events', 'start_payment_event_worker',
+]
@@ -0,0 +1,202 @@
+"""
+Расшифрованные настройки платёжных систем (PaymentSetting)
+
+Ключи платёжных систем хранятся в БД зашифрованными (Fernet). Раньше каждый
+запрос (список методов оплаты, создание платежа, вебхук) загружал строку
+PaymentSetting и заново расшифровывал ~20 ключей.
+
+Теперь строка загружается и расшифровывается один раз и хранится в памяти
+worker'а вместе со списком доступных методов оплаты. После сохранения
+/api/admin/payment-settings вызывается invalidate_payment_settings(): она
+меняет версию в общем кеше (Redis), и остальные worker'ы перечитывают
+настройки при следующей проверке версии. Без общего кеша (CACHE_TYPE=null)
+настройки расшифровываются один раз за запрос: иначе другие worker'ы создавали бы
+платежи со старыми ключами и проверяли вебхуки старыми секретами.
+"""
+import os
+import time
+import threading
+
+from sqlalchemy import Text
+
+from modules.core import get_cache, get_fernet, get_shared_version, request_cached
+from modules.models.payment import PaymentSetting
+
+
+SETTINGS_VERSION_KEY = 'payment_settings_version'
+SETTINGS_CHECK_INTERVAL = float(os.getenv('PAYMENT_SETTINGS_CHECK_INTERVAL', 5))  # Как часто сверять версию с общим кешем (сек)
+SETTINGS_MAX_AGE = 300  # Перечитать настройки не реже чем раз в 5 минут (если смена версии потерялась)
+
+# Условия доступности методов оплаты: метод -> поля, которые должны быть заполнены.
+# Порядок совпадает с порядком в /api/public/available-payment-methods.
+METHOD_REQUIREMENTS = (
+    ('crystalpay', ('crystalpay_api_key', 'crystalpay_api_secret')),
+    ('heleket', ('heleket_api_key',)),
+    ('yookassa', ('yookassa_shop_id', 'yookassa_secret_key')),
+    ('yoomoney', ('yoomoney_receiver', 'yoomoney_notification_secret')),
+    ('platega', ('platega_api_key', 'platega_merchant_id')),
+    ('mulenpay', ('mulenpay_api_key', 'mulenpay_secret_key', 'mulenpay_shop_id')),
+    ('urlpay', ('urlpay_api_key', 'urlpay_secret_key', 'urlpay_shop_id')),
+    ('telegram_stars', ('telegram_bot_token',)),
+    ('monobank', ('monobank_token',)),
+    ('btcpayserver', ('btcpayserver_url', 'btcpayserver_api_key', 'btcpayserver_store_id')),
+    ('tribute', ('tribute_api_key',)),
+    ('robokassa', ('robokassa_merchant_login', 'robokassa_password1')),
+    ('freekassa', ('freekassa_shop_id', 'freekassa_secret')),
+    ('cryptobot', ('cryptobot_api_key',)),
+)
+
+_state = {'settings': None, 'loaded': False, 'version': None, 'loaded_at': 0.0, 'checked_at': 0.0}
+_lock = threading.Lock()
+
+
+# ============================================================================
+# ШИФРОВАНИЕ
+# ============================================================================
+
+def decrypt_key(key):
+    """
+    Расшифровка ключа из PaymentSetting.
+    Поддерживает TEXT (str) и варианты PostgreSQL (memoryview/bytes).
+    Незашифрованная строка возвращается как есть.
+    """
+    if not key:
+        return ""
+
+    fernet = get_fernet()
+
+    try:
+        # PostgreSQL может вернуть memoryview
+        if isinstance(key, memoryview):
+            key = bytes(key)
+
+        # Если ключ хранится как строка (PostgreSQL TEXT)
+        if isinstance(key, str):
+            # Если строка уже не зашифрована — возвращаем как есть
+            if not key.startswith('gAAAAAB'):
+                return key
+            # Зашифрована, но нет fernet — не можем расшифровать
+            if not fernet:
+                return ""
+            return fernet.decrypt(key.encode('utf-8')).decode('utf-8')
+
+        # Если bytes — пробуем расшифровать
+        if isinstance(key, (bytes, bytearray)):
+            if not fernet:
+                return ""
+            return fernet.decrypt(bytes(key)).decode('utf-8')
+
+        # Прочие типы — пытаемся привести к bytes
+        if not fernet:
+            return str(key)
+        return fernet.decrypt(bytes(key)).decode('utf-8')
+    except Exception as e:
+        print(f"[DECRYPT] Failed to decrypt key: {type(key)}, error: {str(e)[:100]}")
+        return ""
+
+
+def encrypt_key(key):
+    """Шифрование ключа для сохранения в PaymentSetting (None для пустого значения)"""
+    if not key or not key.strip():
+        return None
+    fernet = get_fernet()
+    if not fernet:
+        return key  # Если нет fernet, сохраняем как есть
+    try:
+        # PostgreSQL TEXT хранит строки, поэтому конвертируем bytes в строку
+        return fernet.encrypt(key.encode('utf-8')).decode('utf-8')
+    except Exception as e:
+        print(f"⚠️  Ошибка шифрования ключа: {str(e)[:100]}")
+        return key  # Если ошибка шифрования, сохраняем как есть
+
+
+# ============================================================================
+# НАСТРОЙКИ В ПАМЯТИ ПРОЦЕССА
+# ============================================================================
+
+class DecryptedPaymentSettings:
+    """
+    Снимок PaymentSetting с расшифрованными ключами.
+    Атрибуты совпадают с колонками модели (текстовые - уже расшифрованы),
+    плюс version и available_methods. Только для чтения.
+    """
+
+    def __init__(self, row, version=None):
+        for column in PaymentSetting.__table__.columns:
+            value = getattr(row, column.key, None)
+            if isinstance(column.type, Text):
+                value = decrypt_key(value)
+            setattr(self, column.key, value)
+        self.version = version
+        self.available_methods = self._compute_available_methods()
+
+    def _compute_available_methods(self):
+        available = []
+        for method, fields in METHOD_REQUIREMENTS:
+            if all(getattr(self, field, None) for field in fields):
+                available.append(method)
+                if method == 'platega' and self.platega_mir_enabled:
+                    available.append('platega_mir')
+        return available
+
+    def is_available(self, method):
+        return method in self.available_methods
+
+
+def _load_settings(version):
+    settings = None
+    try:
+        row = PaymentSetting.query.first()
+        if row is not None:
+            settings = DecryptedPaymentSettings(row, version)
+    except Exception as e:
+        print(f"Warning: failed to load payment settings: {e}")
+        return None
+    if version is not None:
+        now = time.time()
+        _state.update({'settings': settings, 'loaded': True, 'version': version, 'loaded_at': now, 'checked_at': now})
+    return settings
+
+
+def get_payment_settings():
+    """Расшифрованные настройки платёжных систем (DecryptedPaymentSettings) или None"""
+    state = _state
+    now = time.time()
+    if state['loaded'] and now - state['checked_at'] < SETTINGS_CHECK_INTERVAL:
+        return state['settings']
+
+    with _lock:
+        if state['loaded'] and now - state['checked_at'] < SETTINGS_CHECK_INTERVAL:
+            return state['settings']
+        version = get_shared_version(SETTINGS_VERSION_KEY)
+        if version is not None:
+            if state['loaded'] and version == state['version'] and now - state['loaded_at'] < SETTINGS_MAX_AGE:
+                state['checked_at'] = now
+                return state['settings']
+            return _load_settings(version)
+        state.update({'settings': None, 'loaded': False})
+
+    # Общего кеша нет - не храним настройки дольше запроса
+    return request_cached('payment_settings', lambda: _load_settings(None))
+
+
+def get_available_payment_methods():
+    """Список доступных методов оплаты (предрасчитан при загрузке настроек)"""
+    settings = get_payment_settings()
+    return list(settings.available_methods) if settings else []
+
+
+def invalidate_payment_settings():
+    """Сбросить кеш настроек во всех worker'ах (вызывать после изменения PaymentSetting)"""
+    try:
+        get_cache().set(SETTINGS_VERSION_KEY, f"{time.time():.6f}", timeout=0)
+    except Exception as e:
+        print(f"Warning: failed to publish payment settings version: {e}")
+    with _lock:
+        _state.update({'settings': None, 'loaded': False, 'checked_at': 0.0})
+
+
+__all__ = [
+    'decrypt_key', 'encrypt_key', 'DecryptedPaymentSettings',
+    'get_payment_settings', 'get_available_payment_methods', 'invalidate_payment_settings',
+]
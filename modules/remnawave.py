@@ -0,0 +1,330 @@
+"""
+Общий клиент RemnaWave API
+
+Один пул keep-alive соединений на процесс (gunicorn worker), чтобы не платить
+за TCP+TLS handshake на каждый запрос к панели.
+
+Настройки (переменные окружения):
+- API_URL, ADMIN_TOKEN, REMNAWAVE_COOKIES - адрес и авторизация панели
+- REMNAWAVE_TIMEOUT       - таймаут запроса в секундах (по умолчанию 10)
+- REMNAWAVE_RETRIES       - количество повторов при сетевых ошибках/5xx (по умолчанию 2)
+- REMNAWAVE_POOL_SIZE     - размер пула соединений (по умолчанию 20)
+- REMNAWAVE_FANOUT_WORKERS - сколько запросов get_users_data() выполняется параллельно
+                            (общий пул потоков процесса, по умолчанию 8)
+
+Использование:
+    from modules.remnawave import get_remnawave
+
+    remnawave = get_remnawave()
+    resp = remnawave.get_user(uuid)
+    if resp.status_code == 200:
+        data = remnawave.response_data(resp)
+"""
+
+import os
+import json
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class RemnaWaveClient:
+    """Клиент RemnaWave API поверх requests.Session с пулом соединений"""
+
+    def __init__(self, base_url=None, token=None, cookies=None, timeout=None, retries=None, pool_size=None):
+        self.base_url = (base_url if base_url is not None else os.getenv("API_URL", "") or "").rstrip("/")
+        self.token = token if token is not None else os.getenv("ADMIN_TOKEN")
+        self.timeout = float(timeout if timeout is not None else os.getenv("REMNAWAVE_TIMEOUT", 10))
+        retries = int(retries if retries is not None else os.getenv("REMNAWAVE_RETRIES", 2))
+        pool_size = int(pool_size if pool_size is not None else os.getenv("REMNAWAVE_POOL_SIZE", 20))
+
+        if cookies is None:
+            cookies = {}
+            cookies_str = os.getenv("REMNAWAVE_COOKIES", "")
+            if cookies_str:
+                try:
+                    cookies = json.loads(cookies_str)
+                except json.JSONDecodeError:
+                    cookies = {}
+
+        self.cookies = cookies if isinstance(cookies, dict) else {}
+        self.retries = retries
+        self.pool_size = pool_size
+        self.fanout_workers = max(1, min(int(os.getenv("REMNAWAVE_FANOUT_WORKERS", 8)), pool_size))
+        self._pid = None
+        self._session = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._user_listeners = []
+
+    def _build_session(self):
+        session = requests.Session()
+        if self.token:
+            session.headers["Authorization"] = f"Bearer {self.token}"
+        session.cookies.update(self.cookies)
+
+        # Повторяем только безопасные методы (GET/HEAD/DELETE...) на 5xx;
+        # ошибки установки соединения повторяются для любых методов (запрос не ушел на сервер)
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def session(self):
+        """requests.Session текущего процесса (после fork пул создается заново)"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._build_session()
+                    self._pid = pid
+        return self._session
+
+    @property
+    def executor(self):
+        """Пул потоков для параллельных запросов (один на процесс, ограничен fanout_workers)"""
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.fanout_workers, thread_name_prefix="remnawave")
+                    self._executor_pid = pid
+        return self._executor
+
+    @property
+    def configured(self):
+        """Настроены ли API_URL и ADMIN_TOKEN"""
+        return bool(self.base_url and self.token)
+
+    # ------------------------------------------------------------------
+    # Низкоуровневые запросы
+    # ------------------------------------------------------------------
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """Выполнить запрос к RemnaWave. path - относительный путь (/api/...)"""
+        if not self.base_url:
+            raise requests.exceptions.InvalidURL("API_URL is not configured")
+        url = f"{self.base_url}{path}"
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def add_user_listener(self, callback):
+        """
+        Подписаться на изменения пользователей, сделанные через клиент.
+        callback(action, payload): ('upsert', данные пользователя) или ('delete', uuid)
+        """
+        if callback not in self._user_listeners:
+            self._user_listeners.append(callback)
+
+    def _notify_user(self, action, payload):
+        for callback in self._user_listeners:
+            try:
+                callback(action, payload)
+            except Exception as e:
+                print(f"RemnaWave: user listener failed: {e}")
+
+    def _notify_user_response(self, resp):
+        if self._user_listeners and resp is not None and resp.status_code in (200, 201):
+            data = self.response_data(resp)
+            if isinstance(data, dict) and data.get("uuid"):
+                self._notify_user("upsert", data)
+
+    @staticmethod
+    def response_data(resp):
+        """Достать полезную нагрузку из ответа RemnaWave ({"response": ...} или сам JSON)"""
+        try:
+            payload = resp.json() if resp is not None and resp.content else {}
+        except ValueError:
+            return {}
+        if isinstance(payload, dict):
+            return payload.get("response", payload)
+        return payload
+
+    # ------------------------------------------------------------------
+    # Пользователи
+    # ------------------------------------------------------------------
+
+    def get_user(self, uuid, **kwargs):
+        """GET /api/users/{uuid}"""
+        return self.get(f"/api/users/{uuid}", **kwargs)
+
+    def get_user_data(self, uuid, **kwargs):
+        """Данные пользователя (dict) или None, если не найден/ошибка"""
+        try:
+            resp = self.get_user(uuid, **kwargs)
+        except requests.RequestException as e:
+            print(f"RemnaWave: failed to get user {uuid}: {e}")
+            return None
+        if resp.status_code != 200:
+            return None
+        data = self.response_data(resp)
+        return data if isinstance(data, dict) else None
+
+    def get_users_data(self, uuids, **kwargs):
+        """
+        Данные нескольких пользователей параллельно: {uuid: dict или None}.
+        Одновременно выполняется не больше fanout_workers запросов (на весь процесс).
+        """
+        uuids = list(dict.fromkeys(u for u in uuids if u))
+        if not uuids:
+            return {}
+        if len(uuids) == 1:
+            return {uuids[0]: self.get_user_data(uuids[0], **kwargs)}
+        futures = {u: self.executor.submit(self.get_user_data, u, **kwargs) for u in uuids}
+        result = {}
+        for u, future in futures.items():
+            try:
+                result[u] = future.result()
+            except Exception as e:
+                print(f"RemnaWave: failed to get user {u}: {e}")
+                result[u] = None
+        return result
+
+    def get_user_by_short_uuid(self, short_uuid, **kwargs):
+        """GET /api/users/by-short-uuid/{short_uuid}"""
+        return self.get(f"/api/users/by-short-uuid/{short_uuid}", **kwargs)
+
+    def get_users_by_email(self, email, **kwargs):
+        """GET /api/users/by-email/{email}"""
+        return self.get(f"/api/users/by-email/{urllib.parse.quote(email, safe='')}", **kwargs)
+
+    def get_users_by_telegram_id(self, telegram_id, **kwargs):
+        """GET /api/users/by-telegram-id/{telegram_id}"""
+        return self.get(f"/api/users/by-telegram-id/{telegram_id}", **kwargs)
+
+    def create_user(self, payload, **kwargs):
+        """POST /api/users"""
+        resp = self.post("/api/users", json=payload, **kwargs)
+        self._notify_user_response(resp)
+        return resp
+
+    def patch_user(self, payload, **kwargs):
+        """PATCH /api/users (payload должен содержать uuid)"""
+        resp = self.patch("/api/users", json=payload, **kwargs)
+        self._notify_user_response(resp)
+        return resp
+
+    def delete_user(self, uuid, **kwargs):
+        """DELETE /api/users/{uuid}"""
+        resp = self.delete(f"/api/users/{uuid}", **kwargs)
+        if self._user_listeners and resp.status_code in (200, 204, 404):
+            self._notify_user("delete", uuid)
+        return resp
+
+    def accessible_nodes(self, uuid, **kwargs):
+        """GET /api/users/{uuid}/accessible-nodes"""
+        return self.get(f"/api/users/{uuid}/accessible-nodes", **kwargs)
+
+    def list_users_paged(self, page_size=1000, max_users=50000, with_total=False, **kwargs):
+        """
+        Постранично обойти /api/users (size/start).
+        Генератор отдает списки пользователей по страницам
+        (with_total=True - пары (список, total из ответа API или None)).
+        Ответ страницы не 2xx - requests.HTTPError (список не считается пустым).
+        """
+        start = 0
+        total = None
+        fetched = 0
+        while True:
+            resp = self.get("/api/users", params={"size": page_size, "start": start}, **kwargs)
+            if not 200 <= resp.status_code < 300:
+                raise requests.HTTPError(f"RemnaWave /api/users (start={start}): HTTP {resp.status_code}", response=resp)
+            data = self.response_data(resp)
+
+            if isinstance(data, dict):
+                chunk = data.get("users", []) or []
+                if total is None:
+                    try:
+                        total = int(data.get("total")) if data.get("total") is not None else None
+                    except Exception:
+                        total = None
+            elif isinstance(data, list):
+                chunk = data
+            else:
+                chunk = []
+
+            if not isinstance(chunk, list) or len(chunk) == 0:
+                break
+
+            yield (chunk, total) if with_total else chunk
+            fetched += len(chunk)
+            start += page_size
+
+            if total is not None and fetched >= total:
+                break
+            # Защита от бесконечного цикла, если API ведет себя неожиданно
+            if start > max_users:
+                break
+
+    # ------------------------------------------------------------------
+    # Ноды и сквады
+    # ------------------------------------------------------------------
+
+    def nodes(self, **kwargs):
+        """GET /api/nodes"""
+        return self.get("/api/nodes", **kwargs)
+
+    def public_nodes(self, **kwargs):
+        """GET /api/nodes/public"""
+        return self.get("/api/nodes/public", **kwargs)
+
+    def node_action(self, uuid, action, **kwargs):
+        """POST /api/nodes/{uuid}/actions/{action} (enable/disable)"""
+        return self.post(f"/api/nodes/{uuid}/actions/{action}", **kwargs)
+
+    def restart_node(self, uuid, **kwargs):
+        """POST /api/nodes/{uuid}/restart"""
+        return self.post(f"/api/nodes/{uuid}/restart", **kwargs)
+
+    def restart_all_nodes(self, **kwargs):
+        """POST /api/nodes/restart-all"""
+        return self.post("/api/nodes/restart-all", **kwargs)
+
+    def squads(self, **kwargs):
+        """GET /api/internal-squads"""
+        return self.get("/api/internal-squads", **kwargs)
+
+
+# Общий клиент: сессия внутри пересоздается в каждом worker-процессе после fork
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_remnawave():
+    """Возвращает общий экземпляр RemnaWaveClient"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RemnaWaveClient()
+    return _client
+
+
+__all__ = ['RemnaWaveClient', 'get_remnawave']
@@ -0,0 +1,414 @@
+"""
+Снимок пользователей RemnaWave
+
+Полный список /api/users (десятки тысяч записей) больше не выкачивается на каждый
+запрос админки и каждую авто-рассылку. Снимок обновляется в фоне и хранится:
+- в Redis (CACHE_TYPE=redis): хэши rw:users:by_uuid (uuid -> JSON),
+  rw:users:by_email (email/username -> uuid) и rw:users:versions (uuid -> updatedAt),
+  общие для всех worker'ов;
+- иначе - в памяти процесса.
+
+Обновление инкрементальное: в хранилище записываются только пользователи,
+у которых изменился updatedAt, и удаляются исчезнувшие. Версии записываются
+одной транзакцией с данными, поэтому не опережают их. Удаление выполняется
+только по полному списку (получено столько пользователей, сколько сообщил API).
+Мутации через RemnaWaveClient (create/patch/delete) сразу попадают в снимок.
+
+Настройки:
+- REMNAWAVE_SNAPSHOT_INTERVAL - период фонового обновления в секундах (по умолчанию 300)
+
+Использование:
+    from modules.remnawave_snapshot import get_users_snapshot
+
+    snapshot = get_users_snapshot()
+    live_map = snapshot.get_map()
+    user = snapshot.get(uuid) or snapshot.find_by_email(["user@example.com"])
+"""
+
+import os
+import json
+import time
+import uuid as uuid_lib
+import threading
+
+from modules.core import get_redis
+from modules.remnawave import get_remnawave
+
+
+KEY_BY_UUID = "rw:users:by_uuid"
+KEY_BY_EMAIL = "rw:users:by_email"
+KEY_VERSIONS = "rw:users:versions"
+KEY_META = "rw:users:meta"
+KEY_LOCK = "rw:users:refresh_lock"
+
+
+def _email_keys(user):
+    """Ключи индекса по email/username (в нижнем регистре)"""
+    keys = []
+    for field in ('email', 'username', 'name'):
+        value = user.get(field)
+        if value and isinstance(value, str):
+            keys.append(value.lower())
+    return keys
+
+
+def _version(user):
+    """Версия записи пользователя (updatedAt или хеш содержимого)"""
+    return user.get('updatedAt') or json.dumps(user, sort_keys=True, default=str)
+
+
+class UsersSnapshot:
+    """Фоново обновляемый снимок пользователей RemnaWave (по UUID и email)"""
+
+    def __init__(self, interval=None, page_size=1000):
+        self.interval = int(interval if interval is not None else os.getenv("REMNAWAVE_SNAPSHOT_INTERVAL", 300))
+        self.page_size = page_size
+
+        # Локальное хранилище и версии (updatedAt) - при отсутствии Redis
+        self._by_uuid = {}
+        self._by_email = {}
+        self._versions = {}
+        self._refreshed_at = 0.0
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    # ------------------------------------------------------------------
+    # Хранилище
+    # ------------------------------------------------------------------
+
+    @property
+    def redis(self):
+        return get_redis()
+
+    def refreshed_at(self):
+        """Время последнего полного обновления (unix time), 0 если снимка нет"""
+        r = self.redis
+        if r is not None:
+            try:
+                value = r.hget(KEY_META, "refreshed_at")
+                return float(value) if value else 0.0
+            except Exception as e:
+                print(f"Warning: snapshot meta read failed: {e}")
+        return self._refreshed_at
+
+    def age(self):
+        refreshed_at = self.refreshed_at()
+        return time.time() - refreshed_at if refreshed_at else None
+
+    def _acquire_refresh_lock(self):
+        r = self.redis
+        if r is not None:
+            token = uuid_lib.uuid4().hex
+            try:
+                if r.set(KEY_LOCK, token, nx=True, ex=max(self.interval, 120)):
+                    return token
+                return None
+            except Exception as e:
+                print(f"Warning: snapshot lock failed: {e}")
+        return "local" if self._lock.acquire(blocking=False) else None
+
+    def _release_refresh_lock(self, token):
+        if token == "local":
+            self._lock.release()
+            return
+        r = self.redis
+        if r is not None:
+            try:
+                if r.get(KEY_LOCK) == token.encode():
+                    r.delete(KEY_LOCK)
+            except Exception:
+                pass
+
+    # ------------------------------------------------------------------
+    # Обновление
+    # ------------------------------------------------------------------
+
+    def refresh(self):
+        """
+        Обновить снимок из RemnaWave (если другой процесс уже обновляет - ничего не делает).
+        Возвращает количество измененных записей или None, если обновление не выполнялось.
+        """
+        remnawave = get_remnawave()
+        if not remnawave.configured:
+            return None
+
+        token = self._acquire_refresh_lock()
+        if not token:
+            return None
+
+        try:
+            # Хранилище пустое (первый запуск / сброс Redis) - записываем всех, а не только изменения
+            versions = self._load_versions() if self.refreshed_at() else {}
+            started = time.time()
+            seen = set()
+            changed = {}
+            listed = 0
+            total = None
+            for chunk, total in remnawave.list_users_paged(page_size=self.page_size, timeout=20, with_total=True):
+                listed += len(chunk)
+                for u in chunk:
+                    if not isinstance(u, dict) or not u.get('uuid'):
+                        continue
+                    user_uuid = str(u['uuid'])
+                    seen.add(user_uuid)
+                    if versions.get(user_uuid) != _version(u):
+                        changed[user_uuid] = u
+
+            # Неполный список (обрезан или без total) не означает, что остальные пользователи удалены
+            if total is not None and listed >= total:
+                removed = [u for u in self._stored_uuids() if u not in seen]
+            else:
+                removed = []
+                print(f"[RW SNAPSHOT] Listing incomplete ({listed} of {total}), removals skipped")
+
+            if not self._apply(changed, removed, full=True):
+                return None
+            print(f"[RW SNAPSHOT] {len(seen)} users, {len(changed)} changed, {len(removed)} removed in {time.time() - started:.1f}s")
+            return len(changed) + len(removed)
+        except Exception as e:
+            print(f"Warning: RemnaWave snapshot refresh failed: {e}")
+            return None
+        finally:
+            self._release_refresh_lock(token)
+
+    def _load_versions(self):
+        """Версии записей снимка {uuid: version} (при ошибке чтения - пустой словарь, т.е. полная перезапись)"""
+        r = self.redis
+        if r is not None:
+            try:
+                return {k.decode(): v.decode() for k, v in r.hgetall(KEY_VERSIONS).items()}
+            except Exception as e:
+                print(f"Warning: snapshot versions read failed: {e}")
+                return {}
+        return dict(self._versions)
+
+    def _stored_uuids(self):
+        """UUID всех пользователей в хранилище"""
+        r = self.redis
+        if r is not None:
+            return [k.decode() for k in r.hkeys(KEY_BY_UUID)]
+        return list(self._by_uuid)
+
+    def _stale_email_keys(self, old_rows, changed):
+        """Ключи индекса email, которые были у пользователя, но отсутствуют в новой записи: {key: uuid}"""
+        stale = {}
+        for user_uuid, old in old_rows:
+            if not old:
+                continue
+            new_keys = set(_email_keys(changed[user_uuid])) if user_uuid in changed else set()
+            for key in _email_keys(old):
+                if key not in new_keys:
+                    stale[key] = user_uuid
+        return stale
+
+    def _apply(self, changed, removed, full=False):
+        """
+        Записать изменения (данные, индекс email, версии) в хранилище.
+        False - запись в Redis не удалась (версии сброшены, следующее обновление перезапишет всех).
+        """
+        now = time.time()
+        r = self.redis
+        if r is not None:
+            try:
+                self._apply_redis(r, changed, removed, full, now)
+                return True
+            except Exception as e:
+                print(f"Warning: snapshot write to Redis failed: {e}")
+                try:
+                    r.delete(KEY_VERSIONS)
+                except Exception:
+                    pass
+                self._versions.clear()
+                return False
+
+        old_rows = [(u, self._by_uuid.get(u)) for u in list(changed) + list(removed)]
+        for key, user_uuid in self._stale_email_keys(old_rows, changed).items():
+            if self._by_email.get(key) == user_uuid:
+                del self._by_email[key]
+        for user_uuid in removed:
+            self._by_uuid.pop(user_uuid, None)
+            self._versions.pop(user_uuid, None)
+        for user_uuid, u in changed.items():
+            self._by_uuid[user_uuid] = u
+            self._versions[user_uuid] = _version(u)
+            for key in _email_keys(u):
+                self._by_email[key] = user_uuid
+        if full:
+            self._refreshed_at = now
+        return True
+
+    def _apply_redis(self, r, changed, removed, full, now):
+        uuids = list(changed) + list(removed)
+        old_rows = []
+        for i in range(0, len(uuids), 1000):
+            batch = uuids[i:i + 1000]
+            old_rows.extend((u, json.loads(row) if row else None) for u, row in zip(batch, r.hmget(KEY_BY_UUID, batch)))
+        stale = self._stale_email_keys(old_rows, changed)
+        # Ключ email мог перейти к другому пользователю - удаляем только свои
+        stale_keys = list(stale)
+        drop = []
+        for i in range(0, len(stale_keys), 1000):
+            batch = stale_keys[i:i + 1000]
+            for key, owner in zip(batch, r.hmget(KEY_BY_EMAIL, batch)):
+                if owner and owner.decode() == stale[key]:
+                    drop.append(key)
+
+        # MULTI/EXEC: данные, индекс и версии записываются вместе
+        pipe = r.pipeline(transaction=True)
+        if drop:
+            pipe.hdel(KEY_BY_EMAIL, *drop)
+        if removed:
+            pipe.hdel(KEY_BY_UUID, *removed)
+            pipe.hdel(KEY_VERSIONS, *removed)
+        items = list(changed.items())
+        for i in range(0, len(items), 1000):
+            batch = items[i:i + 1000]
+            pipe.hset(KEY_BY_UUID, mapping={k: json.dumps(v, default=str) for k, v in batch})
+            pipe.hset(KEY_VERSIONS, mapping={k: _version(v) for k, v in batch})
+            email_map = {}
+            for k, v in batch:
+                for key in _email_keys(v):
+                    email_map[key] = k
+            if email_map:
+                pipe.hset(KEY_BY_EMAIL, mapping=email_map)
+        if full:
+            pipe.hset(KEY_META, mapping={"refreshed_at": now})
+        pipe.execute()
+
+    def upsert(self, user):
+        """Точечно обновить пользователя в снимке (после create/patch)"""
+        if isinstance(user, dict) and user.get('uuid'):
+            self._apply({str(user['uuid']): user}, [])
+
+    def remove(self, user_uuid):
+        """Удалить пользователя из снимка (после delete)"""
+        if user_uuid:
+            self._apply({}, [str(user_uuid)])
+
+    # ------------------------------------------------------------------
+    # Фоновое обновление
+    # ------------------------------------------------------------------
+
+    def _loop(self):
+        while True:
+            try:
+                age = self.age()
+                if age is None or age >= self.interval:
+                    self.refresh()
+            except Exception as e:
+                print(f"Warning: snapshot loop error: {e}")
+            time.sleep(max(self.interval // 4, 15))
+
+    def start(self):
+        """Запустить фоновый поток обновления (один на процесс, переживает fork)"""
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="remnawave-snapshot", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def ensure_loaded(self, background=True):
+        """
+        Гарантировать наличие снимка: если его еще нет - загрузить синхронно
+        (только первый раз), иначе обновление идет в фоне.
+        background=False (разовые скрипты/задачи) - устаревший снимок обновляется синхронно.
+        """
+        if background:
+            self.start()
+            if not self.refreshed_at():
+                self.refresh()
+            return
+        age = self.age()
+        if age is None or age >= self.interval:
+            self.refresh()
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def get_map(self, background=True):
+        """Словарь uuid -> данные пользователя RemnaWave"""
+        self.ensure_loaded(background=background)
+        r = self.redis
+        if r is not None:
+            try:
+                rows = r.hgetall(KEY_BY_UUID)
+                return {k.decode(): json.loads(v) for k, v in rows.items()}
+            except Exception as e:
+                print(f"Warning: snapshot read from Redis failed: {e}")
+        return dict(self._by_uuid)
+
+    def get_many(self, uuids, background=True):
+        """Словарь uuid -> данные только для указанных UUID"""
+        uuids = [str(u) for u in uuids if u]
+        if not uuids:
+            return {}
+        self.ensure_loaded(background=background)
+        r = self.redis
+        if r is not None:
+            try:
+                rows = r.hmget(KEY_BY_UUID, uuids)
+                return {k: json.loads(v) for k, v in zip(uuids, rows) if v}
+            except Exception as e:
+                print(f"Warning: snapshot read from Redis failed: {e}")
+        return {k: self._by_uuid[k] for k in uuids if k in self._by_uuid}
+
+    def get(self, user_uuid, background=True):
+        """Данные одного пользователя или None"""
+        return self.get_many([user_uuid], background=background).get(str(user_uuid)) if user_uuid else None
+
+    def find_by_email(self, keys, background=True):
+        """Найти пользователя по первому совпавшему email/username из списка вариантов"""
+        keys = [k.lower() for k in keys if k]
+        if not keys:
+            return None
+        self.ensure_loaded(background=background)
+        r = self.redis
+        if r is not None:
+            try:
+                for user_uuid in r.hmget(KEY_BY_EMAIL, keys):
+                    if user_uuid:
+                        return self.get(user_uuid.decode(), background=background)
+                return None
+            except Exception as e:
+                print(f"Warning: snapshot read from Redis failed: {e}")
+        for key in keys:
+            user_uuid = self._by_email.get(key)
+            if user_uuid and user_uuid in self._by_uuid:
+                return self._by_uuid[user_uuid]
+        return None
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_users_snapshot():
+    """Возвращает общий экземпляр UsersSnapshot"""
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = UsersSnapshot()
+                get_remnawave().add_user_listener(_on_user_changed)
+    return _snapshot
+
+
+def _on_user_changed(action, payload):
+    """Обработчик мутаций из RemnaWaveClient"""
+    try:
+        if action == 'upsert':
+            _snapshot.upsert(payload)
+        elif action == 'delete':
+            _snapshot.remove(payload)
+    except Exception as e:
+        print(f"Warning: snapshot update failed: {e}")
+
+
+__all__ = ['UsersSnapshot', 'get_users_snapshot']
@@ -0,0 +1,308 @@
+"""
+Планировщик фоновых задач (отдельный процесс: scheduler_worker.py)
+
+Автоматическая рассылка запускается в часы из настроек (AutoBroadcastSettings,
+fallback - AUTO_BROADCAST_ENABLED / AUTO_BROADCAST_HOURS). Настройки читаются
+на каждом такте, поэтому изменения в админке применяются без перезапуска.
+
+Одновременно задачи выполняет только один экземпляр (лидер):
+- при CACHE_TYPE=redis - ключ в Redis с TTL (SCHEDULER_LOCK_TTL), который лидер продлевает;
+  если лидер умер, через TTL задачи забирает другой экземпляр
+- без Redis - файловая блокировка instance/scheduler.lock (экземпляры на одном хосте)
+Каждый запуск рассылки дополнительно отмечается в общем кэше (auto_broadcast:slot:<дата><час>),
+поэтому смена лидера в середине часа не приводит к повторной рассылке.
+
+Лидер также подхватывает ожидающие задания ручной рассылки и события платежей
+(если worker'ы API были перезапущены до их выполнения).
+
+Прогресс текущего/последнего запуска: get_auto_broadcast_progress()
+(показывается в /api/admin/auto-broadcast-settings).
+"""
+
+import os
+import time
+import socket
+import threading
+import uuid as uuid_lib
+from datetime import datetime, timezone
+
+from modules.core import get_app, get_cache, get_redis
+
+
+SCHEDULER_TICK_SECONDS = int(os.getenv("SCHEDULER_TICK_SECONDS", 30))
+SCHEDULER_LOCK_TTL = int(os.getenv("SCHEDULER_LOCK_TTL", 90))
+SCHEDULER_SWEEP_SECONDS = int(os.getenv("SCHEDULER_SWEEP_SECONDS", 60))
+
+LEADER_LOCK_KEY = "scheduler:leader"
+SLOT_KEY_PREFIX = "auto_broadcast:slot:"
+SLOT_KEY_TTL = 2 * 86400
+PROGRESS_KEY = "auto_broadcast:progress"
+PROGRESS_TTL = 7 * 86400
+
+# Продление/снятие блокировки только владельцем (значение ключа = токен экземпляра)
+_RENEW_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) else return 0 end"
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ============================================================================
+# БЛОКИРОВКА ЛИДЕРА
+# ============================================================================
+
+class LeaderLock:
+    """Блокировка "только один экземпляр": Redis (между хостами) или файл (один хост)"""
+
+    def __init__(self, key=LEADER_LOCK_KEY, ttl=SCHEDULER_LOCK_TTL, lock_path=None):
+        self.key = key
+        self.ttl = max(int(ttl), 10)
+        self.token = f"{worker_id()}:{uuid_lib.uuid4().hex[:8]}"
+        self.lock_path = lock_path
+        self.held = False
+        self._file = None
+        self._mutex = threading.Lock()  # acquire вызывают основной цикл и поток продления
+
+    def _acquire_redis(self, r):
+        if self.held and r.eval(_RENEW_SCRIPT, 1, self.key, self.token, self.ttl):
+            return True
+        return bool(r.set(self.key, self.token, nx=True, ex=self.ttl))
+
+    def _acquire_file(self):
+        if self._file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            # Нет fcntl (Windows) - считаем экземпляр единственным
+            return True
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        f = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def acquire(self):
+        """Захватить или продлить блокировку. Возвращает True, если экземпляр - лидер"""
+        r = get_redis()
+        with self._mutex:
+            try:
+                if r is not None:
+                    held = self._acquire_redis(r)
+                else:
+                    held = self._acquire_file()
+            except Exception as e:
+                # Redis недоступен - не выполняем задачи, чтобы не разослать дважды
+                print(f"⚠️ [scheduler] Блокировка лидера недоступна: {e}")
+                held = False
+            if held != self.held:
+                print(f"{'👑' if held else '💤'} [scheduler] {self.token}: {'лидер' if held else 'не лидер'}")
+            self.held = held
+            return held
+
+    def release(self):
+        r = get_redis()
+        with self._mutex:
+            try:
+                if r is not None and self.held:
+                    r.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+            except Exception as e:
+                print(f"⚠️ [scheduler] Ошибка снятия блокировки: {e}")
+            self.held = False
+
+
+# ============================================================================
+# НАСТРОЙКИ И ПРОГРЕСС АВТОМАТИЧЕСКОЙ РАССЫЛКИ
+# ============================================================================
+
+def get_auto_broadcast_settings():
+    """Настройки автоматической рассылки из БД или переменных окружения"""
+    try:
+        from modules.models.auto_broadcast import AutoBroadcastSettings
+        settings = AutoBroadcastSettings.query.first()
+        if settings:
+            return {'enabled': bool(settings.enabled), 'hours': settings.hours or ''}
+    except Exception as e:
+        print(f"Warning: Could not load auto broadcast settings from DB: {e}")
+    return {
+        'enabled': os.getenv('AUTO_BROADCAST_ENABLED', 'true').lower() == 'true',
+        'hours': os.getenv('AUTO_BROADCAST_HOURS', '9,14,19')
+    }
+
+
+def parse_hours(hours):
+    result = set()
+    for h in str(hours or '').split(','):
+        try:
+            hour = int(h.strip())
+        except ValueError:
+            continue
+        if 0 <= hour <= 23:
+            result.add(hour)
+    return result
+
+
+def save_auto_broadcast_progress(progress):
+    try:
+        get_cache().set(PROGRESS_KEY, progress, timeout=PROGRESS_TTL)
+    except Exception as e:
+        print(f"Warning: auto broadcast progress not saved: {e}")
+
+
+def get_auto_broadcast_progress():
+    """Прогресс текущего или последнего запуска автоматической рассылки (None - нет данных)"""
+    try:
+        return get_cache().get(PROGRESS_KEY)
+    except Exception:
+        return None
+
+
+# ============================================================================
+# ЗАДАЧИ
+# ============================================================================
+
+def _claim_slot(slot):
+    """Отметить запуск слота (True - слот еще не выполнялся ни одним экземпляром)"""
+    try:
+        return bool(get_cache().add(f"{SLOT_KEY_PREFIX}{slot}", worker_id(), timeout=SLOT_KEY_TTL))
+    except Exception as e:
+        print(f"⚠️ [scheduler] Не удалось отметить слот {slot}: {e}")
+        return False
+
+
+def run_auto_broadcast(slot=None):
+    """Выполнить автоматическую рассылку с записью прогресса (блокирующе, нужен app context)"""
+    from send_auto_broadcasts import send_auto_broadcasts
+
+    started = time.time()
+    progress = {
+        'slot': slot,
+        'status': 'running',
+        'worker': worker_id(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'finished_at': None,
+        'elapsed_seconds': 0,
+    }
+
+    def report(stats):
+        progress.update(stats)
+        progress['elapsed_seconds'] = round(time.time() - started, 1)
+        save_auto_broadcast_progress(progress)
+
+    report({})
+    print(f"📬 [scheduler] Запуск автоматической рассылки (слот {slot})...")
+    try:
+        ok = send_auto_broadcasts(progress=report)
+        progress['status'] = 'done' if ok else 'failed'
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        progress['status'] = 'failed'
+        progress['error'] = str(e)[:500]
+    progress['finished_at'] = datetime.now(timezone.utc).isoformat()
+    report({})
+    print(f"{'✅' if progress['status'] == 'done' else '❌'} [scheduler] Автоматическая рассылка: {progress['status']} "
+          f"за {progress['elapsed_seconds']}с")
+    return progress
+
+
+class Scheduler:
+    """Цикл планировщика: такт раз в SCHEDULER_TICK_SECONDS, задачи выполняет только лидер"""
+
+    def __init__(self, app=None, lock=None):
+        self.app = app or get_app()
+        self.lock = lock or LeaderLock(lock_path=os.path.join(self.app.instance_path, "scheduler.lock"))
+        self.stop_event = threading.Event()
+        self._last_sweep = 0.0
+        self._local_slots = set()  # Слоты, выполненные этим процессом (если кэш не общий)
+
+    def _heartbeat(self):
+        # Продлеваем блокировку и во время долгой рассылки
+        interval = max(self.lock.ttl / 3, 1)
+        while not self.stop_event.wait(interval):
+            with self.app.app_context():
+                self.lock.acquire()
+
+    def _due_slot(self, now):
+        settings = get_auto_broadcast_settings()
+        if not settings['enabled'] or now.hour not in parse_hours(settings['hours']):
+            return None
+        slot = now.strftime('%Y%m%d%H')
+        return None if slot in self._local_slots else slot
+
+    def _sweep(self):
+        """Подхватить ожидающие задания ручной рассылки и события платежей"""
+        from modules.broadcast import start_broadcast_worker
+        from modules.payment_events import start_payment_event_worker
+        start_broadcast_worker(self.app)
+        start_payment_event_worker(self.app)
+
+    def tick(self):
+        with self.app.app_context():
+            if not self.lock.acquire():
+                return
+            if time.time() - self._last_sweep >= SCHEDULER_SWEEP_SECONDS:
+                self._last_sweep = time.time()
+                try:
+                    self._sweep()
+                except Exception as e:
+                    print(f"⚠️ [scheduler] Ошибка запуска исполнителей: {e}")
+            # Часы - по локальному времени сервера (как раньше у CronTrigger)
+            slot = self._due_slot(datetime.now())
+            if slot:
+                self._local_slots.add(slot)
+                if _claim_slot(slot):
+                    run_auto_broadcast(slot)
+                else:
+                    print(f"⏭️ [scheduler] Слот {slot} уже выполнен другим экземпляром")
+
+    def run(self):
+        print(f"📅 [scheduler] Запущен {self.lock.token} (такт {SCHEDULER_TICK_SECONDS}с, блокировка {self.lock.ttl}с)")
+        heartbeat = threading.Thread(target=self._heartbeat, name="scheduler-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.tick()
+                except Exception as e:
+                    import traceback
+                    traceback.print_exc()
+                    print(f"❌ [scheduler] Ошибка такта: {e}")
+                self.stop_event.wait(SCHEDULER_TICK_SECONDS)
+        finally:
+            with self.app.app_context():
+                self.lock.release()
+            print("🛑 [scheduler] Остановлен")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_embedded = None
+_embedded_lock = threading.Lock()
+
+
+def start_embedded_scheduler(app=None):
+    """Запустить планировщик потоком текущего процесса (python app.py без scheduler_worker.py)"""
+    global _embedded
+    with _embedded_lock:
+        if _embedded is not None:
+            return _embedded
+        _embedded = Scheduler(app)
+        threading.Thread(target=_embedded.run, name="scheduler", daemon=True).start()
+        return _embedded
+
+
+__all__ = [
+    'LeaderLock', 'Scheduler', 'start_embedded_scheduler', 'run_auto_broadcast',
+    'get_auto_broadcast_settings', 'parse_hours',
+    'get_auto_broadcast_progress', 'save_auto_broadcast_progress',
+]
@@ -0,0 +1,210 @@
+"""
+Настройки-синглтоны (одна строка в таблице) в памяти worker'а
+
+SystemSetting, BrandingSetting, ReferralSetting, BotConfig и TrialSettings
+читаются почти каждым обработчиком, часто несколько раз за запрос. Раньше
+каждое обращение было отдельным запросом .query.first().
+
+Теперь строка загружается один раз и хранится в памяти worker'а как снимок
+только для чтения (SettingsSnapshot). После сохранения в админке вызывается
+invalidate_settings(): она меняет версию в общем кеше (Redis), и остальные
+worker'ы перечитывают настройки при следующей проверке версии (не чаще
+SETTINGS_CHECK_INTERVAL секунд) - в обычном запросе к БД не обращаемся.
+Без общего кеша (CACHE_TYPE=null) другие worker'ы об изменении не узнают,
+поэтому снимки живут только в пределах одного запроса.
+
+Для изменения настроек по-прежнему используется ORM-строка (Model.query.first()),
+снимок изменять нельзя.
+
+Та же версия отдается боту (GET /api/public/config-version, long-poll через
+wait_for_version): бот перечитывает конфигурацию только после ее изменения и
+передает полученную версию (?version=...) - worker со снимком другой версии
+сверяется с общим кешем сразу (ensure_version), а не через SETTINGS_CHECK_INTERVAL.
+
+Long-poll занимает поток worker'а на время ожидания (до CONFIG_VERSION_WAIT_MAX):
+при sync-worker'ах gunicorn это целый процесс. Поэтому ждать могут только запросы
+бота (X-Bot-Key), и не больше CONFIG_VERSION_MAX_WAITERS на процесс.
+"""
+import os
+import time
+import threading
+
+from modules.core import get_cache, get_shared_version, request_cached
+
+
+SETTINGS_VERSION_KEY = 'settings_registry_version'
+SETTINGS_CHECK_INTERVAL = float(os.getenv('SETTINGS_REGISTRY_CHECK_INTERVAL', 5))  # Как часто сверять версию с общим кешем (сек)
+SETTINGS_MAX_AGE = 300  # Перечитать настройки не реже чем раз в 5 минут (если смена версии потерялась)
+CONFIG_VERSION_WAIT_MAX = float(os.getenv('CONFIG_VERSION_WAIT_MAX', 25))  # Максимальное ожидание long-poll (сек)
+CONFIG_VERSION_MAX_WAITERS = int(os.getenv('CONFIG_VERSION_MAX_WAITERS', 1))  # Одновременных long-poll на процесс
+CONFIG_VERSION_POLL_INTERVAL = 0.5  # Как часто long-poll сверяет версию с общим кешем (сек)
+
+_state = {'version': None, 'loaded_at': 0.0, 'checked_at': 0.0, 'snapshots': {}}
+_lock = threading.Lock()
+_waiters = threading.BoundedSemaphore(max(CONFIG_VERSION_MAX_WAITERS, 1))
+
+
+def _load_system():
+    from modules.models.system import SystemSetting
+    return SystemSetting.query.first()
+
+
+def _load_branding():
+    from modules.models.branding import BrandingSetting
+    return BrandingSetting.query.first()
+
+
+def _load_referral():
+    from modules.models.referral import ReferralSetting
+    return ReferralSetting.query.first()
+
+
+def _load_bot_config():
+    from modules.models.bot_config import BotConfig
+    return BotConfig.query.first()
+
+
+def _load_trial():
+    # Создает настройки по умолчанию, если их еще нет
+    from modules.models.trial import get_trial_settings
+    return get_trial_settings()
+
+
+LOADERS = {
+    'system': _load_system,
+    'branding': _load_branding,
+    'referral': _load_referral,
+    'bot_config': _load_bot_config,
+    'trial': _load_trial,
+}
+
+
+class SettingsSnapshot:
+    """Копия колонок строки настроек. Только для чтения."""
+
+    def __init__(self, row):
+        for column in row.__table__.columns:
+            object.__setattr__(self, column.key, getattr(row, column.key, None))
+        object.__setattr__(self, '__model__', type(row).__name__)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__model__} snapshot is read-only, change the ORM row and call invalidate_settings()")
+
+    def __repr__(self):
+        return f"<SettingsSnapshot {self.__model__} id={getattr(self, 'id', None)}>"
+
+
+def _current_snapshots(force=False):
+    """Словарь снимков текущей версии (сбрасывается при смене версии)"""
+    state = _state
+    now = time.time()
+    if force or now - state['checked_at'] >= SETTINGS_CHECK_INTERVAL:
+        with _lock:
+            if force or now - state['checked_at'] >= SETTINGS_CHECK_INTERVAL:
+                version = current_version()
+                if version is None or version != state['version'] or now - state['loaded_at'] >= SETTINGS_MAX_AGE:
+                    state.update({'version': version, 'loaded_at': now, 'snapshots': {}})
+                state['checked_at'] = now
+    if state['version'] is None:
+        # Общего кеша нет - снимки только на время запроса
+        return request_cached('settings_snapshots', dict)
+    return state['snapshots']
+
+
+def get_settings(name):
+    """
+    Снимок настроек name ('system', 'branding', 'referral', 'bot_config', 'trial')
+    или None, если строки в БД нет.
+    """
+    loader = LOADERS[name]
+    snapshots = _current_snapshots()
+    if name in snapshots:
+        return snapshots[name]
+    try:
+        row = loader()
+    except Exception as e:
+        print(f"Warning: failed to load {name} settings: {e}")
+        return None
+    snapshot = SettingsSnapshot(row) if row is not None else None
+    # Словарь мог смениться (новая версия) - записываем в тот, из которого читали
+    snapshots[name] = snapshot
+    return snapshot
+
+
+def sync():
+    """
+    Сверить версию с общим кешем сейчас, не дожидаясь SETTINGS_CHECK_INTERVAL.
+    Вызывать перед тем, как ответ из снимков сохраняется надолго (кеш ответов
+    по тегам) или отдается после объявления новой версии (конфигурация бота).
+    Возвращает версию, с которой совпадают снимки.
+    """
+    _current_snapshots(force=True)
+    return _state['version']
+
+
+def ensure_version(version):
+    """Снимки не старше version: если worker видел другую версию, сверить с общим кешем сейчас"""
+    if version and version != _state['version']:
+        return sync()
+    return _state['version']
+
+
+def get_system_settings():
+    return get_settings('system')
+
+
+def get_branding_settings():
+    return get_settings('branding')
+
+
+def get_referral_settings():
+    return get_settings('referral')
+
+
+def get_bot_config():
+    return get_settings('bot_config')
+
+
+def get_trial_settings():
+    return get_settings('trial')
+
+
+def current_version():
+    """Версия настроек из общего кеша (создается, если ее еще нет). None - кеш недоступен"""
+    return get_shared_version(SETTINGS_VERSION_KEY)
+
+
+def wait_for_version(known, timeout):
+    """
+    Дождаться версии, отличной от known (не дольше timeout секунд). Возвращает текущую версию.
+    Если уже ждут CONFIG_VERSION_MAX_WAITERS запросов этого процесса - отвечает сразу.
+    """
+    version = current_version()
+    if version is None or version != known or not _waiters.acquire(blocking=False):
+        return version
+    try:
+        deadline = time.time() + min(timeout, CONFIG_VERSION_WAIT_MAX)
+        while version is not None and version == known and time.time() < deadline:
+            time.sleep(CONFIG_VERSION_POLL_INTERVAL)
+            version = current_version()
+        return version
+    finally:
+        _waiters.release()
+
+
+def invalidate_settings():
+    """Сбросить кеш настроек во всех worker'ах (вызывать после изменения любой из строк настроек)"""
+    try:
+        get_cache().set(SETTINGS_VERSION_KEY, f"{time.time():.6f}", timeout=0)
+    except Exception as e:
+        print(f"Warning: failed to publish settings version: {e}")
+    with _lock:
+        _state.update({'checked_at': 0.0, 'snapshots': {}})
+
+
+__all__ = [
+    'SettingsSnapshot', 'get_settings', 'invalidate_settings', 'current_version', 'wait_for_version', 'sync',
+    'ensure_version',
+    'get_system_settings', 'get_branding_settings', 'get_referral_settings',
+    'get_bot_config', 'get_trial_settings',
+]
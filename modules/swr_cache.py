@@ -0,0 +1,272 @@
+"""
+Кеш данных RemnaWave: single-flight и stale-while-revalidate
+
+live_data_<uuid>, nodes_<uuid>, squads_list, nodes_list раньше читались простым
+get/set с TTL 300с. Когда запись популярного пользователя истекала (или удалялась
+вебхуком), все одновременные запросы шли в RemnaWave.
+
+Теперь у записи два срока:
+- мягкий (soft_ttl) - пока он не истек, значение свежее. Хранится отдельным
+  ключом-маркером <key>:fresh, поэтому само значение лежит под прежним ключом
+  и cache.delete(key) по-прежнему сбрасывает запись
+- жесткий (hard_ttl = soft_ttl + SWR_STALE_SECONDS) - до него устаревшее значение
+  отдается сразу, а обновление выполняет один фоновый поток
+
+Загрузку ключа в каждый момент выполняет только один исполнитель (single-flight):
+- при CACHE_TYPE=redis - блокировка SET NX в Redis (между worker'ами)
+- иначе - блокировка в памяти процесса
+Остальные запросы ждут результата не дольше SWR_WAIT_SECONDS.
+
+Использование:
+    from modules import swr_cache
+
+    data = swr_cache.get_or_load(f'live_data_{uuid}', lambda: remnawave.get_user_data(uuid))
+"""
+
+import os
+import time
+import threading
+import uuid as uuid_lib
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.core import get_app, get_cache, get_redis
+
+
+SWR_STALE_SECONDS = int(os.getenv('SWR_STALE_SECONDS', 600))  # Сколько отдавать устаревшее значение во время обновления
+SWR_LOCK_TTL = int(os.getenv('SWR_LOCK_TTL', 30))  # Максимальное время загрузки одного ключа (сек)
+SWR_WAIT_SECONDS = float(os.getenv('SWR_WAIT_SECONDS', 5))  # Сколько ждать чужую загрузку при промахе
+SWR_REFRESH_WORKERS = int(os.getenv('SWR_REFRESH_WORKERS', 4))
+
+LOCK_PREFIX = 'swr:lock:'
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class _Flight:
+    """Загрузка ключа в этом процессе (ожидающие получают результат без чтения кеша)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+_executor = {'pool': None, 'pid': None}
+
+
+def _fresh_key(key):
+    return f'{key}:fresh'
+
+
+def _hard_ttl(soft_ttl, hard_ttl):
+    return hard_ttl if hard_ttl is not None else soft_ttl + SWR_STALE_SECONDS
+
+
+# ============================================================================
+# ЧТЕНИЕ / ЗАПИСЬ
+# ============================================================================
+
+def read_many(keys):
+    """{key: (значение, свежее ли)} для найденных в кеше ключей (один запрос к кешу)"""
+    keys = list(keys)
+    if not keys:
+        return {}
+    try:
+        values = get_cache().get_many(*[k for key in keys for k in (key, _fresh_key(key))])
+    except Exception as e:
+        print(f"Warning: cache read failed: {e}")
+        return {}
+    result = {}
+    for i, key in enumerate(keys):
+        value, fresh = values[2 * i], values[2 * i + 1]
+        if value is not None:
+            result[key] = (value, bool(fresh))
+    return result
+
+
+def read(key):
+    """(значение, свежее ли); (None, False) - промах"""
+    return read_many([key]).get(key, (None, False))
+
+
+def store_many(values, soft_ttl=300, hard_ttl=None):
+    """Записать значения {key: value} со сроками soft_ttl/hard_ttl"""
+    if not values:
+        return
+    hard_ttl = _hard_ttl(soft_ttl, hard_ttl)
+    try:
+        cache = get_cache()
+        cache.set_many(values, timeout=hard_ttl)
+        cache.set_many({_fresh_key(key): 1 for key in values}, timeout=soft_ttl)
+    except Exception as e:
+        print(f"Warning: cache write failed: {e}")
+
+
+def store(key, value, soft_ttl=300, hard_ttl=None):
+    store_many({key: value}, soft_ttl, hard_ttl)
+
+
+def mark_stale(key):
+    """Считать значение устаревшим: следующее чтение отдаст его и обновит в фоне"""
+    try:
+        get_cache().delete(_fresh_key(key))
+    except Exception:
+        pass
+
+
+# ============================================================================
+# SINGLE-FLIGHT
+# ============================================================================
+
+def acquire(key):
+    """Захватить загрузку ключа. Токен или None, если ключ уже загружает кто-то другой"""
+    with _flights_lock:
+        if key in _flights:
+            return None
+        _flights[key] = _Flight()
+    token = uuid_lib.uuid4().hex
+    r = get_redis()
+    if r is not None:
+        try:
+            if not r.set(f'{LOCK_PREFIX}{key}', token, nx=True, ex=SWR_LOCK_TTL):
+                with _flights_lock:
+                    _flights.pop(key, None).done.set()
+                return None
+        except Exception as e:
+            # Redis недоступен - достаточно блокировки в процессе
+            print(f"Warning: single-flight lock unavailable: {e}")
+    return token
+
+
+def release(key, token, value=None):
+    """Завершить загрузку ключа и разбудить ожидающих в этом процессе"""
+    r = get_redis()
+    if r is not None:
+        try:
+            r.eval(_RELEASE_SCRIPT, 1, f'{LOCK_PREFIX}{key}', token)
+        except Exception:
+            pass
+    with _flights_lock:
+        flight = _flights.pop(key, None)
+    if flight is not None:
+        flight.value = value
+        flight.done.set()
+
+
+def wait_for(key, timeout=None):
+    """Дождаться загрузки ключа другим исполнителем. Значение или None"""
+    timeout = SWR_WAIT_SECONDS if timeout is None else timeout
+    with _flights_lock:
+        flight = _flights.get(key)
+    if flight is not None:
+        flight.done.wait(timeout)
+        if flight.value is not None:
+            return flight.value
+        return read(key)[0]
+
+    # Загружает другой worker - ждем появления значения, пока жива его блокировка
+    r = get_redis()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        value = read(key)[0]
+        if value is not None:
+            return value
+        try:
+            if r is None or not r.exists(f'{LOCK_PREFIX}{key}'):
+                return read(key)[0]
+        except Exception:
+            return None
+        time.sleep(0.05)
+    return None
+
+
+def _load(key, loader, soft_ttl, hard_ttl, token):
+    value = None
+    try:
+        value = loader()
+        if value is not None:
+            store(key, value, soft_ttl, hard_ttl)
+        return value
+    finally:
+        release(key, token, value)
+
+
+def _get_executor():
+    pid = os.getpid()
+    if _executor['pool'] is None or _executor['pid'] != pid:
+        with _flights_lock:
+            if _executor['pool'] is None or _executor['pid'] != pid:
+                _executor['pool'] = ThreadPoolExecutor(max_workers=max(SWR_REFRESH_WORKERS, 1), thread_name_prefix="swr-refresh")
+                _executor['pid'] = pid
+    return _executor['pool']
+
+
+def refresh_async(key, loader, soft_ttl=300, hard_ttl=None):
+    """Обновить ключ в фоне, если его еще никто не обновляет"""
+    token = acquire(key)
+    if not token:
+        return False
+    app = get_app()
+
+    def run():
+        with app.app_context():
+            try:
+                _load(key, loader, soft_ttl, hard_ttl, token)
+            except Exception as e:
+                print(f"Warning: background refresh of {key} failed: {e}")
+
+    try:
+        _get_executor().submit(run)
+    except Exception as e:
+        release(key, token)
+        print(f"Warning: background refresh of {key} not started: {e}")
+        return False
+    return True
+
+
+# ============================================================================
+# ОСНОВНОЙ ИНТЕРФЕЙС
+# ============================================================================
+
+def get_or_load(key, loader, soft_ttl=300, hard_ttl=None, force_refresh=False):
+    """
+    Значение ключа из кеша или loader().
+
+    - свежее значение - возвращается сразу
+    - устаревшее (мягкий срок истек) - возвращается сразу, обновление в фоне
+    - промах - загружает один исполнитель, остальные ждут его результат
+    - force_refresh - загрузить сейчас, минуя кеш
+
+    loader() возвращает значение для кеша или None (нечего кешировать).
+    Исключения loader() при синхронной загрузке передаются вызывающему.
+    """
+    if not force_refresh:
+        value, fresh = read(key)
+        if value is not None:
+            if not fresh:
+                refresh_async(key, loader, soft_ttl, hard_ttl)
+            return value
+
+        token = acquire(key)
+        if not token:
+            value = wait_for(key)
+            if value is not None:
+                return value
+            # Загрузка другим исполнителем не удалась или затянулась - загружаем сами
+            token = None
+    else:
+        token = None
+
+    if token:
+        return _load(key, loader, soft_ttl, hard_ttl, token)
+    value = loader()
+    if value is not None:
+        store(key, value, soft_ttl, hard_ttl)
+    return value
+
+
+__all__ = [
+    'get_or_load', 'refresh_async', 'read', 'read_many', 'store', 'store_many', 'mark_stale',
+    'acquire', 'release', 'wait_for',
+    'SWR_STALE_SECONDS', 'SWR_LOCK_TTL', 'SWR_WAIT_SECONDS',
+]
@@ -0,0 +1,173 @@
+"""
+Кеш публичных ответов с инвалидацией по тегам
+
+Раньше публичные эндпоинты кешировались через @cache.cached, а админка после
+изменений удаляла угаданные ключи ('flask_cache_view//api/public/tariffs',
+'view//api/public/tariffs', ...) и перебирала Redis по маске. Варианты с
+query string при этом не удалялись, и устаревшие данные отдавались до часа.
+
+Теперь каждый ответ записывается под ключом, в который входят версии его тегов
+(tariffs, options, branding, levels, features). invalidate('tariffs') меняет
+версию тега в общем кеше - все записи с этим тегом (с любыми параметрами запроса)
+перестают находиться во всех worker'ах, старые записи удаляются по TTL.
+Поэтому TTL можно делать длинным (TAGGED_CACHE_TIMEOUT, по умолчанию сутки).
+Перед построением ответа при промахе снимки settings_registry сверяются с общей
+версией: иначе worker записал бы под новую версию тега брендинг из снимка,
+который он еще не перечитал (до SETTINGS_REGISTRY_CHECK_INTERVAL секунд), на весь TTL.
+
+Ответы получают ETag (хеш содержимого). Запрос с совпадающим If-None-Match
+получает пустой 304 - бот и фронтенд не скачивают неизменившиеся каталоги.
+Для эндпоинтов без кеша ответа - декоратор conditional.
+
+Использование:
+    from modules import tagged_cache
+
+    @app.route('/api/public/tariffs')
+    @tagged_cache.cached('tariffs')
+    def public_tariffs(): ...
+
+    tagged_cache.invalidate('tariffs')  # после сохранения в админке
+
+    @app.route('/api/public/bot-config')
+    @tagged_cache.conditional
+    def public_bot_config(): ...
+"""
+
+import os
+import time
+import hashlib
+import functools
+import urllib.parse
+
+from flask import request, make_response
+
+from modules.core import get_cache
+from modules import settings_registry
+
+
+TAGGED_CACHE_TIMEOUT = int(os.getenv('TAGGED_CACHE_TIMEOUT', 86400))
+TAG_VERSION_PREFIX = 'cache_tag:'
+ENTRY_PREFIX = 'tagged:'
+
+TARIFFS = 'tariffs'
+OPTIONS = 'options'
+BRANDING = 'branding'
+LEVELS = 'levels'
+FEATURES = 'features'
+
+
+def _new_version():
+    return f"{time.time():.6f}"
+
+
+def tag_versions(tags):
+    """Текущие версии тегов (одним запросом к кешу); отсутствующие версии создаются"""
+    cache = get_cache()
+    keys = [f'{TAG_VERSION_PREFIX}{tag}' for tag in tags]
+    try:
+        versions = list(cache.get_many(*keys))
+    except Exception:
+        return None
+    for i, version in enumerate(versions):
+        if version is None:
+            # Новая версия, а не "0": если ключ версии вытеснен из кеша, старые записи не вернутся
+            try:
+                cache.add(keys[i], _new_version(), timeout=0)
+                versions[i] = cache.get(keys[i])
+            except Exception:
+                return None
+            if versions[i] is None:
+                return None
+    return versions
+
+
+def invalidate(*tags):
+    """Сбросить все записи с любым из тегов (во всех worker'ах)"""
+    try:
+        get_cache().set_many({f'{TAG_VERSION_PREFIX}{tag}': _new_version() for tag in tags}, timeout=0)
+    except Exception as e:
+        print(f"[CACHE] Error invalidating tags {tags}: {e}")
+
+
+def _request_key():
+    """Путь + отсортированные параметры запроса (варианты query string - разные записи)"""
+    args = sorted(request.args.items(multi=True))
+    return f"{request.path}?{urllib.parse.urlencode(args)}" if args else request.path
+
+
+def entry_key(tags, versions):
+    raw = f"{_request_key()}|{'|'.join(f'{t}={v}' for t, v in zip(tags, versions))}"
+    return f"{ENTRY_PREFIX}{request.path}:{hashlib.md5(raw.encode('utf-8')).hexdigest()}"
+
+
+def _conditional_response(response):
+    """ETag по содержимому (если его еще нет) и 304 при совпадении с If-None-Match"""
+    if request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough:
+        if not response.get_etag()[0]:
+            response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def conditional(view):
+    """Декоратор GET-эндпоинта: ETag по содержимому ответа и 304 Not Modified"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return _conditional_response(make_response(view(*args, **kwargs)))
+    return wrapper
+
+
+def cached(*tags, timeout=None):
+    """
+    Декоратор GET-эндпоинта: кешировать успешный (200) ответ под тегами tags.
+    Ответ получает ETag, при совпадении с If-None-Match отдается 304.
+    """
+    timeout = TAGGED_CACHE_TIMEOUT if timeout is None else timeout
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            versions = tag_versions(tags)
+            if versions is None:
+                # Кеш недоступен - отвечаем без него
+                return _conditional_response(make_response(view(*args, **kwargs)))
+
+            cache = get_cache()
+            key = entry_key(tags, versions)
+            try:
+                entry = cache.get(key)
+            except Exception:
+                entry = None
+            if entry:
+                response = make_response(entry['body'], entry['status'])
+                response.headers['Content-Type'] = entry['content_type']
+                if entry.get('etag'):
+                    response.set_etag(entry['etag'])
+                return _conditional_response(response)
+
+            # Админка меняет версию настроек до версии тега - после сверки снимки не старше тега
+            settings_registry.sync()
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                response.add_etag()
+                try:
+                    cache.set(key, {
+                        'body': response.get_data(),
+                        'status': response.status_code,
+                        'content_type': response.headers.get('Content-Type', 'application/json'),
+                        'etag': response.get_etag()[0],
+                    }, timeout=timeout)
+                except Exception as e:
+                    print(f"[CACHE] Error caching {request.path}: {e}")
+            return _conditional_response(response)
+        return wrapper
+    return decorator
+
+
+__all__ = [
+    'cached', 'conditional', 'invalidate', 'tag_versions', 'entry_key', 'TAGGED_CACHE_TIMEOUT',
+    'TARIFFS', 'OPTIONS', 'BRANDING', 'LEVELS', 'FEATURES',
+]
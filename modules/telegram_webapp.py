@@ -0,0 +1,229 @@
+"""
+Проверка initData Telegram Mini App
+
+initData подписана ботом, из которого открыт мини-апп:
+    secret = HMAC_SHA256(key="WebAppData", msg=bot_token)
+    hash   = HMAC_SHA256(key=secret, msg=data_check_string)
+Подпись сверяется с CLIENT_BOT_TOKEN / CLIENT_BOT_V2_TOKEN (мини-апп открывается
+из обоих ботов). Поддельная initData отклоняется до обращения к БД.
+
+Фронтенд присылает одну и ту же initData на все запросы сессии, поэтому
+результат проверки хранится в небольшом LRU (ключ - хэш строки initData):
+повторный запрос не пересчитывает HMAC и не разбирает JSON, проверяется
+только срок жизни auth_date. Там же запоминается user.id, найденный по
+telegram_id, - повторный поиск идет по первичному ключу.
+
+Если токены ботов не заданы, подпись проверить нечем: initData принимается
+без проверки (как раньше), об этом пишется предупреждение в лог.
+"""
+import os
+import json
+import time
+import hmac
+import hashlib
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+from modules.core import get_db
+from modules.models.user import User
+
+db = get_db()
+
+INIT_DATA_MAX_AGE = int(os.getenv('TELEGRAM_INIT_DATA_MAX_AGE', 86400))  # Срок жизни initData (сек), 0 - без ограничения
+INIT_DATA_CACHE_SIZE = int(os.getenv('TELEGRAM_INIT_DATA_CACHE_SIZE', 2048))
+
+_cache = OrderedDict()  # sha256(initData) -> {'telegram_id', 'user', 'auth_date'}
+_user_ids = OrderedDict()  # telegram_id (str) -> user.id
+_lock = threading.Lock()
+_secrets = {}  # bot_token -> secret key
+_warned = {'no_tokens': False}
+
+
+# ============================================================================
+# ПОДПИСЬ
+# ============================================================================
+
+def _bot_tokens():
+    tokens = []
+    for name in ('CLIENT_BOT_TOKEN', 'CLIENT_BOT_V2_TOKEN'):
+        token = (os.getenv(name) or '').strip()
+        if token and token not in tokens and token != 'your_telegram_bot_token_here':
+            tokens.append(token)
+    return tokens
+
+
+def _secret_keys():
+    keys = []
+    for token in _bot_tokens():
+        secret = _secrets.get(token)
+        if secret is None:
+            secret = hmac.new(b'WebAppData', token.encode('utf-8'), hashlib.sha256).digest()
+            _secrets[token] = secret
+        keys.append(secret)
+    return keys
+
+
+def is_validation_enabled():
+    """Проверяется ли подпись initData (задан хотя бы один токен бота)"""
+    if _bot_tokens():
+        return True
+    if not _warned['no_tokens']:
+        _warned['no_tokens'] = True
+        print("Warning: CLIENT_BOT_TOKEN is not set - Telegram initData is accepted without signature check")
+    return False
+
+
+def _to_pairs(init_data):
+    """initData (строка или dict) -> список пар (ключ, значение)"""
+    if isinstance(init_data, dict):
+        pairs = []
+        for key, value in init_data.items():
+            if isinstance(value, list):
+                value = value[0] if value else ''
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+            pairs.append((key, '' if value is None else str(value)))
+        return pairs
+    return urllib.parse.parse_qsl(init_data, keep_blank_values=True)
+
+
+def _check_signature(fields, secrets):
+    received = fields.get('hash')
+    if not received:
+        return False
+    data_check_string = '\n'.join(
+        f"{key}={value}" for key, value in sorted(fields.items()) if key != 'hash'
+    ).encode('utf-8')
+    for secret in secrets:
+        expected = hmac.new(secret, data_check_string, hashlib.sha256).hexdigest()
+        if hmac.compare_digest(expected, received):
+            return True
+    return False
+
+
+def _is_fresh(auth_date):
+    if INIT_DATA_MAX_AGE <= 0:
+        return True
+    return bool(auth_date) and time.time() - auth_date <= INIT_DATA_MAX_AGE
+
+
+# ============================================================================
+# ПРОВЕРКА initData
+# ============================================================================
+
+def _cache_key(init_data):
+    if isinstance(init_data, dict):
+        raw = json.dumps(init_data, sort_keys=True, ensure_ascii=False, default=str)
+    else:
+        raw = init_data
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def validate_init_data(init_data):
+    """
+    Проверяет initData и возвращает запись
+    {'telegram_id', 'user', 'auth_date'} или None,
+    если initData отсутствует, подпись неверна или истек срок auth_date.
+    """
+    if not init_data or not isinstance(init_data, (str, dict)):
+        return None
+
+    key = _cache_key(init_data)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    if entry is not None:
+        if not is_validation_enabled() or _is_fresh(entry['auth_date']):
+            return entry
+        with _lock:
+            _cache.pop(key, None)
+        return None
+
+    try:
+        fields = dict(_to_pairs(init_data))
+    except Exception:
+        return None
+
+    validate = is_validation_enabled()
+    if validate and not _check_signature(fields, _secret_keys()):
+        return None
+
+    try:
+        auth_date = int(fields.get('auth_date') or 0)
+    except (TypeError, ValueError):
+        auth_date = 0
+    if validate and not _is_fresh(auth_date):
+        return None
+
+    try:
+        user_data = json.loads(fields.get('user') or '')
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(user_data, dict) or not user_data.get('id'):
+        return None
+
+    entry = {
+        'telegram_id': user_data.get('id'),
+        'user': user_data,
+        'auth_date': auth_date,
+    }
+    with _lock:
+        _cache[key] = entry
+        while len(_cache) > INIT_DATA_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return entry
+
+
+def unsafe_init_data_allowed():
+    """
+    initDataUnsafe (данные без подписи) принимается только когда подпись
+    проверить нечем - для разработки вне Telegram.
+    """
+    return not is_validation_enabled()
+
+
+# ============================================================================
+# ПОЛЬЗОВАТЕЛЬ ПО telegram_id
+# ============================================================================
+
+def get_user_by_telegram_id(telegram_id):
+    """
+    User по telegram_id. id найденного пользователя запоминается,
+    повторные запросы берут его по первичному ключу (identity map сессии).
+    """
+    if not telegram_id:
+        return None
+    telegram_id = str(telegram_id)
+
+    with _lock:
+        user_id = _user_ids.get(telegram_id)
+        if user_id is not None:
+            _user_ids.move_to_end(telegram_id)
+    if user_id is not None:
+        user = db.session.get(User, user_id)
+        if user is not None and user.telegram_id == telegram_id:
+            return user
+        with _lock:
+            _user_ids.pop(telegram_id, None)
+
+    user = User.query.filter_by(telegram_id=telegram_id).first()
+    if user is not None:
+        with _lock:
+            _user_ids[telegram_id] = user.id
+            while len(_user_ids) > INIT_DATA_CACHE_SIZE:
+                _user_ids.popitem(last=False)
+    return user
+
+
+def clear_init_data_cache():
+    with _lock:
+        _cache.clear()
+        _user_ids.clear()
+
+
+__all__ = [
+    'validate_init_data', 'is_validation_enabled', 'unsafe_init_data_allowed',
+    'get_user_by_telegram_id', 'clear_init_data_cache',
+]
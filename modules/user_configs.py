@@ -0,0 +1,194 @@
+"""
+Статус конфигов пользователя (экран "Мои конфиги" в Mini App и личном кабинете)
+
+Раньше для каждого UserConfig выполнялся отдельный запрос к RemnaWave (при промахе
+кеша live_data_<uuid>) и отдельный запрос последнего платежа - у реселлеров
+с десятками конфигов экран открывался за N x RTT.
+
+Теперь:
+- live_data всех конфигов читается из кеша одним get_many, промахи запрашиваются
+  в RemnaWave параллельно (RemnaWaveClient.get_users_data, ограниченный пул);
+  устаревшие записи отдаются сразу и обновляются в фоне (modules/swr_cache.py)
+- последние оплаченные платежи по всем конфигам - один сгруппированный запрос,
+  тарифы к ним - еще один
+
+Использование:
+    from modules.user_configs import resolve_live_data, get_live_data, get_last_paid_tariffs
+
+    live = resolve_live_data([c.remnawave_uuid for c in configs])
+    data = get_live_data(user.remnawave_uuid)
+    tariffs = get_last_paid_tariffs(user.id)
+    tariff = tariffs.get(config.id) or tariffs.get(None)
+"""
+
+import requests
+from sqlalchemy import select, func, and_, or_
+
+from modules.core import get_db
+from modules.remnawave import get_remnawave
+from modules import swr_cache
+
+
+LIVE_DATA_TIMEOUT = 300
+
+
+def live_data_key(remnawave_uuid):
+    return f'live_data_{remnawave_uuid}'
+
+
+def fetch_live_data(remnawave_uuid):
+    """Запрос данных пользователя в RemnaWave, минуя кеш (requests.HTTPError, если ответ не 200)"""
+    remnawave = get_remnawave()
+    resp = remnawave.get_user(remnawave_uuid)
+    if resp.status_code != 200:
+        raise requests.HTTPError(f"RemnaWave: HTTP {resp.status_code}", response=resp)
+    data = remnawave.response_data(resp)
+    return data if isinstance(data, dict) and data else None
+
+
+def _load_live_data(remnawave_uuid):
+    try:
+        return fetch_live_data(remnawave_uuid)
+    except requests.RequestException as e:
+        print(f"RemnaWave: failed to get user {remnawave_uuid}: {e}")
+        return None
+
+
+def get_live_data(remnawave_uuid, force_refresh=False, raise_errors=False):
+    """
+    Данные пользователя RemnaWave (dict) из кеша live_data_<uuid> или None.
+    Устаревшая запись отдается сразу и обновляется в фоне (см. modules/swr_cache.py).
+    raise_errors=True - ошибки запроса к RemnaWave (requests.RequestException) передаются вызывающему.
+    """
+    if not remnawave_uuid:
+        return None
+    return swr_cache.get_or_load(
+        live_data_key(remnawave_uuid),
+        (lambda: fetch_live_data(remnawave_uuid)) if raise_errors else (lambda: _load_live_data(remnawave_uuid)),
+        soft_ttl=LIVE_DATA_TIMEOUT,
+        force_refresh=force_refresh,
+    )
+
+
+def resolve_live_data(uuids, force_refresh=False):
+    """
+    Данные RemnaWave для списка UUID: {uuid: dict} (пустой dict - нет данных).
+    Кеш live_data_<uuid> читается одним запросом, устаревшие записи обновляются в фоне,
+    промахи загружаются параллельно (ключи, которые уже загружает кто-то другой, - ждем).
+    """
+    uuids = list(dict.fromkeys(u for u in uuids if u))
+    result = {}
+
+    if not force_refresh and uuids:
+        cached = swr_cache.read_many([live_data_key(u) for u in uuids])
+        for u in uuids:
+            data, fresh = cached.get(live_data_key(u), (None, False))
+            if isinstance(data, dict) and data:
+                result[u] = data
+                if not fresh:
+                    swr_cache.refresh_async(live_data_key(u), lambda u=u: _load_live_data(u), soft_ttl=LIVE_DATA_TIMEOUT)
+
+    missed = [u for u in uuids if u not in result]
+    remnawave = get_remnawave()
+    if missed and remnawave.base_url:
+        tokens = {}
+        waiting = []
+        for u in missed:
+            token = swr_cache.acquire(live_data_key(u)) if not force_refresh else None
+            if token or force_refresh:
+                tokens[u] = token
+            else:
+                waiting.append(u)
+
+        fetched = {}
+        try:
+            fetched = remnawave.get_users_data(list(tokens))
+        finally:
+            fresh = {u: data for u, data in fetched.items() if isinstance(data, dict) and data}
+            swr_cache.store_many({live_data_key(u): data for u, data in fresh.items()}, soft_ttl=LIVE_DATA_TIMEOUT)
+            for u, token in tokens.items():
+                if token:
+                    swr_cache.release(live_data_key(u), token, fresh.get(u))
+        result.update(fresh)
+
+        for u in waiting:
+            data = swr_cache.wait_for(live_data_key(u))
+            if not data:
+                data = _load_live_data(u)
+                if data:
+                    swr_cache.store(live_data_key(u), data, soft_ttl=LIVE_DATA_TIMEOUT)
+            if isinstance(data, dict) and data:
+                result[u] = data
+
+    for u in uuids:
+        result.setdefault(u, {})
+    return result
+
+
+NODES_TIMEOUT = 600
+
+
+def nodes_key(remnawave_uuid):
+    return f'nodes_{remnawave_uuid}'
+
+
+def get_accessible_nodes(remnawave_uuid, force_refresh=False):
+    """
+    Доступные пользователю ноды (ответ /api/users/{uuid}/accessible-nodes) из кеша nodes_<uuid>.
+    Ошибки запроса (requests.RequestException) передаются вызывающему.
+    """
+    def load():
+        resp = get_remnawave().accessible_nodes(remnawave_uuid)
+        resp.raise_for_status()
+        return resp.json()
+
+    return swr_cache.get_or_load(nodes_key(remnawave_uuid), load, soft_ttl=NODES_TIMEOUT, force_refresh=force_refresh)
+
+
+def get_last_paid_tariffs(user_id):
+    """
+    Тариф последнего оплаченного платежа пользователя по каждому конфигу:
+    {user_config_id: Tariff}. Ключ None - тариф самого последнего оплаченного платежа
+    пользователя (для конфигов без своих платежей).
+    Два запроса независимо от количества конфигов.
+    """
+    from modules.models.payment import Payment
+    from modules.models.tariff import Tariff
+
+    db = get_db()
+    paid = and_(Payment.user_id == user_id, Payment.status == 'PAID', Payment.tariff_id.isnot(None))
+    latest = (
+        select(Payment.user_config_id, func.max(Payment.created_at).label('created_at'))
+        .where(paid)
+        .group_by(Payment.user_config_id)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(Payment.user_config_id, Payment.tariff_id, Payment.created_at)
+        .join(latest, and_(
+            Payment.created_at == latest.c.created_at,
+            or_(
+                Payment.user_config_id == latest.c.user_config_id,
+                and_(Payment.user_config_id.is_(None), latest.c.user_config_id.is_(None)),
+            ),
+        ))
+        .where(paid)
+        .order_by(Payment.id.desc())
+    ).all()
+
+    last = {}  # user_config_id -> (created_at, tariff_id)
+    for config_id, tariff_id, created_at in rows:
+        last.setdefault(config_id, (created_at, tariff_id))
+    if not last:
+        return {}
+
+    tariff_ids = {tariff_id for _, tariff_id in last.values()}
+    tariffs = {t.id: t for t in Tariff.query.filter(Tariff.id.in_(tariff_ids)).all()}
+
+    result = {config_id: tariffs.get(tariff_id) for config_id, (_, tariff_id) in last.items()}
+    newest_config = max(last, key=lambda k: last[k][0])
+    result[None] = tariffs.get(last[newest_config][1])
+    return result
+
+
+__all__ = ['get_live_data', 'fetch_live_data', 'get_accessible_nodes', 'nodes_key', 'resolve_live_data', 'get_last_paid_tariffs', 'live_data_key', 'LIVE_DATA_TIMEOUT']
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк генерации изображения тарифа (modules/image_generator/tariff_image.py)
+
+Замеряет время рендера (холодный первый вызов и медиана повторных) и пиковую
+память процесса. Каждый вариант запускается в отдельном процессе, чтобы
+пиковая память (ru_maxrss) не смешивалась между вариантами.
+
+Сравнение с предыдущей версией модуля из git:
+    python other/tools/benchmark_tariff_image.py --baseline HEAD~1
+Только текущая версия:
+    python other/tools/benchmark_tariff_image.py -n 20
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+MODULE_PATH = 'modules/image_generator/tariff_image.py'
+
+SAMPLE = dict(
+    tier_name="Премиум",
+    tier_icon="⭐",
+    features=[{"name": f"Функция {i}", "icon": "✓"} for i in range(1, 6)],
+    tariffs=[
+        {"name": f"{days} дней", "duration_days": days, "price_uah": price}
+        for days, price in ((30, 150), (90, 400), (180, 750), (365, 1400))
+    ],
+    currency="uah",
+    currency_symbol="₴",
+    primary_color=(63, 105, 255),
+)
+
+
+def load_generator(source=None):
+    """generate_tariff_image текущей версии или из исходника другой ревизии"""
+    if source is None:
+        from modules.image_generator.tariff_image import generate_tariff_image
+        return generate_tariff_image
+    module = types.ModuleType('tariff_image_baseline')
+    exec(compile(source, f'<baseline {MODULE_PATH}>', 'exec'), module.__dict__)
+    return module.generate_tariff_image
+
+
+def run_variant(label, source, iterations, queue):
+    generate = load_generator(source)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    image = generate(**SAMPLE)
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        generate(**SAMPLE)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "label": label,
+        "cold_ms": cold_ms,
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "peak_rss_mb": rss_after / 1024,
+        "peak_delta_mb": (rss_after - rss_before) / 1024,
+        "size_kb": len(image) / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк генерации изображения тарифа")
+    parser.add_argument('--baseline', help="git-ревизия для сравнения (например HEAD~1)")
+    parser.add_argument('-n', '--iterations', type=int, default=10, help="количество повторных рендеров")
+    args = parser.parse_args()
+
+    variants = []
+    if args.baseline:
+        source = subprocess.check_output(
+            ['git', 'show', f'{args.baseline}:{MODULE_PATH}'], cwd=ROOT, text=True
+        )
+        variants.append((f"baseline ({args.baseline})", source))
+    variants.append(("current", None))
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for label, source in variants:
+        queue = ctx.Queue()
+        process = ctx.Process(target=run_variant, args=(label, source, args.iterations, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    print(f"{'variant':<24}{'cold ms':>10}{'median ms':>12}{'min ms':>10}{'peak MB':>10}{'+MB':>8}{'PNG KB':>9}")
+    for r in results:
+        print(
+            f"{r['label']:<24}{r['cold_ms']:>10.1f}{r['median_ms']:>12.1f}{r['min_ms']:>10.1f}"
+            f"{r['peak_rss_mb']:>10.1f}{r['peak_delta_mb']:>8.1f}{r['size_kb']:>9.1f}"
+        )
+    if len(results) == 2 and results[1]['median_ms']:
+        print(f"\nspeedup (median): x{results[0]['median_ms'] / results[1]['median_ms']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
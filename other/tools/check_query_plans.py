@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Проверка планов частых запросов (индексы из migration/schema/add_hot_lookup_indexes.py)
+
+Для каждого запроса выполняется EXPLAIN на текущей БД (DATABASE_URL или SQLite):
+- SQLite: EXPLAIN QUERY PLAN, ошибка - "SCAN <таблица>" без индекса
+- PostgreSQL: EXPLAIN (FORMAT JSON) при enable_seqscan=off, ошибка - узел "Seq Scan"
+  (если планировщик выбрал Seq Scan даже так, подходящего индекса нет)
+
+Код выхода 1, если хотя бы один запрос читает таблицу целиком.
+    python other/tools/check_query_plans.py
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, ROOT)
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(ROOT, '.env'))
+
+
+def hot_queries():
+    """(название, select) - запросы из маршрутов, которые выполняются на каждом запросе/вебхуке"""
+    from sqlalchemy import select, func
+    from modules.models.payment import Payment
+    from modules.models.payment_event import PaymentEvent
+    from modules.models.user import User
+    from modules.models.user_config import UserConfig
+    from modules.models.ticket import Ticket, TicketMessage
+    from modules.models.casino import CasinoGame
+
+    since = datetime.now(timezone.utc) - timedelta(days=30)
+    return [
+        ("payment by order_id", select(Payment).where(Payment.order_id == 'SN-0')),
+        ("payment by payment_system_id (webhooks)", select(Payment).where(Payment.payment_system_id == 'x')),
+        ("payments of user", select(Payment).where(Payment.user_id == 1).order_by(Payment.created_at.desc())),
+        ("paid payments of user", select(Payment).where(Payment.user_id == 1, Payment.status == 'PAID')),
+        ("paid payments in period", select(func.count(Payment.id)).where(Payment.status == 'PAID', Payment.created_at >= since)),
+        ("payment event by dedupe_key", select(PaymentEvent).where(PaymentEvent.dedupe_key == 'paid:1')),
+        ("user by telegram_id", select(User).where(User.telegram_id == '1')),
+        ("referrals count", select(func.count(User.id)).where(User.referrer_id == 1)),
+        ("users by role", select(User).where(User.role == 'CLIENT').order_by(User.created_at.desc()).limit(50)),
+        ("primary config of user", select(UserConfig).where(UserConfig.user_id == 1, UserConfig.is_primary.is_(True))),
+        ("configs of user", select(UserConfig).where(UserConfig.user_id == 1)),
+        ("tickets of user", select(Ticket).where(Ticket.user_id == 1).order_by(Ticket.created_at.desc())),
+        ("messages of ticket", select(TicketMessage).where(TicketMessage.ticket_id == 1).order_by(TicketMessage.created_at.asc())),
+        ("casino games of user", select(CasinoGame).where(CasinoGame.user_id == 1).order_by(CasinoGame.created_at.desc()).limit(20)),
+    ]
+
+
+def _driver_sql(stmt, dialect):
+    compiled = stmt.compile(dialect=dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return str(compiled), params
+
+
+def _sqlite_plan(conn, sql, params):
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    details = [row[-1] for row in rows]
+    full_scans = [d for d in details if d.startswith('SCAN ') and ' USING ' not in d and 'CONSTANT ROW' not in d]
+    return details, full_scans
+
+
+def _pg_nodes(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _pg_nodes(child)
+
+
+def _postgres_plan(conn, sql, params):
+    conn.exec_driver_sql("SET enable_seqscan = off")
+    try:
+        plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+    finally:
+        conn.exec_driver_sql("RESET enable_seqscan")
+    if isinstance(plan, str):
+        import json
+        plan = json.loads(plan)
+    details, full_scans = [], []
+    for node in _pg_nodes(plan[0]['Plan']):
+        label = f"{node['Node Type']} {node.get('Relation Name') or ''} {node.get('Index Name') or ''}".strip()
+        details.append(label)
+        if node['Node Type'] == 'Seq Scan':
+            full_scans.append(label)
+    return details, full_scans
+
+
+def main():
+    from app import app
+    from modules.core import get_db
+
+    failed = 0
+    with app.app_context():
+        engine = get_db().engine
+        dialect = engine.dialect
+        if dialect.name not in ('sqlite', 'postgresql'):
+            print(f"❌ Неподдерживаемая БД: {dialect.name}")
+            return 2
+        explain = _postgres_plan if dialect.name == 'postgresql' else _sqlite_plan
+        print(f"БД: {dialect.name}\n")
+
+        with engine.connect() as conn:
+            for name, stmt in hot_queries():
+                sql, params = _driver_sql(stmt, dialect)
+                try:
+                    details, full_scans = explain(conn, sql, params)
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ {name}: EXPLAIN не выполнен: {e}")
+                    conn.rollback()
+                    continue
+                if full_scans:
+                    failed += 1
+                    print(f"❌ {name}: полный просмотр таблицы - {'; '.join(full_scans)}")
+                else:
+                    print(f"✅ {name}: {'; '.join(details)}")
+            conn.rollback()
+
+    print(f"\n{'❌' if failed else '✅'} Запросов с полным просмотром таблицы: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -54,6 +54,10 @@ def run_all_schema_migrations(app=None):
         ('migration/schema/add_user_config_id_to_payment.py', 'migrate'),  # Поле user_config_id в payment
         ('migration/schema/add_create_new_config_to_payment.py', 'migrate'),  # Поле create_new_config в payment
         ('migration/schema/add_purchase_options_table.py', 'add_purchase_options_table'),
+        ('migration/schema/add_broadcast_job_table.py', 'add_broadcast_job_table'),  # Задания ручной рассылки
+        ('migration/schema/add_analytics_daily_table.py', 'add_analytics_daily_table'),  # Дневные агрегаты аналитики (+ первичное заполнение)
+        ('migration/schema/add_payment_event_table.py', 'add_payment_event_table'),  # Inbox событий платежей (вебхуки)
+        ('migration/schema/add_hot_lookup_indexes.py', 'add_hot_lookup_indexes'),  # Индексы для частых выборок
     ]
     
     success_count = 0
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Отдельный процесс планировщика (автоматическая рассылка, фоновые задания)
+
+Запуск:
+    python3 scheduler_worker.py
+
+Можно запускать на нескольких серверах/контейнерах: задачи выполняет только
+экземпляр, удерживающий блокировку лидера (см. modules/scheduler.py).
+"""
+
+import os
+import sys
+import signal
+
+# Добавляем путь к проекту
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Загружаем переменные окружения ДО импорта app
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def main():
+    from app import app
+    from modules.scheduler import Scheduler
+
+    scheduler = Scheduler(app)
+
+    def _stop(signum, frame):
+        print(f"🛑 [scheduler] Получен сигнал {signum}, остановка...")
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    scheduler.run()
+
+
+if __name__ == '__main__':
+    main()
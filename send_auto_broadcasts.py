@@ -10,6 +10,7 @@ import json
 from datetime import datetime, timezone, timedelta
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Добавляем путь к проекту
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -18,109 +19,32 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from dotenv import load_dotenv
 load_dotenv()
 
-def get_user_subscription_info(remnawave_uuid):
-    """Получить информацию о подписке пользователя из RemnaWave API"""
-    try:
-        api_url = os.getenv("API_URL")
-        admin_token = os.getenv("ADMIN_TOKEN")
-        
-        if not api_url or not admin_token:
-            return None
-        
-        headers, cookies = get_remnawave_headers_and_cookies()
-        response = requests.get(
-            f"{api_url}/api/users/{remnawave_uuid}",
-            headers=headers,
-            cookies=cookies,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            user_data = data.get('response', data) if isinstance(data, dict) else {}
-            return user_data if isinstance(user_data, dict) else None
-        return None
-    except Exception as e:
-        print(f"Error getting user info for {remnawave_uuid}: {e}")
-        return None
-
+from modules.remnawave import get_remnawave
+from modules.remnawave_snapshot import get_users_snapshot
+from modules.broadcast import send_telegram_photo, read_photo_bytes, telegram_rate_limiter
 
-def get_remnawave_headers_and_cookies():
-    """Заголовки/куки для RemnaWave API (как в админ-роутах)."""
-    headers = {}
-    cookies = {}
 
-    admin_token = os.getenv("ADMIN_TOKEN")
-    if admin_token:
-        headers["Authorization"] = f"Bearer {admin_token}"
+AUTO_BROADCAST_WORKERS = int(os.getenv("AUTO_BROADCAST_WORKERS", 8))
+AUTO_BROADCAST_CHUNK_SIZE = int(os.getenv("AUTO_BROADCAST_CHUNK_SIZE", 500))
 
-    cookies_str = os.getenv("REMNAWAVE_COOKIES", "")
-    if cookies_str:
-        try:
-            cookies = json.loads(cookies_str)
-        except Exception:
-            cookies = {}
 
-    return headers, cookies
+def get_user_subscription_info(remnawave_uuid):
+    """Получить информацию о подписке пользователя из RemnaWave API"""
+    remnawave = get_remnawave()
+    if not remnawave.configured:
+        return None
+    return remnawave.get_user_data(remnawave_uuid, timeout=10)
 
 
 def fetch_all_remnawave_users():
-    """Загрузить всех пользователей из RemnaWave одним запросом с пагинацией."""
-    api_url = os.getenv("API_URL")
-    admin_token = os.getenv("ADMIN_TOKEN")
-    if not api_url or not admin_token:
+    """Пользователи RemnaWave из общего снимка (modules/remnawave_snapshot.py)."""
+    if not get_remnawave().configured:
+        return {}
+    try:
+        return get_users_snapshot().get_map(background=False)
+    except Exception as e:
+        print(f"Warning: failed to load RemnaWave users snapshot: {e}")
         return {}
-
-    headers, cookies = get_remnawave_headers_and_cookies()
-    users_list = []
-    start = 0
-    size = 1000
-    total = None
-
-    while True:
-        try:
-            resp = requests.get(
-                f"{api_url}/api/users",
-                params={"size": size, "start": start},
-                headers=headers,
-                cookies=cookies,
-                timeout=20
-            )
-            payload = resp.json() if resp is not None else {}
-            data = payload.get("response", payload) if isinstance(payload, dict) else payload
-        except Exception as e:
-            print(f"Warning: failed to fetch /api/users page start={start}: {e}")
-            break
-
-        if isinstance(data, dict):
-            chunk = data.get("users", []) or []
-            if total is None:
-                try:
-                    total = int(data.get("total")) if data.get("total") is not None else None
-                except Exception:
-                    total = None
-        elif isinstance(data, list):
-            chunk = data
-        else:
-            chunk = []
-
-        if not isinstance(chunk, list) or len(chunk) == 0:
-            break
-
-        users_list.extend(chunk)
-        start += size
-
-        if total is not None and len(users_list) >= total:
-            break
-
-        if start > 50000:
-            break
-
-    live_map = {}
-    for u in users_list:
-        if isinstance(u, dict) and u.get("uuid"):
-            live_map[str(u["uuid"])] = u
-    return live_map
 
 def parse_iso_datetime(iso_string):
     """Парсинг ISO datetime строки"""
@@ -184,19 +108,19 @@ def send_telegram_message(bot_token, chat_id, text, photo_file=None, button_text
                     }]]
                 }
         
+        # Фото загружается в Telegram один раз, дальше отправляется по file_id
+        photo_bytes = read_photo_bytes(photo_file)
+
         def _do_request():
-            if photo_file:
-                url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+            if photo_bytes:
                 caption = text[:1024] if len(text) > 1024 else text
-                files = {'photo': photo_file}
                 data = {
-                    "chat_id": chat_id,
                     "caption": caption,
                     "parse_mode": "HTML"
                 }
                 if reply_markup:
                     data["reply_markup"] = json.dumps(reply_markup)
-                return requests.post(url, files=files, data=data, timeout=30)
+                return send_telegram_photo(bot_token, chat_id, photo_bytes, data, rate_limiter=telegram_rate_limiter)
             else:
                 url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
                 payload = {
@@ -206,6 +130,7 @@ def send_telegram_message(bot_token, chat_id, text, photo_file=None, button_text
                 }
                 if reply_markup:
                     payload["reply_markup"] = reply_markup
+                telegram_rate_limiter.acquire()
                 return requests.post(url, json=payload, timeout=15)
 
         # Telegram rate limit/retry (429) и временные ошибки
@@ -284,311 +209,275 @@ def send_via_configured_bots(bot_type: str, old_bot_token: str, new_bot_token: s
         continue
     return False, last_err or "No bot token"
 
-def send_auto_broadcasts():
-    """Отправить автоматические рассылки"""
+# Тексты сообщений для лога
+MESSAGE_LABELS = {
+    'subscription_expiring_3days': "уведомление о подписке",
+    'trial_expiring': "уведомление о триале",
+    'trial_active': "уведомление об активном триале",
+    'no_subscription': "сообщение 'без подписки'",
+    'trial_not_used': "сообщение 'триал не использован'",
+}
+
+
+def _message_snapshot(msg):
+    """Поля сообщения в виде dict (ORM-объект не передаем в потоки отправки)"""
+    if not msg or not msg.enabled:
+        return None
+    return {
+        'message_type': msg.message_type,
+        'message_text': msg.message_text,
+        'bot_type': msg.bot_type,
+        'button_text': msg.button_text,
+        'button_url': msg.button_url,
+        'button_action': msg.button_action,
+    }
+
+
+def iter_user_chunks(db, User, UserConfig, chunk_size):
+    """
+    Клиенты с telegram_id порциями по chunk_size (по возрастанию id, без OFFSET).
+    Одним запросом с основным конфигом: [(user_id, email, telegram_id, uuid для проверки подписки)].
+    Если несколько конфигов — используем UUID основного конфига.
+    """
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            User.id, User.email, User.telegram_id, User.remnawave_uuid, UserConfig.remnawave_uuid
+        ).outerjoin(
+            UserConfig, db.and_(UserConfig.user_id == User.id, UserConfig.is_primary == True)
+        ).filter(
+            User.role == 'CLIENT',
+            User.telegram_id != None,
+            User.telegram_id != '',
+            User.id > last_id,
+        ).order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            return
+        chunk = {}
+        for user_id, email, telegram_id, user_uuid, primary_uuid in rows:
+            # Один пользователь на случай нескольких конфигов с is_primary
+            if user_id not in chunk or (primary_uuid and not chunk[user_id][3]):
+                chunk[user_id] = (user_id, email, str(telegram_id), primary_uuid or user_uuid)
+        yield list(chunk.values())
+        last_id = rows[-1][0]
+
+
+def plan_user_messages(user_info, messages, now, from_snapshot=True):
+    """Какие сообщения отправить пользователю (список типов из messages)"""
+    planned = []
+    if not user_info:
+        # Пользователь без подписки
+        if messages.get('no_subscription'):
+            planned.append('no_subscription')
+        return planned
+
+    active_squads = user_info.get('activeInternalSquads', [])
+    has_active_subscription = len(active_squads) > 0 if active_squads else False
+    created_at_str = user_info.get('createdAt')
+    created_at = parse_iso_datetime(created_at_str) if created_at_str else None
+
+    if not has_active_subscription:
+        # Пользователь без активной подписки
+        if messages.get('no_subscription'):
+            planned.append('no_subscription')
+        # Зарегистрирован более 3 дней назад и не имеет подписки - вероятно, не использовал триал
+        if messages.get('trial_not_used') and from_snapshot and created_at:
+            if (now - created_at).days >= 3:
+                planned.append('trial_not_used')
+        return planned
+
+    expire_at = parse_iso_datetime(user_info.get('expireAt'))
+    if not expire_at:
+        return planned
+
+    days_until_expiry = ceil_days_until(expire_at, now)
+
+    # Проверяем, является ли это триалом (обычно 3 дня)
+    is_trial = False
+    if created_at:
+        try:
+            total_seconds = (expire_at - created_at).total_seconds()
+            is_trial = total_seconds <= (3 * 24 * 60 * 60 + 60)  # <= 3 дня (+1 мин допуск)
+        except Exception:
+            is_trial = False
+
+    # Подписка, истекающая через 3 дня (отправляем за 3 дня до окончания)
+    if (0 < days_until_expiry <= 3) and (expire_at > now) and (not is_trial):
+        if messages.get('subscription_expiring_3days'):
+            planned.append('subscription_expiring_3days')
+
+    # Триал, который заканчивается сегодня или завтра
+    if is_trial and days_until_expiry <= 1 and now < expire_at <= (now + timedelta(days=1)):
+        if messages.get('trial_expiring'):
+            planned.append('trial_expiring')
+
+    # Активный триал (осталось больше 1 дня)
+    if is_trial and days_until_expiry > 1 and expire_at > now:
+        if messages.get('trial_active'):
+            planned.append('trial_active')
+    return planned
+
+
+def send_auto_broadcasts(progress=None):
+    """
+    Отправить автоматические рассылки.
+    Клиенты читаются порциями по AUTO_BROADCAST_CHUNK_SIZE (один запрос вместе с основным
+    конфигом), сообщения отправляет пул из AUTO_BROADCAST_WORKERS потоков с общим
+    лимитом Telegram (BROADCAST_TELEGRAM_RATE).
+    progress(stats) - вызывается после каждой порции (см. modules/scheduler.py).
+    """
     # Импортируем уже инициализированное приложение из app.py
     # app.py уже импортирует и инициализирует все модели
     from app import app, db, User, AutoBroadcastMessage
-    
+
     with app.app_context():
         from modules.core import get_cache
+        from modules.models.user_config import UserConfig
         cache = get_cache()
-        
+
         # Получаем настройки автоматических рассылок
-        subscription_msg = AutoBroadcastMessage.query.filter_by(
-            message_type='subscription_expiring_3days'
-        ).first()
-        
-        trial_msg = AutoBroadcastMessage.query.filter_by(
-            message_type='trial_expiring'
-        ).first()
-        
-        no_subscription_msg = AutoBroadcastMessage.query.filter_by(
-            message_type='no_subscription'
-        ).first()
-        
-        trial_not_used_msg = AutoBroadcastMessage.query.filter_by(
-            message_type='trial_not_used'
-        ).first()
-        
-        trial_active_msg = AutoBroadcastMessage.query.filter_by(
-            message_type='trial_active'
-        ).first()
-        
+        messages = {}
+        for msg in AutoBroadcastMessage.query.filter(AutoBroadcastMessage.message_type.in_(list(MESSAGE_LABELS))).all():
+            snapshot = _message_snapshot(msg)
+            if snapshot:
+                messages[msg.message_type] = snapshot
+
         # Получаем токены ботов
         old_bot_token = os.getenv("CLIENT_BOT_TOKEN")
         new_bot_token = os.getenv("CLIENT_BOT_V2_TOKEN") or os.getenv("CLIENT_BOT_TOKEN")
-        
+
         if not old_bot_token and not new_bot_token:
             print("❌ Bot tokens not configured")
             return False
-        
+
         # Текущая дата
         now = datetime.now(timezone.utc)
-        three_days_later = now + timedelta(days=3)
-        
+
         # Кеш-ключ, чтобы не слать одному и тому же пользователю один и тот же тип чаще 1 раза в день
         today_key = now.strftime('%Y%m%d')
-        def should_send(message_type: str, telegram_id: str) -> bool:
+        def dedupe_key(message_type, telegram_id):
+            return f"auto_broadcast:{message_type}:{telegram_id}:{today_key}"
+
+        def filter_not_sent(planned):
+            """Оставить (тип, telegram_id), которым сегодня еще не отправляли, и отметить их (пакетно)"""
+            keys = [dedupe_key(t, tg) for t, tg in planned]
             try:
-                key = f"auto_broadcast:{message_type}:{telegram_id}:{today_key}"
-                if cache.get(key):
-                    return False
-                cache.set(key, True, timeout=60 * 60 * 48)
-                return True
+                already = cache.get_many(*keys) if keys else []
             except Exception:
-                return True
+                already = [None] * len(keys)
+            fresh = [item for item, sent in zip(planned, already) if not sent]
+            if fresh:
+                try:
+                    cache.set_many({dedupe_key(t, tg): True for t, tg in fresh}, timeout=60 * 60 * 48)
+                except Exception:
+                    pass
+            return fresh
 
         # Быстро грузим всех пользователей RemnaWave одним запросом (без per-user запросов)
         live_map = fetch_all_remnawave_users()
 
-        # Получаем всех клиентов с telegram_id (UUID может лежать в UserConfig.primary)
-        users = User.query.filter(
+        total = User.query.filter(
             User.role == 'CLIENT',
             User.telegram_id != None,
             User.telegram_id != '',
-        ).all()
-        
-        subscription_sent = 0
-        subscription_failed = 0
-        trial_sent = 0
-        trial_failed = 0
-        no_subscription_sent = 0
-        no_subscription_failed = 0
-        trial_not_used_sent = 0
-        trial_not_used_failed = 0
-        trial_active_sent = 0
-        trial_active_failed = 0
-        
-        print(f"Проверяем {len(users)} пользователей...")
-        
-        for user in users:
-            try:
-                # Если несколько конфигов — используем UUID основного конфига
-                uuid_for_lookup = user.remnawave_uuid
-                try:
-                    from modules.models.user_config import UserConfig
-                    primary_cfg = UserConfig.query.filter_by(user_id=user.id, is_primary=True).first()
-                    if primary_cfg and primary_cfg.remnawave_uuid:
-                        uuid_for_lookup = primary_cfg.remnawave_uuid
-                except Exception:
-                    uuid_for_lookup = user.remnawave_uuid
-
-                if not uuid_for_lookup or not str(uuid_for_lookup).strip():
-                    # Пользователь есть в БД и имеет telegram_id, но не синхронизирован с RemnaWave
-                    continue
-
-                # Получаем информацию о подписке (из общего списка)
-                user_info = live_map.get(str(uuid_for_lookup)) if uuid_for_lookup else None
-                if not user_info:
-                    # fallback точечным запросом (на случай если список не включает пользователя)
-                    user_info = get_user_subscription_info(str(uuid_for_lookup))
-                if not user_info:
-                    # Пользователь без подписки
-                    if no_subscription_msg and no_subscription_msg.enabled:
-                        if should_send(no_subscription_msg.message_type, str(user.telegram_id)):
-                            success, result = send_via_configured_bots(
-                                no_subscription_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                                no_subscription_msg.message_text,
-                                button_text=no_subscription_msg.button_text,
-                                button_url=no_subscription_msg.button_url,
-                                button_action=no_subscription_msg.button_action
-                            )
-                            if success:
-                                no_subscription_sent += 1
-                                print(f"✅ Отправлено сообщение 'без подписки' пользователю {user.email} (ID: {user.telegram_id})")
-                            else:
-                                no_subscription_failed += 1
-                                print(f"❌ Ошибка отправки 'без подписки' пользователю {user.email}: {result}")
-                    continue
-                
-                expire_at_str = user_info.get('expireAt')
-                active_squads = user_info.get('activeInternalSquads', [])
-                has_active_subscription = len(active_squads) > 0 if active_squads else False
-                
-                # Проверяем, есть ли у пользователя активная подписка
-                if not has_active_subscription:
-                    # Пользователь без активной подписки
-                    if no_subscription_msg and no_subscription_msg.enabled:
-                        if should_send(no_subscription_msg.message_type, str(user.telegram_id)):
-                            success, result = send_via_configured_bots(
-                                no_subscription_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                                no_subscription_msg.message_text,
-                                button_text=no_subscription_msg.button_text,
-                                button_url=no_subscription_msg.button_url,
-                                button_action=no_subscription_msg.button_action
-                            )
-                            if success:
-                                no_subscription_sent += 1
-                                print(f"✅ Отправлено сообщение 'без подписки' пользователю {user.email} (ID: {user.telegram_id})")
-                            else:
-                                no_subscription_failed += 1
-                                print(f"❌ Ошибка отправки 'без подписки' пользователю {user.email}: {result}")
-                    continue
-                
-                if not expire_at_str:
-                    continue
-                
-                expire_at = parse_iso_datetime(expire_at_str)
-                if not expire_at:
-                    continue
-                
-                # Проверяем, истекает ли подписка через 3 дня
-                days_until_expiry = ceil_days_until(expire_at, now)
-                
-                # Проверяем, является ли это триалом (обычно 3 дня)
-                created_at_str = user_info.get('createdAt')
-                created_at = parse_iso_datetime(created_at_str) if created_at_str else None
-                is_trial = False
-                if created_at and expire_at:
-                    try:
-                        total_seconds = (expire_at - created_at).total_seconds()
-                        is_trial = total_seconds <= (3 * 24 * 60 * 60 + 60)  # <= 3 дня (+1 мин допуск)
-                    except Exception:
-                        is_trial = False
-                
-                # Проверяем подписку, истекающую через 3 дня
-                # Отправляем за 3 дня до окончания
-                is_subscription_expiring = (0 < days_until_expiry <= 3) and (expire_at > now) and (not is_trial)
-                
-                # Проверяем триал, который заканчивается сегодня или завтра
-                is_trial_expiring = (
-                    is_trial and
-                    days_until_expiry <= 1 and
-                    expire_at > now and
-                    expire_at <= (now + timedelta(days=1))
+        ).count()
+        stats = {
+            'total': total,
+            'scanned': 0,
+            'sent': 0,
+            'failed': 0,
+            'by_type': {t: {'sent': 0, 'failed': 0} for t in MESSAGE_LABELS},
+        }
+        print(f"Проверяем {total} пользователей (порции по {AUTO_BROADCAST_CHUNK_SIZE}, потоков отправки {AUTO_BROADCAST_WORKERS})...")
+
+        def _send_task(message_type, telegram_id):
+            msg = messages[message_type]
+            with app.app_context():
+                return send_via_configured_bots(
+                    msg['bot_type'], old_bot_token, new_bot_token, telegram_id,
+                    msg['message_text'],
+                    button_text=msg['button_text'],
+                    button_url=msg['button_url'],
+                    button_action=msg['button_action']
                 )
-                
-                # Проверяем активный триал (осталось больше 1 дня)
-                is_trial_active = (
-                    is_trial and
-                    days_until_expiry > 1 and
-                    expire_at > now
-                )
-                
-                # Отправляем уведомление о подписке
-                if is_subscription_expiring and subscription_msg and subscription_msg.enabled:
-                    message_text = subscription_msg.message_text
-                    if should_send(subscription_msg.message_type, str(user.telegram_id)):
-                        success, result = send_via_configured_bots(
-                            subscription_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                            message_text,
-                            button_text=subscription_msg.button_text,
-                            button_url=subscription_msg.button_url,
-                            button_action=subscription_msg.button_action
-                        )
-                        if success:
-                            subscription_sent += 1
-                            print(f"✅ Отправлено уведомление о подписке пользователю {user.email} (ID: {user.telegram_id})")
-                        else:
-                            subscription_failed += 1
-                            print(f"❌ Ошибка отправки подписки пользователю {user.email}: {result}")
-                
-                # Отправляем уведомление о триале
-                if is_trial_expiring and trial_msg and trial_msg.enabled:
-                    message_text = trial_msg.message_text
-                    if should_send(trial_msg.message_type, str(user.telegram_id)):
-                        success, result = send_via_configured_bots(
-                            trial_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                            message_text,
-                            button_text=trial_msg.button_text,
-                            button_url=trial_msg.button_url,
-                            button_action=trial_msg.button_action
-                        )
-                        if success:
-                            trial_sent += 1
-                            print(f"✅ Отправлено уведомление о триале пользователю {user.email} (ID: {user.telegram_id})")
-                        else:
-                            trial_failed += 1
-                            print(f"❌ Ошибка отправки триала пользователю {user.email}: {result}")
-                
-                # Отправляем уведомление об активном триале
-                if is_trial_active and trial_active_msg and trial_active_msg.enabled:
-                    message_text = trial_active_msg.message_text
-                    if should_send(trial_active_msg.message_type, str(user.telegram_id)):
-                        success, result = send_via_configured_bots(
-                            trial_active_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                            message_text,
-                            button_text=trial_active_msg.button_text,
-                            button_url=trial_active_msg.button_url,
-                            button_action=trial_active_msg.button_action
-                        )
-                        if success:
-                            trial_active_sent += 1
-                            print(f"✅ Отправлено уведомление об активном триале пользователю {user.email} (ID: {user.telegram_id})")
-                        else:
-                            trial_active_failed += 1
-                            print(f"❌ Ошибка отправки активного триала пользователю {user.email}: {result}")
-            
+
+        def _handle_result(future, message_type, email, telegram_id):
+            label = MESSAGE_LABELS[message_type]
+            try:
+                success, result = future.result()
             except Exception as e:
-                print(f"❌ Ошибка обработки пользователя {user.email}: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
-        
-        # Проверяем пользователей без триала (если они зарегистрированы, но не использовали триал)
-        if trial_not_used_msg and trial_not_used_msg.enabled:
-            # Получаем пользователей, которые зарегистрированы, но не имеют активной подписки
-            users_without_trial = User.query.filter(
-                User.role == 'CLIENT',
-                User.telegram_id != None,
-                User.telegram_id != '',
-            ).all()
-            
-            for user in users_without_trial:
-                try:
-                    uuid_for_lookup = user.remnawave_uuid
+                success, result = False, str(e)
+            if success:
+                stats['sent'] += 1
+                stats['by_type'][message_type]['sent'] += 1
+                print(f"✅ Отправлено {label} пользователю {email} (ID: {telegram_id})")
+            else:
+                stats['failed'] += 1
+                stats['by_type'][message_type]['failed'] += 1
+                print(f"❌ Ошибка отправки ({label}) пользователю {email}: {result}")
+
+        # Конвейер: чтение порции из БД -> точечные запросы в RemnaWave для отсутствующих в снимке ->
+        # решение + пакетная проверка дедупликации -> отправка пулом. Отправки порции не ждем,
+        # следующая порция читается, пока идут отправки (в работе не больше max_in_flight сообщений).
+        max_in_flight = AUTO_BROADCAST_WORKERS * 4
+        in_flight = {}
+
+        def _drain(limit):
+            while len(in_flight) > limit:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    _handle_result(future, *in_flight.pop(future))
+
+        with ThreadPoolExecutor(max_workers=AUTO_BROADCAST_WORKERS, thread_name_prefix="auto-broadcast") as pool:
+            for chunk in iter_user_chunks(db, User, UserConfig, AUTO_BROADCAST_CHUNK_SIZE):
+                # Пользователь есть в БД и имеет telegram_id, но не синхронизирован с RemnaWave - пропускаем
+                chunk = [row for row in chunk if row[3] and str(row[3]).strip()]
+
+                # fallback точечным запросом (на случай если список не включает пользователя) - параллельно
+                missing = [str(row[3]) for row in chunk if str(row[3]) not in live_map]
+                fetched = dict(zip(missing, pool.map(get_user_subscription_info, missing))) if missing else {}
+
+                planned = []
+                for user_id, email, telegram_id, uuid_for_lookup in chunk:
                     try:
-                        from modules.models.user_config import UserConfig
-                        primary_cfg = UserConfig.query.filter_by(user_id=user.id, is_primary=True).first()
-                        if primary_cfg and primary_cfg.remnawave_uuid:
-                            uuid_for_lookup = primary_cfg.remnawave_uuid
-                    except Exception:
-                        uuid_for_lookup = user.remnawave_uuid
-                    user_info = live_map.get(str(uuid_for_lookup)) if uuid_for_lookup else None
-                    if not user_info:
+                        user_info = live_map.get(str(uuid_for_lookup))
+                        from_snapshot = bool(user_info)
+                        if not user_info:
+                            user_info = fetched.get(str(uuid_for_lookup))
+                        for message_type in plan_user_messages(user_info, messages, now, from_snapshot):
+                            planned.append((message_type, telegram_id, email))
+                    except Exception as e:
+                        print(f"❌ Ошибка обработки пользователя {email}: {e}")
+                        import traceback
+                        traceback.print_exc()
                         continue
-                    
-                    active_squads = user_info.get('activeInternalSquads', [])
-                    has_active = len(active_squads) > 0 if active_squads else False
-                    
-                    # Если нет активной подписки, проверяем, использовал ли пользователь триал
-                    if not has_active:
-                        created_at_str = user_info.get('createdAt')
-                        created_at = parse_iso_datetime(created_at_str) if created_at_str else None
-                        
-                        # Если пользователь зарегистрирован более 3 дней назад и не имеет подписки - вероятно, не использовал триал
-                        if created_at:
-                            days_since_registration = (now - created_at).days
-                            if days_since_registration >= 3:
-                                if should_send(trial_not_used_msg.message_type, str(user.telegram_id)):
-                                    success, result = send_via_configured_bots(
-                                        trial_not_used_msg.bot_type, old_bot_token, new_bot_token, user.telegram_id,
-                                        trial_not_used_msg.message_text,
-                                        button_text=trial_not_used_msg.button_text,
-                                        button_url=trial_not_used_msg.button_url,
-                                        button_action=trial_not_used_msg.button_action
-                                    )
-                                    if success:
-                                        trial_not_used_sent += 1
-                                        print(f"✅ Отправлено сообщение 'триал не использован' пользователю {user.email} (ID: {user.telegram_id})")
-                                    else:
-                                        trial_not_used_failed += 1
-                                        print(f"❌ Ошибка отправки 'триал не использован' пользователю {user.email}: {result}")
-                except Exception as e:
-                    print(f"❌ Ошибка обработки пользователя {user.email} для 'триал не использован': {e}")
-                    continue
-        
+
+                # Один пользователь (telegram_id) может встретиться в порции дважды
+                emails = {(t, tg): email for t, tg, email in planned}
+                for message_type, telegram_id in filter_not_sent(list(emails)):
+                    _drain(max_in_flight - 1)
+                    future = pool.submit(_send_task, message_type, telegram_id)
+                    in_flight[future] = (message_type, emails[(message_type, telegram_id)], telegram_id)
+
+                stats['scanned'] += len(chunk)
+                _drain(max_in_flight)
+                if progress:
+                    progress(stats)
+            _drain(0)
+            if progress:
+                progress(stats)
+
+        by_type = stats['by_type']
         print()
         print("=" * 80)
         print("✅ АВТОМАТИЧЕСКАЯ РАССЫЛКА ЗАВЕРШЕНА")
-        print(f"   Подписка (истекает через 3 дня): отправлено {subscription_sent}, ошибок {subscription_failed}")
-        print(f"   Триал (истекает): отправлено {trial_sent}, ошибок {trial_failed}")
-        print(f"   Без подписки: отправлено {no_subscription_sent}, ошибок {no_subscription_failed}")
-        print(f"   Триал не использован: отправлено {trial_not_used_sent}, ошибок {trial_not_used_failed}")
-        print(f"   Триал активен: отправлено {trial_active_sent}, ошибок {trial_active_failed}")
+        print(f"   Подписка (истекает через 3 дня): отправлено {by_type['subscription_expiring_3days']['sent']}, ошибок {by_type['subscription_expiring_3days']['failed']}")
+        print(f"   Триал (истекает): отправлено {by_type['trial_expiring']['sent']}, ошибок {by_type['trial_expiring']['failed']}")
+        print(f"   Без подписки: отправлено {by_type['no_subscription']['sent']}, ошибок {by_type['no_subscription']['failed']}")
+        print(f"   Триал не использован: отправлено {by_type['trial_not_used']['sent']}, ошибок {by_type['trial_not_used']['failed']}")
+        print(f"   Триал активен: отправлено {by_type['trial_active']['sent']}, ошибок {by_type['trial_active']['failed']}")
         print("=" * 80)
-        
+
         return True
 
 if __name__ == '__main__':